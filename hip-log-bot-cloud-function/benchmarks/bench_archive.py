@@ -0,0 +1,128 @@
+"""Benchmark the reads and storage of archived DailyLogs, offline
+
+Seeds a user with a history of daily logs in the in-process Firestore fake, then
+compares (before and after archiving every month older than --min-age-months):
+* the round trips and documents read for a range of an old month, a recent week
+  and the full history stream
+* the number of documents and approximate bytes stored
+
+Stored bytes follow Firestore's document size rules roughly (document name + field
+names and values + 32 bytes per document), so they're for comparison only.
+
+Usage (from hip-log-bot-cloud-function/):
+    python benchmarks/bench_archive.py [--history-days 1095] [--min-age-months 3]
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "src")]
+os.environ.setdefault("FIRESTORE_COLLECTION_NAME", "UsersBenchmark")
+
+import logging  # noqa: E402
+import firebase_admin.firestore  # noqa: E402
+from services.archiver import archive_user  # noqa: E402
+from services.hiplogdb import HipLogDB  # noqa: E402
+from tests.fake_firestore import FakeClient  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+USER = "MarkTheTester"
+TODAY = date(2023, 11, 3)
+
+
+def seed_history(client, days):
+    start = TODAY - timedelta(days=days)
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{USER}/DailyLogs"
+    for i in range(days):
+        day = str(start + timedelta(days=i))
+        activities = {
+            "squats": {
+                "sets": [
+                    {"reps": 10, "weight": {"amount": 60, "unit": "kg"}},
+                    {"reps": 8, "weight": {"amount": 70, "unit": "kg"}},
+                ]
+            },
+            "hip adductions": {"sets": [{"reps": 15}, {"reps": 15}]},
+        }
+        client.load(
+            f"{path}/{day}",
+            {
+                "date": day,
+                "activities": activities if i % 3 else {},
+                "symptoms": {"left hip": {"severity": i % 4}},
+            },
+        )
+
+
+def storage(client):
+    """(number of documents, approximate bytes) under the user"""
+    prefix = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{USER}"
+    paths = [path for path in client._docs if path.startswith(prefix)]
+    n_bytes = 0
+    for path in paths:
+        data = client.dump(path)
+        encoded = json.dumps(
+            data, default=lambda value: "x" * len(value), separators=(",", ":")
+        )
+        n_bytes += len(path) + 1 + len(encoded) + 32
+
+    return len(paths), n_bytes
+
+
+def measure(client):
+    """Round trips and documents read for some typical reads, each with a fresh
+    HipLogDB (ie only the catalog as last seen by the process is known)"""
+    old = TODAY.replace(year=TODAY.year - 1, day=1)
+    reads = {
+        "old month": lambda db: db.get_logs(USER, str(old), str(old + timedelta(27))),
+        "recent week": lambda db: db.get_logs(
+            USER, str(TODAY - timedelta(6)), str(TODAY)
+        ),
+        "full stream": lambda db: list(db.stream_logs(USER)),
+    }
+    res = {}
+    for name, read in reads.items():
+        # As in a warm instance, which has seen the user's catalog before
+        HipLogDB().get_catalog(USER)
+        client.reset_stats()
+        read(HipLogDB())
+        res[name] = (client.num_rpcs, sum(call.documents for call in client.calls))
+
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--history-days", type=int, default=3 * 365)
+    parser.add_argument("--min-age-months", type=int, default=3)
+    args = parser.parse_args()
+
+    client = FakeClient()
+    firebase_admin.firestore.client = lambda: client
+    seed_history(client, args.history_days)
+    HipLogDB().rebuild_catalog(USER)
+
+    before_reads, before_storage = measure(client), storage(client)
+    archive_user(HipLogDB(), USER, args.min_age_months, today=TODAY)
+    after_reads, after_storage = measure(client), storage(client)
+
+    print(f"{'read':<20} {'rpcs':>12} {'docs':>12}")
+    for name in before_reads:
+        (rpcs, docs), (rpcs_after, docs_after) = before_reads[name], after_reads[name]
+        print(
+            f"{name:<20} {f'{rpcs} -> {rpcs_after}':>12} "
+            f"{f'{docs} -> {docs_after}':>12}"
+        )
+    print(
+        f"{'stored docs':<20} {before_storage[0]:>12} -> {after_storage[0]}\n"
+        f"{'stored bytes':<20} {before_storage[1]:>12} -> {after_storage[1]}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Benchmark the size and speed of the binary log codec against JSON
+
+Generates a realistic history (a few activities with weighted sets most days, a
+symptom every day, the odd note) and reports the encoded size and the encode and
+decode times per log of each format, with and without zlib. Deterministic for a
+given seed.
+
+Usage (from hip-log-bot-cloud-function/):
+    python benchmarks/bench_codec.py [--logs 365] [--seed 0]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+import zlib
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from models import log_codec  # noqa: E402
+from models.daily_log import DailyLog  # noqa: E402
+from models.measurement import Measurement  # noqa: E402
+from models.record import Activity, Set, Symptom  # noqa: E402
+
+ACTIVITIES = ["squats", "hip adductions", "deadlifts", "clamshells", "plank", "yoga"]
+
+
+def generate_logs(n_logs, seed):
+    rng = random.Random(seed)
+    start = date(2023, 11, 3) - timedelta(days=n_logs)
+    logs = []
+    for i in range(n_logs):
+        day = str(start + timedelta(days=i))
+        activities = []
+        for name in rng.sample(ACTIVITIES, rng.randint(0, 4)):
+            if name == "plank":
+                sets = [Set(duration=Measurement(rng.choice([30, 45, 60]), "s"))]
+            elif name == "yoga":
+                sets = [Set(duration=Measurement(rng.randint(10, 40), "min"))]
+            else:
+                unit = rng.choice(["kg", "lb"])
+                sets = [
+                    Set(
+                        reps=rng.randint(5, 15),
+                        weight=Measurement(rng.choice([20, 40, 62.5, 80]), unit),
+                    )
+                    for _ in range(rng.randint(1, 4))
+                ]
+            activities.append(Activity(name, sets=sets))
+        log = DailyLog(
+            day,
+            activities=activities,
+            symptoms=[Symptom("left hip", rng.randint(0, 3))],
+            activity_notes="felt good" if rng.random() < 0.1 else None,
+        )
+        logs.append((day, log.to_dict()))
+
+    return logs
+
+
+def json_dumps(logs):
+    return "\n".join(json.dumps(log_dict) for _, log_dict in logs).encode()
+
+
+def json_loads(data):
+    return [json.loads(line) for line in data.split(b"\n")]
+
+
+FORMATS = {
+    "json": (json_dumps, json_loads),
+    "json+zlib": (
+        lambda logs: zlib.compress(json_dumps(logs), 9),
+        lambda data: json_loads(zlib.decompress(data)),
+    ),
+    "logcodec": (log_codec.dumps, lambda data: list(log_codec.loads(data))),
+    "logcodec+zlib": (
+        lambda logs: zlib.compress(log_codec.dumps(logs), 9),
+        lambda data: list(log_codec.loads(zlib.decompress(data))),
+    ),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--logs", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logs = generate_logs(args.logs, args.seed)
+    header = ["bytes", "bytes/log", "enc us/log", "dec us/log"]
+    print(f"{'format':<15} " + " ".join(f"{h:>11}" for h in header))
+    for name, (dumps, loads) in FORMATS.items():
+        data = dumps(logs)
+        encode = min(timeit.repeat(lambda: dumps(logs), number=1, repeat=args.repeat))
+        decode = min(timeit.repeat(lambda: loads(data), number=1, repeat=args.repeat))
+        print(
+            f"{name:<15} {len(data):>11} {len(data) / len(logs):>11.1f} "
+            f"{encode / len(logs) * 1e6:>11.2f} {decode / len(logs) * 1e6:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Benchmark the Executor's Firestore round trips and latency, offline
+
+Runs a mix of intents against the in-process Firestore fake with a long tailed
+latency distribution, and reports the RPCs per intent and p50/p95/p99 of the
+simulated latency. Deterministic for a given seed.
+
+Usage (from hip-log-bot-cloud-function/):
+    python benchmarks/bench_executor.py [--requests 200] [--median-ms 20] [--seed 0]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "src")]
+os.environ.setdefault("FIRESTORE_COLLECTION_NAME", "UsersBenchmark")
+
+import logging  # noqa: E402
+import firebase_admin.firestore  # noqa: E402
+from services.executor import Executor  # noqa: E402
+from tests.fake_firestore import FakeClient, LatencyModel  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+REQUESTS = {
+    "LogActivity": {
+        "activity": "Squats",
+        "reps": [10, 8],
+        "weight": [{"amount": 60, "unit": "kg"}, {"amount": 70, "unit": "kg"}],
+        "duration": [],
+        "date": "2023-11-03T12:00:00+01:00",
+    },
+    "LogSymptom": {
+        "symptom": "Left hip",
+        "severity": "2",
+        "date": "2023-11-03T12:00:00+01:00",
+    },
+    "GetDailyLog": {"date": "2023-11-03T12:00:00+01:00"},
+    "GetNumLogs": {},
+    "GetActivityList": {},
+    "GetActivitySummary": {"activity": "squat"},
+    "GetStreak": {},
+    "GetCorrelations": {},
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def seed_history(client, days):
+    """Give the benchmark user some history to read"""
+    from datetime import date, timedelta
+
+    start = date(2023, 11, 3) - timedelta(days=days)
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/MarkTheTester/DailyLogs"
+    for i in range(days):
+        day = str(start + timedelta(days=i))
+        client.load(
+            f"{path}/{day}",
+            {
+                "date": day,
+                "activities": {"squats": {"sets": [{"reps": 10}]}} if i % 2 else {},
+                "symptoms": {"left hip": {"severity": i % 4}},
+            },
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--median-ms", type=float, default=20)
+    parser.add_argument("--sigma", type=float, default=0.6)
+    parser.add_argument("--history-days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    client = FakeClient(
+        latency=LatencyModel.lognormal(args.median_ms, args.sigma, seed=args.seed)
+    )
+    firebase_admin.firestore.client = lambda: client
+    seed_history(client, args.history_days)
+
+    header = ["rpcs", "docs", "p50 ms", "p95 ms", "p99 ms"]
+    print(f"{'intent':<20} " + " ".join(f"{h:>8}" for h in header))
+    for intent, parameters in REQUESTS.items():
+        latencies = []
+        for _ in range(args.requests):
+            client.reset_stats()
+            request = {
+                "queryResult": {
+                    "parameters": dict(parameters),
+                    "intent": {"displayName": intent},
+                }
+            }
+            # Some models still print() so keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                Executor(request).run()
+            latencies.append(client.elapsed * 1000)
+
+        # RPC counts are from the last (steady state) request
+        docs = sum(call.documents for call in client.calls)
+        print(
+            f"{intent:<20} {client.num_rpcs:>8} {docs:>8} "
+            f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f} "
+            f"{percentile(latencies, 99):>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Benchmark parsing Dialogflow requests into intents
+
+Turns the training phrases of the exported Dialogflow agent (dialogflow/intents/
+*_usersays_en.json) into webhook requests the way Dialogflow would fill them in:
+custom entities resolve to their reference values, @sys.date to a timestamp, weights
+and durations to {"amount", "unit"} dicts, and list parameters to lists. Then
+reports the parses per second of each intent, and for LogActivity also with the
+legacy second pass that rebuilt the Activity from the parsed dict. Phrases that
+leave out a required parameter (that Dialogflow would prompt for) count as invalid.
+
+Usage (from hip-log-bot-cloud-function/):
+    python benchmarks/bench_intent_parse.py [--repeat 20] [--number 200]
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from errors import ValidationError  # noqa: E402
+from models.intent import Intent  # noqa: E402
+from models.intent_schema import INTENT_SCHEMAS  # noqa: E402
+from models.record import Activity  # noqa: E402
+
+AGENT = os.path.join(os.path.dirname(ROOT), "dialogflow")
+TIMESTAMP = "2023-11-03T12:00:00+00:00"
+DURATION_UNITS = {"m": "min", "min": "min", "minute": "min", "s": "s", "h": "h"}
+
+
+def load_entities():
+    """Custom entity synonym (lowercase) -> reference value, per entity"""
+    entities = {}
+    for path in glob.glob(os.path.join(AGENT, "entities", "*_entries_en.json")):
+        name = os.path.basename(path)[: -len("_entries_en.json")]
+        with open(path) as f:
+            entries = json.load(f)
+        entities[name] = {
+            synonym.lower(): entry["value"]
+            for entry in entries
+            for synonym in entry["synonyms"] + [entry["value"]]
+        }
+
+    return entities
+
+
+def load_requests():
+    """Intent name -> a webhook request per training phrase"""
+    entities = load_entities()
+    requests = {}
+    for intent_name in INTENT_SCHEMAS:
+        with open(os.path.join(AGENT, "intents", f"{intent_name}.json")) as f:
+            params = json.load(f)["responses"][0]["parameters"]
+        with open(
+            os.path.join(AGENT, "intents", f"{intent_name}_usersays_en.json")
+        ) as f:  # noqa
+            phrases = json.load(f)
+
+        requests[intent_name] = []
+        for phrase in phrases:
+            parameters = {p["name"]: [] if p["isList"] else "" for p in params}
+            for part in phrase["data"]:
+                if part.get("alias") not in parameters:
+                    continue
+                value = to_value(part["meta"], part["text"], entities)
+                if isinstance(parameters[part["alias"]], list):
+                    parameters[part["alias"]].append(value)
+                else:
+                    parameters[part["alias"]] = value
+            # Dialogflow prompts for the required date rather than leaving it out
+            if "date" in parameters and not parameters.get("date-period"):
+                parameters["date"] = parameters["date"] or TIMESTAMP
+            requests[intent_name].append(
+                {
+                    "queryResult": {
+                        "intent": {"displayName": intent_name},
+                        "parameters": parameters,
+                    }
+                }
+            )
+
+    return requests
+
+
+def to_value(meta, text, entities):
+    """What Dialogflow sends for an annotated part of a training phrase"""
+    if meta == "@sys.date":
+        return TIMESTAMP
+    if meta == "@sys.date-period":
+        return {"startDate": "2023-10-30T00:00:00+00:00", "endDate": TIMESTAMP}
+    if meta in ("@sys.number", "@sys.number-integer"):
+        return float(text) if meta == "@sys.number" else int(text)
+    match = re.match(r"([\d.]+)\s*([a-z]*)", text.lower())
+    if meta == "@sys.unit-weight":
+        return {"amount": float(match[1]), "unit": match[2] or "kg"}
+    if meta == "@sys.duration":
+        unit = match[2].rstrip("s") if match[2] not in ("s", "") else "s"
+        return {"amount": float(match[1]), "unit": DURATION_UNITS.get(unit, unit)}
+    synonyms = entities.get(meta.lstrip("@"), {})
+    return synonyms.get(text.lower(), text)
+
+
+def parse(requests):
+    for req in requests:
+        try:
+            Intent(req)
+        except ValidationError:
+            pass
+
+
+def parse_and_rebuild(requests):
+    for req in requests:
+        try:
+            Activity.from_dict(Intent(req).log_input)
+        except ValidationError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    requests = load_requests()
+    runs = [(name, reqs, parse) for name, reqs in requests.items()]
+    runs.append(("LogActivity+rebuild", requests["LogActivity"], parse_and_rebuild))
+
+    print(f"{'intent':<22} {'phrases':>8} {'invalid':>8} {'parses/s':>12}")
+    for name, reqs, fn in runs:
+        invalid = 0
+        for req in reqs:
+            try:
+                Intent(req)
+            except ValidationError:
+                invalid += 1
+        seconds = min(
+            timeit.repeat(lambda: fn(reqs), number=args.number, repeat=args.repeat)
+        )
+        rate = len(reqs) * args.number / seconds
+        print(f"{name:<22} {len(reqs):>8} {invalid:>8} {rate:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Aggregate request profiles and print the top functions per intent
+
+Reads profiles written to PROFILE_OUTPUT (JSON lines) or picked out of exported logs
+(lines containing "Request profile: "), see `services.profiling`. For each intent,
+prints how many requests were profiled, their mean time, and the functions with the
+most cumulative time summed over the profiles.
+
+Usage (from hip-log-bot-cloud-function/):
+    python scripts/aggregate_profiles.py FILE [FILE ...] [--intent GetActivityList]
+        [--top 20] [--sort cumtime|tottime|calls] [--json]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from services.profiling import aggregate, read_profiles  # noqa: E402
+
+SORT_KEYS = ("cumtime", "tottime", "calls")
+
+
+def load(paths):
+    for path in paths:
+        with open(path) as fp:
+            yield from read_profiles(fp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("files", nargs="+", help="profile or log files")
+    parser.add_argument("--intent", help="only this intent's profiles")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--sort", choices=SORT_KEYS, default=SORT_KEYS[0])
+    parser.add_argument("--json", action="store_true", help="print as JSON")
+    args = parser.parse_args()
+
+    profiles = load(args.files)
+    if args.intent:
+        profiles = (p for p in profiles if p.intent == args.intent)
+    by_intent = aggregate(profiles)
+    top = args.top
+
+    for entry in by_intent.values():
+        ranked = sorted(
+            entry["functions"].items(), key=lambda f: f[1][args.sort], reverse=True
+        )
+        entry["functions"] = dict(ranked[:top])
+
+    if args.json:
+        print(json.dumps(by_intent, indent=2))
+        return
+
+    for intent, entry in sorted(by_intent.items(), key=lambda i: str(i[0])):
+        mean_ms = entry["seconds"] / entry["profiles"] * 1000
+        print(f"{intent}: {entry['profiles']} profiles, {mean_ms:.1f} ms mean")
+        print(f"  {'cumtime':>10} {'tottime':>10} {'calls':>8}  function")
+        for function, totals in entry["functions"].items():
+            print(
+                f"  {totals['cumtime']:>10.4f} {totals['tottime']:>10.4f} "
+                f"{totals['calls']:>8}  {function}"
+            )
+        print()
+
+
+if __name__ == "__main__":
+    main()
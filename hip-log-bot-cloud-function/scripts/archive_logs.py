@@ -0,0 +1,68 @@
+"""Pack users' old DailyLogs into one compressed archive document per month
+
+Months at least --min-age-months old are archived (see `services.archiver`). The
+logs stay readable and writable, and a run can be repeated at any time (eg on a
+schedule) since archived months are skipped.
+
+Usage (from hip-log-bot-cloud-function/, with the usual Firestore credentials and
+FIRESTORE_COLLECTION_NAME set):
+    python scripts/archive_logs.py USER [USER ...]
+    python scripts/archive_logs.py --all --min-age-months 6
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import firebase_admin  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+from firebase_admin import firestore  # noqa: E402
+from services.archiver import archive_user, DEFAULT_MIN_AGE_MONTHS  # noqa: E402
+from services.hiplogdb import HipLogDB  # noqa: E402
+
+logger = logging.getLogger("archive_logs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("users", nargs="*", help="user ids to archive")
+    parser.add_argument("--all", action="store_true", help="archive every user")
+    parser.add_argument("--min-age-months", type=int, default=DEFAULT_MIN_AGE_MONTHS)
+    args = parser.parse_args()
+    if not args.users and not args.all:
+        parser.error("Pass user ids or --all")
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    firebase_admin.initialize_app()
+
+    users = args.users
+    if args.all:
+        collection = firestore.client().collection(
+            os.environ["FIRESTORE_COLLECTION_NAME"]
+        )
+        users = [ref.id for ref in collection.list_documents()]
+
+    failed = []
+    for user in users:
+        hiplogdb = HipLogDB()
+        try:
+            archived = archive_user(hiplogdb, user, args.min_age_months)
+        except Exception as e:
+            logger.error(f"Failed to archive '{user}': {e}")
+            failed.append(user)
+            continue
+        logger.info(f"'{user}': archived {archived} logs ({hiplogdb.io_stats})")
+
+    logger.info(f"Archived {len(users) - len(failed)} of {len(users)} users")
+    if failed:
+        logger.error(f"Re-run for: {' '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Export a user's DailyLogs to a file
+
+The default format is the compact binary log stream (see `models.log_codec`), which
+can be read back one log at a time with `log_codec.load()`. JSON lines (one
+{"date": ..., "log": ...} object per line) are also supported for other tools.
+
+Usage (from hip-log-bot-cloud-function/, with the usual Firestore credentials and
+FIRESTORE_COLLECTION_NAME set):
+    python scripts/export_logs.py USER OUTPUT_FILE [--format logcodec|jsonl]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import firebase_admin  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+from models import log_codec  # noqa: E402
+from services.hiplogdb import HipLogDB  # noqa: E402
+
+logger = logging.getLogger("export_logs")
+
+FORMATS = ("logcodec", "jsonl")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("user", help="user id to export")
+    parser.add_argument("output", help="file to write")
+    parser.add_argument("--format", choices=FORMATS, default=FORMATS[0])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    firebase_admin.initialize_app()
+
+    hiplogdb = HipLogDB()
+    logs = hiplogdb.stream_logs(args.user)
+    if args.format == "logcodec":
+        with open(args.output, "wb") as fp:
+            n_logs = log_codec.dump(logs, fp)
+    else:
+        n_logs = 0
+        with open(args.output, "w") as fp:
+            for date, log_dict in logs:
+                fp.write(json.dumps({"date": date, "log": log_dict}) + "\n")
+                n_logs += 1
+
+    logger.info(
+        f"Exported {n_logs} logs of '{args.user}' to {args.output} ({hiplogdb.io_stats})"  # noqa
+    )
+
+
+if __name__ == "__main__":
+    main()
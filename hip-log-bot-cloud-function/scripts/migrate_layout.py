@@ -0,0 +1,68 @@
+"""Move users' DailyLogs to another layout (flat or yearly), online
+
+Each user keeps being able to log while they're migrated (see
+`HipLogDB.migrate_layout()`), and an interrupted run can simply be re-run.
+
+Usage (from hip-log-bot-cloud-function/, with the usual Firestore credentials and
+FIRESTORE_COLLECTION_NAME set):
+    python scripts/migrate_layout.py --layout yearly USER [USER ...]
+    python scripts/migrate_layout.py --layout yearly --all
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import firebase_admin  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+from firebase_admin import firestore  # noqa: E402
+from models.catalog import LAYOUTS  # noqa: E402
+from services.hiplogdb import HipLogDB, MIGRATION_PAGE_SIZE  # noqa: E402
+
+logger = logging.getLogger("migrate_layout")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("users", nargs="*", help="user ids to migrate")
+    parser.add_argument("--all", action="store_true", help="migrate every user")
+    parser.add_argument("--layout", choices=LAYOUTS, required=True)
+    parser.add_argument("--page-size", type=int, default=MIGRATION_PAGE_SIZE)
+    args = parser.parse_args()
+    if not args.users and not args.all:
+        parser.error("Pass user ids or --all")
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    firebase_admin.initialize_app()
+
+    users = args.users
+    if args.all:
+        collection = firestore.client().collection(
+            os.environ["FIRESTORE_COLLECTION_NAME"]
+        )
+        users = [ref.id for ref in collection.list_documents()]
+
+    failed = []
+    for user in users:
+        hiplogdb = HipLogDB()
+        try:
+            copied = hiplogdb.migrate_layout(user, args.layout, args.page_size)
+        except Exception as e:
+            logger.error(f"Failed to migrate '{user}': {e}")
+            failed.append(user)
+            continue
+        logger.info(f"'{user}': copied {copied} logs ({hiplogdb.io_stats})")
+
+    logger.info(f"Migrated {len(users) - len(failed)} of {len(users)} users")
+    if failed:
+        logger.error(f"Re-run for: {' '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Recompute every user's derived data (catalog, year summaries and stats), eg after
+a stats schema change
+
+Users are listed a page at a time and fanned out across worker processes. Each
+user's logs are streamed once and the results written back with a BulkWriter,
+throttled to --max-ops-per-second in total. Users that succeed are appended to the
+--checkpoint file, so rerunning the same command after an interruption (or to retry
+failed users) skips them.
+
+Usage (from hip-log-bot-cloud-function/, with the usual Firestore credentials and
+FIRESTORE_COLLECTION_NAME set):
+    python scripts/recompute_all.py --workers 8 --checkpoint recompute.done
+    python scripts/recompute_all.py USER [USER ...]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import firebase_admin  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+from services.hiplogdb import HipLogDB  # noqa: E402
+from services.recompute import (  # noqa: E402
+    DEFAULT_MAX_OPS_PER_SECOND,
+    DEFAULT_PAGE_SIZE,
+    Checkpoint,
+    recompute_users,
+)
+
+logger = logging.getLogger("recompute_all")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("users", nargs="*", help="only these users (default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--checkpoint", help="file of users already recomputed")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument(
+        "--max-ops-per-second", type=int, default=DEFAULT_MAX_OPS_PER_SECOND
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    firebase_admin.initialize_app()
+
+    users = args.users or HipLogDB().list_users(args.page_size)
+    report = recompute_users(
+        users, args.workers, Checkpoint(args.checkpoint), args.max_ops_per_second
+    )
+    print(json.dumps(report.to_dict(), indent=2))
+    if report.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
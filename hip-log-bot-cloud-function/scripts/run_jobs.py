@@ -0,0 +1,68 @@
+"""Queue and run background jobs (catalog rebuilds, archival, stats) from the CLI
+
+Uses the queue in JOB_QUEUE: the Firestore one shared with the webhook by default, a
+SQLite file path, or "memory" for one that only lives for this run.
+
+Usage (from hip-log-bot-cloud-function/, with the usual Firestore credentials and
+FIRESTORE_COLLECTION_NAME set):
+    python scripts/run_jobs.py                                # run due jobs
+    python scripts/run_jobs.py --enqueue rebuild_catalog --all
+    python scripts/run_jobs.py --enqueue archive_logs USER [USER ...] --workers 8
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import firebase_admin  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+from firebase_admin import firestore  # noqa: E402
+from services.jobs import (  # noqa: E402
+    DEFAULT_MAX_WORKERS,
+    HANDLERS,
+    JobWorker,
+    get_queue,
+)
+
+logger = logging.getLogger("run_jobs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("users", nargs="*", help="user ids to queue jobs for")
+    parser.add_argument("--enqueue", choices=sorted(HANDLERS), help="job to queue")
+    parser.add_argument("--all", action="store_true", help="queue for every user")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--max-seconds", type=float, help="stop starting new jobs")
+    parser.add_argument("--no-run", action="store_true", help="only queue the jobs")
+    args = parser.parse_args()
+    if args.enqueue and not args.users and not args.all:
+        parser.error("Pass user ids or --all to queue jobs")
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    firebase_admin.initialize_app()
+
+    queue = get_queue()
+    if args.enqueue:
+        users = args.users
+        if args.all:
+            collection = firestore.client().collection(
+                os.environ["FIRESTORE_COLLECTION_NAME"]
+            )
+            users = [ref.id for ref in collection.list_documents()]
+        queued = sum(queue.enqueue(args.enqueue, user) for user in users)
+        logger.info(f"Queued {queued} {args.enqueue} jobs ({len(users)} users)")
+
+    if not args.no_run:
+        metrics = JobWorker(queue, max_workers=args.workers).run(args.max_seconds)
+        if metrics.dead:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+from google.api_core.exceptions import (
+    DeadlineExceeded,
+    InternalServerError,
+    ResourceExhausted,
+    RetryError,
+    ServiceUnavailable,
+)
+
+# Firestore errors that mean the database can't be reached right now, rather than
+# anything being wrong with the request
+STORAGE_ERRORS = (
+    DeadlineExceeded,
+    InternalServerError,
+    ResourceExhausted,
+    RetryError,
+    ServiceUnavailable,
+)
+
+
+class UnsupportedIntent(ValueError):
+    """The request is for an intent this webhook doesn't handle
+
+    Attributes:
+        intent (str): the intent's display name
+    """
+
+    def __init__(self, message: str, intent: str = None):
+        super().__init__(message)
+        self.intent = intent
+
+
+class ValidationError(ValueError):
+    """The request's parameters are missing or invalid
+
+    Attributes:
+        parameter (str): the Dialogflow parameter at fault, if any
+    """
+
+    def __init__(self, message: str, parameter: str = None):
+        super().__init__(message)
+        self.parameter = parameter
+
+
+class MissingParameter(ValidationError):
+    """A required parameter is missing or empty"""
+
+
+class InvalidParameter(ValidationError):
+    """A parameter's value can't be converted to what it stands for"""
+
+
+class MismatchedSets(InvalidParameter):
+    """The reps/weights/durations lists of a set of activity sets differ in length"""
+
+
+class InvalidDateRange(ValidationError):
+    """A date range is reversed or longer than can be read at once"""
+
+
+class InvalidDeleteRange(InvalidDateRange):
+    """A date range is longer than can be deleted at once
+
+    Attributes:
+        max_days (int): the most days that can be deleted at once
+    """
+
+    def __init__(self, message: str, max_days: int = None):
+        super().__init__(message)
+        self.max_days = max_days
+
+
+class StorageUnavailable(Exception):
+    """Firestore can't be reached right now (see `STORAGE_ERRORS`). Retrying later
+    may work"""
+
+
+class RateLimited(Exception):
+    """The sender is over their rate limit (see `services.rate_limit`)"""
+
+
+class Overloaded(Exception):
+    """The instance is already running as many requests as it takes at once"""
+
+
+# Replies for each error type, most specific first (see `response_for()`)
+ERROR_RESPONSES = {
+    UnsupportedIntent: "We don't support this yet (intent = {intent})",
+    MismatchedSets: "It looks like you provided unmatched entries for reps/weights/durations (eg specified 2 sets of reps but only 1 weight). Check your log and try again",  # noqa
+    InvalidDeleteRange: "That's too many days to delete at once. Try a range of up to {max_days} days",  # noqa
+    InvalidDateRange: "That's too many days at once. Try a range of up to a year",
+    ValidationError: "I couldn't make sense of that. Try a different way or type 'help'",  # noqa
+    StorageUnavailable: "I can't reach your logs right now. Try again in a minute",
+    RateLimited: "Whoa, that's a lot of messages! Give me a minute and try again",
+    Overloaded: "I'm a bit busy right now. Try again in a few seconds",
+}
+UNKNOWN_ERROR_RESPONSE = "Something went wrong. Try a different way or type 'help'"
+
+
+# Public functions
+def response_for(error: Exception) -> str:
+    """The reply for an error: its type's (or closest base type's) response in
+    `ERROR_RESPONSES`, or `UNKNOWN_ERROR_RESPONSE`"""
+    for cls in type(error).__mro__:
+        response = ERROR_RESPONSES.get(cls)
+        if response is not None:
+            if cls is UnsupportedIntent:
+                return response.format(intent=error.intent)
+            if cls is InvalidDeleteRange:
+                return response.format(max_days=error.max_days)
+            return response
+
+    return UNKNOWN_ERROR_RESPONSE
@@ -1,9 +1,15 @@
 import logging
-import firebase_admin
+import os
 import functions_framework
+from errors import Overloaded, RateLimited, response_for
+from services import metrics, profiling, warmup
 from services.executor import Executor
+from services.io_stats import IO_STATS_HEADER
+from services.jobs import JobWorker, drain_in_background, get_queue
+from services.metrics import METRICS_PATH
+from services.rate_limit import get_admission_control
 from dotenv import load_dotenv
-from utils import get_runtime_config
+from utils import error_log_limiter, get_runtime_config, is_ops_request
 
 logging.basicConfig(level=get_runtime_config()["log_level"])
 logger = logging.getLogger(__name__)
@@ -12,37 +18,107 @@ logger = logging.getLogger(__name__)
 if not load_dotenv():
     logger.info(".env file not found")
 
+# Warm the instance up as it starts, rather than on its first request, if set (eg
+# alongside min instances, which are started ahead of traffic)
+if os.environ.get("WARMUP_ON_START", "off") == "on":
+    warmup.warm_up()
+
 
 @functions_framework.http
 def main(request):
     logger.debug("Starting main()")
 
-    # Initialize the firebase components
-    try:
-        fb_app = firebase_admin.get_app()
-        logger.info("Opened existing Firestore app")
-    except ValueError:
-        fb_app = firebase_admin.initialize_app()
-        logger.info("Opened new Firestore app")
+    # Scrapes of the metrics, when enabled, are served by the same function to
+    # callers holding the ops token
+    if request.path == METRICS_PATH:
+        if not is_ops_request(request):
+            return "Forbidden", 403
+        return serve_metrics()
+
+    # Warm-up requests (eg from a startup probe or scheduler, holding the ops token)
+    # and health checks
+    if request.path == warmup.WARMUP_PATH:
+        if not is_ops_request(request):
+            return "Forbidden", 403
+        return warmup.warm_up(warmup.WARMUP_MIN_INTERVAL_SECONDS).to_dict()
+    if request.path == warmup.HEALTH_PATH:
+        return serve_health()
+
+    # Initialize the firebase components. The app is kept open for the life of the
+    # instance, so later requests reuse its Firestore channel
+    warmup.init_firebase()
 
-    # Initialize handlers
-    request = request.get_json(force=True)
-    logger.debug(f"Input request:\n{request}")
+    # Initialize handlers. A body that isn't JSON is left to the executor to turn
+    # away, same as any other bad request
+    request = request.get_json(force=True, silent=True)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Input request:\n{request}")
 
+    # Turn away senders over their rate limit (and requests beyond what the instance
+    # runs at once) before doing any work for them
+    executor = None
     try:
-        res = Executor(request).run()
-    except:  # noqa
+        with get_admission_control().admit(request):
+            metrics.REQUESTS_IN_FLIGHT.inc()
+            try:
+                executor = Executor(request)
+                if profiling.should_profile(request):
+                    res = profiling.run_profiled(executor)
+                else:
+                    res = executor.run()
+            finally:
+                metrics.REQUESTS_IN_FLIGHT.dec()
+    except (RateLimited, Overloaded) as e:
+        error_log_limiter.log(logger, type(e).__name__, f"Rejected request: {e}")
+        metrics.REJECTED_REQUESTS.inc(type(e).__name__)
+        res = response_for(e)
+    except Exception as e:
+        error_log_limiter.log(logger, "main", f"Executor failed: {e!r}", exc_info=True)
         res = "Something went wrong. Reach out to the developer"
 
-    # Close fireabse
-    try:
-        firebase_admin.delete_app(fb_app)
-        logger.debug("Closed Firestore app")
-    except ValueError:
-        logger.warning("Failed to close Firestore app")
-        pass
+    # Run any jobs the request queued (in-memory queue only) after responding
+    if drain_in_background():
+        logger.debug("Running queued jobs in the background")
+
+    # Send response back to DialogFlow, in the format of the platform it came from
+    if executor is not None:
+        response = executor.renderer.to_response(res)
+    else:
+        response = {"fulfillmentText": res}
 
-    # Send response back to DialogFlow
-    response = {"fulfillmentText": res}
+    if executor is not None and get_runtime_config()["debug_headers"]:
+        return response, 200, {IO_STATS_HEADER: str(executor.io_stats)}
 
     return response
+
+
+@functions_framework.http
+def run_jobs(request):
+    """Worker entry point for a shared job queue (Firestore by default, see
+    `FirestoreJobQueue`), eg called on a schedule by a caller holding the ops token:
+    runs due jobs for up to `max_seconds` (query parameter, default 60) and reports
+    the outcome"""
+    if not is_ops_request(request):
+        return "Forbidden", 403
+
+    warmup.init_firebase()
+
+    max_seconds = float(request.args.get("max_seconds", 60))
+    job_metrics = JobWorker(get_queue()).run(max_seconds=max_seconds)
+
+    return {"metrics": job_metrics.to_dict(), "queue": get_queue().counts()}
+
+
+def serve_metrics():
+    """The process's metrics in the Prometheus text format (see `services.metrics`),
+    or a 404 if they're disabled"""
+    if not metrics.REGISTRY.enabled:
+        return "Metrics are disabled", 404
+    return metrics.REGISTRY.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
+def serve_health():
+    """The instance's warm state and Firestore latency (see `services.warmup`), with a
+    503 if it isn't fully warm or Firestore is unreachable"""
+    status = warmup.health()
+    return status, 200 if status["status"] == "ok" else 503
@@ -0,0 +1,122 @@
+from __future__ import annotations
+from typing import Dict, List
+import copy
+import json
+import logging
+import zlib
+from models import log_codec
+
+logger = logging.getLogger(__name__)
+
+
+class MonthArchive:
+    """A month of a user's DailyLogs packed into a single compressed document
+
+    The logs (in the `DailyLog.to_dict()` format) are stored as one compressed blob
+    (see `models.log_codec`), which is only unpacked when a log is actually read. The
+    dates are stored alongside in plain form so listing them doesn't need an unpack.
+    """
+
+    ENCODING = "zlib+logcodec"
+
+    # Encodings that can still be read (archives are rewritten in the current one)
+    READABLE_ENCODINGS = (ENCODING, "zlib+json")
+
+    # Initialization
+    def __init__(self, month: str, logs: Dict[str, dict] = None):
+        """
+        Args:
+            month (str): 'YYYY-MM'
+            logs (dict, optional): date -> log dict. Defaults to no logs.
+        """
+        self._month = month
+        self._logs = dict(logs) if logs else {}
+        self._dates = sorted(self._logs)
+        self._packed = None
+        self._packed_encoding = None
+
+    # Class Methods
+    @classmethod
+    def from_dict(cls, input_dict: dict) -> MonthArchive:
+        """Initialize from the Firestore document, without unpacking the logs"""
+        if input_dict.get("encoding") not in cls.READABLE_ENCODINGS:
+            raise ValueError(f"Unsupported archive encoding '{input_dict['encoding']}'")
+
+        archive = cls(input_dict["month"])
+        archive._dates = list(input_dict["dates"])
+        archive._packed = input_dict["data"]
+        archive._packed_encoding = input_dict["encoding"]
+        archive._logs = None
+
+        return archive
+
+    @staticmethod
+    def month_of(date: str) -> str:
+        """The 'YYYY-MM' month of a 'YYYY-MM-DD' date"""
+        return date[:7]
+
+    # Properties
+    @property
+    def month(self) -> str:
+        return self._month
+
+    @property
+    def dates(self) -> List[str]:
+        return self._dates
+
+    @property
+    def is_unpacked(self) -> bool:
+        return self._logs is not None
+
+    # Public Methods
+    def get(self, date: str) -> dict:
+        """Get a log dict (a copy, so it can be modified), or None if there's no log
+        for the date"""
+        if date not in self._dates:
+            return None
+
+        return copy.deepcopy(self._unpack()[date])
+
+    def items(self):
+        """(date, log dict) pairs in date order"""
+        logs = self._unpack()
+        for date in self._dates:
+            yield date, copy.deepcopy(logs[date])
+
+    def set(self, date: str, log_dict: dict):
+        self._unpack()[date] = copy.deepcopy(log_dict)
+        self._dates = sorted(self._logs)
+        self._packed = self._packed_encoding = None
+
+    def remove(self, date: str):
+        if self._unpack().pop(date, None) is not None:
+            self._dates = sorted(self._logs)
+            self._packed = self._packed_encoding = None
+
+    # Converters/Serializers
+    def to_dict(self) -> dict:
+        if self._packed_encoding != self.ENCODING:
+            logs = self._unpack()
+            encoded = log_codec.dumps((date, logs[date]) for date in self._dates)
+            self._packed = zlib.compress(encoded, 9)
+            self._packed_encoding = self.ENCODING
+
+        return {
+            "month": self._month,
+            "encoding": self.ENCODING,
+            "version": log_codec.VERSION,
+            "dates": self._dates,
+            "num_logs": len(self._dates),
+            "data": self._packed,
+        }
+
+    # Private methods
+    def _unpack(self) -> dict:
+        if self._logs is None:
+            logger.debug(f"Unpacking archive for {self._month}")
+            data = zlib.decompress(self._packed)
+            if self._packed_encoding == "zlib+json":
+                self._logs = json.loads(data)
+            else:
+                self._logs = dict(log_codec.loads(data))
+        return self._logs
@@ -0,0 +1,246 @@
+from __future__ import annotations
+from datetime import date as Date
+from typing import List
+import logging
+from models.daily_log import DailyLog
+from models.date_bitmap import DateBitmap
+from models.severity_series import SeveritySeries
+from utils import parse_date
+
+logger = logging.getLogger(__name__)
+
+# How a user's DailyLogs are laid out in Firestore:
+# * flat: Users/{user}/DailyLogs/{date}
+# * yearly: Users/{user}/Years/{yyyy}/DailyLogs/{date}, with a summary in each year's
+#   document
+LAYOUT_FLAT = "flat"
+LAYOUT_YEARLY = "yearly"
+LAYOUTS = (LAYOUT_FLAT, LAYOUT_YEARLY)
+
+
+class Catalog:
+    """A summary of everything a user has logged, stored in the user's top level
+    document so it can be fetched with a single point read.
+
+    Attributes:
+        log_version (int): counter that's bumped on every upload/delete, used to
+        invalidate anything derived from the user's history
+        log_dates (DateBitmap): the dates that have a DailyLog
+        num_logs (int): how many DailyLogs there are, counted as they're created and
+        deleted (see `HipLogDB.reconcile_num_logs()` for fixing any drift)
+        activity_dates (dict): activity name -> DateBitmap of the dates it was done
+        symptom_dates (dict): symptom name -> DateBitmap of the dates it was logged
+        symptom_severities (dict): symptom name -> SeveritySeries of its severity on
+        those dates. Symptoms logged before the series were kept have none until the
+        catalog is rebuilt (see `get_symptom_severities()`)
+        indexed (bool): True once the catalog reflects the user's full history (ie it
+        was built from the DailyLogs rather than only from recent uploads)
+        layout (str): where the user's DailyLogs are stored (see LAYOUTS)
+        migrating_to (str): the layout the logs are being moved to, if a migration is
+        in progress (writes go to both layouts until it's done)
+        archived_months (set): 'YYYY-MM' months whose logs were packed into a single
+        archive document (see `models.archive.MonthArchive`)
+        journal_head (int): version of the latest change in the user's journal that
+        wasn't undone yet (see `models.journal.JournalEntry`), if any
+    """
+
+    # Initialization
+    def __init__(self, indexed: bool = False):
+        self.log_version = 0
+        self.log_dates = DateBitmap()
+        self.num_logs = 0
+        self.activity_dates = {}
+        self.symptom_dates = {}
+        self.symptom_severities = {}
+        self.indexed = indexed
+        self.layout = LAYOUT_FLAT
+        self.migrating_to = None
+        self.archived_months = set()
+        self.journal_head = None
+
+    # Class Methods
+    @classmethod
+    def from_dict(cls, input_dict: dict) -> Catalog:
+        """Initialize a Catalog using the user document's dict"""
+        input_dict = input_dict or {}
+        catalog = cls(indexed=bool(input_dict.get("indexed")))
+        catalog.log_version = input_dict.get("log_version", 0)
+        catalog.layout = input_dict.get("layout", LAYOUT_FLAT)
+        catalog.migrating_to = input_dict.get("migrating_to")
+        catalog.archived_months = set(input_dict.get("archived_months") or [])
+        catalog.journal_head = input_dict.get("journal_head")
+        catalog.log_dates = DateBitmap.from_dict(input_dict.get("log_dates"))
+        # Catalogs written before the counter start from their dates
+        catalog.num_logs = input_dict.get("num_logs", catalog.log_dates.count())
+        catalog.activity_dates = {
+            name: DateBitmap.from_dict(d)
+            for name, d in (input_dict.get("activity_dates") or {}).items()
+        }
+        catalog.symptom_dates = {
+            name: DateBitmap.from_dict(d)
+            for name, d in (input_dict.get("symptom_dates") or {}).items()
+        }
+        catalog.symptom_severities = {
+            name: SeveritySeries.from_dict(d)
+            for name, d in (input_dict.get("symptom_severities") or {}).items()
+        }
+
+        return catalog
+
+    @classmethod
+    def from_log_dicts(cls, logs) -> Catalog:
+        """Build a complete catalog from (date, log dict) pairs, eg from
+        `HipLogDB.stream_logs()`"""
+        catalog = cls(indexed=True)
+        for date, log_dict in logs:
+            catalog.record_log(DailyLog.from_dict(date, log_dict))
+
+        return catalog
+
+    # Properties
+    @property
+    def activities(self) -> List[str]:
+        """Names of all the activities ever logged, sorted"""
+        return sorted(self.activity_dates)
+
+    @property
+    def symptoms(self) -> List[str]:
+        """Names of all the symptoms ever logged, sorted"""
+        return sorted(self.symptom_dates)
+
+    @property
+    def years(self) -> List[int]:
+        """Every year from the first to the last log (empty if there are no logs)"""
+        if not self.log_dates.count():
+            return []
+        return list(range(self.log_dates.start.year, self.log_dates.end.year + 1))
+
+    # Public Methods
+    def record_log(self, log: DailyLog):
+        """Add a new/updated DailyLog's date and records to the catalog. Only a new
+        log is counted"""
+        day = parse_date(log.date)
+        if day not in self.log_dates:
+            self.num_logs += 1
+        self.log_dates.add(day)
+        for name in log.activities:
+            self.activity_dates.setdefault(name, DateBitmap()).add(day)
+        for name, symptom in log.symptoms.items():
+            # A symptom logged before the series were kept only gets one once its
+            # whole history is recorded (by a rebuild), so a series is never partial
+            if name in self.symptom_severities or name not in self.symptom_dates:
+                self.symptom_severities.setdefault(name, SeveritySeries()).set(
+                    day, symptom.severity
+                )
+            self.symptom_dates.setdefault(name, DateBitmap()).add(day)
+
+    def record_patch(
+        self, patch: DailyLog, log: DailyLog, removed_symptoms: List[str] = ()
+    ):
+        """Add a patch of a DailyLog (see `DailyLog.merge()`) to the catalog,
+        dropping the date of any activity it removed the last sets of, and of the
+        whole log if it left it empty
+
+        Args:
+            patch (DailyLog): the change
+            log (DailyLog): the day's log with the patch merged in
+            removed_symptoms (list, optional): symptoms the change also removed
+        """
+        self.record_log(patch)
+        day = parse_date(log.date)
+        for name in patch.to_dict()["activities"]:
+            if name not in log.activities:
+                _remove_day(self.activity_dates, name, day)
+        for name in removed_symptoms:
+            self._remove_symptom_day(name, day)
+        if log.is_empty:
+            self.remove_log(log)
+
+    def remove_log(self, log: DailyLog):
+        """Remove a deleted DailyLog's date and records from the catalog. Names that
+        no longer have any dates are dropped."""
+        day = parse_date(log.date)
+        if day in self.log_dates:
+            self.num_logs -= 1
+        self.log_dates.remove(day)
+        for name in log.activities:
+            _remove_day(self.activity_dates, name, day)
+        for name in log.symptoms:
+            self._remove_symptom_day(name, day)
+
+    def get_month_dates(self, month: str) -> List[str]:
+        """The dates logged in a 'YYYY-MM' month"""
+        return [
+            str(day) for day in self.log_dates.dates() if str(day).startswith(month)
+        ]
+
+    def get_activity_dates(self, name: str) -> DateBitmap:
+        """Get the dates an activity was done (empty if never)"""
+        return self.activity_dates.get(name, DateBitmap())
+
+    def get_symptom_severities(self, name: str):
+        """Get the dates a symptom was logged and its SeveritySeries, or None if its
+        history isn't in the catalog (it was logged before the series were kept)"""
+        if name not in self.symptom_severities:
+            return None
+        return self.symptom_dates[name], self.symptom_severities[name]
+
+    def year_summary(self, year: int) -> dict:
+        """Summarize a year of logs, for the year's partition document
+
+        Returns:
+            dict: the year, the number of logs and the number of days each activity
+            and symptom was logged
+        """
+        first, last = Date(year, 1, 1), Date(year, 12, 31)
+        summary = {"year": year, "num_logs": self.log_dates.count_between(first, last)}
+        for key, dates_by_name in [
+            ("activities", self.activity_dates),
+            ("symptoms", self.symptom_dates),
+        ]:
+            counts = {
+                name: dates.count_between(first, last)
+                for name, dates in dates_by_name.items()
+            }
+            summary[key] = {name: n for name, n in counts.items() if n}
+
+        return summary
+
+    # Private methods
+    def _remove_symptom_day(self, name: str, day: Date):
+        if name in self.symptom_severities:
+            self.symptom_severities[name].remove(day)
+        _remove_day(self.symptom_dates, name, day)
+        if name not in self.symptom_dates:
+            self.symptom_severities.pop(name, None)
+
+    # Converters/Serializers
+    def to_dict(self) -> dict:
+        return {
+            "log_version": self.log_version,
+            "indexed": self.indexed,
+            "layout": self.layout,
+            "migrating_to": self.migrating_to,
+            "archived_months": sorted(self.archived_months),
+            "journal_head": self.journal_head,
+            "log_dates": self.log_dates.to_dict(),
+            "num_logs": self.num_logs,
+            "activity_dates": {
+                name: dates.to_dict() for name, dates in self.activity_dates.items()
+            },
+            "symptom_dates": {
+                name: dates.to_dict() for name, dates in self.symptom_dates.items()
+            },
+            "symptom_severities": {
+                name: series.to_dict()
+                for name, series in self.symptom_severities.items()
+            },
+        }
+
+
+def _remove_day(dates_by_name: dict, name: str, day: Date):
+    """Remove a day from a name's dates, dropping the name if it has none left"""
+    if name in dates_by_name:
+        dates_by_name[name].remove(day)
+        if not dates_by_name[name].count():
+            del dates_by_name[name]
@@ -1,7 +1,9 @@
-from typing import List
-from datetime import datetime
+from __future__ import annotations
+from typing import List, Tuple
 import logging
+from models.log_date import LogDate
 from models.record import Activity, Symptom
+from models.renderers import CompactRenderer, PlainTextRenderer
 
 logger = logging.getLogger(__name__)
 logger.propagate = True
@@ -17,7 +19,7 @@ class DailyLog:
         activity_notes=None,
         symptom_notes=None,
     ):
-        self._date = date
+        self._date = LogDate.parse(date)
         self._activity_notes = activity_notes
         self._symptom_notes = symptom_notes
         self._activities = {}
@@ -30,27 +32,9 @@ class DailyLog:
             self.add_symptom(p)
 
     def __str__(self):
-        formatted_date = datetime.strptime(self._date, "%Y-%m-%d").strftime(
-            "%b. %-d, %Y"
-        )
-        header = f"{formatted_date} Log:"
-
-        output = [header, ""]
-        output.append(f"{len(self.activities)}x activities:")
-        for idx, activity in enumerate(self._activities):
-            output.append(f"* {self._activities[activity].__str__()}")
-
-        if self._activity_notes:
-            output.append(self._activity_notes)
-
-        output.extend(["", f"{len(self.symptoms)}x symptom records:"])
-        for idx, symptom in enumerate(self._symptoms):
-            output.append(f"* {self._symptoms[symptom].__str__()}")
-
-        if self._symptom_notes:
-            output.append(self._symptom_notes)
-
-        return "\n".join(output)
+        """Print method for DailyLog (see `PlainTextRenderer` for the format).
+        Rendered from cached fragments, so it's cheap to call repeatedly"""
+        return PlainTextRenderer().render_log(self)
 
     # Class Methods
     @classmethod
@@ -86,7 +70,14 @@ class DailyLog:
                 logger.debug(
                     f"Parsing symptom {symptom_name} with input: {symptom_dict}"
                 )
-                daily_log.add_symptom(Symptom(symptom_name, symptom_dict["severity"]))
+                daily_log.add_symptom(
+                    Symptom(
+                        symptom_name,
+                        symptom_dict["severity"],
+                        symptom_dict.get("id"),
+                        symptom_dict.get("ts"),
+                    )
+                )
 
         logger.debug("Finished creating a DailyLog instance")
 
@@ -95,16 +86,42 @@ class DailyLog:
     # Properties
     @property
     def activities(self) -> dict:
-        return self._activities
+        """The activities, leaving out any whose sets were all removed (which are
+        only kept for their removals, see `merge()`)"""
+        if all(a.sets or not a.removed_set_ids for a in self._activities.values()):
+            return self._activities
+        return {
+            name: a
+            for name, a in self._activities.items()
+            if a.sets or not a.removed_set_ids
+        }
 
     @property
     def symptoms(self):
         return self._symptoms
 
     @property
-    def date(self):
+    def date(self) -> LogDate:
         return self._date
 
+    @property
+    def is_empty(self) -> bool:
+        """True if nothing is logged (eg once a log's only activity was removed)"""
+        return not (
+            self.activities
+            or self._symptoms
+            or self._activity_notes
+            or self._symptom_notes
+        )
+
+    @property
+    def activity_notes(self):
+        return self._activity_notes
+
+    @property
+    def symptom_notes(self):
+        return self._symptom_notes
+
     # Public Methods related to Activities
     def add_activity(self, activity: Activity, overwrite: bool = False):
         """Add or update an activity to a DailyLog. When updating, by default will
@@ -153,6 +170,24 @@ class DailyLog:
             logger.info(f"No activity named {name} found.")
             return None
 
+    def last_set(self, name: str = None) -> Tuple[Activity, str]:
+        """The set logged last (of an activity, or of any)
+
+        Returns:
+            tuple: (the set's activity, the set's key, see `Activity.keyed_sets()`),
+            or (None, None) if there are no sets
+        """
+        candidates = [
+            (s.ts or 0, i, j, activity, key)
+            for i, activity in enumerate(self.activities.values())
+            if name is None or activity.name == name
+            for j, (key, s) in enumerate(activity.keyed_sets().items())
+        ]
+        if not candidates:
+            return None, None
+        *_, activity, key = max(candidates, key=lambda c: c[:3])
+        return activity, key
+
     def list_activities(self):
         """List all activity names."""
         for activity_name in self._activities.keys():
@@ -185,13 +220,56 @@ class DailyLog:
     def set_symptom_notes(self, notes: str):
         self._symptom_notes = notes
 
+    # Public Methods related to merging
+    def merge(self, other: DailyLog) -> DailyLog:
+        """Merge two versions of the day's log (eg written by different devices, or
+        a log and a patch of it) into a new one. Merges converge: the result is the
+        same whatever the order versions are merged in, and merging a version in
+        again changes nothing
+
+        * activities' sets are an add-wins set (see `Activity.merge()`)
+        * symptoms are last writer wins (see `Symptom.merge()`)
+        * notes aren't timestamped, so differing ones resolve to the greater
+
+        Raises:
+            ValueError: the logs are for different dates
+        """
+        if self._date != other.date:
+            raise ValueError(f"Can't merge logs of {self._date} and {other.date}")
+
+        merged = DailyLog(
+            self._date,
+            activity_notes=_merge_notes(self._activity_notes, other.activity_notes),
+            symptom_notes=_merge_notes(self._symptom_notes, other.symptom_notes),
+        )
+        for mine, theirs, add in [
+            (self._activities, other._activities, merged._activities),
+            (self._symptoms, other._symptoms, merged._symptoms),
+        ]:
+            for name in mine.keys() | theirs.keys():
+                if name in mine and name in theirs:
+                    add[name] = mine[name].merge(theirs[name])
+                else:
+                    record = mine.get(name) or theirs[name]
+                    add[name] = record.merge(record)
+
+        return merged
+
     # Converters/Serializers
+    def summarize(self) -> str:
+        """A one line summary of the log, for multi-day views
+
+        Sample to demonstrate format:
+        "Fri Nov. 3: Squats (2 sets), Yoga (1 set); Left Hip: 1"
+        """
+        return CompactRenderer().render_log(self)
+
     def to_dict(self):
         return {
             "date": self.date,
             "activities": {
                 name: activity.to_dict(include_name=False)
-                for name, activity in self.activities.items()
+                for name, activity in self._activities.items()
             },
             "symptoms": {
                 name: symptom.to_dict(include_name=False)
@@ -200,3 +278,9 @@ class DailyLog:
             "symptom_notes": self._symptom_notes,
             "activity_notes": self._activity_notes,
         }
+
+
+def _merge_notes(mine: str, theirs: str) -> str:
+    if mine is None or theirs is None:
+        return mine if theirs is None else theirs
+    return max(mine, theirs)
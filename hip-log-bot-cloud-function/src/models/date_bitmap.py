@@ -0,0 +1,171 @@
+from __future__ import annotations
+from datetime import date as Date, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DateBitmap:
+    """A compact set of dates, stored as one bit per calendar day
+
+    Bit `i` is set when `start + i days` is in the set. The bits live in a Python int,
+    so queries like "how many days in a row" are a handful of word-level operations
+    (O(n/64)) rather than a scan over documents. Five years of history is ~230 bytes.
+    """
+
+    # Initialization and Magic methods
+    def __init__(self, start: Date = None, bits: int = 0):
+        self._start = start
+        self._bits = bits
+
+    def __contains__(self, day: Date) -> bool:
+        pos = self._pos(day)
+        return pos is not None and pos >= 0 and bool(self._bits >> pos & 1)
+
+    def __len__(self):
+        return self.count()
+
+    def __eq__(self, other):
+        if not isinstance(other, DateBitmap):
+            return NotImplemented
+        return self.dates() == other.dates()
+
+    # Class Methods
+    @classmethod
+    def from_dict(cls, input_dict: dict) -> DateBitmap:
+        """Initialize from the Firestore format (see `to_dict()`)"""
+        if not input_dict or not input_dict.get("start"):
+            return cls()
+
+        return cls(
+            Date.fromisoformat(input_dict["start"]),
+            int.from_bytes(input_dict.get("bits", b""), "little"),
+        )
+
+    # Properties
+    @property
+    def start(self) -> Date:
+        return self._start
+
+    @property
+    def end(self) -> Date:
+        """The last date in the set (None if empty)"""
+        if not self._bits:
+            return None
+        return self._start + timedelta(days=self._bits.bit_length() - 1)
+
+    # Public Methods
+    def add(self, day: Date):
+        if self._start is None:
+            self._start = day
+        elif day < self._start:
+            # Re-anchor on the earlier date
+            self._bits <<= (self._start - day).days
+            self._start = day
+
+        self._bits |= 1 << self._pos(day)
+
+    def remove(self, day: Date):
+        pos = self._pos(day)
+        if pos is not None and pos >= 0:
+            self._bits &= ~(1 << pos)
+
+    def count(self) -> int:
+        return self._bits.bit_count()
+
+    def count_between(self, first: Date, last: Date) -> int:
+        """Count the dates in the inclusive range [first, last]"""
+        return self._window(first, last).bit_count()
+
+    def count_month(self, year: int, month: int) -> int:
+        first = Date(year, month, 1)
+        if month == 12:
+            last = Date(year + 1, 1, 1) - timedelta(days=1)
+        else:
+            last = Date(year, month + 1, 1) - timedelta(days=1)
+        return self.count_between(first, last)
+
+    def streak(self, as_of: Date) -> int:
+        """Number of consecutive days in the set ending on `as_of`
+
+        If `as_of` itself isn't in the set yet (eg nothing logged today), the streak
+        ending the day before still counts as current.
+        """
+        if as_of not in self:
+            as_of = as_of - timedelta(days=1)
+
+        pos = self._pos(as_of)
+        if pos is None or pos < 0:
+            return 0
+
+        # The streak ends at the highest missing day at or before `as_of`
+        missing = ~self._bits & ((1 << (pos + 1)) - 1)
+        if not missing:
+            return pos + 1
+        return pos - (missing.bit_length() - 1)
+
+    def longest_streak(self) -> int:
+        """Length of the longest run of consecutive days"""
+        bits = self._bits
+        length = 0
+        while bits:
+            # Each pass drops the last day of every run
+            bits &= bits >> 1
+            length += 1
+        return length
+
+    def last_before(self, as_of: Date) -> Date:
+        """The latest date in the set on or before `as_of` (None if there isn't one)"""
+        pos = self._pos(as_of)
+        if pos is None or pos < 0:
+            return None
+
+        window = self._bits & ((1 << (pos + 1)) - 1)
+        if not window:
+            return None
+        return self._start + timedelta(days=window.bit_length() - 1)
+
+    def gap(self, as_of: Date) -> int:
+        """Days since the last date in the set (None if nothing before `as_of`)"""
+        last = self.last_before(as_of)
+        return (as_of - last).days if last else None
+
+    def dates(self) -> list:
+        """All dates in the set, in order"""
+        res = []
+        bits = self._bits
+        pos = 0
+        while bits:
+            if bits & 1:
+                res.append(self._start + timedelta(days=pos))
+            bits >>= 1
+            pos += 1
+        return res
+
+    # Converters
+    def to_dict(self) -> dict:
+        if self._start is None:
+            return {"start": None, "bits": b""}
+
+        return {
+            "start": self._start.isoformat(),
+            "bits": self._bits.to_bytes((self._bits.bit_length() + 7) // 8, "little"),
+        }
+
+    # Private methods
+    def _pos(self, day: Date) -> int:
+        if self._start is None:
+            return None
+        return (day - self._start).days
+
+    def _window(self, first: Date, last: Date) -> int:
+        """The bits for the inclusive range [first, last]"""
+        if self._start is None or last < first:
+            return 0
+
+        lo = max(self._pos(first), 0)
+        hi = self._pos(last)
+        if hi < 0:
+            return 0
+
+        return (self._bits >> lo) & ((1 << (hi - lo + 1)) - 1)
@@ -1,8 +1,13 @@
 import json
 import logging
-import datetime
 import utils
-from models.supported_intents import SupportedIntents
+from datetime import timedelta
+from typing import List, Optional
+from errors import UnsupportedIntent, ValidationError
+from models import log_date
+from models.intent_schema import INTENT_SCHEMAS, extract_date
+from models.log_date import LogDate
+from models.record import Set
 
 logger = logging.getLogger(__name__)
 
@@ -19,14 +24,23 @@ class Intent:
 
     # Initialization
     def __init__(self, req):
-        self._type = req["queryResult"]["intent"]["displayName"]
-        self._raw_entity = req["queryResult"]["parameters"]
+        try:
+            self._type = req["queryResult"]["intent"]["displayName"]
+            self._raw_entity = req["queryResult"]["parameters"]
+        except (KeyError, TypeError) as e:
+            raise ValidationError("Not a Dialogflow webhook request") from e
         self._log_input = {}
         self._date = None
+        self._start_date = None
+        self._end_date = None
+        self._utc_offset = None
         self._user = None
+        self._source = (req.get("originalDetectIntentRequest") or {}).get("source")
+        self._sets = None
 
-        if self._type not in SupportedIntents.all():
-            raise ValueError("Unsupported intent passed")
+        self._schema = INTENT_SCHEMAS.get(self._type)
+        if self._schema is None:
+            raise UnsupportedIntent("Unsupported intent passed", self._type)
 
         self._set_user(req)
         self._extract_log_input()
@@ -35,7 +49,11 @@ class Intent:
 
     # Magic methods
     def __str__(self):
-        return f"{self.type} {f'(date={self._date})' if self._date else ''}: {json.dumps(self._log_input)}"  # noqa
+        if self.is_date_range:
+            when = f"(dates={self._start_date} to {self._end_date})"
+        else:
+            when = f"(date={self._date})" if self._date else ""
+        return f"{self.type} {when}: {json.dumps(self._log_input)}"  # noqa
 
     # Class methods
     @classmethod
@@ -48,19 +66,21 @@ class Intent:
         (e.g '2023-07-24T12:00:00+01:00')
 
         Returns:
-        str: a date string in the '%Y-%m-%d' format
+        LogDate: the date, a str in the '%Y-%m-%d' format (see `models.log_date`)
         """
 
-        if date == "today":
-            return str(datetime.date.today())
-        else:
-            return date.split("T")[0]
+        return extract_date(date)
 
     # Properties
     @property
     def type(self):
         return self._type
 
+    @property
+    def source(self):
+        """The platform the request came from (eg "facebook"), if any"""
+        return self._source
+
     @property
     def entity(self):
         """The raw entity"""
@@ -77,155 +97,123 @@ class Intent:
         return self._log_input
 
     @property
-    def date(self):
+    def sets(self) -> List[Set]:
+        """An activity's sets, already converted (LogActivity only)"""
+        return self._sets
+
+    @property
+    def date(self) -> LogDate:
         return self._date
 
     @property
-    def user(self):
-        return self._user
+    def start_date(self):
+        """First date of a date period (or the single date)"""
+        return self._start_date or self._date
 
-    # Public Methods
+    @property
+    def end_date(self):
+        """Last date of a date period (or the single date)"""
+        return self._end_date or self._date
 
-    # Private methods
-    def _set_date(self):
-        """
-        Format timestamp to just the date component string
+    @property
+    def utc_offset(self) -> Optional[timedelta]:
+        """The user's UTC offset, from the request's timestamps (None if it has
+        none)"""
+        return self._utc_offset
 
-        Parameters:
-        - date (str): full timestamp string in '%Y-%m-%dT%H:%M:%S%z' format
-        (e.g '2023-07-24T12:00:00+01:00')
+    @property
+    def today(self) -> LogDate:
+        """Today's date for the user (see `utc_offset`), or in the server's timezone
+        if the offset isn't known"""
+        return log_date.today(self._utc_offset)
 
-        Returns:
-        str: a date string in the '%Y-%m-%d' format
-        """
+    @property
+    def is_date_range(self) -> bool:
+        """True if the intent is for a date period (eg "last week") rather than a
+        single date"""
+        return self._start_date is not None
+
+    @property
+    def user(self):
+        return self._user
 
-        self._date = Intent.extract_date(self._raw_entity["date"])
+    # Public Methods
 
+    # Private methods
     def _extract_log_input(self):
-        """Parse the raw entity dict into the dict input that matches the dict
-        initialization format of the Record classes
+        """Validate and convert the raw entity dict with the intent's schema (see
+        `models.intent_schema`), in a single pass
 
-        This sets the _log_input attribute, which aligns the names and types:
+        This sets the date(s) and the _log_input attribute, which aligns the names
+        and types with the dict initialization format of the Record classes:
         * 'date' is removed
         * 'activity' or 'symptom' will be renamed to 'name'
         * 'severity' will be cast to int
-        * Any attributes that are empty (strings), will be skipped
+        * an activity's reps/weight/duration lists become a list of sets (also
+          converted to Sets, see `sets`)
 
         Raises:
-            ValueError: raises errors if date is missing for intent types that should
-            include a date
+            ValidationError: a required parameter (eg the date) is missing, or a value
+            is invalid (see `errors`)
         """
-
-        logger.debug(
-            f"Starting parsing raw intent response based on '{self._type}' logic"
-        )
-
-        # Extract date for date-based activities
-        if self.type in [
-            SupportedIntents.LogActivity,
-            SupportedIntents.LogSymptom,
-            SupportedIntents.GetDailyLog,
-            SupportedIntents.DeleteDailyLog,
-        ]:
-            # Expecting a date parameter for these intents
-            if not self._raw_entity.get("date"):
-                raise ValueError("Input entity is missing a date among the attributes")
-
-            # Extract date as a top level attribute and remove it from the parsed
-            # entities as it's not needed there
-            self._set_date()
-            logger.debug(f"Set intent date as {self._date}")
-
-        # Now do the processing. In some cases, intent keys/vals need to be renamed
-        if self.type == SupportedIntents.LogActivity:
-            self._log_input["name"] = self._raw_entity["activity"].lower()
-
-            # Prepare the set dicts from the individaul arrays of reps/durations/weights
-            self._log_input["sets"] = []
-
-            # Check that all attributes have values for each set
-            attribute_lengths = set(
-                [
-                    len(v)
-                    for k, v in self._raw_entity.items()
-                    if k in ["reps", "weight", "duration"] and v != []
-                ]
-            )
-            if len(attribute_lengths) > 1:
-                logger.debug("Unique attribute_lenghts > 1 (aka mismatch)")
-                raise ValueError("Mismatched number of reps/weights/durations")
-            # If no reps/duration/weights provided, skip
-            elif attribute_lengths:
-                n_sets = len(self._raw_entity["reps"])
-                for i in range(n_sets):
-                    s = {}  # {"reps": 3, weight: {"amount": 12, "unit": "kg"}}
-                    if self._raw_entity["reps"]:
-                        s["reps"] = int(self._raw_entity["reps"][i])
-                    if self._raw_entity["weight"]:
-                        s["weight"] = self._raw_entity["weight"][i]
-                    if self._raw_entity["duration"]:
-                        s["duration"] = self._raw_entity["duration"][i]
-                    self._log_input["sets"].append(s)
-            else:
-                self._log_input["sets"].append({"reps": 1})
-
-        elif self.type == SupportedIntents.LogSymptom:
-            self._log_input["name"] = self._raw_entity["symptom"].lower()
-            self._log_input["severity"] = int(self._raw_entity["severity"])
-
-        elif self.type == SupportedIntents.GetActivitySummary:
-            self._log_input["name"] = self._raw_entity["activity"].lower()
-
-        # Explicitly handle the simpler activities (can't be in a catch all Else)
-        elif self.type in [
-            SupportedIntents.DeleteDailyLog,
-            SupportedIntents.GetNumLogs,
-            SupportedIntents.GetCommandList,
-            SupportedIntents.GetActivityList,
-            SupportedIntents.GetSymptomList,
-        ]:
-            logger.debug("Skipping any log input parsing for this intent")
-            pass
+        parsed = self._schema.parse(self._raw_entity)
+        self._date = parsed.date
+        self._start_date, self._end_date = parsed.start_date, parsed.end_date
+        self._utc_offset = parsed.utc_offset
+        self._log_input = parsed.log_input
+        self._sets = parsed.sets
 
     def _set_user(self, req):
-        """Set the user property, with default handling
-
-        Handles 2 situations:
-        1) a test call, can be local or from DialogFlow directly (missing
-        `originalDetectIntentRequest`). In this case, defaults to a fake
-        username (eg MarkTheTester)
-        2) a production call (eg Facebook messenger trigger). This has an expected
-        format
+        """Set the user property (see `extract_user()`)
 
         Args:
             req (_type_): request object from DialogFlow
         """
-        if not req.get("originalDetectIntentRequest"):
-            logger.debug(
-                f"originalDetectIntentRequest not found so assuming called locally directly. Defaulting user={utils.test_username}"  # noqa
-            )
-            user = utils.test_username
-
-        elif req.get("originalDetectIntentRequest")["source"] == "DIALOGFLOW_CONSOLE":
-            logger.debug(
-                f"originalDetectIntentRequest source is 'DIALOGFLOW_CONSOLE'.  Defaulting user={utils.test_username}"  # noqa
-            )
-            user = utils.test_username
-
-        else:
-            user = (
-                req.get("originalDetectIntentRequest", {})
-                .get("payload", {})
-                .get("data", {})
-                .get("sender", {})
-                .get("id")
-                or "default_value"
-            )
-
-            if user == "default_value":
-                raise ValueError(
-                    "User info not found as expected in originalDetectIntentRequest from Dialogflow. Maybe it's not a FB call"  # noqa
-                )
-
+        user = extract_user(req)
         logger.debug(f"Set user = '{user}'")
         self._user = user
+
+
+def extract_user(req: dict) -> str:
+    """Get the user a request is from, with default handling
+
+    Handles 2 situations:
+    1) a test call, can be local or from DialogFlow directly (missing
+    `originalDetectIntentRequest`). In this case, defaults to a fake
+    username (eg MarkTheTester)
+    2) a production call (eg Facebook messenger trigger). This has an expected
+    format
+
+    Args:
+        req (dict): request object from DialogFlow
+
+    Raises:
+        ValidationError: a production call without the sender's id
+    """
+    if not req.get("originalDetectIntentRequest"):
+        logger.debug(
+            f"originalDetectIntentRequest not found so assuming called locally directly. Defaulting user={utils.test_username}"  # noqa
+        )
+        return utils.test_username
+
+    elif req.get("originalDetectIntentRequest")["source"] == "DIALOGFLOW_CONSOLE":
+        logger.debug(
+            f"originalDetectIntentRequest source is 'DIALOGFLOW_CONSOLE'.  Defaulting user={utils.test_username}"  # noqa
+        )
+        return utils.test_username
+
+    user = (
+        req.get("originalDetectIntentRequest", {})
+        .get("payload", {})
+        .get("data", {})
+        .get("sender", {})
+        .get("id")
+        or "default_value"
+    )
+
+    if user == "default_value":
+        raise ValidationError(
+            "User info not found as expected in originalDetectIntentRequest from Dialogflow. Maybe it's not a FB call"  # noqa
+        )
+
+    return user
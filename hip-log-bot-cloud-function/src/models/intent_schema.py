@@ -0,0 +1,280 @@
+from __future__ import annotations
+from typing import Callable, List, Optional, Tuple
+import logging
+from datetime import timedelta
+from errors import InvalidParameter, MismatchedSets, MissingParameter
+from models import log_date
+from models.log_date import LogDate
+from models.measurement import Measurement
+from models.record import Set, Symptom
+
+logger = logging.getLogger(__name__)
+
+# Dialogflow parameters that make up an activity's sets, one list entry per set
+SET_PARAMETERS = ("reps", "weight", "duration")
+
+
+class Param:
+    """A Dialogflow parameter of an intent: where it goes in the log input and how
+    its value is converted (and validated)"""
+
+    __slots__ = ("key", "target", "convert", "required")
+
+    def __init__(self, key: str, target: str, convert: Callable, required: bool = True):
+        self.key = key
+        self.target = target
+        self.convert = convert
+        self.required = required
+
+
+class ParsedParameters:
+    """The result of parsing an intent's parameters
+
+    Attributes:
+        date (LogDate): the date, if the intent has one
+        start_date (LogDate): first date of a date period, if one was given
+        end_date (LogDate): last date of a date period, if one was given
+        utc_offset (timedelta): the user's UTC offset, taken from the first
+        timestamp among the date parameters (None if there's none)
+        log_input (dict): inputs in the dict initialization format of the Record
+        classes (eg {"name": "yoga", "sets": [{"reps": 1}]})
+        sets (List[Set]): an activity's sets, already converted
+    """
+
+    __slots__ = ("date", "start_date", "end_date", "utc_offset", "log_input", "sets")
+
+    def __init__(self):
+        self.date = self.start_date = self.end_date = self.utc_offset = None
+        self.log_input = {}
+        self.sets = None
+
+
+class IntentSchema:
+    """How an intent's Dialogflow parameters are validated and converted. Built once
+    per intent (see `INTENT_SCHEMAS`), so parsing a request is a single pass over
+    the parameters with no per-request decisions about the intent type"""
+
+    # Initialization
+    def __init__(
+        self,
+        params: Tuple[Param, ...] = (),
+        dated: bool = False,
+        date_period: bool = False,
+        sets: bool = False,
+        single_set: bool = False,
+    ):
+        """
+        Args:
+            params (tuple, optional): the parameters copied to the log input
+            dated (bool, optional): a 'date' parameter is required
+            date_period (bool, optional): a 'date-period' parameter can be given
+            instead of the date
+            sets (bool, optional): the parameters include an activity's sets
+            single_set (bool, optional): the sets are a single set's values, at least
+            one of which is required
+        """
+        self.params = params
+        self.dated = dated
+        self.date_period = date_period
+        self.sets = sets
+        self.single_set = single_set
+
+    # Public Methods
+    def parse(self, parameters: dict) -> ParsedParameters:
+        """Validate and convert an intent's Dialogflow parameters
+
+        Raises:
+            MissingParameter: a required parameter is missing or empty
+            InvalidParameter: a parameter has a value that can't be converted
+            MismatchedSets: the sets' reps/weights/durations don't line up
+        """
+        res = ParsedParameters()
+
+        # Dialogflow sends an empty string when the period isn't given
+        period = parameters.get("date-period") if self.date_period else None
+        if period and period.get("startDate"):
+            start = period["startDate"]
+            end = period.get("endDate") or start
+            res.utc_offset = _first_utc_offset(start, end)
+            start_date = _extract_param_date(start, res.utc_offset, "date-period")
+            end_date = _extract_param_date(end, res.utc_offset, "date-period")
+            if start_date > end_date:
+                start_date, end_date = end_date, start_date
+            res.start_date, res.end_date = start_date, end_date
+        elif self.dated:
+            date = parameters.get("date")
+            if not date:
+                raise MissingParameter(
+                    "Input entity is missing a date among the attributes", "date"
+                )
+            res.utc_offset = _first_utc_offset(date)
+            res.date = _extract_param_date(date, res.utc_offset, "date")
+
+        for param in self.params:
+            value = parameters.get(param.key)
+            if value in (None, ""):
+                if param.required:
+                    raise MissingParameter(f"Missing '{param.key}'", param.key)
+                continue
+            try:
+                res.log_input[param.target] = param.convert(value)
+            except (TypeError, ValueError, AttributeError) as e:
+                raise InvalidParameter(
+                    f"Invalid '{param.key}': {value!r} ({e})", param.key
+                ) from e
+
+        if self.sets:
+            res.log_input["sets"], res.sets = parse_sets(parameters)
+            if self.single_set:
+                if not any(_as_list(parameters.get(k)) for k in SET_PARAMETERS):
+                    raise MissingParameter("Missing the set's values", "sets")
+                if len(res.sets) > 1:
+                    raise InvalidParameter("Expected a single set", "sets")
+
+        return res
+
+
+# Public functions
+def extract_date(date: str, utc_offset: Optional[timedelta] = None) -> LogDate:
+    """The date of a Dialogflow timestamp (eg '2023-07-24T12:00:00+01:00') or
+    "today", at the user's UTC offset if known (see `models.log_date.resolve()`)
+
+    Raises:
+        ValueError: the value isn't a timestamp or "today"
+    """
+    return log_date.resolve(date, utc_offset)
+
+
+def parse_sets(parameters: dict) -> Tuple[List[dict], List[Set]]:
+    """Build an activity's sets from the Dialogflow reps/weight/duration lists, in a
+    single pass
+
+    Returns:
+        tuple: (set dicts with the parameters' values as given, in the Record
+        classes' format, the converted Sets). Without any lists it's a single set of
+        1 rep
+
+    Raises:
+        MismatchedSets: the non-empty lists differ in length
+        InvalidParameter: a value can't be converted
+    """
+    lists = [_as_list(parameters.get(key)) for key in SET_PARAMETERS]
+    lengths = {len(values) for values in lists if values}
+    if len(lengths) > 1:
+        raise MismatchedSets("Mismatched number of reps/weights/durations", "sets")
+    n_sets = lengths.pop() if lengths else 0
+
+    if not n_sets:
+        return [{"reps": 1}], [Set(reps=1)]
+
+    reps, weights, durations = lists
+    set_dicts, sets = [], []
+    for i in range(n_sets):
+        set_dict = {}
+        try:
+            n_reps = None
+            if reps:
+                n_reps = set_dict["reps"] = int(reps[i])
+            weight = duration = None
+            if weights:
+                weight = set_dict["weight"] = weights[i]
+            if durations:
+                duration = set_dict["duration"] = durations[i]
+            sets.append(Set(n_reps, _to_measurement(duration), _to_measurement(weight)))
+        except (TypeError, ValueError, KeyError) as e:
+            raise InvalidParameter(f"Invalid set {i + 1}: {e}", "sets") from e
+        set_dicts.append(set_dict)
+
+    return set_dicts, sets
+
+
+# Private functions
+def _as_list(values) -> list:
+    # Dialogflow sends an empty string for a missing list
+    if isinstance(values, list):
+        return values
+    return [values] if values not in (None, "") else []
+
+
+def _name(value: str) -> str:
+    return value.lower()
+
+
+def _severity(value) -> int:
+    severity = int(value)
+    if severity not in Symptom.ALLOWED_LEVELS:
+        raise ValueError(f"must be one of {Symptom.ALLOWED_LEVELS}")
+    return severity
+
+
+def _set_number(value) -> int:
+    """A set's 1-based number (Dialogflow sends numbers as floats)"""
+    number = float(value)
+    if number < 1 or not number.is_integer():
+        raise ValueError("must be a whole number from 1")
+    return int(number)
+
+
+def _to_measurement(value) -> Measurement:
+    """A Dialogflow unit value (eg {"amount": "12.5", "unit": "kg"}) as a
+    Measurement, or None if empty"""
+    if not value:
+        return None
+    amount = value["amount"]
+    if isinstance(amount, str):
+        amount = float(amount)
+    return Measurement(amount, value["unit"])
+
+
+_ACTIVITY = Param("activity", "name", _name)
+
+INTENT_SCHEMAS = {
+    "LogActivity": IntentSchema((_ACTIVITY,), dated=True, sets=True),
+    "LogSymptom": IntentSchema(
+        (Param("symptom", "name", _name), Param("severity", "severity", _severity)),
+        dated=True,
+    ),
+    # Without an activity, the last set of any
+    "UndoLastSet": IntentSchema(
+        (Param("activity", "name", _name, required=False),), dated=True
+    ),
+    # Only the set's values that are given are changed
+    "EditSet": IntentSchema(
+        (_ACTIVITY, Param("set-number", "set_number", _set_number)),
+        dated=True,
+        sets=True,
+        single_set=True,
+    ),
+    "DeleteActivity": IntentSchema((_ACTIVITY,), dated=True),
+    "UndoLastChange": IntentSchema(),
+    "GetDailyLog": IntentSchema(dated=True, date_period=True),
+    "DeleteDailyLog": IntentSchema(dated=True, date_period=True),
+    "GetActivitySummary": IntentSchema((_ACTIVITY,)),
+    # The activity is optional, without it the streak is for any log
+    "GetStreak": IntentSchema((Param("activity", "name", _name, required=False),)),
+    "GetNumLogs": IntentSchema(),
+    "GetCommandList": IntentSchema(),
+    "GetActivityList": IntentSchema(),
+    "GetSymptomList": IntentSchema(),
+    # Without a period, the trend is over the last `trends.DEFAULT_WINDOW_DAYS`
+    "GetSymptomTrend": IntentSchema(
+        (Param("symptom", "name", _name),), date_period=True
+    ),
+    "GetCorrelations": IntentSchema(),
+}
+
+
+def _first_utc_offset(*timestamps: str) -> Optional[timedelta]:
+    for timestamp in timestamps:
+        if isinstance(timestamp, str):
+            offset = log_date.utc_offset_of(timestamp)
+            if offset is not None:
+                return offset
+    return None
+
+
+def _extract_param_date(value, utc_offset: Optional[timedelta], key: str) -> LogDate:
+    try:
+        return extract_date(value, utc_offset)
+    except (AttributeError, TypeError, ValueError) as e:
+        raise InvalidParameter(f"Invalid '{key}': {value!r} ({e})", key) from e
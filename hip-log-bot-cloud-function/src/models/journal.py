@@ -0,0 +1,175 @@
+from __future__ import annotations
+from typing import Dict, List, Tuple
+import copy
+import logging
+import time
+from models.daily_log import DailyLog
+from models.record import Activity, Symptom
+
+logger = logging.getLogger(__name__)
+
+
+class JournalEntry:
+    """A change to a user's logs as recorded in their journal: what was changed and
+    how to revert it
+
+    Entries are only ever appended, in the same batch as the change they record (see
+    `HipLogDB.upload_patch()`), and are keyed by the user's log version after the
+    change. Each entry points to the previous one that's still to be undone, and the
+    catalog points to the latest, so a change is reverted with point reads rather
+    than a read of the history (see `HipLogDB.undo_last_change()`).
+
+    A change is either a patch of a log (see `DailyLog.merge()`), reverted by the
+    inverse patch worked out when it's recorded, or a delete, reverted by writing
+    back the deleted logs.
+
+    Attributes:
+        intent (str): the intent that made the change
+        dates (List[str]): the dates of the logs that were changed
+        at (float): when the change was made (epoch seconds)
+        patch (dict): the patch applied (`DailyLog.to_dict()` format), None for a
+        delete
+        undo_patch (dict): the patch that reverts it (its symptoms are stamped when
+        it's applied, see `get_undo_patch()`)
+        removed_symptoms (List[str]): symptoms the revert removes, as the change
+        logged them for the first time
+        restore (dict): for a delete, date -> deleted log dict. The logs are stored
+        apart from the entry, a document each (see `HipLogDB`), so an entry read back
+        has none until they're fetched
+        version (int): the user's log version after the change (set when it's
+        committed)
+        previous (int): version of the previous entry still to be undone, if any
+        (set when it's committed)
+        undone (bool): the change was reverted
+    """
+
+    # Initialization
+    def __init__(
+        self,
+        intent: str,
+        dates: List[str] = (),
+        patch: dict = None,
+        undo_patch: dict = None,
+        removed_symptoms: List[str] = (),
+        restore: Dict[str, dict] = None,
+        at: float = None,
+    ):
+        self.intent = str(intent)
+        self.dates = list(dates)
+        self.at = at or time.time()
+        self.patch = patch
+        self.undo_patch = undo_patch
+        self.removed_symptoms = list(removed_symptoms)
+        self.restore = restore
+        self.version = None
+        self.previous = None
+        self.undone = False
+
+    # Class Methods
+    @classmethod
+    def for_patch(cls, intent: str, log: DailyLog, patch: DailyLog) -> JournalEntry:
+        """Record a patch of a log, working out its inverse
+
+        Args:
+            intent (str): the intent that made the change
+            log (DailyLog): the log before the patch
+            patch (DailyLog): the change, stamped (see `Activity.stamp()`)
+        """
+        undo_patch, removed_symptoms = _inverse(log, patch)
+        return cls(
+            intent,
+            [patch.date],
+            patch=patch.to_dict(),
+            undo_patch=undo_patch.to_dict(),
+            removed_symptoms=removed_symptoms,
+        )
+
+    @classmethod
+    def from_dict(cls, input_dict: dict) -> JournalEntry:
+        entry = cls(
+            input_dict["intent"],
+            input_dict["dates"],
+            patch=input_dict.get("patch"),
+            undo_patch=input_dict.get("undo_patch"),
+            removed_symptoms=input_dict.get("removed_symptoms") or (),
+            restore={} if input_dict.get("deleted") else None,
+            at=input_dict.get("at"),
+        )
+        entry.version = input_dict.get("version")
+        entry.previous = input_dict.get("previous")
+        entry.undone = bool(input_dict.get("undone"))
+
+        return entry
+
+    @staticmethod
+    def doc_id(version: int) -> str:
+        """The journal document name of a version, padded so that documents sort by
+        version"""
+        return f"{version:010d}"
+
+    # Properties
+    @property
+    def is_delete(self) -> bool:
+        return self.restore is not None
+
+    # Public Methods
+    def get_undo_patch(self) -> DailyLog:
+        """The patch that reverts the change, with its symptoms stamped now so that
+        they win over the change's (see `Symptom.merge()`)"""
+        undo_patch = DailyLog.from_dict(self.dates[0], copy.deepcopy(self.undo_patch))
+        for symptom in undo_patch.symptoms.values():
+            symptom.stamp()
+
+        return undo_patch
+
+    def get_deleted_logs(self) -> List[DailyLog]:
+        """The logs a delete removed"""
+        return [
+            DailyLog.from_dict(date, copy.deepcopy(self.restore[date]))
+            for date in self.dates
+        ]
+
+    # Converters/Serializers
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "previous": self.previous,
+            "intent": self.intent,
+            "dates": self.dates,
+            "at": self.at,
+            "patch": self.patch,
+            "undo_patch": self.undo_patch,
+            "removed_symptoms": self.removed_symptoms,
+            "deleted": self.is_delete,
+            "undone": self.undone,
+        }
+
+
+# Private functions
+def _inverse(log: DailyLog, patch: DailyLog) -> Tuple[DailyLog, List[str]]:
+    """The patch that reverts a patch of a log, and the symptoms the revert must
+    remove (which a patch can't express)
+
+    * sets the patch added are removed, and sets it removed are added back
+    * symptoms get their previous severity back, or are removed if they're new
+    * notes aren't patched by intents, so they're left as they are
+    """
+    inverse = DailyLog(patch.date)
+    for name in patch.to_dict()["activities"]:
+        change = patch.get_activity(name)
+        before = log.activities.get(name)
+        restored = []
+        if before:
+            keys = sorted(k for k in change.removed_set_ids if before.get_set(k))
+            restored = before.restoration(keys).sets
+        inverse.add_activity(Activity(name, restored, [s.id for s in change.sets]))
+
+    removed_symptoms = []
+    for name in patch.symptoms:
+        before = log.symptoms.get(name)
+        if before:
+            inverse.add_symptom(Symptom(name, before.severity))
+        else:
+            removed_symptoms.append(name)
+
+    return inverse, removed_symptoms
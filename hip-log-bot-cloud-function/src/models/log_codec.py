@@ -0,0 +1,229 @@
+"""A compact, versioned binary encoding of DailyLogs (in the `DailyLog.to_dict()`
+format), for archives, exports and caches
+
+Logs are msgpack arrays rather than maps, so the keys that the dict format repeats
+for every set ("sets", "reps", "weight", "amount", "unit") are implied by position:
+
+    log:         [day, activities, symptoms, activity_notes, symptom_notes]
+    activity:    [name, sets]
+    set:         [reps, duration, weight]
+    measurement: [amount, unit]
+    symptom:     [name, severity]
+
+* day is the number of days since 1970-01-01
+* units are their index in `UNITS`
+* activity and symptom names are written once per stream, then referred to by their
+  index in the order they first appeared
+* trailing empty values are dropped
+
+A stream is a version byte followed by any number of logs, so it can be written and
+read one log at a time.
+"""
+
+from __future__ import annotations
+from datetime import date, timedelta
+from typing import BinaryIO, Iterable, Iterator, Tuple
+import msgpack
+from models.record import visible_sets
+
+VERSION = 1
+
+# Unit codes. Taken from `Measurement.ALLOWED_UNITS`, but fixed here since encoded
+# logs refer to them by position: new units must only ever be appended
+UNITS = (
+    "mg",
+    "oz",
+    "g",
+    "CD",
+    "kg",
+    "lb",
+    "t",
+    "s",
+    "second",
+    "min",
+    "h",
+    "day",
+    "wk",
+    "mo",
+    "yr",
+    "decade",
+    "century",
+)
+_UNIT_CODES = {unit: code for code, unit in enumerate(UNITS)}
+
+_EPOCH = date(1970, 1, 1)
+
+
+class LogEncoder:
+    """Encodes a stream of logs, one at a time
+
+    Example:
+        encoder = LogEncoder()
+        data = encoder.header() + b"".join(encoder.encode(d, log) for d, log in logs)
+    """
+
+    # Initialization
+    def __init__(self):
+        self._packer = msgpack.Packer()
+        self._names = {}
+
+    # Public Methods
+    def header(self) -> bytes:
+        """The bytes that start the stream"""
+        return bytes([VERSION])
+
+    def encode(self, date_str: str, log_dict: dict) -> bytes:
+        """Encode the next log of the stream"""
+        # Removed sets are left out (and with them the ids they're addressed by)
+        activities = []
+        for name, activity in (log_dict.get("activities") or {}).items():
+            sets = visible_sets(activity)
+            if sets or not activity.get("removed"):
+                activities.append([self._name(name), [_encode_set(s) for s in sets]])
+        symptoms = [
+            [self._name(name), symptom["severity"]]
+            for name, symptom in (log_dict.get("symptoms") or {}).items()
+        ]
+        record = [
+            (date.fromisoformat(date_str) - _EPOCH).days,
+            activities,
+            symptoms,
+            log_dict.get("activity_notes"),
+            log_dict.get("symptom_notes"),
+        ]
+
+        return self._packer.pack(_trim(record))
+
+    # Private methods
+    def _name(self, name: str):
+        """The name's index if it's already been written, otherwise the name"""
+        if name in self._names:
+            return self._names[name]
+        self._names[name] = len(self._names)
+        return name
+
+
+class LogDecoder:
+    """Decodes a stream of logs written by `LogEncoder`"""
+
+    # Initialization
+    def __init__(self, version: int):
+        if version != VERSION:
+            raise ValueError(f"Unsupported log encoding version {version}")
+        self._names = []
+
+    # Public Methods
+    def decode(self, record: list) -> Tuple[str, dict]:
+        """Decode the next unpacked log of the stream
+
+        Returns:
+            tuple: (date, log dict), where the dict matches `DailyLog.to_dict()`
+        """
+        record = record + [None] * (5 - len(record))
+        day, activities, symptoms, activity_notes, symptom_notes = record
+        date_str = str(_EPOCH + timedelta(days=day))
+
+        return date_str, {
+            "date": date_str,
+            "activities": {
+                self._name(name): {"sets": [_decode_set(s) for s in sets]}
+                for name, sets in activities or []
+            },
+            "symptoms": {
+                self._name(name): {"severity": severity}
+                for name, severity in symptoms or []
+            },
+            "symptom_notes": symptom_notes,
+            "activity_notes": activity_notes,
+        }
+
+    # Private methods
+    def _name(self, ref) -> str:
+        if isinstance(ref, int):
+            return self._names[ref]
+        self._names.append(ref)
+        return ref
+
+
+# Public functions
+def dumps(logs: Iterable[Tuple[str, dict]]) -> bytes:
+    """Encode (date, log dict) pairs (eg from `HipLogDB.stream_logs()`) as one
+    stream"""
+    encoder = LogEncoder()
+    return encoder.header() + b"".join(encoder.encode(d, log) for d, log in logs)
+
+
+def loads(data: bytes) -> Iterator[Tuple[str, dict]]:
+    """Decode a stream from bytes, one (date, log dict) pair at a time"""
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(data[1:])
+    decoder = LogDecoder(data[0])
+    for record in unpacker:
+        yield decoder.decode(record)
+
+
+def dump(logs: Iterable[Tuple[str, dict]], fp: BinaryIO) -> int:
+    """Write (date, log dict) pairs to a binary file as they come
+
+    Returns:
+        int: number of logs written
+    """
+    encoder = LogEncoder()
+    fp.write(encoder.header())
+    n_logs = 0
+    for date_str, log_dict in logs:
+        fp.write(encoder.encode(date_str, log_dict))
+        n_logs += 1
+
+    return n_logs
+
+
+def load(fp: BinaryIO) -> Iterator[Tuple[str, dict]]:
+    """Read (date, log dict) pairs from a binary file, without reading it all at
+    once"""
+    header = fp.read(1)
+    if not header:
+        return
+    decoder = LogDecoder(header[0])
+    for record in msgpack.Unpacker(fp, raw=False):
+        yield decoder.decode(record)
+
+
+# Private functions
+def _encode_set(set_dict: dict) -> list:
+    return _trim(
+        [
+            set_dict.get("reps"),
+            _encode_measurement(set_dict.get("duration")),
+            _encode_measurement(set_dict.get("weight")),
+        ]
+    )
+
+
+def _decode_set(record: list) -> dict:
+    # Same keys, order and omissions as `Set.to_dict()`
+    res = {}
+    for key, value in zip(["reps", "duration", "weight"], record):
+        if value:
+            res[key] = value if key == "reps" else _decode_measurement(value)
+
+    return res
+
+
+def _encode_measurement(measurement: dict):
+    if not measurement:
+        return None
+    unit = measurement["unit"]
+    return [measurement["amount"], _UNIT_CODES.get(unit, unit)]
+
+
+def _decode_measurement(record: list) -> dict:
+    amount, unit = record
+    return {"amount": amount, "unit": UNITS[unit] if isinstance(unit, int) else unit}
+
+
+def _trim(values: list) -> list:
+    """Drop trailing empty values"""
+    while values and values[-1] in (None, [], {}):
+        values.pop()
+    return values
@@ -0,0 +1,104 @@
+from __future__ import annotations
+from datetime import date as Date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional
+
+# Format of a log date, which is also its Firestore document id
+DATE_FORMAT = "%Y-%m-%d"
+
+# Parsed dates and UTC offsets kept per process. Requests mostly name the same few
+# recent dates, so this stays small in practice
+CACHE_SIZE = 4096
+
+
+class LogDate(str):
+    """A 'YYYY-MM-DD' log date, parsed once
+
+    It's a str, so it's used as-is wherever the date string was (Firestore document
+    ids, dict keys, replies), and carries the parsed `date` so nothing downstream has
+    to parse it again. Get one with `parse()` (cached), `from_date()` or `resolve()`.
+
+    Attributes:
+        date (datetime.date): the parsed date
+    """
+
+    # Initialization
+    def __new__(cls, value: str, parsed: Date = None):
+        log_date = super().__new__(cls, value)
+        log_date.date = parsed or datetime.strptime(value, DATE_FORMAT).date()
+        log_date._formats = {}
+        return log_date
+
+    # Class Methods
+    @classmethod
+    def parse(cls, value: str) -> LogDate:
+        """The LogDate of a 'YYYY-MM-DD' string (itself if it's already one). Each
+        string is parsed once per process
+
+        Raises:
+            ValueError: the string isn't a 'YYYY-MM-DD' date
+        """
+        if isinstance(value, LogDate):
+            return value
+        return _parse(value)
+
+    @classmethod
+    def from_date(cls, value: Date) -> LogDate:
+        return cls(value.isoformat(), value)
+
+    # Public Methods
+    def format(self, fmt: str) -> str:
+        """The date formatted with `strftime`, kept for the next call"""
+        res = self._formats.get(fmt)
+        if res is None:
+            res = self._formats[fmt] = self.date.strftime(fmt)
+        return res
+
+
+# Public functions
+def is_valid(value: str) -> bool:
+    """Whether a string is a 'YYYY-MM-DD' date (free for a LogDate)"""
+    try:
+        LogDate.parse(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def today(utc_offset: Optional[timedelta] = None) -> LogDate:
+    """Today's date at a UTC offset (eg the user's, see `utc_offset_of()`), or in
+    the server's timezone if the offset isn't known"""
+    if utc_offset is None:
+        return LogDate.from_date(Date.today())
+    return LogDate.from_date(datetime.now(timezone(utc_offset)).date())
+
+
+def resolve(value: str, utc_offset: Optional[timedelta] = None) -> LogDate:
+    """The LogDate of a Dialogflow date parameter: a timestamp (eg
+    '2023-07-24T12:00:00+01:00', already in the user's timezone so only its date is
+    kept) or "today" (at `utc_offset`, see `today()`)
+
+    Raises:
+        ValueError: the value isn't a timestamp or "today"
+    """
+    if value == "today":
+        return today(utc_offset)
+    return LogDate.parse(value.split("T")[0])
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def utc_offset_of(timestamp: str) -> Optional[timedelta]:
+    """The UTC offset of a Dialogflow timestamp (eg +01:00 for
+    '2023-07-24T12:00:00+01:00'), or None if it has none (or isn't a timestamp)"""
+    if "T" not in timestamp:
+        return None
+    try:
+        return datetime.fromisoformat(timestamp).utcoffset()
+    except ValueError:
+        return None
+
+
+# Private functions
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse(value: str) -> LogDate:
+    return LogDate(value)
@@ -24,6 +24,28 @@ class Measurement:
         "century",
     ]
 
+    # Conversion factors of the mass and time units
+    KILOGRAMS_PER_UNIT = {
+        "mg": 1e-6,
+        "g": 1e-3,
+        "oz": 0.0283495,
+        "lb": 0.453592,
+        "kg": 1,
+        "t": 1000,
+    }
+    SECONDS_PER_UNIT = {
+        "s": 1,
+        "second": 1,
+        "min": 60,
+        "h": 3600,
+        "day": 86400,
+        "wk": 604800,
+        "mo": 2629746,
+        "yr": 31556952,
+        "decade": 315569520,
+        "century": 3155695200,
+    }
+
     # Initialization and Magic methods
     def __init__(self, amount: float, unit: str):
         self.amount = amount
@@ -57,6 +79,18 @@ class Measurement:
         else:
             raise ValueError(f"Cannot convert {self.unit} to kilograms")
 
+    def in_kilograms(self) -> float:
+        """The amount in kilograms (without changing the measurement), or None if
+        it isn't a mass"""
+        factor = self.KILOGRAMS_PER_UNIT.get(self.unit)
+        return self.amount * factor if factor is not None else None
+
+    def in_seconds(self) -> float:
+        """The amount in seconds (without changing the measurement), or None if it
+        isn't a time"""
+        factor = self.SECONDS_PER_UNIT.get(self.unit)
+        return self.amount * factor if factor is not None else None
+
     # Converters
     def to_dict(self):
         return {"amount": self.amount, "unit": self.unit}
@@ -1,6 +1,9 @@
 from __future__ import annotations
-from typing import List
+from typing import Dict, List
+import copy
 import logging
+import time
+import uuid
 from models.measurement import Measurement
 
 logger = logging.getLogger(__name__)
@@ -15,6 +18,10 @@ class Record:
     initialization, printing, properties
     """
 
+    # Attributes that identify a write rather than describe the record (see
+    # `stamp()`). They're left out of comparisons, and of the dict when unset
+    METADATA = ()
+
     # Initialization & Magic methods
     def __init__(self, name, **attributes):
         self.name = name
@@ -32,7 +39,8 @@ class Record:
         """
         parts = []
         for k, v in self.attributes.items():
-            if k == "name" or not v:  # skip since initialized with this
+            # Skip the name since it starts the line
+            if k == "name" or k in self.METADATA or not v:
                 continue
 
             if isinstance(v, list):
@@ -47,6 +55,8 @@ class Record:
             # Don't attempt to compare against unrelated types
             return NotImplemented
         for attr in set(list(self.attributes.keys()) + list(other.attributes.keys())):
+            if attr in self.METADATA:
+                continue
             self_attr = getattr(self, attr)
             other_attr = getattr(other, attr)
 
@@ -90,6 +100,8 @@ class Record:
         for k, v in self.attributes.items():
             if not include_name and k == "name":
                 continue
+            if k in self.METADATA and v is None:
+                continue
             if isinstance(v, Measurement):
                 v = v.to_dict()
 
@@ -101,9 +113,21 @@ class Record:
 
 
 class Set:
+    """A set of an activity: reps and/or a duration and/or a weight
+
+    Sets logged by intents also carry an `id` (unique) and `ts` (when they were
+    logged, in microseconds, see `stamp()`), so concurrent writes of a log can be
+    merged (see `Activity.merge()`). Neither is part of comparisons.
+    """
+
     # Initialization and Magic methods
     def __init__(
-        self, reps: int = None, duration: Measurement = None, weight: Measurement = None
+        self,
+        reps: int = None,
+        duration: Measurement = None,
+        weight: Measurement = None,
+        id: str = None,
+        ts: int = None,
     ):
         if reps and not isinstance(reps, int):
             raise TypeError("reps must be int input")
@@ -116,6 +140,8 @@ class Set:
 
         self.duration = duration
         self.weight = weight
+        self.id = id
+        self.ts = ts
 
     def __str__(self):
         """Print method for a Set
@@ -165,14 +191,23 @@ class Set:
 
 
 class Activity(Record):
+    """An activity's sets on a day
+
+    Its sets are an add-wins set: a set is removed by adding its key to
+    `removed_set_ids` (a tombstone), so removals and concurrent additions of other
+    sets merge in any order (see `merge()`). A set's key is its `id`, or for sets
+    logged before ids its position (see `set_key()`).
+    """
+
     # Initialization
-    def __init__(self, name, sets: List[Set] = None):
+    def __init__(self, name, sets: List[Set] = None, removed_set_ids=()):
         """Initialize Activity
 
         Supports a basic activity or with set info. If no set info provided, defaults
         to a single set with reps=1
         """
         super().__init__(name)
+        self.removed_set_ids = set(removed_set_ids)
         if sets is None:
             self.sets = [Set(reps=1)]
         elif isinstance(sets, Set):
@@ -197,9 +232,19 @@ class Activity(Record):
     # Class Methods
     @classmethod
     def from_dict(cls, activity_dict: dict) -> Activity:
-        activity = cls(activity_dict["name"], [])
-        for s in activity_dict["sets"]:
-            activity.sets.append(Set(**s))
+        """Initialize an Activity using its dict, leaving out removed sets"""
+        removed = activity_dict.get("removed") or ()
+        activity = cls(activity_dict["name"], [], removed)
+        for i, s in enumerate(activity_dict["sets"]):
+            s = Set(**s)
+            if removed and s.id is None:
+                # Other sets' positions shift once the removed ones are left out
+                s.id = set_key(i, s)
+            if set_key(i, s) not in activity.removed_set_ids:
+                activity.sets.append(s)
+        if removed:
+            # Edited sets are stored at the end (see `replacement()`)
+            activity.sets.sort(key=_log_order)
 
         return activity
 
@@ -207,6 +252,70 @@ class Activity(Record):
     def add_set(self, set: Set):
         self.sets.append(set)
 
+    def stamp(self, ts: int = None):
+        """Give the sets that don't have one an id and a timestamp, in order"""
+        ts = ts or now_micros()
+        for i, s in enumerate(self.sets):
+            if s.id is None:
+                s.id, s.ts = new_id(), ts + i
+
+    def keyed_sets(self) -> Dict[str, Set]:
+        """The sets by key (see `set_key()`)"""
+        return {set_key(i, s): s for i, s in enumerate(self.sets)}
+
+    def get_set(self, key: str) -> Set:
+        """The set with a key (see `set_key()`), or None"""
+        return self.keyed_sets().get(key)
+
+    def removal(self, keys: List[str] = None) -> Activity:
+        """A patch of the activity (see `merge()`) that removes some of its sets, by
+        key (all of them by default)"""
+        return Activity(self.name, [], keys or self.keyed_sets())
+
+    def replacement(self, key: str, **fields) -> Activity:
+        """A patch of the activity (see `merge()`) that replaces one of its sets with
+        a copy with some fields changed (eg `reps=12`), in the same place
+
+        Raises:
+            KeyError: there's no set with the key
+        """
+        new = _copy_in_place(key, self.keyed_sets()[key])
+        for field, value in fields.items():
+            setattr(new, field, value)
+
+        return Activity(self.name, [new], [key])
+
+    def restoration(self, keys: List[str]) -> Activity:
+        """A patch of the activity (see `merge()`) that adds back copies of some of
+        its sets, by key, in their places (eg to revert a patch that removes them)
+
+        Raises:
+            KeyError: there's no set with one of the keys
+        """
+        keyed = self.keyed_sets()
+        return Activity(self.name, [_copy_in_place(key, keyed[key]) for key in keys])
+
+    def merge(self, other: Activity) -> Activity:
+        """Merge two versions of an activity (eg written by different devices) into
+        a new one. The result is the same whatever the order they're merged in, and
+        merging a version in again changes nothing
+
+        * sets are kept unless either version removed them, ordered by when they
+          were logged (sets logged before ids come first, in their order)
+        * removals from both versions are kept
+        """
+        removed = self.removed_set_ids | other.removed_set_ids
+        sets = {}
+        for activity in (self, other):
+            for key, s in activity.keyed_sets().items():
+                if key not in removed and key not in sets:
+                    # Keyed by id from here on, as positions shift once removed
+                    # sets are left out
+                    sets[key] = copy.copy(s)
+                    sets[key].id = key
+
+        return Activity(self.name, sorted(sets.values(), key=_log_order), removed)
+
     def to_dict(self, include_name=True):
         """Convert activity to a pure dict
 
@@ -221,15 +330,24 @@ class Activity(Record):
         result = {
             "sets": [s.to_dict() if hasattr(s, "to_dict") else s for s in self.sets]
         }
+        if self.removed_set_ids:
+            result["removed"] = sorted(self.removed_set_ids)
         if include_name:
             result["name"] = self.name
         return result
 
 
 class Symptom(Record):
+    """A symptom's severity on a day
+
+    Symptoms logged by intents carry an `id` and `ts` (see `Activity`), and the
+    latest one wins when versions are merged (see `merge()`).
+    """
+
     ALLOWED_LEVELS = [0, 1, 2, 3]
+    METADATA = ("id", "ts")
 
-    def __init__(self, name, severity: int):
+    def __init__(self, name, severity: int, id: str = None, ts: int = None):
         super().__init__(name)
 
         if severity not in self.ALLOWED_LEVELS:
@@ -237,6 +355,8 @@ class Symptom(Record):
                 f"Invalid severity: {severity}. Allowed severities are: {', '.join(map(str, self.ALLOWED_LEVELS))}"  # noqa
             )
         self.severity = severity
+        self.id = id
+        self.ts = ts
 
     # Magic methods
     def __str__(self):
@@ -247,3 +367,63 @@ class Symptom(Record):
         """
 
         return f"{self.name.title()}: {self.severity}"
+
+    # Public methods
+    def stamp(self, ts: int = None):
+        """Give the symptom an id and a timestamp, if it doesn't have them"""
+        if self.id is None:
+            self.id, self.ts = new_id(), ts or now_micros()
+
+    def merge(self, other: Symptom) -> Symptom:
+        """The later of two versions of a symptom (last writer wins), by timestamp
+        then id so that every replica picks the same one"""
+        return copy.copy(max(self, other, key=_write_order))
+
+
+# Public functions
+def new_id() -> str:
+    """A unique id for a set or symptom write"""
+    return uuid.uuid4().hex[:16]
+
+
+def now_micros() -> int:
+    return time.time_ns() // 1000
+
+
+def set_key(position: int, s: Set) -> str:
+    """The key a set is addressed by: its id, or for sets logged before ids, its
+    position in the activity's stored sets (which only ever grow at the end)"""
+    return s.id if s.id is not None else f"{position:04d}"
+
+
+def visible_sets(activity_dict: dict) -> List[dict]:
+    """An activity dict's sets (see `Activity.to_dict()`), leaving out removed ones"""
+    sets = activity_dict.get("sets") or []
+    removed = activity_dict.get("removed")
+    if not removed:
+        return sets
+    removed = set(removed)
+    keyed = [(s.get("id", f"{i:04d}"), s) for i, s in enumerate(sets)]
+    keyed = [(key, s) for key, s in keyed if key not in removed]
+    return [
+        s for _, s in sorted(keyed, key=lambda item: (item[1].get("ts", 0), item[0]))
+    ]
+
+
+# Private functions
+def _copy_in_place(key: str, s: Set) -> Set:
+    """A copy of a set, with a new id, that sorts where the set is"""
+    new = copy.copy(s)
+    # Same timestamp so it sorts where the set is. Sets logged before ids sort by key
+    # instead, so the new id starts with the set's position
+    new.id = new_id() if s.ts else f"{key[:4]}.{new_id()}"
+    return new
+
+
+def _log_order(s: Set) -> tuple:
+    # Sets are keyed by id once merged or once some were removed
+    return (s.ts or 0, s.id)
+
+
+def _write_order(symptom: Symptom) -> tuple:
+    return (symptom.ts or 0, symptom.id or "", symptom.severity)
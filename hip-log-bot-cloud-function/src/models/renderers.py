@@ -0,0 +1,282 @@
+from __future__ import annotations
+from collections import OrderedDict
+from itertools import chain
+from typing import Callable, Iterable, Iterator, List
+import logging
+from models.log_date import LogDate
+
+logger = logging.getLogger(__name__)
+
+# Longest text Messenger accepts in a single message
+MESSENGER_MAX_LENGTH = 2000
+
+# Appended in place of whatever didn't fit
+TRUNCATION_MARKER = "…"
+
+# Offered under Messenger replies (Messenger allows up to 13, of 20 chars each)
+MESSENGER_QUICK_REPLIES = ["Today's log", "Log activity", "Log symptom", "Help"]
+
+
+class FragmentCache:
+    """A bounded LRU cache of rendered record fragments (eg "* Squats 2 sets: 10x
+    60kg, 8x 70kg")
+
+    Fragments are keyed on the record's content rather than the record object, so
+    a record that changes (eg gets another set) simply misses the cache, and records
+    with the same content (eg "Left Hip: 1" on many days) share a fragment.
+    """
+
+    # Initialization
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._fragments = OrderedDict()
+
+    def __len__(self):
+        return len(self._fragments)
+
+    # Public Methods
+    def get(self, key: tuple, render: Callable[[], str]) -> str:
+        """Get the fragment for a key, rendering (and caching) it on a miss"""
+        fragment = self._fragments.get(key)
+        if fragment is not None:
+            self.hits += 1
+            self._fragments.move_to_end(key)
+            return fragment
+
+        self.misses += 1
+        fragment = render()
+        self._fragments[key] = fragment
+        if len(self._fragments) > self.max_size:
+            self._fragments.popitem(last=False)
+
+        return fragment
+
+    def clear(self):
+        self._fragments.clear()
+        self.hits = self.misses = 0
+
+
+class Renderer:
+    """Base class for rendering DailyLogs to text for an output target
+
+    Output is built line by line from cached per-record fragments, and stops as
+    soon as the target's `max_length` is reached, so a huge log is never rendered
+    in full only to be cut.
+
+    Subclasses implement `log_lines()` (and optionally `to_response()`).
+    """
+
+    name = None
+    max_length = None
+    bullet = "* "
+
+    # Shared by every renderer (keys include the renderer name)
+    fragments = FragmentCache()
+
+    # Public Methods
+    def render_log(self, log) -> str:
+        """Render a single DailyLog"""
+        return self.join(self.log_lines(log))
+
+    def render_logs(self, header: str, logs: Iterable) -> str:
+        """Render several DailyLogs as one summary line each, under a header"""
+        lines = (f"{self.bullet}{self.summary_line(log)}" for log in logs)
+        return self.join(chain([header, ""], lines))
+
+    def summary_line(self, log) -> str:
+        """A one line summary of a DailyLog
+
+        Sample to demonstrate format:
+        "Fri Nov. 3: Squats (2 sets), Yoga (1 set); Left Hip: 1"
+        """
+        parts = []
+        activities = [
+            self.fragments.get(
+                ("compact", "activity", a.name, len(a.sets)),
+                lambda a=a: (
+                    f"{a.name.title()} ({len(a.sets)} set"
+                    f"{'s' if len(a.sets) != 1 else ''})"
+                ),
+            )
+            for a in log.activities.values()
+        ]
+        if activities:
+            parts.append(", ".join(activities))
+        if log.symptoms:
+            parts.append(", ".join(self._symptom(s) for s in log.symptoms.values()))
+
+        summary = "; ".join(parts) or "nothing logged"
+        return f"{format_date(log.date, '%a %b. %-d')}: {summary}"
+
+    def log_lines(self, log) -> Iterator[str]:
+        raise NotImplementedError
+
+    def to_response(self, text: str) -> dict:
+        """The Dialogflow fulfillment response for a reply"""
+        return {"fulfillmentText": text}
+
+    def join(self, lines: Iterable[str]) -> str:
+        """Join lines, stopping (and marking the cut) before `max_length` would be
+        exceeded. Lines after the cut are never generated"""
+        if self.max_length is None:
+            return "\n".join(lines)
+
+        res: List[str] = []
+        length = -1
+        for line in lines:
+            length += len(line) + 1
+            if length > self.max_length:
+                return self._truncate(res, line)
+            res.append(line)
+
+        return "\n".join(res)
+
+    # Private methods
+    def _truncate(self, lines: List[str], overflowing_line: str) -> str:
+        """End the output with the marker, dropping lines (or cutting the only one)
+        to make room for it"""
+        logger.info(f"Truncating {self.name} output to {self.max_length} chars")
+        while lines and len("\n".join(lines)) + 1 + len(TRUNCATION_MARKER) > (
+            self.max_length
+        ):
+            lines.pop()
+        if not lines:
+            cut = self.max_length - len(TRUNCATION_MARKER)
+            return overflowing_line[:cut] + TRUNCATION_MARKER
+
+        return "\n".join(lines + [TRUNCATION_MARKER])
+
+    def _activity(self, activity, render: Callable[[], str]) -> str:
+        return self.fragments.get(
+            (self.name, "activity", activity.name, _sets_key(activity.sets)), render
+        )
+
+    def _symptom(self, symptom) -> str:
+        return self.fragments.get(
+            ("symptom", symptom.name, symptom.severity), symptom.__str__
+        )
+
+
+class PlainTextRenderer(Renderer):
+    """The full log as plain text (the default)
+
+    Sample to demonstrate format:
+    "Sep. 24, 2023 Log:
+
+    2x activities:
+    * Curls 2 sets: 10x 10kg, 8x 8kg
+    * Yoga 1 sets: 3min
+
+    1x symptom records:
+    * Left Hip: 3"
+    """
+
+    name = "text"
+
+    def log_lines(self, log) -> Iterator[str]:
+        yield f"{format_date(log.date, '%b. %-d, %Y')} Log:"
+        yield ""
+        yield f"{len(log.activities)}x activities:"
+        for activity in log.activities.values():
+            yield f"* {self._activity(activity, activity.__str__)}"
+        if log.activity_notes:
+            yield log.activity_notes
+
+        yield ""
+        yield f"{len(log.symptoms)}x symptom records:"
+        for symptom in log.symptoms.values():
+            yield f"* {self._symptom(symptom)}"
+        if log.symptom_notes:
+            yield log.symptom_notes
+
+
+class MessengerRenderer(Renderer):
+    """The full log with Messenger's markdown, within its message size limit, and
+    with quick replies for the usual next steps
+
+    Sample to demonstrate format:
+    "*Sun Sep. 24, 2023*
+    • *Curls*: 10x 10kg, 8x 8kg
+    • *Yoga*: 3min
+    • Left Hip: 3"
+    """
+
+    name = "messenger"
+    max_length = MESSENGER_MAX_LENGTH
+    bullet = "• "
+
+    def log_lines(self, log) -> Iterator[str]:
+        yield f"*{format_date(log.date, '%a %b. %-d, %Y')}*"
+        if not log.activities and not log.symptoms:
+            yield "Nothing logged yet"
+        for activity in log.activities.values():
+            fragment = self._activity(
+                activity,
+                lambda: f"*{activity.name.title()}*: "
+                + ", ".join(s.__str__() for s in activity.sets),
+            )
+            yield f"{self.bullet}{fragment}"
+        if log.activity_notes:
+            yield f"_{log.activity_notes}_"
+        for symptom in log.symptoms.values():
+            yield f"{self.bullet}{self._symptom(symptom)}"
+        if log.symptom_notes:
+            yield f"_{log.symptom_notes}_"
+
+    def to_response(self, text: str) -> dict:
+        return {
+            "fulfillmentText": text,
+            "fulfillmentMessages": [
+                {
+                    "platform": "FACEBOOK",
+                    "quickReplies": {
+                        "title": text,
+                        "quickReplies": MESSENGER_QUICK_REPLIES,
+                    },
+                }
+            ],
+        }
+
+
+class CompactRenderer(Renderer):
+    """Each log as a single line (see `Renderer.summary_line()`)"""
+
+    name = "compact"
+    bullet = ""
+
+    def log_lines(self, log) -> Iterator[str]:
+        yield self.summary_line(log)
+
+
+RENDERERS = {
+    renderer.name: renderer
+    for renderer in [PlainTextRenderer, MessengerRenderer, CompactRenderer]
+}
+
+# Dialogflow request sources (`originalDetectIntentRequest.source`) with their own
+# renderer. Everything else gets plain text
+SOURCE_RENDERERS = {"facebook": MessengerRenderer}
+
+
+def renderer_for_source(source: str) -> Renderer:
+    """The renderer for the platform a request came from"""
+    return SOURCE_RENDERERS.get(source, PlainTextRenderer)()
+
+
+def format_date(date: str, fmt: str) -> str:
+    """Format a 'YYYY-MM-DD' date, parsing and formatting each date only once (see
+    `models.log_date`)"""
+    return LogDate.parse(date).format(fmt)
+
+
+def _sets_key(sets) -> tuple:
+    """A hashable key of a list of Sets' content"""
+    return tuple(
+        (s.reps, _measurement_key(s.duration), _measurement_key(s.weight)) for s in sets
+    )
+
+
+def _measurement_key(measurement):
+    return (measurement.amount, measurement.unit) if measurement else None
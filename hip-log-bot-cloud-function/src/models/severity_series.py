@@ -0,0 +1,61 @@
+from __future__ import annotations
+from datetime import date as Date
+import logging
+from models.date_bitmap import DateBitmap
+from models.record import Symptom
+
+logger = logging.getLogger(__name__)
+
+# Bits needed for a severity (0-3)
+NUM_PLANES = max(Symptom.ALLOWED_LEVELS).bit_length()
+
+
+class SeveritySeries:
+    """A symptom's severity on each day it was logged, stored as bit planes: plane
+    `i` is a DateBitmap of the days whose severity has bit `i` set
+
+    Which days the symptom was logged on isn't kept here (a day with severity 0 has
+    no bits set), but in the catalog's `symptom_dates`. Two bits per day means five
+    years of a symptom is ~460 bytes, so the series lives in the catalog and a trend
+    needs no reads beyond it (see `services.trends`).
+    """
+
+    # Initialization
+    def __init__(self, planes: list = None):
+        self._planes = planes or [DateBitmap() for _ in range(NUM_PLANES)]
+
+    # Class Methods
+    @classmethod
+    def from_dict(cls, input_dict: dict) -> SeveritySeries:
+        """Initialize from the Firestore format (see `to_dict()`)"""
+        planes = (input_dict or {}).get("planes") or []
+        return cls(
+            [DateBitmap.from_dict(p) for p in planes]
+            + [DateBitmap() for _ in range(NUM_PLANES - len(planes))]
+        )
+
+    # Properties
+    @property
+    def planes(self) -> list:
+        """The bit planes, lowest bit first"""
+        return self._planes
+
+    # Public Methods
+    def set(self, day: Date, severity: int):
+        for i, plane in enumerate(self._planes):
+            if severity >> i & 1:
+                plane.add(day)
+            else:
+                plane.remove(day)
+
+    def remove(self, day: Date):
+        for plane in self._planes:
+            plane.remove(day)
+
+    def get(self, day: Date) -> int:
+        """The severity on a day (0 if it has none, see the class docstring)"""
+        return sum(1 << i for i, plane in enumerate(self._planes) if day in plane)
+
+    # Converters/Serializers
+    def to_dict(self) -> dict:
+        return {"planes": [plane.to_dict() for plane in self._planes]}
@@ -0,0 +1,229 @@
+from __future__ import annotations
+from typing import Iterable, List, Tuple
+import logging
+from models.measurement import Measurement
+from models.record import visible_sets
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever what's computed changes. Stats with an older schema are stale and
+# get recomputed (see `services.recompute`)
+SCHEMA_VERSION = 2
+
+# Personal records kept per activity
+MAX_WEIGHT = "max_weight_kg"
+MAX_REPS_AT_WEIGHT = "max_reps_at_weight"
+MAX_DURATION = "max_duration_s"
+BEST_1RM = "best_1rm_kg"
+
+
+class UserStats:
+    """Running totals and personal records of everything a user has logged, stored
+    in a single stats document per user
+
+    Attributes:
+        schema_version (int): the SCHEMA_VERSION the stats were computed with
+        log_version (int): the catalog's log version the stats were computed at. The
+        stats are only current while the two match
+        activities (dict): activity name -> {"num_days", "num_sets", "total_reps",
+        "first_date", "last_date"}
+        symptoms (dict): symptom name -> {"num_days", "total_severity",
+        "max_severity", "first_date", "last_date"}
+        records (dict): activity name -> personal records (see
+        `activity_records()`). Unlike the totals, these are also kept up to date by
+        every activity upload
+        stale (bool): set when a log is deleted, since the records may then be too
+        high, until the stats are recomputed
+    """
+
+    # Initialization
+    def __init__(self, log_version: int = 0):
+        self.schema_version = SCHEMA_VERSION
+        self.log_version = log_version
+        self.activities = {}
+        self.symptoms = {}
+        self.records = {}
+        self.stale = False
+
+    # Class Methods
+    @classmethod
+    def from_dict(cls, input_dict: dict) -> UserStats:
+        """Initialize UserStats using the stats document's dict"""
+        input_dict = input_dict or {}
+        stats = cls(input_dict.get("log_version", 0))
+        stats.schema_version = input_dict.get("schema_version", 0)
+        stats.activities = dict(input_dict.get("activities") or {})
+        stats.symptoms = dict(input_dict.get("symptoms") or {})
+        stats.records = dict(input_dict.get("records") or {})
+        stats.stale = bool(input_dict.get("stale"))
+
+        return stats
+
+    @classmethod
+    def from_log_dicts(
+        cls, logs: Iterable[Tuple[str, dict]], log_version: int = 0
+    ) -> UserStats:
+        """Compute stats from (date, log dict) pairs in date order, eg from
+        `HipLogDB.stream_logs()`"""
+        stats = cls(log_version)
+        for date, log_dict in logs:
+            stats.record_log_dict(date, log_dict)
+
+        return stats
+
+    # Properties
+    @property
+    def has_current_records(self) -> bool:
+        """Whether the personal records can be compared against (they're complete
+        and no log was deleted since they were computed)"""
+        return self.schema_version == SCHEMA_VERSION and not self.stale
+
+    # Public Methods
+    def is_current(self, log_version: int) -> bool:
+        """Whether the stats are up to date with the user's logs at `log_version`"""
+        return (
+            self.schema_version == SCHEMA_VERSION
+            and self.log_version == log_version
+            and not self.stale
+        )
+
+    def find_prs(self, name: str, sets: List[dict]) -> List[str]:
+        """Describe the personal records of an activity that new sets (in the
+        `Set.to_dict()` format) beat. Takes O(sets)
+
+        The first time an activity (or a weight of it) is logged isn't a PR, only
+        beating an existing record is.
+
+        Returns:
+            List[str]: eg ["heaviest weight (100kg)", "most reps at 80kg (8)"]
+        """
+        previous = self.records.get(name)
+        if not previous:
+            return []
+
+        new = activity_records(sets)
+        prs = []
+        if new.get(MAX_WEIGHT, 0) > previous.get(MAX_WEIGHT, float("inf")):
+            prs.append(f"heaviest weight ({_format_kg(new[MAX_WEIGHT])})")
+        previous_reps = previous.get(MAX_REPS_AT_WEIGHT) or {}
+        for weight, reps in (new.get(MAX_REPS_AT_WEIGHT) or {}).items():
+            if reps > previous_reps.get(weight, float("inf")):
+                prs.append(f"most reps at {weight}kg ({reps})")
+        if new.get(MAX_DURATION, 0) > previous.get(MAX_DURATION, float("inf")):
+            prs.append(f"longest duration ({_format_seconds(new[MAX_DURATION])})")
+        if new.get(BEST_1RM, 0) > previous.get(BEST_1RM, float("inf")):
+            prs.append(f"best estimated 1RM ({_format_kg(new[BEST_1RM])})")
+
+        return prs
+
+    def add_records(self, name: str, records: dict):
+        """Raise an activity's personal records to the given ones (see
+        `activity_records()`) where they're higher"""
+        current = self.records.setdefault(name, {})
+        for key, value in records.items():
+            if key == MAX_REPS_AT_WEIGHT:
+                reps = current.setdefault(MAX_REPS_AT_WEIGHT, {})
+                for weight, n in value.items():
+                    reps[weight] = max(reps.get(weight, 0), n)
+            else:
+                current[key] = max(current.get(key, 0), value)
+
+    def record_log_dict(self, date: str, log_dict: dict):
+        """Add a log (in the `DailyLog.to_dict()` format) to the totals. Logs must be
+        recorded in date order"""
+        for name, activity in (log_dict.get("activities") or {}).items():
+            sets = visible_sets(activity)
+            if not sets and activity.get("removed"):
+                continue
+            totals = self._totals(self.activities, name, date)
+            totals["num_sets"] = totals.get("num_sets", 0) + len(sets)
+            totals["total_reps"] = totals.get("total_reps", 0) + sum(
+                s.get("reps") or 0 for s in sets
+            )
+            self.add_records(name, activity_records(sets))
+
+        for name, symptom in (log_dict.get("symptoms") or {}).items():
+            severity = symptom.get("severity") or 0
+            totals = self._totals(self.symptoms, name, date)
+            totals["total_severity"] = totals.get("total_severity", 0) + severity
+            totals["max_severity"] = max(totals.get("max_severity", 0), severity)
+
+    # Private methods
+    def _totals(self, totals_by_name: dict, name: str, date: str) -> dict:
+        """Get the totals of a name, counting another day of it"""
+        totals = totals_by_name.setdefault(name, {"num_days": 0, "first_date": date})
+        totals["num_days"] += 1
+        totals["last_date"] = date
+        return totals
+
+    # Converters/Serializers
+    def to_dict(self) -> dict:
+        return {
+            "schema_version": self.schema_version,
+            "log_version": self.log_version,
+            "activities": self.activities,
+            "symptoms": self.symptoms,
+            "records": self.records,
+            "stale": self.stale,
+        }
+
+
+def activity_records(sets: List[dict]) -> dict:
+    """The personal records set by some sets of an activity (in the `Set.to_dict()`
+    format), all in kg and seconds:
+    * max_weight_kg: heaviest weight
+    * max_reps_at_weight: weight (kg, to 0.1) -> most reps
+    * max_duration_s: longest duration
+    * best_1rm_kg: best estimated one rep max (see `estimated_1rm()`)
+    """
+    records = {}
+    for s in sets:
+        reps = s.get("reps")
+        weight = _convert(s.get("weight"), Measurement.in_kilograms)
+        duration = _convert(s.get("duration"), Measurement.in_seconds)
+        if weight:
+            _raise(records, MAX_WEIGHT, weight)
+            if reps:
+                _raise(
+                    records.setdefault(MAX_REPS_AT_WEIGHT, {}),
+                    _weight_key(weight),
+                    reps,
+                )
+                _raise(records, BEST_1RM, estimated_1rm(weight, reps))
+        if duration:
+            _raise(records, MAX_DURATION, duration)
+
+    return records
+
+
+def estimated_1rm(weight: float, reps: int) -> float:
+    """Estimate the most that could be lifted once from a set (Epley formula)"""
+    if reps <= 1:
+        return weight
+    return round(weight * (1 + reps / 30), 2)
+
+
+# Private functions
+def _convert(measurement: dict, to_base_unit) -> float:
+    if not measurement:
+        return None
+    value = to_base_unit(Measurement(**measurement))
+    return round(value, 2) if value is not None else None
+
+
+def _raise(records: dict, key: str, value):
+    records[key] = max(records.get(key, value), value)
+
+
+def _weight_key(kilograms: float) -> str:
+    return f"{round(kilograms, 1):g}"
+
+
+def _format_kg(kilograms: float) -> str:
+    return f"{round(kilograms, 1):g}kg"
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds >= 60 and seconds % 60 == 0:
+        return f"{seconds / 60:g}min"
+    return f"{seconds:g}s"
@@ -1,4 +1,5 @@
 from enum import Enum
+from functools import lru_cache
 
 
 class SupportedIntents(Enum):
@@ -23,6 +24,11 @@ class SupportedIntents(Enum):
         "See how many days you’ve logged",
         "How many days have I logged",
     )
+    GetStreak = (
+        "GetStreak",
+        "See how many days in a row you've logged (overall or for an activity)",
+        "What's my streak? How many days in a row have I done PT exercises?",
+    )
     GetActivityList = (
         "GetActivityList",
         "Get a list of previously logged activities",
@@ -38,6 +44,36 @@ class SupportedIntents(Enum):
         "Get a list of previously logged symptoms",
         "List my symptoms. What symptoms have I logged?",
     )
+    GetSymptomTrend = (
+        "GetSymptomTrend",
+        "See how a symptom has been trending (over the last 90 days, or a period)",
+        "How has my left hip been? How was my knee last month?",
+    )
+    GetCorrelations = (
+        "GetCorrelations",
+        "See how your activities relate to your symptoms",
+        "What affects my hip? Which activities make my symptoms worse?",
+    )
+    UndoLastSet = (
+        "UndoLastSet",
+        "Remove the last set you logged (of an activity, or of any)",
+        "Remove my last set, Remove my last set of squats",
+    )
+    EditSet = (
+        "EditSet",
+        "Fix one of a day's sets of an activity",
+        "Change squats set 2 to 12 reps, My second set of curls was 8kg",
+    )
+    DeleteActivity = (
+        "DeleteActivity",
+        "Delete an activity from a daily log",
+        "Remove yoga from today, Delete yesterday's squats",
+    )
+    UndoLastChange = (
+        "UndoLastChange",
+        "Undo your last change to your logs (again to undo the one before)",
+        "Undo that, Undo my last change",
+    )
     DeleteDailyLog = (
         "DeleteDailyLog",
         "Delete a daily log",
@@ -68,7 +104,9 @@ class SupportedIntents(Enum):
         return [intent.name for intent in cls]
 
     @classmethod
+    @lru_cache(maxsize=None)
     def summarize(cls):
+        """The command list reply. It never changes, so it's built once"""
         output = ["The following are supported commands:", ""]
         for intent in cls:
             name, description, examples = intent.value
@@ -0,0 +1,283 @@
+from __future__ import annotations
+from typing import Iterable, List, Tuple
+from collections import OrderedDict
+from datetime import date as Date, timedelta
+import logging
+import numpy as np
+from models.record import visible_sets
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lags (in days) between an activity and the symptom it's compared against. 0 means
+# same day, 1 means the day after, etc.
+DEFAULT_LAGS = (0, 1, 2)
+
+# Minimum number of symptom observations on both "activity" and "no activity" days
+# before a correlation is reported. Anything less is noise
+MIN_OBSERVATIONS = 5
+
+# Users whose correlations are kept per instance. The least recently used are
+# dropped beyond this
+MAX_CACHED_USERS = 256
+
+
+class HistoryFrame:
+    """A columnar view of a user's history with one row per calendar day
+
+    Activities are stored as a (days x activities) matrix of the number of sets done
+    that day (0 when not done). Symptoms are stored as a (days x symptoms) matrix of
+    severities, with NaN for days the symptom wasn't logged, since a missing record
+    isn't the same as a severity of 0.
+    """
+
+    # Initialization
+    def __init__(
+        self,
+        start: Date,
+        activities: List[str],
+        symptoms: List[str],
+        activity_matrix: np.ndarray,
+        symptom_matrix: np.ndarray,
+    ):
+        self._start = start
+        self._activities = activities
+        self._symptoms = symptoms
+        self._activity_matrix = activity_matrix
+        self._symptom_matrix = symptom_matrix
+
+    # Class Methods
+    @classmethod
+    def from_log_dicts(cls, logs: Iterable[Tuple[str, dict]]) -> HistoryFrame:
+        """Build the frame from (date, log dict) pairs, eg from
+        `HipLogDB.stream_logs()`. The dicts match the Firestore structure so this
+        avoids building a DailyLog per day.
+        """
+        # First pass collects the sparse entries so the matrices can be allocated
+        # once at their final size
+        activity_entries = []
+        symptom_entries = []
+        activity_idx = {}
+        symptom_idx = {}
+        days = []
+        for date_str, log_dict in logs:
+            day = Date.fromisoformat(date_str).toordinal()
+            days.append(day)
+
+            for name, activity_dict in (log_dict.get("activities") or {}).items():
+                num_sets = len(visible_sets(activity_dict))
+                if not num_sets and activity_dict.get("removed"):
+                    continue
+                col = activity_idx.setdefault(name, len(activity_idx))
+                activity_entries.append((day, col, num_sets))
+
+            for name, symptom_dict in (log_dict.get("symptoms") or {}).items():
+                col = symptom_idx.setdefault(name, len(symptom_idx))
+                symptom_entries.append((day, col, symptom_dict["severity"]))
+
+        if not days:
+            return cls(Date.today(), [], [], np.zeros((0, 0)), np.zeros((0, 0)))
+
+        first_day = min(days)
+        n_days = max(days) - first_day + 1
+
+        activity_matrix = np.zeros((n_days, len(activity_idx)))
+        if activity_entries:
+            rows, cols, vals = np.array(activity_entries).T
+            activity_matrix[rows.astype(int) - first_day, cols.astype(int)] = vals
+
+        symptom_matrix = np.full((n_days, len(symptom_idx)), np.nan)
+        if symptom_entries:
+            rows, cols, vals = np.array(symptom_entries).T
+            symptom_matrix[rows.astype(int) - first_day, cols.astype(int)] = vals
+
+        logger.debug(
+            f"Built HistoryFrame with {n_days} days, {len(activity_idx)} activities and {len(symptom_idx)} symptoms"  # noqa
+        )
+
+        return cls(
+            Date.fromordinal(first_day),
+            list(activity_idx),
+            list(symptom_idx),
+            activity_matrix,
+            symptom_matrix,
+        )
+
+    # Properties
+    @property
+    def start(self) -> Date:
+        return self._start
+
+    @property
+    def end(self) -> Date:
+        return self._start + timedelta(days=max(self.num_days - 1, 0))
+
+    @property
+    def num_days(self) -> int:
+        return self._activity_matrix.shape[0]
+
+    @property
+    def activities(self) -> List[str]:
+        return self._activities
+
+    @property
+    def symptoms(self) -> List[str]:
+        return self._symptoms
+
+    @property
+    def activity_matrix(self) -> np.ndarray:
+        return self._activity_matrix
+
+    @property
+    def symptom_matrix(self) -> np.ndarray:
+        return self._symptom_matrix
+
+
+class Correlation:
+    """The relationship between doing an activity and a symptom `lag` days later"""
+
+    def __init__(
+        self,
+        activity: str,
+        symptom: str,
+        lag: int,
+        r: float,
+        delta: float,
+        n: int,
+    ):
+        self.activity = activity
+        self.symptom = symptom
+        self.lag = lag
+        self.r = r
+        self.delta = delta
+        self.n = n
+
+    def __str__(self):
+        """Print method for a Correlation
+
+        Sample to demonstrate format:
+        "Days after squats, left hip severity rises by 0.8 (r=0.42, 120 days)"
+        """
+        if self.lag == 0:
+            when = f"On days with {self.activity}"
+        elif self.lag == 1:
+            when = f"Days after {self.activity}"
+        else:
+            when = f"{self.lag} days after {self.activity}"
+
+        direction = "rises" if self.delta >= 0 else "drops"
+        return (
+            f"{when}, {self.symptom} severity {direction} by {abs(self.delta):.1f} "
+            f"(r={self.r:.2f}, {self.n} days)"
+        )
+
+
+def lagged_correlations(
+    frame: HistoryFrame, lags: Iterable[int] = DEFAULT_LAGS
+) -> List[Correlation]:
+    """Correlate every activity with every symptom at each lag
+
+    For each lag, the activity matrix is shifted against the symptom matrix and all
+    the (activity, symptom) pairs are computed at once with matrix products, masking
+    out the days where the symptom wasn't logged.
+
+    Returns:
+        List[Correlation]: correlations sorted by strength (|r|), strongest first
+    """
+    results = []
+    if not frame.activities or not frame.symptoms:
+        return results
+
+    for lag in lags:
+        if lag >= frame.num_days:
+            continue
+
+        # Activity on day t against the symptom on day t + lag
+        x = frame.activity_matrix[: frame.num_days - lag]
+        y = frame.symptom_matrix[lag:]
+
+        observed = ~np.isnan(y)
+        mask = observed.astype(float)
+        y0 = np.where(observed, y, 0.0)
+
+        # Pearson r with per-pair sample counts (a x s matrices)
+        n = mask.sum(axis=0)
+        sum_x = x.T @ mask
+        sum_xx = (x**2).T @ mask
+        sum_y = y0.sum(axis=0)
+        sum_yy = (y0**2).sum(axis=0)
+        sum_xy = x.T @ y0
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = sum_xy - sum_x * sum_y / n
+            var_x = sum_xx - sum_x**2 / n
+            var_y = sum_yy - sum_y**2 / n
+            r = cov / np.sqrt(var_x * var_y)
+
+            # Mean severity when the activity was done vs when it wasn't
+            did = (x > 0).astype(float)
+            n_did = did.T @ mask
+            n_didnt = n - n_did
+            mean_did = (did.T @ y0) / n_did
+            mean_didnt = (sum_y - did.T @ y0) / n_didnt
+            delta = mean_did - mean_didnt
+
+        valid = (
+            np.isfinite(r) & (n_did >= MIN_OBSERVATIONS) & (n_didnt >= MIN_OBSERVATIONS)
+        )
+        for a, s in zip(*np.nonzero(valid)):
+            results.append(
+                Correlation(
+                    frame.activities[a],
+                    frame.symptoms[s],
+                    lag,
+                    float(r[a, s]),
+                    float(delta[a, s]),
+                    int(n[s]),
+                )
+            )
+
+    results.sort(key=lambda c: abs(c.r), reverse=True)
+    return results
+
+
+class CorrelationCache:
+    """In-process cache of each user's correlations, keyed on their log version
+
+    The log version is bumped by `HipLogDB` on every upload and delete, so checking it
+    costs one point read and a stale entry is never served after new uploads. Only
+    the latest version of each user is kept, and only for the MAX_CACHED_USERS most
+    recently used users.
+    """
+
+    _entries = OrderedDict()
+
+    @classmethod
+    def get(cls, hiplogdb, user: str) -> List[Correlation]:
+        version = hiplogdb.get_log_version(user)
+
+        cached = cls._entries.get(user)
+        if cached and cached[0] == version:
+            logger.debug(f"Correlation cache hit for '{user}' (version {version})")
+            metrics.CACHE_LOOKUPS.inc("correlations", "hit")
+            cls._entries.move_to_end(user)
+            return cached[1]
+        metrics.CACHE_LOOKUPS.inc("correlations", "miss")
+
+        logger.info(f"Computing correlations for '{user}' (version {version})")
+        frame = HistoryFrame.from_log_dicts(hiplogdb.stream_logs(user))
+        correlations = lagged_correlations(frame)
+        cls._entries[user] = (version, correlations)
+        cls._entries.move_to_end(user)
+        if len(cls._entries) > MAX_CACHED_USERS:
+            cls._entries.popitem(last=False)
+
+        return correlations
+
+    @classmethod
+    def invalidate(cls, user: str = None):
+        """Drop a user's cached correlations (or everyone's if no user given)"""
+        if user is None:
+            cls._entries.clear()
+        else:
+            cls._entries.pop(user, None)
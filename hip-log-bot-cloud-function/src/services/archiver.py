@@ -0,0 +1,53 @@
+from __future__ import annotations
+from datetime import date
+from typing import List
+import logging
+from models.catalog import Catalog
+from services.hiplogdb import HipLogDB
+
+logger = logging.getLogger(__name__)
+
+# Months are archived once they're at least this many months before the current one.
+# Most reads are of the last few weeks, which stay as individual documents
+DEFAULT_MIN_AGE_MONTHS = 3
+
+
+def months_to_archive(
+    catalog: Catalog, today: date, min_age_months: int = DEFAULT_MIN_AGE_MONTHS
+) -> List[str]:
+    """List the 'YYYY-MM' months with logs that are old enough to archive and aren't
+    archived yet
+
+    Example: on 2023-11-03 with min_age_months=3, months up to 2023-08 are eligible
+    """
+    n_months = today.year * 12 + today.month - 1 - min_age_months
+    cutoff = f"{n_months // 12:04d}-{n_months % 12 + 1:02d}"
+
+    months = {str(day)[:7] for day in catalog.log_dates.dates()}
+    return sorted(
+        month
+        for month in months
+        if month <= cutoff and month not in catalog.archived_months
+    )
+
+
+def archive_user(
+    hiplogdb: HipLogDB,
+    user: str,
+    min_age_months: int = DEFAULT_MIN_AGE_MONTHS,
+    today: date = None,
+) -> int:
+    """Archive every eligible month of a user's logs (see `months_to_archive()`)
+
+    Returns:
+        int: number of logs archived
+    """
+    months = months_to_archive(
+        hiplogdb.get_catalog(user), today or date.today(), min_age_months
+    )
+    n_archived = 0
+    for month in months:
+        n_archived += hiplogdb.archive_month(user, month)
+
+    logger.info(f"Archived {n_archived} logs of '{user}' in {len(months)} months")
+    return n_archived
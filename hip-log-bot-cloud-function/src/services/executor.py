@@ -1,59 +1,128 @@
 import logging
-import traceback
+import time
+import utils
+from datetime import timedelta
+from typing import List, Tuple
+from errors import (
+    STORAGE_ERRORS,
+    StorageUnavailable,
+    UnsupportedIntent,
+    ValidationError,
+    response_for,
+)
+from models.catalog import Catalog
 from models.intent import Intent
 from models.supported_intents import SupportedIntents
 from models.record import Activity, Symptom
+from models.date_bitmap import DateBitmap
+from models.daily_log import DailyLog
+from models.journal import JournalEntry
+from models.log_date import LogDate
+from models.renderers import PlainTextRenderer, Renderer, renderer_for_source
+from models.stats import activity_records
+from services import metrics
 from services.hiplogdb import HipLogDB
+from services.analytics import CorrelationCache
+from services.archiver import months_to_archive
+from services.io_stats import INTENT_BUDGETS, NEW_USER_BUDGET, IOStats
+from services.jobs import (
+    ARCHIVE_LOGS,
+    COMPACT_JOURNAL,
+    COMPACT_JOURNAL_EVERY_WRITES,
+    REBUILD_CATALOG,
+    RECOMPUTE_STATS,
+    RECONCILE_EVERY_WRITES,
+    RECONCILE_NUM_LOGS,
+    JobQueue,
+    get_queue,
+)
+from services.name_index import NameIndex
+from services.trends import DEFAULT_WINDOW_DAYS, SymptomTrend
 
 logger = logging.getLogger(__name__)
 
 
 class Executor:
     def __init__(self, request):
-        self._hiplogdb = HipLogDB()
+        # The Firestore client is only created once the request has parsed, so bad
+        # requests are turned away without it
+        self._hiplogdb = None
         self._request = request
+        self._renderer = PlainTextRenderer()
+        self._jobs = get_queue()
+        # Kinds of job found due while running the intent, queued with its change
+        # (see `_add_follow_up_jobs()`)
+        self._follow_up_jobs = []
+
+    @property
+    def renderer(self) -> Renderer:
+        """How replies are rendered, for the platform the request came from"""
+        return self._renderer
+
+    @property
+    def jobs(self) -> JobQueue:
+        """Where follow-up work is queued rather than done while the user waits"""
+        return self._jobs
+
+    @property
+    def intent(self) -> Intent:
+        """The parsed request, or None if it hasn't been (successfully) parsed"""
+        return getattr(self, "_intent", None)
+
+    @property
+    def io_stats(self) -> IOStats:
+        """The Firestore round trips made while running the request"""
+        return self._hiplogdb.io_stats if self._hiplogdb else IOStats()
 
     def run(self) -> str:
-        """Run the
+        """Run the request's intent
+
+        Errors are turned into replies (see `errors.response_for()`) and logged
+        without the request, at a limited rate, so a flood of bad requests stays
+        cheap to answer.
 
         Returns:
             str: Returns the message passed back to users, or an error message as needed
         """
-        error_occurred = False
+        start = time.perf_counter()
+        outcome = "ok"
         try:
-            self._intent = Intent(self._request)
-            res = self._decision_flow()
-
-        # Known errors: return a polished error message for handled error types
-        except ValueError as e:  # noqa
-            logger.error(f"Caught ValueError: {e}")
-            error_occurred = True
+            with metrics.INTENT_PARSE_SECONDS.time():
+                self._intent = Intent(self._request)
+            self._renderer = renderer_for_source(self._intent.source)
+            self._hiplogdb = HipLogDB()
+            self._hiplogdb.add_commit_writes(self._add_follow_up_jobs)
+            try:
+                res = self._decision_flow()
+            except STORAGE_ERRORS as e:
+                raise StorageUnavailable(f"Firestore unavailable: {e!r}") from e
 
-            traceback.print_exc()
-            # TODO: change
-            if "Unsupported intent" in str(e):
-                res = f"We don't support this yet (intent = {self._request['queryResult']['intent']['displayName']}))"  # noqa
-
-            elif "Mismatched number of reps/weights/durations" in str(e):
-                res = "It looks like you provided unmatched entries for reps/weights/durations (eg specified 2 sets of reps but only 1 weight). Check your log and try again"  # noqa
-            else:
-                raise
+        # Known errors: a polished reply for each type
+        except (UnsupportedIntent, ValidationError, StorageUnavailable) as e:
+            res = response_for(e)
+            outcome = type(e).__name__
+            utils.error_log_limiter.log(
+                logger,
+                type(e).__name__,
+                f'Caught {type(e).__name__}: {e}. Setting response value to:\n"{res}"',  # noqa
+            )
 
         # Entirely unknown errors but "caught" within executor (as oppose to even
         # broader error from main.py)
-        except Exception:
-            logger.error("Caught unknown exception")
-            error_occurred = True
-            traceback.print_exc()
-            res = "Something went wrong. Try a different way or type 'help'"
+        except Exception as e:
+            res = response_for(e)
+            outcome = type(e).__name__
+            intent_type = getattr(self, "_intent", None) and self._intent.type
+            utils.error_log_limiter.log(
+                logger,
+                type(e).__name__,
+                f"Caught unknown exception running {intent_type}: {e!r}",
+                exc_info=True,
+            )
 
-        # Include trace and error in logs
         finally:
-            if error_occurred:
-                logger.error(
-                    f"Failed logging, here's the input request:\n{self._request}\n"
-                )
-                logger.error(f'Setting response value to:\n"{res}"')
+            self._check_io_budget()
+            self._record_metrics(outcome, time.perf_counter() - start)
 
         return res
 
@@ -68,19 +137,63 @@ class Executor:
         # First handle generic requests, that don't require specific log queries.
         # Otherwise do log-based actions
         if self._intent.type == SupportedIntents.GetNumLogs:
-            num_logs = self._hiplogdb.get_num_logs_by_user(self._intent.user)
-            res = f"There are {num_logs} logs"
+            catalog = self._hiplogdb.get_catalog(self._intent.user)
+            today = self._intent.today.date
+            num_this_month = catalog.log_dates.count_month(today.year, today.month)
+            res = f"There are {catalog.num_logs} logs ({num_this_month} this month)"
+
+        elif self._intent.type == SupportedIntents.GetStreak:
+            catalog = self._hiplogdb.get_catalog(self._intent.user)
+            activity_name = self._intent.log_input.get("name")
+            if activity_name:
+                activity_name = (
+                    NameIndex.for_catalog(self._intent.user, catalog).resolve(
+                        activity_name
+                    )
+                    or activity_name
+                )
+                res = self._summarize_streak(
+                    catalog.get_activity_dates(activity_name), f"'{activity_name}'"
+                )
+            else:
+                res = self._summarize_streak(catalog.log_dates, "a log")
 
         elif self._intent.type == SupportedIntents.GetActivityList:
             activity_list = self._hiplogdb.get_activity_list_by_user(self._intent.user)
-            activity_str = ",\n".join(activity_list)
-            res = f"Here are the activities you've previously logged:\n{activity_str}"
+            res = self._list_names(
+                "Here are the activities you've previously logged:", activity_list
+            )
 
         elif self._intent.type == SupportedIntents.GetSymptomList:
-            # TODO: functionalize this with GetActivityList
             symptom_list = self._hiplogdb.get_symptom_list_by_user(self._intent.user)
-            symptom_str = ",\n".join(symptom_list)
-            res = f"Here are the symptoms you've previously logged:\n{symptom_str}"
+            res = self._list_names(
+                "Here are the symptoms you've previously logged:", symptom_list
+            )
+
+        elif (
+            self._intent.type == SupportedIntents.GetDailyLog
+            and self._intent.is_date_range
+        ):
+            logs = self._hiplogdb.get_logs(
+                self._intent.user, self._intent.start_date, self._intent.end_date
+            )
+            res = self._summarize_logs(logs)
+
+        elif (
+            self._intent.type == SupportedIntents.DeleteDailyLog
+            and self._intent.is_date_range
+        ):
+            deleted = self._hiplogdb.delete_logs(
+                self._intent.user,
+                self._intent.start_date,
+                self._intent.end_date,
+                journal=JournalEntry(self._intent.type),
+            )
+            period = self._format_period()
+            if deleted:
+                res = f"Your {len(deleted)} entries for {period} were deleted"
+            else:
+                res = f"There were no entries for {period}. Nothing was deleted"
 
         elif self._intent.type == SupportedIntents.GetDailyLog:
             log = self._hiplogdb.get_log(
@@ -89,32 +202,123 @@ class Executor:
             logger.info(f"Retrieved DailyLog (local object) generated:\n{log}")
 
         elif self._intent.type == SupportedIntents.LogActivity:
+            # The stats come in the same round trip, to check for personal records
             log = self._hiplogdb.get_log(
-                self._intent.user, self._intent.date, initialize_empty=True
+                self._intent.user,
+                self._intent.date,
+                initialize_empty=True,
+                with_stats=True,
+            )
+            # Log under the existing name if it's just a different form of it (eg
+            # "pushup" vs "pushups"), so the same activity isn't split in two
+            # The sets were already converted while parsing the intent
+            activity = Activity(
+                self._resolve_existing_name(
+                    self._intent.log_input["name"], "activities"
+                ),
+                sets=self._intent.sets,
             )
-            log.add_activity(Activity.from_dict(self._intent._log_input))
+            pr_line = self._check_prs(activity)
+            # Only the new sets are uploaded, so concurrent logs of the day merge
+            # instead of overwriting each other
+            activity.stamp()
+            patch = DailyLog(self._intent.date, activities=[activity])
+            journal = JournalEntry.for_patch(self._intent.type, log, patch)
+            log = log.merge(patch)
             logger.info(f"DailyLog (local object) generated:\n{log}")
 
         elif self._intent.type == SupportedIntents.LogSymptom:
             log = self._hiplogdb.get_log(
                 self._intent.user, self._intent.date, initialize_empty=True
             )
-            log.add_symptom(Symptom(**self._intent.log_input))
+            symptom_input = dict(self._intent.log_input)
+            symptom_input["name"] = self._resolve_existing_name(
+                symptom_input["name"], "symptoms"
+            )
+            symptom = Symptom(**symptom_input)
+            symptom.stamp()
+            patch = DailyLog(self._intent.date, symptoms=[symptom])
+            journal = JournalEntry.for_patch(self._intent.type, log, patch)
+            log = log.merge(patch)
             logger.info(f"DailyLog (local object) generated:\n{log}")
 
+        elif self._intent.type in [
+            SupportedIntents.UndoLastSet,
+            SupportedIntents.EditSet,
+            SupportedIntents.DeleteActivity,
+        ]:
+            log = self._hiplogdb.get_log(
+                self._intent.user, self._intent.date, initialize_empty=True
+            )
+            # Only the changed sets are uploaded, the rest of the log isn't rewritten
+            patch, res = self._edit_sets(log)
+            if patch:
+                journal = JournalEntry.for_patch(self._intent.type, log, patch)
+                log = log.merge(patch)
+                self._hiplogdb.upload_patch(
+                    self._intent.user, patch, log, journal=journal
+                )
+                res = f"{res}\n\n{self._renderer.render_log(log)}"
+
+        elif self._intent.type == SupportedIntents.UndoLastChange:
+            entry, logs = self._hiplogdb.undo_last_change(self._intent.user)
+            if entry is None:
+                res = "There's nothing to undo"
+            else:
+                dates = entry.dates[0]
+                if len(entry.dates) > 1:
+                    dates = f"{entry.dates[0]} to {entry.dates[-1]}"
+                res = f"Undid your last change ({entry.intent} for {dates})"
+                if len(logs) == 1:
+                    res = f"{res}\n\n{self._renderer.render_log(logs[0])}"
+                else:
+                    res = f"{res}\n\n{self._summarize_logs(logs)}"
+
         elif self._intent.type == SupportedIntents.DeleteDailyLog:
-            self._hiplogdb.delete_log(self._intent.user, self._intent.date)
+            self._hiplogdb.delete_log(
+                self._intent.user,
+                self._intent.date,
+                journal=JournalEntry(self._intent.type),
+            )
             res = f"Your entry '{self._intent.date}' was deleted"
 
         elif self._intent.type == SupportedIntents.GetActivitySummary:
-            activity_name = self._intent.log_input["name"]
-            stats = self._hiplogdb.get_activity_summary(
-                self._intent.user, activity_name
+            # Resolve the name against the catalog first so that a miss doesn't
+            # need a query
+            activity_query = self._intent.log_input["name"]
+            index = NameIndex.for_catalog(
+                self._intent.user, self._hiplogdb.get_catalog(self._intent.user)
             )
+            activity_name = index.resolve(activity_query)
+            if activity_name:
+                stats = self._hiplogdb.get_activity_summary(
+                    self._intent.user, activity_name
+                )
+            else:
+                activity_name = activity_query
+                stats = {"total_count": 0}
+
             output = [f"**Summary Stats for '{activity_name}'**\n"]
             output += [f"{k}: {v}" for k, v in stats.items()]
+            suggestions = (
+                index.suggest(activity_query) if not stats["total_count"] else []
+            )
+            if suggestions:
+                output.append(f"\nDid you mean: {', '.join(suggestions)}?")
             res = "\n".join(output)
 
+        elif self._intent.type == SupportedIntents.GetSymptomTrend:
+            res = self._summarize_trend()
+
+        elif self._intent.type == SupportedIntents.GetCorrelations:
+            correlations = CorrelationCache.get(self._hiplogdb, self._intent.user)
+            if correlations:
+                output = ["Here's how your activities relate to your symptoms:"]
+                output += [f"* {c}" for c in correlations[:3]]
+                res = "\n".join(output)
+            else:
+                res = "There isn't enough history yet to relate your activities and symptoms. Keep logging!"  # noqa
+
         if self._intent.type in [
             SupportedIntents.LogActivity,
             SupportedIntents.LogSymptom,
@@ -124,19 +328,255 @@ class Executor:
             # TODO: retrieve into here too but tbd how cuz also need to handle
             # differently
 
-            # Upload the new/modified log back
+            # Upload the new/modified log back, raising the activity's records
             logger.info("Uploading DailyLog")
-            self._hiplogdb.upload_log(self._intent.user, log)
+            records = None
+            if self._intent.type == SupportedIntents.LogActivity:
+                sets = activity.to_dict(include_name=False)["sets"]
+                records = {activity.name: activity_records(sets)}
+            self._hiplogdb.upload_patch(
+                self._intent.user, patch, log, records, journal=journal
+            )
             logger.info("Completed upload")
 
-        if self._intent.type in [
+        if not self._intent.is_date_range and self._intent.type in [
             SupportedIntents.LogActivity,
             SupportedIntents.LogSymptom,
             SupportedIntents.GetDailyLog,
         ]:
-            res = log.__str__()
+            res = self._renderer.render_log(log)
+            if self._intent.type == SupportedIntents.LogActivity and pr_line:
+                res = f"{pr_line}\n\n{res}"
 
         if self._intent.type == SupportedIntents.GetCommandList:
             res = SupportedIntents.summarize()
 
         return res
+
+    def _record_metrics(self, outcome: str, seconds: float):
+        intent = getattr(self, "_intent", None)
+        intent_type = intent.type if intent else "unknown"
+        if intent is None and outcome != "ok":
+            metrics.INTENT_PARSE_ERRORS.inc(outcome)
+        metrics.REQUESTS.inc(intent_type, outcome)
+        metrics.REQUEST_SECONDS.observe(seconds, intent_type)
+
+    def _check_io_budget(self):
+        """Log the request's round trips, warning if they exceed the intent's
+        budget (eg a change that made an intent read every log)"""
+        intent_type = getattr(self, "_intent", None) and self._intent.type
+        logger.info(f"I/O for {intent_type}: {self.io_stats}")
+
+        budget = INTENT_BUDGETS.get(intent_type)
+        if budget and self._hiplogdb is not None and self._hiplogdb.new_users:
+            budget = budget + NEW_USER_BUDGET
+        violations = self.io_stats.over_budget(budget) if budget else []
+        if violations:
+            logger.warning(
+                f"{intent_type} exceeded its I/O budget ({budget}): {', '.join(violations)}"  # noqa
+            )
+
+    def _check_prs(self, activity: Activity) -> str:
+        """Compare an activity's new sets against the user's personal records (from
+        the stats fetched with the log, so no extra read)
+
+        Returns:
+            str: the PR line for the reply, or None if no record was beaten
+        """
+        user = self._intent.user
+        stats = self._hiplogdb.get_stats(user)
+        if not stats.has_current_records:
+            # Eg after a delete: recompute them rather than compare against records
+            # that may be too high (or missing). A new user has none to compare
+            if self._hiplogdb.get_catalog(user).log_dates.count():
+                self._follow_up_jobs.append(RECOMPUTE_STATS)
+            return None
+
+        sets = activity.to_dict(include_name=False)["sets"]
+        prs = stats.find_prs(activity.name, sets)
+        if not prs:
+            return None
+
+        logger.info(f"New personal records for '{activity.name}': {prs}")
+        return f"New PR! {activity.name.title()}: {', '.join(prs)}"
+
+    def _add_follow_up_jobs(self, batch, user: str, catalog: Catalog):
+        """Queue the maintenance that the intent's change makes due, to run in the
+        background. The jobs go in the change's batch (see
+        `HipLogDB.add_commit_writes()`), so they cost no round trip of their own
+
+        * after deletes, set edits and undos, the stats are recomputed (uploads
+          raise the personal records themselves, and the totals are left to whatever
+          needs them)
+        * once months are old enough, they're archived
+        * every so many writes, the log counter is checked against the logs, and the
+          journal is compacted
+        """
+        kinds = list(self._follow_up_jobs)
+        if self._intent.type in [
+            SupportedIntents.UndoLastSet,
+            SupportedIntents.EditSet,
+            SupportedIntents.DeleteActivity,
+            SupportedIntents.UndoLastChange,
+            SupportedIntents.DeleteDailyLog,
+        ]:
+            kinds.append(RECOMPUTE_STATS)
+
+        # The catalog as it's being written, so this doesn't cost a read
+        if months_to_archive(catalog, self._intent.today.date):
+            kinds.append(ARCHIVE_LOGS)
+        if catalog.log_version % RECONCILE_EVERY_WRITES == 0:
+            kinds.append(RECONCILE_NUM_LOGS)
+        if catalog.log_version % COMPACT_JOURNAL_EVERY_WRITES == 0:
+            kinds.append(COMPACT_JOURNAL)
+
+        for kind in dict.fromkeys(kinds):
+            self._jobs.enqueue(kind, user, batch=batch)
+
+    def _edit_sets(self, log: DailyLog) -> Tuple[DailyLog, str]:
+        """Work out the patch of the day's log for an UndoLastSet, EditSet or
+        DeleteActivity intent, addressing the sets by key (see
+        `Activity.keyed_sets()`)
+
+        Returns:
+            tuple: (the patch, or None if there's nothing to change, the reply)
+        """
+        date = self._intent.date
+        name = self._intent.log_input.get("name")
+        if name:
+            name = self._resolve_existing_name(name, "activities")
+
+        if self._intent.type == SupportedIntents.UndoLastSet:
+            activity, key = log.last_set(name)
+            if not activity:
+                of = f" of {name}" if name else ""
+                return None, f"There are no sets{of} on {date}. Nothing was undone"
+            change = activity.removal([key])
+            res = f"Removed your last set of {activity.name}: {activity.get_set(key)}"
+
+        elif self._intent.type == SupportedIntents.EditSet:
+            activity = log.activities.get(name)
+            number = self._intent.log_input["set_number"]
+            num_sets = len(activity.sets) if activity else 0
+            if number > num_sets:
+                res = f"There are {num_sets} sets of {name} on {date}"
+                return None, f"{res}, so there's no set {number}"
+            key = list(activity.keyed_sets())[number - 1]
+            # Only the values that were given change (eg the weight is kept when
+            # just the reps are fixed)
+            new = self._intent.sets[0]
+            fields = {
+                field: getattr(new, field)
+                for field in self._intent.log_input["sets"][0]
+            }
+            change = activity.replacement(key, **fields)
+            res = f"Changed set {number} of {activity.name} to {change.sets[0]}"
+
+        else:
+            activity = log.activities.get(name)
+            if not activity:
+                return None, f"There's no {name} on {date}. Nothing was deleted"
+            change = activity.removal()
+            res = f"Deleted {activity.name} from {date}"
+
+        return DailyLog(date, activities=[change]), res
+
+    def _resolve_existing_name(self, name: str, kind: str) -> str:
+        """Map a new record's name onto an already logged one if it's just a
+        different form of it (no fuzzy matching, since a typo-like name may well be a
+        genuinely new activity)
+
+        Args:
+            name (str): the name from the intent
+            kind (str): "activities" or "symptoms"
+        """
+        index = NameIndex.for_catalog(
+            self._intent.user, self._hiplogdb.get_catalog(self._intent.user), kind
+        )
+        resolved = index.resolve(name, fuzzy=False)
+        if resolved and resolved != name:
+            logger.info(f"Logging '{name}' under existing name '{resolved}'")
+            return resolved
+
+        return name
+
+    def _list_names(self, header: str, names: List[str]) -> str:
+        """One name per line under a header, cut to the renderer's length limit"""
+        lines = [f"{name}," for name in names[:-1]] + names[-1:]
+        return self._renderer.join([header] + (lines or [""]))
+
+    def _summarize_logs(self, logs: List[DailyLog]) -> str:
+        """A compact summary of the logs in the intent's date period, one line per
+        logged day"""
+        period = self._format_period()
+        if not logs:
+            return f"You didn't log anything for {period}"
+
+        return self._renderer.render_logs(f"{period}: {len(logs)} day(s) logged", logs)
+
+    def _format_period(self) -> str:
+        """The intent's date period for messages, eg "Oct. 30 - Nov. 5, 2023" """
+        start = LogDate.parse(self._intent.start_date)
+        end = LogDate.parse(self._intent.end_date)
+        if start.date.year != end.date.year:
+            return f"{start.format('%b. %-d, %Y')} - {end.format('%b. %-d, %Y')}"
+
+        return f"{start.format('%b. %-d')} - {end.format('%b. %-d, %Y')}"
+
+    def _summarize_trend(self) -> str:
+        """Describe a symptom's trend over the intent's period (or the last
+        DEFAULT_WINDOW_DAYS days), from the catalog alone if it has the symptom's
+        severities"""
+        user = self._intent.user
+        catalog = self._hiplogdb.get_catalog(user)
+        query = self._intent.log_input["name"]
+        index = NameIndex.for_catalog(user, catalog, "symptoms")
+        name = index.resolve(query)
+        if not name:
+            res = f"You haven't logged '{query}' yet"
+            suggestions = index.suggest(query)
+            if suggestions:
+                res += f". Did you mean: {', '.join(suggestions)}?"
+            return res
+
+        if self._intent.is_date_range:
+            start = LogDate.parse(self._intent.start_date).date
+            end = LogDate.parse(self._intent.end_date).date
+            period = self._format_period()
+        else:
+            end = self._intent.today.date
+            start = end - timedelta(days=DEFAULT_WINDOW_DAYS - 1)
+            period = f"the last {DEFAULT_WINDOW_DAYS} days"
+
+        trend = SymptomTrend.from_catalog(catalog, name, start, end)
+        if trend is None:
+            # Logged before the catalog kept severities, so the period's logs are
+            # read instead, and the catalog rebuilt for next time
+            logger.info(f"No severities of '{name}' in the catalog, reading its logs")
+            logs = self._hiplogdb.stream_logs(user, since=str(start))
+            trend = SymptomTrend.from_log_dicts(name, logs, start, end)
+            self._hiplogdb.commit_writes(
+                lambda batch: self._jobs.enqueue(REBUILD_CATALOG, user, batch=batch)
+            )
+
+        return self._renderer.join(
+            [f"**{name.title()} over {period}**"] + trend.summary()
+        )
+
+    def _summarize_streak(self, dates: DateBitmap, label: str) -> str:
+        """Describe the current streak for a set of logged dates
+
+        Args:
+            dates (DateBitmap): the dates something was logged
+            label (str): what was logged, for the message (eg "'pushups'")
+        """
+        if not dates.count():
+            return f"You haven't logged {label} yet"
+
+        today = self._intent.today.date
+        streak = dates.streak(today)
+        longest = dates.longest_streak()
+        if streak:
+            return f"You've logged {label} {streak} day(s) in a row (longest streak: {longest} days)"  # noqa
+
+        return f"It's been {dates.gap(today)} days since you last logged {label} (longest streak: {longest} days)"  # noqa
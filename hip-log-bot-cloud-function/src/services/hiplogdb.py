@@ -1,14 +1,58 @@
+import copy
+import heapq
 import logging
 import os
-from typing import List
+import time
+from datetime import timedelta
+from typing import List, Tuple
 from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+from google.cloud.firestore_v1.transforms import DELETE_FIELD, ArrayUnion, Maximum
+from errors import InvalidDateRange, InvalidDeleteRange
+from models.archive import MonthArchive
+from models.catalog import Catalog, LAYOUT_FLAT, LAYOUT_YEARLY, LAYOUTS
 from models.daily_log import DailyLog
-from utils import is_valid_date_format
-from google.cloud.firestore_v1 import aggregation
+from models.journal import JournalEntry
+from models.log_date import LogDate
+from models.stats import SCHEMA_VERSION, UserStats
+from services import metrics
+from services.io_stats import IOStats
+from utils import is_valid_date_format, parse_date
+from google.cloud.firestore_v1.field_path import FieldPath
 
 logger = logging.getLogger(__name__)
 # print(__name__)
 
+# Number of times a write is retried when the user's catalog changed concurrently
+CATALOG_WRITE_ATTEMPTS = 3
+
+# Longest date range that can be read at once. Every day in a range is fetched in the
+# same round trip
+MAX_DATE_RANGE_DAYS = 366
+
+# Number of logs copied per transaction when migrating a user to another layout
+MIGRATION_PAGE_SIZE = 100
+
+# Most writes allowed in a single batch
+MAX_BATCH_WRITES = 500
+
+# Writes of a change's batch left for the ones its callers add (eg the follow-up jobs
+# it makes due, see `add_commit_writes()`)
+COMMIT_WRITES_RESERVED = 10
+
+# Longest date range that can be deleted at once, as the deletes go in one batch: per
+# day, the log (in both layouts during a migration) and its copy in the journal, plus
+# the catalog, the stats, the journal entry, two years' summaries and the reserve
+MAX_DELETE_RANGE_DAYS = (MAX_BATCH_WRITES - 5 - COMMIT_WRITES_RESERVED) // 3
+
+# Journal entries are kept for this many log versions (see `compact_journal()`)
+JOURNAL_KEEP_VERSIONS = 200
+
+# Document read by health checks and warm-ups, kept apart from the users' collection
+HEALTH_COLLECTION = "Health"
+HEALTH_DOCUMENT = "ping"
+
 
 class HipLogDB:
     """A handler class for interacting with the Firestore Database for the Hip Log Bots
@@ -16,13 +60,39 @@ class HipLogDB:
     The database is a schema-less document store, where the collection will contain a
     set of documents. Each document is a daily record (eg key = "2023-03-04")
 
+    Each user's top level document holds their Catalog (a summary of what they've
+    logged), which is kept in sync with their DailyLogs by writing both in the same
+    batch. The catalog write is conditional on it not having changed since it was
+    read, so concurrent writers retry rather than overwrite each other.
+
+    The DailyLogs are either all in one collection, or partitioned by year with a
+    summary in each year's document (see `models.catalog.LAYOUTS`). The catalog says
+    which, and reads and writes are routed accordingly. `migrate_layout()` moves a
+    user between layouts while they keep logging.
+
+    Old months can be packed into a single compressed archive document each (see
+    `archive_month()`). Reads and writes of those months go to the archive instead.
+
+    Totals derived from the logs (see `models.stats.UserStats`) are in a stats
+    document per user, recomputed from the logs by `rebuild_catalog()` and
+    `recompute_derived()`.
+
     Attributes:
         num_logs (int): number of daily logs for current user in the database (assuming
         a single user)
         collection_name (str): the selected collection name we'll be writing to
+        io_stats (IOStats): counts and timings of the round trips made by this
+        instance
+        new_users (set): users found without a catalog or logs (eg new ones) by this
+        instance
 
     """
 
+    # Each user's catalog as last seen by this process, to know where their logs are
+    # (layout, archived months) so that a log can be fetched in the same round trip
+    # as the catalog that confirms it
+    _seen_catalogs = {}
+
     # Initialization
     def __init__(self):
         """Initialize a handler for my Firestore database.
@@ -38,8 +108,38 @@ class HipLogDB:
         self._collection_name = os.environ["FIRESTORE_COLLECTION_NAME"]
         self._collection = self._db.collection(self._collection_name)
 
+        # Catalogs fetched during this instance's lifetime: user -> (Catalog, the
+        # document's update time or None if it doesn't exist yet)
+        self._catalogs = {}
+
+        # Archives fetched during this instance's lifetime: (user, month) ->
+        # MonthArchive. Only kept while they're at least as new as the user's catalog
+        self._archives = {}
+
+        # Stats fetched alongside logs during this instance's lifetime: user ->
+        # UserStats
+        self._stats = {}
+
+        # Every round trip goes through the private helpers below, which record it
+        self._io_stats = IOStats()
+        self._new_users = set()
+
+        # Callers' writes added to every change's batch (see `add_commit_writes()`)
+        self._commit_writes = []
+
+    # Properties
+    @property
+    def io_stats(self) -> IOStats:
+        return self._io_stats
+
+    @property
+    def new_users(self) -> set:
+        return self._new_users
+
     # Public Methods
-    def get_log(self, user: str, date: str, initialize_empty=False) -> DailyLog:
+    def get_log(
+        self, user: str, date: str, initialize_empty=False, with_stats=False
+    ) -> DailyLog:
         """Download a user's daily log document
 
         Query firestore collection by user-date and return it as a DailyLog object.
@@ -49,6 +149,8 @@ class HipLogDB:
             user (str): 'user id' document name in 'users' collection
             date (str): 'date' document name in dailyLogs
             initialize_empty: if True, will return a new DailyLog instance for date
+            with_stats: if True, the user's stats are fetched in the same round trip
+            (see `get_stats()`)
 
         Returns:
             DailyLog/None: a DailyLog object or None if record not found
@@ -58,11 +160,11 @@ class HipLogDB:
         if not is_valid_date_format(date):
             raise ValueError("Invalid date provided. Must be a 'YYYY-MM-DD' string")
 
-        # Download doc as json
-        fetched_doc = self._get_user_log_ref(user, date).get()
+        # Download doc as json. The catalog is fetched in the same round trip since
+        # any following upload will need it
+        fetched_dict = self._get_logs_and_catalog(user, [date], with_stats)[date]
 
-        if fetched_doc.exists:
-            fetched_dict = fetched_doc.to_dict()
+        if fetched_dict is not None:
             logger.info(f"Retrieved log as dict:\n{fetched_dict}")  # noqa
 
             # Map the Firestore dict to the DailyLog object
@@ -80,109 +182,1442 @@ class HipLogDB:
 
         return log
 
-    def upload_log(self, user: str, log: DailyLog):
+    def get_logs(self, user: str, start_date: str, end_date: str) -> List[DailyLog]:
+        """Download a user's daily logs for an inclusive date range
+
+        Every day in the range (and the catalog, as with `get_log()`) is fetched in a
+        single round trip, however long the range is.
+
+        Args:
+            user (str): 'user id' document name in 'users' collection
+            start_date (str): first date of the range
+            end_date (str): last date of the range
+
+        Returns:
+            List[DailyLog]: the logs that exist in the range, in date order
+        """
+        logger.info(f"Starting DailyLog fetch for '{start_date}' to '{end_date}'")
+        dates = self._get_dates_in_range(start_date, end_date)
+        log_dicts = self._get_logs_and_catalog(user, dates)
+
+        logs = [
+            DailyLog.from_dict(date, log_dicts[date])
+            for date in dates
+            if log_dicts[date] is not None
+        ]
+        logger.info(f"Retrieved {len(logs)} logs for '{start_date}' to '{end_date}'")
+
+        return logs
+
+    def upload_log(self, user: str, log: DailyLog, records: dict = None):
+        """Upload a user's daily log
+
+        Args:
+            user (str): 'user id' document name in 'users' collection
+            log (DailyLog): the day's full log
+            records (dict, optional): activity name -> personal records (see
+            `models.stats.activity_records()`) to raise the user's stats to, in the
+            same batch. Defaults to none.
+        """
         log_dict = log.to_dict()
 
         logger.info(f"Uploading '{log.date}' log; dict:\n{log_dict}")
-        self._get_user_log_ref(user, log.date).set(log_dict)
 
-        # In case this was a new one, update the count
-        # TODO: optimization - run this only if log was new
-        # self._num_logs = self.get_num_logs_by_user(user)
+        state = {}
 
-    def delete_log(self, user: str, date: str) -> None:
-        try:
-            self._get_user_log_ref(user, date).delete()
-            logger.info(f"Document with ID {date} deleted successfully!")
-        except Exception as e:
-            logger.error(f"An error occurred: {e}")
+        def update_catalog(catalog):
+            state["first_log"] = _is_new(catalog)
+            catalog.record_log(log)
 
-    def get_activity_summary(self, user: str, activity_name: str) -> dict:
-        """Get summary statistics for an activity
+        def add_writes(batch):
+            self._write_logs(batch, user, {log.date: log_dict})
+            if records:
+                self._write_records(batch, user, records, state["first_log"])
+
+        self._commit_with_catalog(
+            user,
+            update_catalog,
+            add_writes,
+            years=[parse_date(log.date).year],
+        )
+        if records:
+            self._add_records(user, records, state["first_log"])
 
-        Fetch stats with a collection query and format them into a nice summary
+    def upload_patch(
+        self,
+        user: str,
+        patch: DailyLog,
+        log: DailyLog,
+        records: dict = None,
+        removed_symptoms: List[str] = (),
+        journal: JournalEntry = None,
+        undoes: JournalEntry = None,
+    ):
+        """Upload a change to a user's daily log (eg a new, edited or removed set, or
+        a symptom) without rewriting the rest of it
 
-        Returns: a dict of stats
+        The patch is merged into the stored log by Firestore (sets are appended with
+        an array union, removals added to the activity's tombstones, symptoms
+        replaced), so it doesn't matter what other writers did to the log since it
+        was read, and a retry doesn't need to read it again. See `DailyLog.merge()`
+        for the semantics.
+
+        Logs in archived months, and logs of a user being migrated between layouts,
+        are written in full instead. A log the patch leaves empty is deleted.
+
+        Args:
+            user (str): 'user id' document name in 'users' collection
+            patch (DailyLog): the change, stamped (see `Activity.stamp()`)
+            log (DailyLog): the day's full log with the patch merged in, for the
+            catalog and for when it can't be written as a patch
+            records (dict, optional): see `upload_log()`
+            removed_symptoms (list, optional): symptoms to remove from the log too
+            (which a patch can't express)
+            journal (JournalEntry, optional): the change's entry, appended to the
+            user's journal in the same batch
+            undoes (JournalEntry, optional): the journal entry the patch reverts,
+            marked undone in the same batch
+        """
+        logger.info(f"Uploading patch of '{log.date}' log:\n{patch.to_dict()}")
+        state = {}
+
+        def update_catalog(catalog):
+            state["first_log"] = _is_new(catalog)
+            catalog.record_patch(patch, log, removed_symptoms)
+
+        def add_writes(batch):
+            catalog = self._catalogs[user][0]
+            month = MonthArchive.month_of(log.date)
+            if log.is_empty:
+                self._write_logs(batch, user, {log.date: None})
+            elif catalog.migrating_to or month in catalog.archived_months:
+                self._write_logs(batch, user, {log.date: log.to_dict()})
+            else:
+                fields = _patch_fields(patch, removed_symptoms)
+                for log_ref in self._get_user_log_write_refs(user, log.date):
+                    batch.set(log_ref, fields, merge=True)
+            if records:
+                self._write_records(batch, user, records, state["first_log"])
+            if undoes:
+                self._mark_stats_stale(batch, user)
+
+        self._commit_with_catalog(
+            user,
+            update_catalog,
+            add_writes,
+            years=[parse_date(log.date).year],
+            journal=journal,
+            undoes=undoes,
+        )
+        if records:
+            self._add_records(user, records, state["first_log"])
+
+    def add_commit_writes(self, add_writes):
+        """Have every change this instance commits from now on carry writes of the
+        caller's too (eg the jobs the change makes due), so they cost no round trip
+        of their own
+
+        Args:
+            add_writes (callable): called with the pending WriteBatch, the user and
+            their Catalog as it's about to be written (once per attempt). Together
+            they add at most `COMMIT_WRITES_RESERVED` writes
+        """
+        self._commit_writes.append(add_writes)
+
+    def commit_writes(self, add_writes) -> list:
+        """Commit writes that go with no change to the user's logs (eg a job queued
+        by a read) in a single round trip, or none if `add_writes` adds nothing
+
+        Args:
+            add_writes (callable): adds the writes to a WriteBatch
+        """
+        batch = self._db.batch()
+        add_writes(batch)
+        return self._commit(batch) if len(batch) else []
+
+    def delete_log(self, user: str, date: str, journal: JournalEntry = None) -> None:
+        """Delete a user's daily log
+
+        Args:
+            user (str): 'user id' document name in 'users' collection
+            date (str): 'YYYY-MM-DD'
+            journal (JournalEntry, optional): the change's entry, appended to the
+            user's journal in the same batch along with the log, so it can be undone
+        """
+        # The deleted log's records are needed to update the catalog
+        log_dict = self._get_logs_and_catalog(user, [date])[date]
+        if log_dict is None:
+            logger.info(f"Document with ID {date} doesn't exist. Nothing to delete")
+            return
+
+        if journal:
+            journal.dates, journal.restore = [date], {date: copy.deepcopy(log_dict)}
+        log = DailyLog.from_dict(date, log_dict)
+
+        def add_writes(batch):
+            self._write_logs(batch, user, {date: None})
+            self._mark_stats_stale(batch, user)
+
+        self._commit_with_catalog(
+            user,
+            lambda catalog: catalog.remove_log(log),
+            add_writes,
+            years=[parse_date(date).year],
+            journal=journal,
+        )
+        logger.info(f"Document with ID {date} deleted successfully!")
+
+    def delete_logs(
+        self, user: str, start_date: str, end_date: str, journal: JournalEntry = None
+    ) -> List[str]:
+        """Delete a user's daily logs for an inclusive date range
+
+        The logs are fetched in one round trip (their records are needed to update
+        the catalog) and deleted along with the catalog update in a single batch, so
+        the range can't be longer than `MAX_DELETE_RANGE_DAYS`. With a journal entry
+        (see `delete_log()`), the logs are kept in it.
+
+        Returns:
+            List[str]: the dates of the logs that were deleted
+        """
+        dates = self._get_dates_in_range(start_date, end_date)
+        if len(dates) > MAX_DELETE_RANGE_DAYS:
+            raise InvalidDeleteRange(
+                f"Invalid date range. Can delete up to {MAX_DELETE_RANGE_DAYS} days",
+                MAX_DELETE_RANGE_DAYS,
+            )
+
+        log_dicts = self._get_logs_and_catalog(user, dates)
+        logs = [
+            DailyLog.from_dict(date, log_dicts[date])
+            for date in dates
+            if log_dicts[date] is not None
+        ]
+        if not logs:
+            logger.info(
+                f"No logs for '{start_date}' to '{end_date}'. Nothing to delete"
+            )
+            return []
+
+        def remove_logs(catalog):
+            for log in logs:
+                catalog.remove_log(log)
+
+        def add_writes(batch):
+            self._write_logs(batch, user, {log.date: None for log in logs})
+            self._mark_stats_stale(batch, user)
+
+        if journal:
+            journal.dates = [log.date for log in logs]
+            journal.restore = {log.date: log.to_dict() for log in logs}
+        self._commit_with_catalog(
+            user,
+            remove_logs,
+            add_writes,
+            years={parse_date(log.date).year for log in logs},
+            journal=journal,
+        )
+        deleted = [log.date for log in logs]
+        logger.info(f"Deleted {len(deleted)} logs for '{start_date}' to '{end_date}'")
+
+        return deleted
+
+    def undo_last_change(self, user: str) -> Tuple[JournalEntry, List[DailyLog]]:
+        """Revert the user's latest change that wasn't undone yet, per their journal
+        (see `models.journal.JournalEntry`)
+
+        The entry is found with point reads (the catalog points to it), and the
+        revert is written like any change: a patch applies the entry's inverse patch,
+        and a delete writes the deleted logs back (merged with anything logged on
+        those days since). The entry is marked undone in the same batch, so undoing
+        again reverts the change before it.
+
+        Returns:
+            tuple: (the entry that was undone, the logs as they are now), or (None,
+            []) if there's nothing to undo
+        """
+        entry = self._get_journal_head(user)
+        if entry is None:
+            return None, []
+        logger.info(f"Undoing {entry.intent} of {entry.dates} for '{user}'")
+
+        if not entry.is_delete:
+            undo_patch = entry.get_undo_patch()
+            log = self.get_log(user, undo_patch.date, initialize_empty=True)
+            log = log.merge(undo_patch)
+            for name in entry.removed_symptoms:
+                log.delete_Symptom(name)
+            self.upload_patch(
+                user,
+                undo_patch,
+                log,
+                removed_symptoms=entry.removed_symptoms,
+                undoes=entry,
+            )
+            return entry, [log]
+
+        current = self._get_logs_and_catalog(user, entry.dates, restore=entry)
+        logs = []
+        for deleted in entry.get_deleted_logs():
+            if current[deleted.date]:
+                deleted = DailyLog.from_dict(deleted.date, current[deleted.date]).merge(
+                    deleted
+                )
+            logs.append(deleted)
+
+        def restore_logs(catalog):
+            for log in logs:
+                catalog.record_log(log)
+
+        def add_writes(batch):
+            self._write_logs(batch, user, {log.date: log.to_dict() for log in logs})
+            self._mark_stats_stale(batch, user)
+
+        self._commit_with_catalog(
+            user,
+            restore_logs,
+            add_writes,
+            years={parse_date(log.date).year for log in logs},
+            undoes=entry,
+        )
+
+        return entry, logs
+
+    def stream_journal(self, user: str, page_size: int = 500):
+        """Stream a user's journal (for auditing), oldest change first
+
+        Yields:
+            JournalEntry: every entry that wasn't compacted away, including undone
+            ones
+        """
+        journal = self._stream_collection(self._get_user_journal_ref(user), page_size)
+        for _, entry_dict in journal:
+            yield JournalEntry.from_dict(entry_dict)
+
+    def compact_journal(
+        self, user: str, keep_versions: int = JOURNAL_KEEP_VERSIONS
+    ) -> int:
+        """Delete a user's journal entries that are more than `keep_versions` log
+        versions old, so the journal stays bounded however long they log. Those
+        changes can't be undone anymore
+
+        Returns:
+            int: number of entries deleted
+        """
+        cutoff = self.get_catalog(user).log_version - keep_versions
+        num_entries = 0
+        old_refs = []
+        journal_ref = self._get_user_journal_ref(user)
+        # Documents are named so they stream in version order
+        for doc_id, entry_dict in self._stream_collection(
+            journal_ref, MAX_BATCH_WRITES
+        ):
+            if int(doc_id) > cutoff:
+                break
+            entry = JournalEntry.from_dict(entry_dict)
+            num_entries += 1
+            old_refs.append(journal_ref.document(doc_id))
+            if entry.is_delete:
+                old_refs.extend(
+                    self._get_user_journal_restore_ref(user, int(doc_id), date)
+                    for date in entry.dates
+                )
+
+        for chunk in _chunks(old_refs, MAX_BATCH_WRITES):
+            batch = self._db.batch()
+            for ref in chunk:
+                batch.delete(ref)
+            self._commit(batch)
+
+        logger.info(f"Compacted {num_entries} journal entries for '{user}'")
+        return num_entries
+
+    def get_catalog(self, user: str) -> Catalog:
+        """Get the user's Catalog. Costs a single point read (or none if it was
+        already fetched alongside a log).
+
+        If the catalog doesn't reflect the user's full history yet (eg their logs
+        predate it), it's rebuilt from the DailyLogs first.
+        """
+        return self._load_catalog(user)[0]
+
+    def rebuild_catalog(self, user: str) -> Catalog:
+        """Rebuild the user's Catalog (and stats) from scratch by streaming all their
+        DailyLogs
+
+        This is expensive (reads every log) so is only for catalogs that were never
+        indexed or have drifted.
+        """
+        logger.info(f"Rebuilding catalog for '{user}'")
+        metrics.CATALOG_REBUILDS.inc()
+        snapshot, catalog, stats = self._compute_derived(user)
+        catalog.log_version = stats.log_version = catalog.log_version + 1
+        if not snapshot.exists and not catalog.log_dates.count():
+            # A brand new user (rather than one whose logs predate catalogs)
+            catalog.layout = _new_user_layout(user)
+
+        batch = self._db.batch()
+        self._write_catalog(
+            batch, user, catalog, snapshot.update_time if snapshot.exists else None
+        )
+        self._write_year_summaries(batch, user, catalog, catalog.years)
+        batch.set(self._get_user_stats_ref(user), stats.to_dict())
+        results = self._commit(batch)
+        self._set_catalog(user, catalog, results[0].update_time)
+        self._stats[user] = stats
+
+        return catalog
+
+    def recompute_derived(self, user: str, writer) -> int:
+        """Recompute everything derived from a user's DailyLogs (catalog, year
+        summaries and stats) in a single pass over them, and queue the writes on a
+        BulkWriter (see `bulk_writer()`)
+
+        The logs are unchanged so the log version isn't bumped. The catalog write is
+        conditional on the catalog not having changed since it was read: if the user
+        logged meanwhile it fails, and the user should be recomputed again.
+
+        Returns:
+            int: number of logs read
         """
+        snapshot, catalog, stats = self._compute_derived(user)
+        if not snapshot.exists and not catalog.log_dates.count():
+            logger.info(f"Nothing to recompute for '{user}'")
+            return 0
+
+        self._write_catalog(
+            writer, user, catalog, snapshot.update_time if snapshot.exists else None
+        )
+        self._write_year_summaries(writer, user, catalog, catalog.years)
+        writer.set(self._get_user_stats_ref(user), stats.to_dict())
 
-        stats = {}
+        return catalog.log_dates.count()
 
-        # Stat 1: total num
-        # TODO need to filter on the contents of the keys of the activities
-        query = self._get_user_dailylogs_ref(user).order_by(
-            f"activities.{activity_name}"
+    def bulk_writer(self, max_ops_per_second: int = 500):
+        """Get a BulkWriter for large numbers of independent (non-atomic) writes,
+        throttled to `max_ops_per_second`"""
+        return self._db.bulk_writer(
+            options=BulkWriterOptions(
+                initial_ops_per_second=min(500, max_ops_per_second),
+                max_ops_per_second=max_ops_per_second,
+            )
         )
-        aggregate_query = aggregation.AggregationQuery(query)
-        aggregate_query.count(alias="all")
-        results = aggregate_query.get()
-        logger.debug(f"Returned result: {results}")
-        stats["total_count"] = results[0][0].value
+
+    def list_users(self, page_size: int = 300):
+        """List every user id in the collection, one page (round trip) at a time.
+        Includes users whose document doesn't exist (ie whose logs predate catalogs)
+
+        Yields:
+            str: user id
+        """
+        for ref in self._collection.list_documents(page_size=page_size):
+            yield ref.id
+
+    def ping(self) -> float:
+        """Read a document that holds no user data (see `HEALTH_COLLECTION`), which
+        opens the Firestore channel and checks it's reachable. Costs a single point
+        read
+
+        Returns:
+            float: seconds the read took
+        """
+        ref = self._db.collection(HEALTH_COLLECTION).document(HEALTH_DOCUMENT)
+        start = time.perf_counter()
+        self._get_doc(ref)
+
+        return time.perf_counter() - start
+
+    def get_stats(self, user: str) -> UserStats:
+        """Get the user's stats. Costs a single point read (or none if they were
+        already fetched alongside a log).
+
+        The totals are only current if `stats.is_current(log_version)`, the personal
+        records if `stats.has_current_records`.
+        """
+        if user not in self._stats:
+            snapshot = self._get_doc(self._get_user_stats_ref(user))
+            self._stats[user] = UserStats.from_dict(
+                snapshot.to_dict() if snapshot.exists else None
+            )
+
+        return self._stats[user]
+
+    def recompute_stats(self, user: str) -> UserStats:
+        """Recompute the user's stats from their DailyLogs (eg once a delete made
+        them stale)
+
+        The write is conditional on the stats not having changed meanwhile (eg an
+        upload raised a record, or another delete), so it raises FailedPrecondition
+        rather than overwrite them, and should be retried.
+        """
+        logger.info(f"Recomputing stats for '{user}'")
+        snapshot = self._get_doc(self._get_user_stats_ref(user))
+        _, _, stats = self._compute_derived(user)
+
+        batch = self._db.batch()
+        self._write_stats(
+            batch, user, stats, snapshot.update_time if snapshot.exists else None
+        )
+        self._commit(batch)
+        self._stats[user] = stats
 
         return stats
 
-    def get_activity_list_by_user(self, user: str) -> List[str]:
-        """Get a list of activities for a user
+    def get_log_version(self, user: str) -> int:
+        """Get the user's log version, a counter that's incremented on every upload
+        and delete. Costs a single point read.
 
-        TODO:
-            * This is highly inefficient and requires downloading each document for a
-            user and should instead be handled with a user attribute that's maintained
-            on each upload
+        Returns:
+            int: the version (0 if the user has never written a log)
         """
-        # Get all the daily logs for the user
-        daily_logs_ref = self._get_user_dailylogs_ref(user).stream()
+        return self.get_catalog(user).log_version
 
-        # Set to store unique activities
-        unique_activities_set = set()
+    def stream_logs(self, user: str, page_size: int = 500, since: str = None):
+        """Stream a user's daily logs in date order
 
-        # Iterate over daily logs and extract activities
-        for daily_log in daily_logs_ref:
-            daily_log_dict = daily_log.get("")
-            logger.debug(f"Reading doc: {daily_log_dict}")
-            activities_map = daily_log_dict.get("activities", {})
+        Each collection of logs is read with a single query that's paged with
+        cursors, so that a long history doesn't have to be held in one response.
+        Archived months are merged in (one more query, if the user has any).
 
-            # Add activities to the set
-            unique_activities_set.update(activities_map.keys())
+        Args:
+            user (str): 'user id' document name in 'users' collection
+            page_size (int, optional): number of documents per page. Defaults to 500.
+            since (str, optional): only stream logs from this date on. With the
+            yearly layout, earlier years' partitions aren't read at all
 
-        res = list(unique_activities_set)
-        res.sort()
-        return res
+        Yields:
+            tuple: (date, log dict) pairs, where the dict matches what `to_dict()`
+            uploads
+        """
+        catalog = self.get_catalog(user)
+        logs = self._stream_logs(user, catalog.layout, catalog, page_size, since)
+        if not catalog.archived_months:
+            yield from logs
+            return
 
-    def get_symptom_list_by_user(self, user: str) -> List[str]:
-        """Get a list of symptoms for a user
+        archives = self._stream_archives(user, page_size, since)
+        yield from self._stream_with_archives(logs, archives, since)
+
+    def get_year_summaries(self, user: str, since_year: int = None) -> List[dict]:
+        """Get the per-year summaries of a user's logs (yearly layout only), in a
+        single round trip
 
-        TODO:
-            * This is highly inefficient and requires downloading each document for a
-            user and should instead be handled with a user attribute that's maintained
-            on each upload
+        Returns:
+            List[dict]: see `Catalog.year_summary()` for the format
         """
-        # Get all the daily logs for the user
-        daily_logs_ref = self._get_user_dailylogs_ref(user).stream()
+        catalog = self.get_catalog(user)
+        if catalog.layout != LAYOUT_YEARLY:
+            raise ValueError("Year summaries are only kept for the yearly layout")
 
-        # Set to store unique symptoms
-        unique_symptoms_set = set()
+        years = [y for y in catalog.years if since_year is None or y >= since_year]
+        refs = [self._get_user_year_ref(user, year) for year in years]
+        snapshots = self._get_all(refs) if refs else {}
 
-        # Iterate over daily logs and extract symptoms
-        for daily_log in daily_logs_ref:
-            daily_log_dict = daily_log.get("")
-            logger.debug(f"Reading symptoms from doc: {daily_log_dict}")
-            symptoms_map = daily_log_dict.get("symptoms", {})
+        return [
+            snapshots[ref.path].to_dict() for ref in refs if snapshots[ref.path].exists
+        ]
 
-            # Add symptoms to the set
-            unique_symptoms_set.update(symptoms_map.keys())
+    def migrate_layout(
+        self, user: str, layout: str, page_size: int = MIGRATION_PAGE_SIZE
+    ) -> int:
+        """Move a user's DailyLogs to another layout, while they keep logging
 
-        res = list(unique_symptoms_set)
-        res.sort()
-        return res
+        1. The catalog is marked as migrating, so from then on every writer writes
+           logs to both layouts
+        2. The existing logs are copied in pages, each in a transaction so that a log
+           that's changed or deleted meanwhile isn't copied stale
+        3. The catalog is switched to the new layout (readers follow)
+        4. The logs left in the old layout are deleted
+
+        Safe to re-run if it's interrupted.
+
+        Args:
+            user (str): 'user id' document name in 'users' collection
+            layout (str): one of `models.catalog.LAYOUTS`
+            page_size (int, optional): logs copied per transaction
+
+        Returns:
+            int: number of logs copied
+        """
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout '{layout}'. Must be one of {LAYOUTS}")
+
+        old_layout = [name for name in LAYOUTS if name != layout][0]
+        catalog = self.get_catalog(user)
+        copied = 0
+        if catalog.layout != layout:
+            logger.info(f"Migrating '{user}' from '{catalog.layout}' to '{layout}'")
+            if catalog.migrating_to != layout:
+
+                def start_migration(catalog):
+                    catalog.migrating_to = layout
+
+                self._commit_with_catalog(user, start_migration, lambda batch: None)
+
+            dates = [str(day) for day in self.get_catalog(user).log_dates.dates()]
+            for chunk in _chunks(dates, page_size):
+                copied += self._copy_logs(user, chunk, old_layout, layout)
+
+            def switch_layout(catalog):
+                catalog.layout, catalog.migrating_to = layout, None
+
+            self._commit_with_catalog(
+                user, switch_layout, lambda batch: None, years=None
+            )
+
+        deleted = self._delete_layout(user, old_layout)
+        logger.info(
+            f"Migrated '{user}' to '{layout}': copied {copied} logs and deleted {deleted} old documents"  # noqa
+        )
+
+        return copied
+
+    def archive_month(self, user: str, month: str) -> int:
+        """Pack a month of a user's DailyLogs into a single compressed archive
+        document, and delete the individual logs
+
+        The archive is written in the same batch as the catalog update that marks
+        the month as archived, so readers find the logs in exactly one place. Reads
+        and writes of the month's logs go to the archive from then on.
+
+        Args:
+            user (str): 'user id' document name in 'users' collection
+            month (str): 'YYYY-MM'
+
+        Returns:
+            int: number of logs archived (0 if the month was already archived or
+            has no logs)
+        """
+        catalog = self.get_catalog(user)
+        if month in catalog.archived_months or not catalog.get_month_dates(month):
+            logger.info(f"Nothing to archive for '{user}' in {month}")
+            return 0
+
+        archived = []
+        state = {}
+
+        def mark_archived(catalog):
+            state["already_archived"] = month in catalog.archived_months
+            catalog.archived_months.add(month)
+
+        def add_writes(batch):
+            # Another process may have archived it meanwhile (then there's nothing
+            # left to pack)
+            if state["already_archived"]:
+                archived.clear()
+                return
+
+            # Read on every attempt, so logs written concurrently aren't lost
+            catalog = self._catalogs[user][0]
+            dates = catalog.get_month_dates(month)
+            refs = [
+                self._get_user_log_ref(user, date, catalog.layout) for date in dates
+            ]
+            snapshots = self._get_all(refs) if refs else {}
+            archive = MonthArchive(
+                month,
+                {
+                    date: snapshots[ref.path].to_dict()
+                    for date, ref in zip(dates, refs)
+                    if snapshots[ref.path].exists
+                },
+            )
+            batch.set(self._get_user_archive_ref(user, month), archive.to_dict())
+            for date in dates:
+                for log_ref in self._get_user_log_write_refs(user, date):
+                    batch.delete(log_ref)
+            self._archives[(user, month)] = archive
+            archived[:] = archive.dates
+
+        self._commit_with_catalog(user, mark_archived, add_writes)
+        logger.info(f"Archived {len(archived)} logs of '{user}' from {month}")
+
+        return len(archived)
+
+    def get_activity_summary(self, user: str, activity_name: str) -> dict:
+        """Get summary statistics for an activity
+
+        Counted from the dates in the user's catalog, so it's a single point read in
+        any layout (and archived logs count too). The log documents aren't counted:
+        an activity whose sets were all removed (eg by DeleteActivity) keeps its key
+        in them, but its date is dropped from the catalog
+
+        Returns: a dict of stats
+        """
+        catalog = self.get_catalog(user)
+        return {"total_count": catalog.get_activity_dates(activity_name).count()}
+
+    def get_activity_list_by_user(self, user: str) -> List[str]:
+        """Get a sorted list of the activities a user has logged
+
+        Read from the user's Catalog, so it's a single point read regardless of how
+        many logs they have
+        """
+        return self.get_catalog(user).activities
+
+    def get_symptom_list_by_user(self, user: str) -> List[str]:
+        """Get a sorted list of the symptoms a user has logged (see
+        `get_activity_list_by_user()`)"""
+        return self.get_catalog(user).symptoms
 
     def get_num_logs_by_user(self, user: str) -> int:
-        return self._get_user_dailylogs_ref(user).count().get()[0][0].value
+        """Get how many DailyLogs a user has. Read from the counter in the user's
+        Catalog, so it's a single point read (or none if the catalog was already
+        fetched) regardless of how many logs they have"""
+        return self.get_catalog(user).num_logs
+
+    def count_logs(self, user: str) -> int:
+        """Count a user's DailyLogs server side, rather than trusting the catalog's
+        counter (see `reconcile_num_logs()`). Costs a count aggregation (one per year
+        with the yearly layout), billed per index entry read
+
+        Logs packed into archives aren't in any collection, so they're counted from
+        the archived months' dates in the catalog (which are written together with
+        the archives).
+        """
+        catalog = self.get_catalog(user)
+        if catalog.layout == LAYOUT_YEARLY:
+            refs = [
+                self._get_user_dailylogs_ref(user, year, LAYOUT_YEARLY)
+                for year in self._list_years(user)
+            ]
+        else:
+            refs = [self._get_user_dailylogs_ref(user, layout=LAYOUT_FLAT)]
+
+        num_logs = sum(self._aggregate(ref.count())[0][0].value for ref in refs)
+        for month in catalog.archived_months:
+            num_logs += len(catalog.get_month_dates(month))
+
+        return num_logs
+
+    def reconcile_num_logs(self, user: str) -> int:
+        """Fix any drift between the catalog's log counter and the user's DailyLogs
+        (see `count_logs()`). The write is conditional on the catalog not having
+        changed since before the count, so a log uploaded meanwhile can't be
+        miscounted (the count is retried instead)
+
+        Returns:
+            int: the correction applied to the counter (0 if it was right)
+        """
+        for attempt in range(1, CATALOG_WRITE_ATTEMPTS + 1):
+            catalog, update_time = self._load_catalog(user)
+            num_logs = self.count_logs(user)
+            drift = num_logs - catalog.num_logs
+            if not drift:
+                return 0
+
+            logger.warning(
+                f"Log counter for '{user}' is off by {drift} ({catalog.num_logs} vs {num_logs} logs). Fixing"  # noqa
+            )
+            batch = self._db.batch()
+            batch.update(
+                self._get_user_ref(user),
+                {"num_logs": num_logs},
+                option=self._db.write_option(last_update_time=update_time),
+            )
+            try:
+                results = self._commit(batch)
+            except FailedPrecondition:
+                if attempt == CATALOG_WRITE_ATTEMPTS:
+                    raise
+                self._catalogs.pop(user, None)
+                continue
+
+            catalog.num_logs = num_logs
+            self._set_catalog(user, catalog, results[0].update_time)
+            return drift
 
     # Private methods
-    def _get_user_log_ref(self, user: str, date: str):
+    def _get_all(self, refs) -> dict:
+        """Fetch several documents in a single round trip
+
+        Returns:
+            dict: document path -> snapshot (including ones that don't exist)
+        """
+        with self._io_stats.track("reads") as op:
+            snapshots = list(self._db.get_all(refs))
+            op.docs = len(snapshots)
+
+        return {snapshot.reference.path: snapshot for snapshot in snapshots}
+
+    def _get_doc(self, ref):
+        """Fetch a single document (point read)"""
+        with self._io_stats.track("reads") as op:
+            snapshot = ref.get()
+            op.docs = 1
+
+        return snapshot
+
+    def _commit(self, batch) -> list:
+        """Commit a WriteBatch (a single round trip however many writes it holds)"""
+        with self._io_stats.track("writes") as op:
+            results = batch.commit()
+            op.docs = len(results)
+
+        return results
+
+    def _aggregate(self, aggregation_query):
+        """Run an aggregation query (eg a count) server side"""
+        with self._io_stats.track("aggregations"):
+            return aggregation_query.get()
+
+    def _get_logs_and_catalog(
+        self,
+        user: str,
+        dates: List[str],
+        with_stats: bool = False,
+        restore: JournalEntry = None,
+    ) -> dict:
+        """Fetch some of a user's logs along with their catalog (and optionally their
+        stats, or the logs a journaled delete removed), in a single round trip
+
+        Where the logs are depends on the user's layout and archived months, which
+        are only known for sure once the catalog is fetched. The catalog last seen by
+        this process is assumed, and whatever's missing is fetched in the (rare) case
+        that it changed.
+
+        Args:
+            restore (JournalEntry, optional): a delete's entry, whose deleted logs
+            are fetched into its `restore`
+
+        Returns:
+            dict: date -> log dict, or None if there's no log that day
+        """
+        user_ref, stats_ref = self._get_user_ref(user), self._get_user_stats_ref(user)
+        guessed_refs = self._get_user_log_read_refs(user, dates)
+        refs = list(_unique(guessed_refs.values())) + [user_ref]
+        if with_stats:
+            refs.append(stats_ref)
+        restore_refs = {}
+        if restore:
+            restore_refs = {
+                date: self._get_user_journal_restore_ref(user, restore.version, date)
+                for date in restore.dates
+            }
+            refs.extend(restore_refs.values())
+        snapshots = self._get_all(refs)
+        self._cache_catalog(user, snapshots[user_ref.path])
+        if with_stats:
+            snapshot = snapshots[stats_ref.path]
+            self._stats[user] = UserStats.from_dict(
+                snapshot.to_dict() if snapshot.exists else None
+            )
+        for date, ref in restore_refs.items():
+            restore.restore[date] = snapshots[ref.path].to_dict()
+
+        log_refs = self._get_user_log_read_refs(user, dates)
+        missing = [ref for ref in log_refs.values() if ref.path not in snapshots]
+        if missing:
+            logger.info(f"Layout of '{user}' changed, fetching the logs again")
+            snapshots.update(self._get_all(list(_unique(missing))))
+
+        catalog = self._catalogs[user][0]
+        res = {}
+        for date, ref in log_refs.items():
+            snapshot = snapshots[ref.path]
+            month = MonthArchive.month_of(date)
+            if month in catalog.archived_months:
+                if (user, month) not in self._archives:
+                    self._archives[(user, month)] = self._to_archive(month, snapshot)
+                res[date] = self._archives[(user, month)].get(date)
+            else:
+                res[date] = snapshot.to_dict() if snapshot.exists else None
+
+        return res
+
+    def _stream_logs(
+        self,
+        user: str,
+        layout: str,
+        catalog: Catalog = None,
+        page_size: int = 500,
+        since: str = None,
+    ):
+        """Stream a user's daily logs from a given layout (see `stream_logs()`)"""
+        if layout == LAYOUT_YEARLY:
+            # The catalog knows the years unless it's being rebuilt, in which case
+            # the partitions are listed
+            if catalog is not None and catalog.indexed and catalog.layout == layout:
+                years = catalog.years
+            else:
+                years = self._list_years(user)
+            since_year = parse_date(since).year if since else None
+            collections = [
+                self._get_user_dailylogs_ref(user, year, layout)
+                for year in years
+                if since_year is None or year >= since_year
+            ]
+        else:
+            collections = [self._get_user_dailylogs_ref(user, layout=layout)]
+
+        for collection in collections:
+            for date, log_dict in self._stream_collection(collection, page_size):
+                if since is None or date >= since:
+                    yield date, log_dict
+
+    def _stream_with_archives(self, logs, archives, since: str = None):
+        """Merge streamed logs with the logs in streamed archives, in date order"""
+        archived = (
+            (date, log_dict)
+            for archive in archives
+            for date, log_dict in archive.items()
+            if since is None or date >= since
+        )
+
+        return heapq.merge(logs, archived, key=lambda pair: pair[0])
+
+    def _stream_archives(self, user: str, page_size: int = 500, since: str = None):
+        """Stream a user's month archives in month order, without unpacking them"""
+        since_month = MonthArchive.month_of(since) if since else None
+        collection = self._get_user_ref(user).collection("Archives")
+        for month, archive_dict in self._stream_collection(collection, page_size):
+            if since_month is None or month >= since_month:
+                yield MonthArchive.from_dict(archive_dict)
+
+    def _stream_collection(self, collection, page_size: int):
+        query = collection.order_by(FieldPath.document_id())
+        last_doc = None
+        while True:
+            page = query.limit(page_size)
+            if last_doc is not None:
+                page = page.start_after(last_doc)
+
+            # Each page is fetched in full so its round trip is timed on its own
+            with self._io_stats.track("queries") as op:
+                docs = list(page.stream())
+                op.docs = len(docs)
+
+            for doc in docs:
+                yield doc.id, doc.to_dict()
+
+            logger.debug(f"Streamed a page of {len(docs)} logs from {collection.id}")
+            if len(docs) < page_size:
+                break
+            last_doc = docs[-1]
+
+    def _list_years(self, user: str) -> List[int]:
+        """List the years that have a partition (yearly layout)"""
+        with self._io_stats.track("queries") as op:
+            refs = list(self._get_user_ref(user).collection("Years").list_documents())
+            op.docs = len(refs)
+
+        return sorted(int(ref.id) for ref in refs)
+
+    def _copy_logs(
+        self, user: str, dates: List[str], from_layout: str, to_layout: str
+    ) -> int:
+        """Copy logs between layouts in a transaction, skipping ones that were
+        already written to the new layout
+
+        Returns:
+            int: number of logs copied
+        """
+        old_refs = [self._get_user_log_ref(user, date, from_layout) for date in dates]
+        new_refs = [self._get_user_log_ref(user, date, to_layout) for date in dates]
+
+        @firestore.transactional
+        def copy(transaction) -> int:
+            snapshots = {
+                snapshot.reference.path: snapshot
+                for snapshot in transaction.get_all(old_refs + new_refs)
+            }
+            n_copied = 0
+            for old_ref, new_ref in zip(old_refs, new_refs):
+                # Logs written since the migration started are in both layouts
+                if (
+                    snapshots[old_ref.path].exists
+                    and not snapshots[new_ref.path].exists
+                ):
+                    transaction.set(new_ref, snapshots[old_ref.path].to_dict())
+                    n_copied += 1
+            return n_copied
+
+        # The whole transaction (begin, reads and commit) is recorded as one write
+        with self._io_stats.track("writes") as op:
+            op.docs = copy(self._db.transaction())
+
+        logger.debug(f"Copied {op.docs} of {len(dates)} logs to '{to_layout}'")
+        return op.docs
+
+    def _delete_layout(self, user: str, layout: str) -> int:
+        """Delete every document a user has in a layout they're no longer using
+
+        Returns:
+            int: number of documents deleted
+        """
+        refs = [
+            self._get_user_log_ref(user, date, layout)
+            for date, _ in self._stream_logs(user, layout)
+        ]
+        if layout == LAYOUT_YEARLY:
+            refs += [
+                self._get_user_year_ref(user, year) for year in self._list_years(user)
+            ]
+
+        for chunk in _chunks(refs, MAX_BATCH_WRITES):
+            batch = self._db.batch()
+            for ref in chunk:
+                batch.delete(ref)
+            self._commit(batch)
+
+        return len(refs)
+
+    def _compute_derived(self, user: str):
+        """Compute a user's catalog and stats from scratch, streaming their DailyLogs
+        (and archives) once
+
+        Returns:
+            tuple: (the user document's snapshot, Catalog, UserStats), both at the
+            user's current log version
+        """
+        snapshot = self._get_doc(self._get_user_ref(user))
+        previous = Catalog.from_dict(snapshot.to_dict() if snapshot.exists else None)
+
+        catalog = Catalog(indexed=True)
+        catalog.log_version = previous.log_version
+        catalog.layout, catalog.migrating_to = previous.layout, previous.migrating_to
+        catalog.journal_head = previous.journal_head
+        stats = UserStats(previous.log_version)
+
+        archives = list(self._stream_archives(user))
+        catalog.archived_months = {archive.month for archive in archives}
+        for date, log_dict in self._stream_with_archives(
+            self._stream_logs(user, previous.layout, previous), archives
+        ):
+            stats.record_log_dict(date, log_dict)
+            catalog.record_log(DailyLog.from_dict(date, log_dict))
+
+        return snapshot, catalog, stats
+
+    def _cache_catalog(self, user: str, snapshot):
+        """Keep a fetched user document around as the user's Catalog
+
+        Archives fetched before it may be older, so they're dropped.
+        """
+        self._forget_archives(user)
+        if snapshot.exists:
+            self._set_catalog(
+                user, Catalog.from_dict(snapshot.to_dict()), snapshot.update_time
+            )
+        else:
+            # Either a brand new user or one whose logs predate catalogs (their
+            # document only exists as the parent of DailyLogs). Both get indexed
+            self._set_catalog(user, Catalog(), None)
+
+    def _set_catalog(self, user: str, catalog: Catalog, update_time):
+        self._catalogs[user] = (catalog, update_time)
+        HipLogDB._seen_catalogs[user] = catalog
+
+    def _load_catalog(self, user: str):
+        """Get the user's (Catalog, update time), fetching and/or rebuilding it if
+        needed
+
+        A user without a catalog costs a query for a single log first, as only one
+        whose logs predate catalogs needs a rebuild. A brand new user starts with an
+        empty catalog, which their first write creates.
+        """
+        if user not in self._catalogs:
+            self._cache_catalog(user, self._get_doc(self._get_user_ref(user)))
+
+        catalog, update_time = self._catalogs[user]
+        if not catalog.indexed:
+            if update_time is None and not self._has_legacy_logs(user):
+                catalog.indexed = True
+                catalog.layout = _new_user_layout(user)
+                self._new_users.add(user)
+            else:
+                self.rebuild_catalog(user)
+
+        return self._catalogs[user]
+
+    def _has_legacy_logs(self, user: str) -> bool:
+        """Whether a user without a catalog has logs (which predate catalogs, so are
+        in the flat layout)"""
+        logs_ref = self._get_user_dailylogs_ref(user, layout=LAYOUT_FLAT)
+        return next(self._stream_collection(logs_ref, 1), None) is not None
+
+    def _get_journal_head(self, user: str) -> JournalEntry:
+        """The user's latest journal entry that wasn't undone, or None
+
+        The catalog points to it, except after an undo that raced with another
+        change, which leaves undone entries to skip.
+        """
+        version = self.get_catalog(user).journal_head
+        while version:
+            snapshot = self._get_doc(self._get_user_journal_ref(user, version))
+            if not snapshot.exists:
+                # Compacted away
+                return None
+            entry = JournalEntry.from_dict(snapshot.to_dict())
+            if not entry.undone:
+                return entry
+            version = entry.previous
+
+        return None
+
+    def _commit_with_catalog(
+        self,
+        user: str,
+        update_catalog,
+        add_writes,
+        years=(),
+        journal: JournalEntry = None,
+        undoes: JournalEntry = None,
+    ):
+        """Commit log writes together with the matching catalog update
+
+        Args:
+            user (str): 'user id' document name in 'users' collection
+            update_catalog (callable): applies the change to a Catalog in place (a
+            copy of the cached one, which replaces it once committed)
+            add_writes (callable): adds the log writes to a WriteBatch
+            years (Iterable[int], optional): years whose logs changed, to update their
+            summaries (yearly layout). None for all years. Defaults to none.
+            journal (JournalEntry, optional): the change's entry, to append to the
+            user's journal as its latest
+            undoes (JournalEntry, optional): a journal entry the change reverts, to
+            mark undone
+        """
+        for attempt in range(1, CATALOG_WRITE_ATTEMPTS + 1):
+            # The change goes to a copy, so a failed commit leaves the cached catalog
+            # (shared with `_seen_catalogs`) as it's stored
+            loaded = self._load_catalog(user)
+            catalog, update_time = copy.deepcopy(loaded[0]), loaded[1]
+            update_catalog(catalog)
+            catalog.log_version += 1
+            if undoes and catalog.journal_head == undoes.version:
+                catalog.journal_head = undoes.previous
+            if journal:
+                journal.version, journal.previous = (
+                    catalog.log_version,
+                    catalog.journal_head,
+                )
+                catalog.journal_head = journal.version
+
+            # The writes read the pending catalog while they're added
+            self._catalogs[user] = (catalog, update_time)
+            try:
+                # The catalog goes first so its result is first
+                batch = self._db.batch()
+                self._write_catalog(batch, user, catalog, update_time)
+                add_writes(batch)
+                if journal:
+                    batch.create(
+                        self._get_user_journal_ref(user, journal.version),
+                        journal.to_dict(),
+                    )
+                    for date, log_dict in (journal.restore or {}).items():
+                        batch.create(
+                            self._get_user_journal_restore_ref(
+                                user, journal.version, date
+                            ),
+                            log_dict,
+                        )
+                if undoes:
+                    batch.update(
+                        self._get_user_journal_ref(user, undoes.version),
+                        {"undone": True},
+                    )
+                self._write_year_summaries(
+                    batch, user, catalog, catalog.years if years is None else years
+                )
+                for add_commit_writes in self._commit_writes:
+                    add_commit_writes(batch, user, catalog)
+                results = self._commit(batch)
+            except (AlreadyExists, FailedPrecondition):
+                if attempt == CATALOG_WRITE_ATTEMPTS:
+                    self._catalogs[user] = loaded
+                    raise
+                logger.warning(
+                    f"Catalog for '{user}' changed while writing (attempt {attempt}). Retrying"  # noqa
+                )
+                self._catalogs.pop(user, None)
+                self._forget_archives(user)
+                continue
+            except BaseException:
+                self._catalogs[user] = loaded
+                raise
+
+            self._set_catalog(user, catalog, results[0].update_time)
+            return
+
+    def _write_catalog(self, batch, user: str, catalog: Catalog, update_time):
+        """Add a conditional write of the catalog to a pending batch. It will fail if
+        the user document was created/changed since `update_time`"""
+        user_ref = self._get_user_ref(user)
+        if update_time is None:
+            batch.create(user_ref, catalog.to_dict())
+        else:
+            batch.update(
+                user_ref,
+                catalog.to_dict(),
+                option=self._db.write_option(last_update_time=update_time),
+            )
+
+    def _write_stats(self, batch, user: str, stats: UserStats, update_time):
+        """Add a conditional write of the stats to a pending batch. It will fail if
+        the stats document was created/changed since `update_time`"""
+        stats_ref = self._get_user_stats_ref(user)
+        if update_time is None:
+            batch.create(stats_ref, stats.to_dict())
+        else:
+            batch.update(
+                stats_ref,
+                stats.to_dict(),
+                option=self._db.write_option(last_update_time=update_time),
+            )
+
+    def _write_records(self, batch, user: str, records: dict, first_log: bool = False):
+        """Add a write to a pending batch that raises the user's personal records to
+        the given ones (activity name -> records), where they're higher
+
+        The maxima are applied by Firestore, so concurrent uploads can't lower each
+        other's records and the stats don't need to be read first. With the user's
+        first log, the stats are created from scratch and the records are complete,
+        so they're marked current with the schema version.
+        """
+        fields = {"records": _maximums(records)}
+        if first_log:
+            fields["schema_version"] = SCHEMA_VERSION
+        batch.set(self._get_user_stats_ref(user), fields, merge=True)
+
+    def _add_records(self, user: str, records: dict, first_log: bool):
+        """Raise the fetched stats' records to match an upload's `_write_records()`"""
+        if user not in self._stats:
+            return
+
+        stats = self._stats[user]
+        for name, activity_records in records.items():
+            stats.add_records(name, activity_records)
+        if first_log:
+            stats.schema_version = SCHEMA_VERSION
+
+    def _mark_stats_stale(self, batch, user: str):
+        """Add a write to a pending batch that flags the user's stats as stale (eg
+        deleted logs may have held records), until they're recomputed"""
+        batch.set(self._get_user_stats_ref(user), {"stale": True}, merge=True)
+        self._stats.pop(user, None)
+
+    def _write_year_summaries(self, batch, user: str, catalog: Catalog, years):
+        """Add writes of the given years' summaries to a pending batch, if the user
+        is (or is moving) on the yearly layout"""
+        if LAYOUT_YEARLY not in (catalog.layout, catalog.migrating_to):
+            return
+
+        for year in sorted(years):
+            batch.set(self._get_user_year_ref(user, year), catalog.year_summary(year))
+
+    def _write_logs(self, batch, user: str, log_dicts: dict):
+        """Add writes of some of a user's logs to a pending batch
+
+        Logs in archived months are written by rewriting their month's archive (once
+        per month). An archive whose logs are all deleted is kept, empty, so the
+        month stays archived.
+
+        Args:
+            log_dicts (dict): date -> log dict to upload, or None to delete the log
+        """
+        catalog = self._catalogs[user][0]
+        archives = {}
+        for date, log_dict in log_dicts.items():
+            month = MonthArchive.month_of(date)
+            if month in catalog.archived_months:
+                archive = archives.setdefault(month, self._get_archive(user, month))
+                if log_dict is None:
+                    archive.remove(date)
+                else:
+                    archive.set(date, log_dict)
+                continue
+
+            for log_ref in self._get_user_log_write_refs(user, date):
+                if log_dict is None:
+                    batch.delete(log_ref)
+                else:
+                    batch.set(log_ref, log_dict)
+
+        for month, archive in archives.items():
+            batch.set(self._get_user_archive_ref(user, month), archive.to_dict())
+
+    def _get_archive(self, user: str, month: str) -> MonthArchive:
+        """Get a month's archive, fetching it unless it was read with (or after) the
+        user's cached catalog"""
+        if (user, month) not in self._archives:
+            snapshot = self._get_doc(self._get_user_archive_ref(user, month))
+            self._archives[(user, month)] = self._to_archive(month, snapshot)
+
+        return self._archives[(user, month)]
+
+    def _forget_archives(self, user: str):
+        for key in [key for key in self._archives if key[0] == user]:
+            del self._archives[key]
+
+    def _to_archive(self, month: str, snapshot) -> MonthArchive:
+        if snapshot.exists:
+            return MonthArchive.from_dict(snapshot.to_dict())
+        return MonthArchive(month)
+
+    def _guess_catalog(self, user: str) -> Catalog:
+        """The user's catalog if it's been fetched, otherwise as last seen by this
+        process (or a new one)"""
+        if user in self._catalogs:
+            return self._catalogs[user][0]
+        return HipLogDB._seen_catalogs.get(user) or Catalog()
+
+    def _get_layout(self, user: str) -> str:
+        """The user's layout, per their catalog if it's been fetched, otherwise as
+        last seen by this process"""
+        return self._guess_catalog(user).layout
+
+    def _get_user_ref(self, user: str):
+        """Get reference to a user's top level document"""
+        return self._collection.document(user)
+
+    def _get_user_year_ref(self, user: str, year: int):
+        """Get reference to a year's partition document (yearly layout), which
+        holds the year's summary"""
+        return self._get_user_ref(user).collection("Years").document(str(year))
+
+    def _get_user_log_ref(self, user: str, date: str, layout: str = None):
         """Get reference to a user's single day log"""
 
-        return self._get_user_dailylogs_ref(user).document(date)
+        return self._get_user_dailylogs_ref(
+            user, parse_date(date).year, layout
+        ).document(date)
+
+    def _get_user_archive_ref(self, user: str, month: str):
+        """Get reference to a user's archive of a 'YYYY-MM' month"""
+        return self._get_user_ref(user).collection("Archives").document(month)
+
+    def _get_user_journal_ref(self, user: str, version: int = None):
+        """Get reference to a user's journal, or to the entry of a version"""
+        journal_ref = self._get_user_ref(user).collection("Journal")
+        if version is None:
+            return journal_ref
+        return journal_ref.document(JournalEntry.doc_id(version))
+
+    def _get_user_journal_restore_ref(self, user: str, version: int, date: str):
+        """Get reference to the copy of a log that the journal entry of a version
+        deleted. Each is a document of its own, as a range's logs could be more than
+        a document holds"""
+        return (
+            self._get_user_journal_ref(user, version)
+            .collection("Restore")
+            .document(date)
+        )
+
+    def _get_user_stats_ref(self, user: str):
+        """Get reference to a user's stats document"""
+        return self._get_user_ref(user).collection("Stats").document("summary")
+
+    def _get_user_log_read_refs(self, user: str, dates: List[str]) -> dict:
+        """Get the reference each day log is read from (its month's archive if it's
+        archived, per the user's catalog or the best guess of it)
+
+        Returns:
+            dict: date -> reference
+        """
+        catalog = self._guess_catalog(user)
+        res = {}
+        for date in dates:
+            month = MonthArchive.month_of(date)
+            if month in catalog.archived_months:
+                res[date] = self._get_user_archive_ref(user, month)
+            else:
+                res[date] = self._get_user_log_ref(user, date, catalog.layout)
+
+        return res
+
+    def _get_user_log_write_refs(self, user: str, date: str) -> list:
+        """Get the references a single day log is written to, which is in both
+        layouts during a migration"""
+        catalog = self._catalogs[user][0]
+        refs = [self._get_user_log_ref(user, date, catalog.layout)]
+        if catalog.migrating_to:
+            refs.append(self._get_user_log_ref(user, date, catalog.migrating_to))
+
+        return refs
+
+    def _get_dates_in_range(self, start_date: str, end_date: str) -> List[str]:
+        """Get each date in an inclusive date range"""
+        if not (is_valid_date_format(start_date) and is_valid_date_format(end_date)):
+            raise ValueError("Invalid date provided. Must be a 'YYYY-MM-DD' string")
+
+        first, last = parse_date(start_date), parse_date(end_date)
+        n_days = (last - first).days + 1
+        if not 0 < n_days <= MAX_DATE_RANGE_DAYS:
+            raise InvalidDateRange(
+                f"Invalid date range. Must cover 1 to {MAX_DATE_RANGE_DAYS} days"
+            )
+
+        return [LogDate.from_date(first + timedelta(days=i)) for i in range(n_days)]
+
+    def _get_user_dailylogs_ref(self, user: str, year: int = None, layout: str = None):
+        """Get reference to all daily logs for a user (or for a year, with the yearly
+        layout)"""
+        if (layout or self._get_layout(user)) == LAYOUT_YEARLY:
+            return self._get_user_year_ref(user, year).collection("DailyLogs")
+        return self._get_user_ref(user).collection("DailyLogs")
+
+
+def _chunks(items: list, size: int):
+    """Split a list into consecutive chunks of at most `size` items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _patch_fields(patch: DailyLog, removed_symptoms: List[str] = ()) -> dict:
+    """The fields to merge into a stored log (with `set(..., merge=True)`) to apply
+    a patch of it (and remove some symptoms)"""
+    patch_dict = patch.to_dict()
+    fields = {"date": patch_dict["date"]}
+    for name, activity in patch_dict["activities"].items():
+        entry = {}
+        if activity["sets"]:
+            entry["sets"] = ArrayUnion(activity["sets"])
+        if activity.get("removed"):
+            entry["removed"] = ArrayUnion(activity["removed"])
+        if entry:
+            fields.setdefault("activities", {})[name] = entry
+    if patch_dict["symptoms"] or removed_symptoms:
+        fields["symptoms"] = dict(patch_dict["symptoms"])
+        fields["symptoms"].update({name: DELETE_FIELD for name in removed_symptoms})
+    for key in ["activity_notes", "symptom_notes"]:
+        if patch_dict[key] is not None:
+            fields[key] = patch_dict[key]
+
+    return fields
+
+
+def _new_user_layout(user: str) -> str:
+    """The layout a brand new user's logs go in"""
+    layout = os.environ.get("DAILYLOG_LAYOUT", LAYOUT_FLAT)
+    logger.info(f"Using the '{layout}' layout for new user '{user}'")
+    return layout
+
+
+def _is_new(catalog: Catalog) -> bool:
+    """Whether the user has never written a log, so has no stats yet"""
+    return not catalog.log_version and not catalog.log_dates.count()
+
+
+def _maximums(values: dict) -> dict:
+    """Wrap every number in a (nested) dict in a Maximum transform"""
+    return {
+        key: _maximums(value) if isinstance(value, dict) else Maximum(value)
+        for key, value in values.items()
+    }
+
 
-    def _get_user_dailylogs_ref(self, user: str):
-        """Get reference to all daily logs for a user"""
-        return self._collection.document(user).collection("DailyLogs")
+def _unique(refs):
+    """Drop repeated references (eg several dates in the same archive)"""
+    seen = set()
+    for ref in refs:
+        if ref.path not in seen:
+            seen.add(ref.path)
+            yield ref
@@ -0,0 +1,181 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import List
+import logging
+import time
+from models.supported_intents import SupportedIntents
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Response header that carries a request's I/O summary (outside of production)
+IO_STATS_HEADER = "X-HipLog-IO"
+
+# The kinds of Firestore round trips that are counted
+KINDS = ("reads", "writes", "queries", "aggregations")
+
+
+class IOBudget:
+    """The most round trips of each kind that a request is allowed to make
+
+    None means unlimited (eg for intents that deliberately page through history).
+    """
+
+    def __init__(
+        self,
+        reads: int = 0,
+        writes: int = 0,
+        queries: int = 0,
+        aggregations: int = 0,
+    ):
+        self.reads = reads
+        self.writes = writes
+        self.queries = queries
+        self.aggregations = aggregations
+
+    def __add__(self, other: IOBudget) -> IOBudget:
+        return IOBudget(
+            **{
+                kind: (
+                    None
+                    if getattr(self, kind) is None or getattr(other, kind) is None
+                    else getattr(self, kind) + getattr(other, kind)
+                )
+                for kind in KINDS
+            }
+        )
+
+    def __str__(self):
+        return ", ".join(
+            f"{kind}<={getattr(self, kind)}"
+            for kind in KINDS
+            if getattr(self, kind) is not None
+        )
+
+
+# Round trips each intent may make for a user whose catalog is up to date. Reads are
+# point reads/batched gets (a log and the catalog come back together), writes are
+# batch commits, queries are pages of query results. Keyed by intent name
+INTENT_BUDGETS = {
+    SupportedIntents.GetCommandList.name: IOBudget(),
+    SupportedIntents.GetNumLogs.name: IOBudget(reads=1),
+    SupportedIntents.GetStreak.name: IOBudget(reads=1),
+    SupportedIntents.GetActivityList.name: IOBudget(reads=1),
+    SupportedIntents.GetSymptomList.name: IOBudget(reads=1),
+    # The catalog holds the symptom's severities
+    SupportedIntents.GetSymptomTrend.name: IOBudget(reads=1),
+    SupportedIntents.GetDailyLog.name: IOBudget(reads=1),
+    SupportedIntents.LogActivity.name: IOBudget(reads=1, writes=1),
+    SupportedIntents.LogSymptom.name: IOBudget(reads=1, writes=1),
+    SupportedIntents.UndoLastSet.name: IOBudget(reads=1, writes=1),
+    SupportedIntents.EditSet.name: IOBudget(reads=1, writes=1),
+    SupportedIntents.DeleteActivity.name: IOBudget(reads=1, writes=1),
+    # The catalog, the journal entry it points to, and the log the entry changed
+    SupportedIntents.UndoLastChange.name: IOBudget(reads=3, writes=1),
+    SupportedIntents.DeleteDailyLog.name: IOBudget(reads=1, writes=1),
+    # Counted from the catalog's dates
+    SupportedIntents.GetActivitySummary.name: IOBudget(reads=1),
+    # Streams the history whenever the log version changed
+    SupportedIntents.GetCorrelations.name: IOBudget(reads=1, queries=None),
+}
+
+# Added to an intent's budget for a user without a catalog yet (eg a new one): a query
+# for a single log, to tell whether their logs predate catalogs (see
+# `HipLogDB._load_catalog()`)
+NEW_USER_BUDGET = IOBudget(queries=1)
+
+# Spent on top of the intent's budget by the webhook's admission of a request, which
+# now and then syncs the sender's request count across instances in a single write
+# (see `services.rate_limit`). It happens before the executor, so outside its IOStats
+ADMISSION_BUDGET = IOBudget(writes=1)
+
+
+class IOStats:
+    """Counts and times the Firestore round trips made while handling a request
+
+    Each round trip is recorded with `track()`, along with the number of documents
+    it read or wrote, so a request that quietly scales with the user's history shows
+    up as many queries or documents.
+    """
+
+    # Initialization
+    def __init__(self):
+        self.reset()
+
+    def __str__(self):
+        """Print method for IOStats
+
+        Sample to demonstrate format:
+        "reads=1 (2 docs), writes=1 (2 docs), queries=0, aggregations=0, 23.4 ms"
+        """
+        parts = []
+        for kind in KINDS:
+            part = f"{kind}={self._rpcs[kind]}"
+            if self._docs[kind]:
+                part += f" ({self._docs[kind]} docs)"
+            parts.append(part)
+        parts.append(f"{self.elapsed * 1000:.1f} ms")
+
+        return ", ".join(parts)
+
+    # Properties
+    @property
+    def elapsed(self) -> float:
+        """Total seconds spent waiting on Firestore"""
+        return sum(self._seconds.values())
+
+    @property
+    def num_rpcs(self) -> int:
+        return sum(self._rpcs.values())
+
+    # Public Methods
+    def reset(self):
+        self._rpcs = dict.fromkeys(KINDS, 0)
+        self._docs = dict.fromkeys(KINDS, 0)
+        self._seconds = dict.fromkeys(KINDS, 0.0)
+
+    def rpcs(self, kind: str) -> int:
+        return self._rpcs[kind]
+
+    def docs(self, kind: str) -> int:
+        return self._docs[kind]
+
+    @contextmanager
+    def track(self, kind: str):
+        """Record a single round trip of a given kind around the block
+
+        Yields:
+            _Op: set its `docs` attribute to the number of documents involved
+        """
+        op = _Op()
+        start = time.perf_counter()
+        try:
+            yield op
+        finally:
+            seconds = time.perf_counter() - start
+            self._rpcs[kind] += 1
+            self._docs[kind] += op.docs
+            self._seconds[kind] += seconds
+            # Process-wide totals across requests (see `services.metrics`)
+            metrics.FIRESTORE_RPCS.inc(kind)
+            metrics.FIRESTORE_DOCS.inc(kind, amount=op.docs)
+            metrics.FIRESTORE_SECONDS.observe(seconds, kind)
+
+    def over_budget(self, budget: IOBudget) -> List[str]:
+        """List how the recorded round trips exceed a budget
+
+        Returns:
+            List[str]: eg ["reads 3 > 1"], empty if within budget
+        """
+        res = []
+        for kind in KINDS:
+            limit = getattr(budget, kind)
+            if limit is not None and self._rpcs[kind] > limit:
+                res.append(f"{kind} {self._rpcs[kind]} > {limit}")
+
+        return res
+
+
+class _Op:
+    def __init__(self):
+        self.docs = 0
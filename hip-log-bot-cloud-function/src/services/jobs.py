@@ -0,0 +1,698 @@
+from __future__ import annotations
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import date
+from typing import Callable, Dict
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1.base_query import FieldFilter
+from services.archiver import DEFAULT_MIN_AGE_MONTHS, archive_user
+from services.hiplogdb import HipLogDB
+from utils import scoped_collection_name
+
+logger = logging.getLogger(__name__)
+
+# Job kinds
+REBUILD_CATALOG = "rebuild_catalog"
+ARCHIVE_LOGS = "archive_logs"
+RECOMPUTE_STATS = "recompute_stats"
+RECONCILE_NUM_LOGS = "reconcile_num_logs"
+COMPACT_JOURNAL = "compact_journal"
+
+# Job statuses
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+
+# Attempts before a failing job is given up on (marked dead)
+MAX_ATTEMPTS = 5
+
+# Seconds before the first retry, doubled for every further attempt, up to the max
+RETRY_BACKOFF_SECONDS = 2.0
+MAX_RETRY_BACKOFF_SECONDS = 300.0
+
+# A running job that hasn't finished after this long is assumed to belong to a
+# worker that died, and is handed out again
+LEASE_SECONDS = 600.0
+
+# Jobs run concurrently by a worker
+DEFAULT_MAX_WORKERS = 4
+
+# Firestore collection of the shared queue (see `FirestoreJobQueue`), per database
+# instance (see `utils.scoped_collection_name()`)
+JOBS_COLLECTION = "Jobs"
+
+# Due jobs fetched per claim from the Firestore queue, so a worker that loses the
+# first to another can take the next
+CLAIM_CANDIDATES = 10
+
+# A user's log counter is checked against their logs once every this many writes
+# (see `reconcile_num_logs()`)
+RECONCILE_EVERY_WRITES = 100
+
+# A user's journal is compacted once every this many writes (see
+# `compact_journal()`)
+COMPACT_JOURNAL_EVERY_WRITES = 100
+
+
+class Job:
+    """A unit of background work for a single user"""
+
+    # Initialization
+    def __init__(
+        self,
+        kind: str,
+        user: str,
+        payload: dict = None,
+        id: int = None,
+        status: str = PENDING,
+        attempts: int = 0,
+        not_before: float = 0.0,
+        last_error: str = None,
+        queued: float = None,
+    ):
+        self.kind = kind
+        self.user = user
+        self.payload = payload or {}
+        self.id = id
+        self.status = status
+        self.attempts = attempts
+        self.not_before = not_before
+        self.last_error = last_error
+        self.queued = queued
+
+    def __str__(self):
+        return f"{self.kind} job {self.id} for '{self.user}' (attempt {self.attempts})"
+
+    # Public Methods
+    def retry_delay(self) -> float:
+        """Seconds to wait before retrying after the current attempt failed"""
+        delay = RETRY_BACKOFF_SECONDS * 2 ** (self.attempts - 1)
+        return min(delay, MAX_RETRY_BACKOFF_SECONDS)
+
+
+class JobQueue:
+    """Base class for queues of background jobs: maintenance work that mustn't run
+    on the webhook's latency path (see `HANDLERS`)
+
+    Jobs are queued per kind and user, ignoring one that's already pending, so a
+    burst of requests from a user leads to a single run. Failed jobs are retried
+    with exponential backoff. Subclasses store the jobs.
+    """
+
+    # Public Methods
+    def enqueue(self, kind: str, user: str, payload: dict = None, batch=None) -> bool:
+        """Queue a job, unless the same kind of job is already pending for the user
+
+        Args:
+            kind (str): the job kind (see `HANDLERS`)
+            user (str): the user it's for
+            payload (dict, optional): the job's parameters
+            batch (WriteBatch, optional): a pending Firestore batch to add the job
+            to (eg the change that makes it due), so queueing costs no round trip of
+            its own. Queues kept outside of Firestore ignore it
+
+        Returns:
+            bool: True if queued, False if it was a duplicate
+        """
+        queued = self._insert(Job(kind, user, payload, queued=time.time()), batch)
+        logger.info(
+            f"{'Queued' if queued else 'Already pending:'} {kind} job for '{user}'"
+        )
+        return queued
+
+    def claim(self, now: float = None) -> Job:
+        """Take the next job that's due (or None), marking it as running"""
+        raise NotImplementedError
+
+    def complete(self, job: Job):
+        job.status = DONE
+        self._save(job)
+
+    def fail(self, job: Job, error: str, now: float = None) -> bool:
+        """Record a failed attempt, scheduling a retry unless it was the last
+
+        Returns:
+            bool: True if it'll be retried
+        """
+        job.last_error = error
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = DEAD
+            logger.error(f"Giving up on {job} after {job.attempts} attempts: {error}")
+        else:
+            job.status = PENDING
+            job.not_before = (now or time.time()) + job.retry_delay()
+        self._save(job)
+
+        return job.status == PENDING
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs by status"""
+        raise NotImplementedError
+
+    # Private methods
+    def _insert(self, job: Job, batch=None) -> bool:
+        raise NotImplementedError
+
+    def _save(self, job: Job):
+        raise NotImplementedError
+
+
+class MemoryJobQueue(JobQueue):
+    """A queue in this process's memory (lost when the instance goes away), run by
+    a background thread (see `drain_in_background()`). For local runs and tests.
+    Finished jobs aren't kept"""
+
+    # Initialization
+    def __init__(self):
+        self._jobs: Dict[int, Job] = {}
+        self._lock = threading.Lock()
+        self._started = {}
+        self._next_id = 1
+
+    # Public Methods
+    def claim(self, now: float = None) -> Job:
+        now = now or time.time()
+        with self._lock:
+            for job in self._jobs.values():
+                expired = (
+                    job.status == RUNNING
+                    and self._started[job.id] + LEASE_SECONDS <= now
+                )
+                if (job.status == PENDING and job.not_before <= now) or expired:
+                    job.status = RUNNING
+                    job.attempts += 1
+                    self._started[job.id] = now
+                    return _copy(job)
+
+        return None
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return _count(job.status for job in self._jobs.values())
+
+    # Private methods
+    def _insert(self, job: Job, batch=None) -> bool:
+        with self._lock:
+            if self._find_pending(job):
+                return False
+            job.id = self._next_id
+            self._next_id += 1
+            self._jobs[job.id] = _copy(job)
+            return True
+
+    def _save(self, job: Job):
+        with self._lock:
+            if job.status == PENDING and self._find_pending(job):
+                # A new job for the same user was queued while this one ran, and
+                # covers the retry
+                logger.info(f"Dropping retry of {job}, an identical job is pending")
+                job.status = DONE
+            if job.status == DONE:
+                self._jobs.pop(job.id, None)
+                self._started.pop(job.id, None)
+            else:
+                self._jobs[job.id] = _copy(job)
+
+    def _find_pending(self, job: Job) -> Job:
+        for other in self._jobs.values():
+            if (other.kind, other.user, other.status) == (job.kind, job.user, PENDING):
+                return other
+        return None
+
+
+class SQLiteJobQueue(JobQueue):
+    """A queue in a SQLite file, so jobs survive restarts and can be run by a worker
+    in another process"""
+
+    # Initialization
+    def __init__(self, path: str):
+        self.path = path
+        with self._connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    user TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    not_before REAL NOT NULL DEFAULT 0,
+                    started REAL,
+                    last_error TEXT
+                );
+                -- At most one pending job per kind and user
+                CREATE UNIQUE INDEX IF NOT EXISTS pending_jobs
+                    ON jobs (kind, user) WHERE status = 'pending';
+                """)
+
+    # Public Methods
+    def claim(self, now: float = None) -> Job:
+        now = now or time.time()
+        with self._connection() as conn:
+            # Take the write lock up front so two workers can't claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """
+                SELECT * FROM jobs
+                WHERE (status = ? AND not_before <= ?) OR (status = ? AND started <= ?)
+                ORDER BY not_before, id LIMIT 1
+                """,
+                (PENDING, now, RUNNING, now - LEASE_SECONDS),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, started = ? "
+                "WHERE id = ?",
+                (RUNNING, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+
+        job = _row_to_job(row)
+        job.status = RUNNING
+        job.attempts += 1
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        with self._connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            return {status: n for status, n in rows}
+
+    # Private methods
+    @contextmanager
+    def _connection(self):
+        """A connection in autocommit mode, closed afterwards"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _insert(self, job: Job, batch=None) -> bool:
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs (kind, user, payload, status) "
+                "VALUES (?, ?, ?, ?)",
+                (job.kind, job.user, json.dumps(job.payload), PENDING),
+            )
+            job.id = cursor.lastrowid
+            return cursor.rowcount == 1
+
+    def _save(self, job: Job):
+        with self._connection() as conn:
+            try:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, not_before = ?, last_error = ? "
+                    "WHERE id = ?",
+                    (job.status, job.not_before, job.last_error, job.id),
+                )
+            except sqlite3.IntegrityError:
+                # A new job for the same user was queued while this one ran, and
+                # covers the retry
+                logger.info(f"Dropping retry of {job}, an identical job is pending")
+                conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (DONE, job.id))
+
+
+class FirestoreJobQueue(JobQueue):
+    """A queue in a Firestore collection, shared by every instance: the webhook
+    queues jobs and `run_jobs` runs them, and they outlive the instance that queued
+    them. Finished jobs aren't kept
+
+    A pending job's document is named after its kind and user, so queueing is a
+    single create, which fails for a duplicate (or a write in the batch of the
+    change that makes the job due, see `JobQueue.enqueue()`). Claiming moves the job
+    to a document of its own, which frees the name for the next change. Unfinished
+    jobs have a `due` time (when they may run, or when their lease runs out), so the
+    due ones are found with a range query on it, oldest first (an index on `due`,
+    `queued`).
+    """
+
+    # Initialization
+    def __init__(self, collection: str = None):
+        self.collection = collection or scoped_collection_name(JOBS_COLLECTION)
+
+    # Public Methods
+    def claim(self, now: float = None) -> Job:
+        now = now or time.time()
+        query = (
+            self._jobs_ref()
+            .where(filter=FieldFilter("due", "<=", now))
+            .order_by("due")
+            .order_by("queued")
+            .limit(CLAIM_CANDIDATES)
+        )
+        for snapshot in query.stream():
+            job = _doc_to_job(snapshot.id, snapshot.to_dict())
+            expired = job.status == RUNNING
+            job.status = RUNNING
+            job.attempts += 1
+            fields = _job_to_doc(job, started=now, due=now + LEASE_SECONDS)
+
+            # Conditional on the job being as it was read, so only one worker
+            # claims it
+            db = firestore.client()
+            option = db.write_option(last_update_time=snapshot.update_time)
+            batch = db.batch()
+            if expired:
+                claimed_ref = snapshot.reference
+                batch.update(claimed_ref, fields, option=option)
+            else:
+                claimed_ref = self._jobs_ref().document()
+                batch.delete(snapshot.reference, option=option)
+                batch.create(claimed_ref, fields)
+            try:
+                batch.commit()
+            except (FailedPrecondition, NotFound):
+                logger.info(f"{job} was claimed by another worker")
+                continue
+
+            job.id = claimed_ref.id
+            return job
+
+        return None
+
+    def counts(self) -> Dict[str, int]:
+        res = {}
+        for status in (PENDING, RUNNING, DEAD):
+            query = self._jobs_ref().where(filter=FieldFilter("status", "==", status))
+            n = query.count().get()[0][0].value
+            if n:
+                res[status] = n
+
+        return res
+
+    # Private methods
+    def _jobs_ref(self):
+        return firestore.client().collection(self.collection)
+
+    def _pending_ref(self, job: Job):
+        return self._jobs_ref().document(f"{job.kind}:{job.user}")
+
+    def _insert(self, job: Job, batch=None) -> bool:
+        ref = self._pending_ref(job)
+        doc = _job_to_doc(job, due=job.not_before)
+        if batch is not None:
+            # A create would fail the whole batch for a duplicate, so a pending job
+            # is replaced instead (the new one covers it)
+            batch.set(ref, doc)
+            job.id = ref.id
+            return True
+
+        try:
+            ref.create(doc)
+        except AlreadyExists:
+            return False
+
+        job.id = ref.id
+        return True
+
+    def _save(self, job: Job):
+        ref = self._jobs_ref().document(job.id)
+        if job.status == DONE:
+            ref.delete()
+        elif job.status == DEAD:
+            # Kept for inspection, without a due time so it's never claimed again
+            ref.set(_job_to_doc(job))
+        else:
+            pending_ref = self._pending_ref(job)
+            batch = firestore.client().batch()
+            batch.create(pending_ref, _job_to_doc(job, due=job.not_before))
+            batch.delete(ref)
+            try:
+                batch.commit()
+                job.id = pending_ref.id
+            except AlreadyExists:
+                # A new job for the same user was queued while this one ran, and
+                # covers the retry
+                logger.info(f"Dropping retry of {job}, an identical job is pending")
+                job.status = DONE
+                ref.delete()
+
+
+class JobMetrics:
+    """Progress and outcome counts of a worker's jobs, with time spent per kind"""
+
+    # Initialization
+    def __init__(self):
+        self.succeeded = 0
+        self.retried = 0
+        self.dead = 0
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        """Sample to demonstrate format:
+        "3 succeeded, 1 retried, 0 dead (archive_logs: 2 in 1.2s, ...)"
+        """
+        kinds = ", ".join(
+            f"{kind}: {n} in {seconds:.1f}s"
+            for kind, (n, seconds) in sorted(self.seconds.items())
+        )
+        return (
+            f"{self.succeeded} succeeded, {self.retried} retried, {self.dead} dead"
+            + (f" ({kinds})" if kinds else "")
+        )
+
+    # Properties
+    @property
+    def finished(self) -> int:
+        return self.succeeded + self.dead
+
+    # Public Methods
+    def record(self, job: Job, seconds: float, succeeded: bool, retrying: bool):
+        with self._lock:
+            n, total = self.seconds.get(job.kind, (0, 0.0))
+            self.seconds[job.kind] = (n + 1, total + seconds)
+            if succeeded:
+                self.succeeded += 1
+            elif retrying:
+                self.retried += 1
+            else:
+                self.dead += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "dead": self.dead,
+            "seconds": {kind: total for kind, (_, total) in self.seconds.items()},
+        }
+
+
+class JobWorker:
+    """Runs queued jobs on a bounded thread pool"""
+
+    # Initialization
+    def __init__(
+        self,
+        queue: JobQueue,
+        handlers: Dict[str, Callable[[Job], None]] = None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ):
+        """
+        Args:
+            queue (JobQueue): where the jobs come from
+            handlers (dict, optional): job kind -> function that runs a job. Defaults
+            to `HANDLERS`.
+            max_workers (int, optional): most jobs run at once
+        """
+        self.queue = queue
+        self.handlers = handlers or HANDLERS
+        self.max_workers = max_workers
+        self.metrics = JobMetrics()
+
+    # Public Methods
+    def run(self, max_seconds: float = None) -> JobMetrics:
+        """Run jobs until none are due (or the time's up), then return the metrics.
+        Jobs waiting on a retry backoff are left for a later run"""
+        deadline = time.time() + max_seconds if max_seconds else None
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            running = set()
+            while True:
+                out_of_time = deadline is not None and time.time() >= deadline
+                while not out_of_time and len(running) < self.max_workers:
+                    job = self.queue.claim()
+                    if job is None:
+                        break
+                    running.add(pool.submit(self._run_job, job))
+
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                logger.info(f"Jobs: {self.metrics} ({len(running)} running)")
+
+        logger.info(f"Worker finished: {self.metrics}. Queue: {self.queue.counts()}")
+        return self.metrics
+
+    # Private methods
+    def _run_job(self, job: Job):
+        start = time.perf_counter()
+        try:
+            handler = self.handlers[job.kind]
+            logger.info(f"Running {job}")
+            handler(job)
+        except Exception as e:
+            logger.warning(f"{job} failed: {e!r}")
+            retrying = self.queue.fail(job, repr(e))
+            self.metrics.record(job, time.perf_counter() - start, False, retrying)
+            return
+
+        self.queue.complete(job)
+        self.metrics.record(job, time.perf_counter() - start, True, False)
+
+
+# Handlers
+def rebuild_catalog(job: Job):
+    HipLogDB().rebuild_catalog(job.user)
+
+
+def archive_logs(job: Job):
+    archive_user(
+        HipLogDB(),
+        job.user,
+        job.payload.get("min_age_months", DEFAULT_MIN_AGE_MONTHS),
+        date.fromisoformat(job.payload["today"]) if "today" in job.payload else None,
+    )
+
+
+def recompute_stats(job: Job):
+    """Recompute the user's stats document (eg personal records after a delete), so
+    the next request that needs them doesn't have to stream their history"""
+    HipLogDB().recompute_stats(job.user)
+
+
+def reconcile_num_logs(job: Job):
+    """Count the user's logs and fix their catalog's counter if it drifted"""
+    HipLogDB().reconcile_num_logs(job.user)
+
+
+def compact_journal(job: Job):
+    """Drop the user's oldest journal entries, so it stays bounded"""
+    HipLogDB().compact_journal(job.user)
+
+
+HANDLERS = {
+    REBUILD_CATALOG: rebuild_catalog,
+    ARCHIVE_LOGS: archive_logs,
+    RECOMPUTE_STATS: recompute_stats,
+    RECONCILE_NUM_LOGS: reconcile_num_logs,
+    COMPACT_JOURNAL: compact_journal,
+}
+
+
+# The process's queue
+_queue = None
+_queue_lock = threading.Lock()
+_drain_thread = None
+
+
+def get_queue() -> JobQueue:
+    """The queue per the `JOB_QUEUE` env var: unset or "firestore" for the shared
+    Firestore queue, "memory" for in-memory (eg local runs), otherwise the path of a
+    SQLite file"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            location = os.environ.get("JOB_QUEUE", "firestore")
+            if location == "firestore":
+                _queue = FirestoreJobQueue()
+            elif location == "memory":
+                _queue = MemoryJobQueue()
+            else:
+                _queue = SQLiteJobQueue(location)
+            logger.info(f"Using job queue '{location}'")
+
+        return _queue
+
+
+def drain_in_background() -> bool:
+    """Run the in-memory queue's jobs on a background thread (a no-op for a shared
+    queue, which is run by `run_jobs`)
+
+    Returns:
+        bool: True if jobs are being run in the background
+    """
+    global _drain_thread
+    queue = get_queue()
+    if not isinstance(queue, MemoryJobQueue):
+        return False
+
+    with _queue_lock:
+        if _drain_thread is None or not _drain_thread.is_alive():
+            if not queue.counts().get(PENDING):
+                return False
+            _drain_thread = threading.Thread(
+                target=JobWorker(queue).run, name="job-worker", daemon=True
+            )
+            _drain_thread.start()
+
+    return True
+
+
+# Private functions
+def _copy(job: Job) -> Job:
+    return Job(**vars(job))
+
+
+def _count(statuses) -> Dict[str, int]:
+    res = {}
+    for status in statuses:
+        res[status] = res.get(status, 0) + 1
+    return res
+
+
+def _doc_to_job(doc_id: str, doc: dict) -> Job:
+    return Job(
+        doc["kind"],
+        doc["user"],
+        doc.get("payload"),
+        id=doc_id,
+        status=doc["status"],
+        attempts=doc.get("attempts", 0),
+        not_before=doc.get("not_before", 0.0),
+        last_error=doc.get("last_error"),
+        queued=doc.get("queued"),
+    )
+
+
+def _job_to_doc(job: Job, started: float = None, due: float = None) -> dict:
+    doc = {
+        "kind": job.kind,
+        "user": job.user,
+        "payload": job.payload,
+        "status": job.status,
+        "attempts": job.attempts,
+        "not_before": job.not_before,
+        "last_error": job.last_error,
+        "queued": job.queued,
+    }
+    if started is not None:
+        doc["started"] = started
+    if due is not None:
+        doc["due"] = due
+
+    return doc
+
+
+def _row_to_job(row: sqlite3.Row) -> Job:
+    return Job(
+        row["kind"],
+        row["user"],
+        json.loads(row["payload"]),
+        id=row["id"],
+        status=row["status"],
+        attempts=row["attempts"],
+        not_before=row["not_before"],
+        last_error=row["last_error"],
+    )
@@ -0,0 +1,271 @@
+from __future__ import annotations
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+import math
+import os
+import threading
+import time
+
+# Content type of `MetricsRegistry.render()`
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Path the webhook serves the metrics on (see `main.main`)
+METRICS_PATH = "/metrics"
+
+# Histogram bucket upper bounds (seconds) for latencies, from a cached reply to a
+# catalog rebuild
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metric:
+    """Base class for a metric with values per combination of label values
+
+    Does nothing while its registry is disabled, so instrumented code costs a method
+    call and an attribute check.
+    """
+
+    type = None
+
+    # Initialization
+    def __init__(self, registry: MetricsRegistry, name: str, help: str, labels=()):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    # Public Methods
+    def samples(self) -> List[Tuple[str, dict, float]]:
+        """The metric's current (sample name, labels, value)s"""
+        with self._lock:
+            return [
+                (self.name, dict(zip(self.labels, key)), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    # Private methods
+    def _key(self, label_values: tuple) -> tuple:
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}")
+        return tuple(str(v) for v in label_values)
+
+
+class Counter(Metric):
+    """A count that only goes up (eg requests served)"""
+
+    type = "counter"
+
+    # Public Methods
+    def inc(self, *label_values, amount: float = 1):
+        if not self._registry.enabled:
+            return
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down (eg requests in flight)"""
+
+    type = "gauge"
+
+    # Public Methods
+    def set(self, value: float, *label_values):
+        if not self._registry.enabled:
+            return
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *label_values, amount: float = 1):
+        if not self._registry.enabled:
+            return
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(Metric):
+    """A distribution of observations (eg latencies), counted in buckets"""
+
+    type = "histogram"
+
+    # Initialization
+    def __init__(self, *args, buckets=LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+
+    # Public Methods
+    def observe(self, value: float, *label_values):
+        if not self._registry.enabled:
+            return
+        key = self._key(label_values)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # A count per bucket plus +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observe the seconds the block takes"""
+        if not self._registry.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self) -> List[Tuple[str, dict, float]]:
+        """Cumulative `_bucket` samples per upper bound, then `_sum` and `_count`"""
+        res = []
+        for _, labels, counts in super().samples():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                res.append(
+                    (
+                        f"{self.name}_bucket",
+                        {**labels, "le": _format(bound)},
+                        cumulative,
+                    )
+                )
+            res.append((f"{self.name}_sum", labels, counts[-1]))
+            res.append((f"{self.name}_count", labels, cumulative))
+
+        return res
+
+
+class MetricsRegistry:
+    """The process's metrics, rendered in the Prometheus text format
+
+    Disabled unless the `METRICS` env var is "on" (see `enable()`).
+    """
+
+    # Initialization
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._metrics: Dict[str, Metric] = {}
+
+    # Public Methods
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._add(Counter(self, name, help, labels))
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self._add(Gauge(self, name, help, labels))
+
+    def histogram(self, name: str, help: str, labels=(), **kwargs) -> Histogram:
+        return self._add(Histogram(self, name, help, labels, **kwargs))
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def clear(self):
+        """Reset every metric's values"""
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    # Private methods
+    def _add(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+
+# Private functions
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY = MetricsRegistry(enabled=os.environ.get("METRICS", "off") == "on")
+
+# Webhook requests
+REQUESTS = REGISTRY.counter(
+    "hiplog_requests_total",
+    "Webhook requests by intent and outcome ('ok' or the error type)",
+    ("intent", "outcome"),
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "hiplog_request_seconds", "Time to run a request's intent", ("intent",)
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "hiplog_requests_in_flight", "Webhook requests being run by this instance"
+)
+REJECTED_REQUESTS = REGISTRY.counter(
+    "hiplog_rejected_requests_total",
+    "Requests turned away before running, by reason",
+    ("reason",),
+)
+
+# Intent parsing
+INTENT_PARSE_SECONDS = REGISTRY.histogram(
+    "hiplog_intent_parse_seconds",
+    "Time to parse a Dialogflow request into an intent",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005),
+)
+INTENT_PARSE_ERRORS = REGISTRY.counter(
+    "hiplog_intent_parse_errors_total",
+    "Requests that failed to parse, by error type",
+    ("error",),
+)
+
+# Firestore
+FIRESTORE_RPCS = REGISTRY.counter(
+    "hiplog_firestore_rpcs_total", "Firestore round trips by kind", ("kind",)
+)
+FIRESTORE_DOCS = REGISTRY.counter(
+    "hiplog_firestore_docs_total",
+    "Documents read or written by Firestore round trips, by kind",
+    ("kind",),
+)
+FIRESTORE_SECONDS = REGISTRY.histogram(
+    "hiplog_firestore_rpc_seconds", "Time waiting on a Firestore round trip", ("kind",)
+)
+CATALOG_REBUILDS = REGISTRY.counter(
+    "hiplog_catalog_rebuilds_total", "Catalogs rebuilt by streaming a user's logs"
+)
+
+# In-process caches
+CACHE_LOOKUPS = REGISTRY.counter(
+    "hiplog_cache_lookups_total",
+    "In-process cache lookups by cache and result ('hit' or 'miss')",
+    ("cache", "result"),
+)
@@ -0,0 +1,190 @@
+from __future__ import annotations
+from typing import Iterable, List
+import logging
+import re
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Candidates must share at least this fraction of trigrams with the query before the
+# (more expensive) edit distance is computed
+MIN_TRIGRAM_SIMILARITY = 0.2
+
+_NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(name: str) -> str:
+    """Lowercase, and collapse punctuation/whitespace to single spaces
+
+    Example: "Push-Ups " -> "push ups"
+    """
+    return _NON_ALPHANUMERIC.sub(" ", name.lower()).strip()
+
+
+def stem(word: str) -> str:
+    """A light suffix stripper that's good enough for exercise and body part names
+    (eg pushups -> pushup, stretches -> stretch, lunging -> lung)"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("ches", "shes", "sses", "xes", "zes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us")):
+        return word[:-1]
+    if len(word) > 5 and word.endswith("ing"):
+        return word[:-3]
+    if len(word) > 4 and word.endswith("ed"):
+        return word[:-2]
+    return word
+
+
+def canonical_form(name: str) -> str:
+    """The normalized and stemmed form used to compare names"""
+    return " ".join(stem(word) for word in normalize(name).split())
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {"".join(gram) for gram in zip(padded, padded[1:], padded[2:])}
+
+
+def edit_distance(a: str, b: str, max_distance: int = None) -> int:
+    """Edit distance between two strings, counting insertions, deletions,
+    substitutions and transpositions of adjacent characters (a common typo) as 1 each
+
+    Args:
+        max_distance (int, optional): stop early and return max_distance + 1 once the
+        distance is known to exceed it
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is not None and len(a) - len(b) > max_distance:
+        return max_distance + 1
+
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i]
+        for j in range(1, len(b) + 1):
+            cost = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (a[i - 1] != b[j - 1]),
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cost = min(cost, before_previous[j - 2] + 1)
+            current.append(cost)
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        before_previous, previous = previous, current
+
+    return previous[-1]
+
+
+class NameIndex:
+    """An in-memory index over a user's activity (or symptom) names
+
+    Resolves a user-supplied name to the key it was logged under, trying in order:
+    the exact key, the normalized/stemmed form (so "pushup" finds "pushups"), and
+    finally the closest name by edit distance among those sharing enough trigrams
+    (so "puhsups" finds "pushups"). A miss costs no database round trip.
+    """
+
+    # Class level cache of built indexes: (user, kind) -> (log version, index)
+    _cache = {}
+
+    # Initialization
+    def __init__(self, names: Iterable[str]):
+        self._names = set(names)
+        self._by_canonical = {}
+        self._by_trigram = {}
+
+        for name in sorted(self._names):
+            canonical = canonical_form(name)
+            # Keep the first (sorted) name when several share a canonical form
+            self._by_canonical.setdefault(canonical, name)
+            for gram in trigrams(canonical):
+                self._by_trigram.setdefault(gram, set()).add(canonical)
+
+    # Class Methods
+    @classmethod
+    def for_catalog(cls, user: str, catalog, kind: str = "activities") -> NameIndex:
+        """Get an index over a Catalog's activity or symptom names, reusing the one
+        built for the same log version if there is one
+
+        Args:
+            kind (str): "activities" or "symptoms"
+        """
+        cached = cls._cache.get((user, kind))
+        if cached and cached[0] == catalog.log_version:
+            metrics.CACHE_LOOKUPS.inc("name_index", "hit")
+            return cached[1]
+        metrics.CACHE_LOOKUPS.inc("name_index", "miss")
+
+        index = cls(getattr(catalog, kind))
+        cls._cache[(user, kind)] = (catalog.log_version, index)
+
+        return index
+
+    # Public Methods
+    def resolve(self, query: str, fuzzy: bool = True) -> str:
+        """Find the name that a user-supplied query refers to
+
+        Args:
+            query (str): name as the user typed it
+            fuzzy (bool, optional): if False, only exact/normalized/stemmed matches
+            are returned (no edit distance). Defaults to True.
+
+        Returns:
+            str/None: the matching name or None if there's no good match
+        """
+        if query in self._names:
+            return query
+
+        canonical = canonical_form(query)
+        if canonical in self._by_canonical:
+            logger.debug(f"Resolved '{query}' by its canonical form '{canonical}'")
+            return self._by_canonical[canonical]
+
+        if not fuzzy:
+            return None
+
+        # Allow roughly 1 typo for every 4 characters
+        max_distance = max(1, len(canonical) // 4)
+        best = None
+        best_distance = max_distance + 1
+        for candidate in self._candidates(canonical):
+            distance = edit_distance(canonical, candidate, max_distance)
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+
+        if best is None:
+            logger.debug(f"No name found for '{query}'")
+            return None
+
+        logger.debug(f"Resolved '{query}' to '{best}' (edit distance {best_distance})")
+        return self._by_canonical[best]
+
+    def suggest(self, query: str, n: int = 3) -> List[str]:
+        """The names most similar to the query by trigram overlap"""
+        canonical = canonical_form(query)
+        return [self._by_canonical[c] for c in self._candidates(canonical)[:n]]
+
+    # Private methods
+    def _candidates(self, canonical: str) -> List[str]:
+        """Canonical names sharing enough trigrams with the query, most similar
+        first"""
+        query_grams = trigrams(canonical)
+        shared = {}
+        for gram in query_grams:
+            for candidate in self._by_trigram.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        scored = []
+        for candidate, n_shared in shared.items():
+            union = len(query_grams) + len(trigrams(candidate)) - n_shared
+            similarity = n_shared / union
+            if similarity >= MIN_TRIGRAM_SIMILARITY:
+                scored.append((similarity, candidate))
+
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        return [candidate for _, candidate in scored]
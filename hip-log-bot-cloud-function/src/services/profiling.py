@@ -0,0 +1,223 @@
+from __future__ import annotations
+from typing import Iterable, List
+import cProfile
+import hashlib
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from utils import get_runtime_config
+
+logger = logging.getLogger(__name__)
+
+# Functions kept per profile, by cumulative time
+DEFAULT_TOP_N = 30
+
+# Prefix of profiles emitted to the logs, so they can be picked out of a log export
+# (see scripts/aggregate_profiles.py)
+LOG_PREFIX = "Request profile: "
+
+# Only one profiler can be active at a time in a process
+_profiler_lock = threading.Lock()
+
+
+class RequestProfile:
+    """The top functions of a profiled request, tagged with the intent type and a
+    hash of the user (so profiles can be shared without user ids)
+
+    Attributes:
+        intent (str): the intent type, or None if the request didn't parse
+        user_hash (str): see `hash_user()`
+        seconds (float): wall time of the request
+        created (float): when the request ran (epoch seconds)
+        functions (List[dict]): {"function", "calls", "tottime", "cumtime"} of the top
+        functions, by cumulative time
+    """
+
+    # Initialization
+    def __init__(
+        self,
+        intent: str = None,
+        user_hash: str = None,
+        seconds: float = 0.0,
+        functions: List[dict] = None,
+        created: float = None,
+    ):
+        self.intent = intent
+        self.user_hash = user_hash
+        self.seconds = seconds
+        self.functions = functions or []
+        self.created = created or time.time()
+
+    # Class Methods
+    @classmethod
+    def from_stats(cls, stats: pstats.Stats, top_n: int = DEFAULT_TOP_N, **tags):
+        """Summarize a cProfile run's stats"""
+        functions = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in sorted(
+            stats.stats.items(), key=lambda item: item[1][3], reverse=True
+        )[:top_n]:
+            functions.append(
+                {
+                    "function": f"{_short_path(filename)}:{line}({name})",
+                    "calls": calls,
+                    "tottime": round(tottime, 6),
+                    "cumtime": round(cumtime, 6),
+                }
+            )
+
+        return cls(functions=functions, **tags)
+
+    @classmethod
+    def from_dict(cls, input_dict: dict) -> RequestProfile:
+        return cls(
+            input_dict.get("intent"),
+            input_dict.get("user_hash"),
+            input_dict.get("seconds", 0.0),
+            input_dict.get("functions"),
+            input_dict.get("created"),
+        )
+
+    # Converters/Serializers
+    def to_dict(self) -> dict:
+        return {
+            "intent": self.intent,
+            "user_hash": self.user_hash,
+            "seconds": round(self.seconds, 6),
+            "created": self.created,
+            "functions": self.functions,
+        }
+
+
+# Public functions
+def should_profile(request) -> bool:
+    """Whether to profile a request, per (first match):
+    * the `PROFILE` env var: "on" profiles every request
+    * a `"profile": true` in the request's originalDetectIntentRequest payload
+      (outside of production only, see `utils.get_runtime_config()`)
+    * the `PROFILE_SAMPLE_RATE` env var: the fraction of requests profiled at random
+    """
+    if os.environ.get("PROFILE", "off") == "on":
+        return True
+
+    if get_runtime_config()["debug_headers"] and isinstance(request, dict):
+        payload = (request.get("originalDetectIntentRequest") or {}).get("payload")
+        if isinstance(payload, dict) and payload.get("profile") is True:
+            return True
+
+    sample_rate = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def run_profiled(executor, top_n: int = DEFAULT_TOP_N) -> str:
+    """Run an Executor under cProfile and emit the request's profile (see `emit()`)
+
+    If another request is being profiled (eg on another thread) the run isn't
+    profiled.
+
+    Returns:
+        str: the executor's reply
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        return executor.run()
+
+    try:
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            res = executor.run()
+        finally:
+            profiler.disable()
+        seconds = time.perf_counter() - start
+    finally:
+        _profiler_lock.release()
+
+    intent = executor.intent
+    profile = RequestProfile.from_stats(
+        pstats.Stats(profiler),
+        top_n,
+        intent=intent.type if intent else None,
+        user_hash=hash_user(intent.user) if intent else None,
+        seconds=seconds,
+    )
+    emit(profile)
+
+    return res
+
+
+def emit(profile: RequestProfile):
+    """Append a profile to the JSON lines file at the `PROFILE_OUTPUT` env var, or
+    log it (see `LOG_PREFIX`) if unset"""
+    line = json.dumps(profile.to_dict())
+    path = os.environ.get("PROFILE_OUTPUT")
+    if path:
+        with open(path, "a") as fp:
+            fp.write(line + "\n")
+    else:
+        logger.info(f"{LOG_PREFIX}{line}")
+    logger.debug(
+        f"Profiled {profile.intent} for user {profile.user_hash} "
+        f"({profile.seconds * 1000:.1f} ms)"
+    )
+
+
+def hash_user(user: str) -> str:
+    """A short, stable hash of a user id"""
+    return hashlib.sha256(user.encode()).hexdigest()[:12]
+
+
+def read_profiles(lines: Iterable[str]) -> Iterable[RequestProfile]:
+    """Parse profiles from JSON lines (see `emit()`), or log lines with the profile
+    after `LOG_PREFIX`. Other lines are skipped"""
+    for line in lines:
+        if LOG_PREFIX in line:
+            line = line.split(LOG_PREFIX, 1)[1]
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        try:
+            yield RequestProfile.from_dict(json.loads(line))
+        except ValueError:
+            continue
+
+
+def aggregate(profiles: Iterable[RequestProfile]) -> dict:
+    """Combine profiles per intent
+
+    Returns:
+        dict: intent -> {"profiles", "seconds", "functions": function -> {"calls",
+        "tottime", "cumtime", "profiles"}}, summed over the intent's profiles
+    """
+    res = {}
+    for profile in profiles:
+        entry = res.setdefault(
+            profile.intent, {"profiles": 0, "seconds": 0.0, "functions": {}}
+        )
+        entry["profiles"] += 1
+        entry["seconds"] += profile.seconds
+        for f in profile.functions:
+            totals = entry["functions"].setdefault(
+                f["function"],
+                {"calls": 0, "tottime": 0.0, "cumtime": 0.0, "profiles": 0},
+            )
+            totals["calls"] += f["calls"]
+            totals["tottime"] += f["tottime"]
+            totals["cumtime"] += f["cumtime"]
+            totals["profiles"] += 1
+
+    return res
+
+
+# Private functions
+def _short_path(filename: str) -> str:
+    """The path from the package or source root (eg "services/hiplogdb.py")"""
+    parts = filename.replace("\\", "/").split("/")
+    for root in ("site-packages", "src"):
+        if root in parts:
+            start = len(parts) - parts[::-1].index(root)
+            return "/".join(parts[start:])
+    return "/".join(parts[-2:])
@@ -0,0 +1,340 @@
+from __future__ import annotations
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict
+import logging
+import os
+import sqlite3
+import threading
+import time
+from firebase_admin import firestore
+from google.cloud.firestore_v1.transforms import Increment
+from errors import Overloaded, RateLimited, ValidationError
+from models.intent import extract_user
+from utils import scoped_collection_name
+
+logger = logging.getLogger(__name__)
+
+# Per sender, on each instance: a burst of requests, then one every few seconds
+USER_BURST = 10
+USER_REFILL_PER_SECOND = 0.5
+
+# Per sender, across all instances (see `SharedCounter`)
+USER_REQUESTS_PER_MINUTE = 40
+WINDOW_SECONDS = 60
+
+# A counter's local increments are written to the store after this many requests or
+# seconds, whichever comes first
+SYNC_EVERY = 5
+SYNC_SECONDS = 5.0
+
+# Requests run at once on an instance
+DEFAULT_MAX_CONCURRENT = 8
+
+# Senders whose buckets are kept in memory (least recently seen are dropped)
+MAX_TRACKED_USERS = 10_000
+
+# Firestore collection of the shared request counts (see `FirestoreCounterStore`),
+# per database instance (see `utils.scoped_collection_name()`)
+COUNTS_COLLECTION = "RequestCounts"
+
+
+class TokenBucket:
+    """Allows a burst of `capacity` requests, then `refill_per_second` on average"""
+
+    __slots__ = ("capacity", "refill_per_second", "tokens", "updated")
+
+    # Initialization
+    def __init__(self, capacity: float, refill_per_second: float, now: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated = now
+
+    # Public Methods
+    def take(self, now: float) -> bool:
+        """Take a token if there's one left"""
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.refill_per_second,
+        )
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class CounterStore:
+    """Base class for stores of request counts per sender and time window, shared by
+    the instances that use the same store"""
+
+    # Public Methods
+    def add(self, key: str, window: int, n: int) -> int:
+        """Add to a sender's count in a window
+
+        Returns:
+            int: the count afterwards, including other instances' requests
+        """
+        raise NotImplementedError
+
+
+class MemoryCounterStore(CounterStore):
+    """Counts in this process's memory, so not actually shared (for a single
+    instance and tests)"""
+
+    # Initialization
+    def __init__(self):
+        self._counts: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    # Public Methods
+    def add(self, key: str, window: int, n: int) -> int:
+        with self._lock:
+            # Past windows won't be counted again
+            for old in [k for k in self._counts if k[1] < window]:
+                del self._counts[old]
+            count = self._counts[key, window] = self._counts.get((key, window), 0) + n
+            return count
+
+
+class FirestoreCounterStore(CounterStore):
+    """Counts in a Firestore collection, shared by every instance (the default)
+
+    Each sender's window is a document, raised with an `Increment` so that
+    instances syncing at once don't conflict. The write's result has the count
+    across instances, so a sync is a single round trip. Documents carry an
+    `expire_at` past their window, for a TTL policy on the collection to clear them.
+    """
+
+    # Initialization
+    def __init__(self, collection: str = None):
+        self.collection = collection or scoped_collection_name(COUNTS_COLLECTION)
+
+    # Public Methods
+    def add(self, key: str, window: int, n: int) -> int:
+        ref = firestore.client().collection(self.collection).document(f"{key}:{window}")
+        expire_at = datetime.fromtimestamp(
+            (window + 2) * WINDOW_SECONDS, tz=timezone.utc
+        )
+        result = ref.set({"count": Increment(n), "expire_at": expire_at}, merge=True)
+        # The only transform, so the only result
+        return result.transform_results[0].integer_value
+
+
+class SQLiteCounterStore(CounterStore):
+    """Counts in a SQLite file, shared by the processes that can reach it (like
+    `SQLiteJobQueue`)"""
+
+    # Initialization
+    def __init__(self, path: str):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS request_counts (
+                    key TEXT NOT NULL,
+                    window INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (key, window)
+                )
+                """)
+        finally:
+            conn.close()
+
+    # Public Methods
+    def add(self, key: str, window: int, n: int) -> int:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM request_counts WHERE window < ?", (window - 1,))
+            conn.execute(
+                "INSERT INTO request_counts (key, window, count) VALUES (?, ?, ?) "
+                "ON CONFLICT (key, window) DO UPDATE SET count = count + ?",
+                (key, window, n, n),
+            )
+            (count,) = conn.execute(
+                "SELECT count FROM request_counts WHERE key = ? AND window = ?",
+                (key, window),
+            ).fetchone()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        return count
+
+    # Private methods
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+
+class SharedCounter:
+    """A sender's requests in the current window across instances, counted locally
+    and written to the store in batches (see `SYNC_EVERY`, `SYNC_SECONDS`), so most
+    requests don't wait on the store. Between syncs other instances' requests are
+    missed, so a sender can go over the limit by a sync's worth per instance"""
+
+    __slots__ = ("window", "count", "pending", "synced")
+
+    # Initialization
+    def __init__(self, window: int, now: float):
+        self.window = window
+        self.count = 0  # As of the last sync
+        self.pending = 0
+        self.synced = now
+
+
+class RateLimiter:
+    """Per-sender rate limits: a local token bucket per sender (see `USER_BURST`,
+    `USER_REFILL_PER_SECOND`), then a per-minute count shared through a
+    `CounterStore`. Senders already over either limit are turned away without
+    touching the store"""
+
+    # Initialization
+    def __init__(
+        self,
+        store: CounterStore = None,
+        burst: float = USER_BURST,
+        refill_per_second: float = USER_REFILL_PER_SECOND,
+        requests_per_minute: int = USER_REQUESTS_PER_MINUTE,
+        clock=time.monotonic,
+        wall_clock=time.time,
+    ):
+        self.store = store or MemoryCounterStore()
+        self.burst = burst
+        self.refill_per_second = refill_per_second
+        self.requests_per_minute = requests_per_minute
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._counters: Dict[str, SharedCounter] = {}
+        self._lock = threading.Lock()
+
+    # Public Methods
+    def allow(self, user: str) -> bool:
+        """Count a request from a sender, unless it's over a limit"""
+        now = self._clock()
+        window = int(self._wall_clock() // WINDOW_SECONDS)
+        with self._lock:
+            if not self._bucket(user, now).take(now):
+                return False
+
+            counter = self._counters.get(user)
+            if counter is None or counter.window != window:
+                counter = self._counters[user] = SharedCounter(window, now)
+            if counter.count + counter.pending >= self.requests_per_minute:
+                return False
+            counter.pending += 1
+            sync = (
+                counter.pending >= SYNC_EVERY
+                or now - counter.synced >= SYNC_SECONDS
+                or counter.count == 0
+            )
+            if sync:
+                pending, counter.pending, counter.synced = counter.pending, 0, now
+
+        if sync:
+            self._sync(user, counter, pending)
+        return True
+
+    # Private methods
+    def _bucket(self, user: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            bucket = self._buckets[user] = TokenBucket(
+                self.burst, self.refill_per_second, now
+            )
+            if len(self._buckets) > MAX_TRACKED_USERS:
+                dropped, _ = self._buckets.popitem(last=False)
+                self._counters.pop(dropped, None)
+        else:
+            self._buckets.move_to_end(user)
+        return bucket
+
+    def _sync(self, user: str, counter: SharedCounter, pending: int):
+        """Write a counter's local increments to the store, and read back the count
+        across instances. If the store can't be reached, the local count is used"""
+        try:
+            count = self.store.add(user, counter.window, pending)
+        except Exception as e:
+            logger.warning(f"Couldn't sync request count of '{user}': {e!r}")
+            with self._lock:
+                counter.pending += pending
+            return
+
+        with self._lock:
+            counter.count = max(counter.count, count)
+
+
+class AdmissionControl:
+    """Decides whether the webhook takes on a request: the sender must be within
+    their rate limits (see `RateLimiter`) and the instance must have a free slot (see
+    `DEFAULT_MAX_CONCURRENT`)"""
+
+    # Initialization
+    def __init__(
+        self,
+        rate_limiter: RateLimiter = None,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+    ):
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    # Public Methods
+    @contextmanager
+    def admit(self, request: dict):
+        """Hold a slot for the request while it runs
+
+        Raises:
+            RateLimited: the sender is over their rate limit
+            Overloaded: the instance is already running `max_concurrent` requests
+        """
+        user = sender_of(request)
+        if user is not None and not self.rate_limiter.allow(user):
+            raise RateLimited(f"'{user}' is over the rate limit")
+        if not self._slots.acquire(blocking=False):
+            raise Overloaded(f"Already running {self.max_concurrent} requests")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+# Public functions
+def sender_of(request) -> str:
+    """The sender of a request (see `extract_user()`), or None if it can't be told
+    (the request is turned away later)"""
+    try:
+        return extract_user(request)
+    except (ValidationError, AttributeError, KeyError, TypeError):
+        return None
+
+
+_admission = None
+_admission_lock = threading.Lock()
+
+
+def get_admission_control() -> AdmissionControl:
+    """The instance's admission control. Request counts are shared through the store
+    per the `RATE_LIMIT_STORE` env var: unset or "firestore" for every instance,
+    "memory" for this instance only, otherwise the path of a SQLite file.
+    `MAX_CONCURRENT_REQUESTS` caps the requests run at once"""
+    global _admission
+    with _admission_lock:
+        if _admission is None:
+            location = os.environ.get("RATE_LIMIT_STORE", "firestore")
+            if location == "firestore":
+                store = FirestoreCounterStore()
+            elif location == "memory":
+                store = MemoryCounterStore()
+            else:
+                store = SQLiteCounterStore(location)
+            max_concurrent = int(
+                os.environ.get("MAX_CONCURRENT_REQUESTS", DEFAULT_MAX_CONCURRENT)
+            )
+            _admission = AdmissionControl(RateLimiter(store), max_concurrent)
+            logger.info(f"Using rate limit store '{location}'")
+
+        return _admission
@@ -0,0 +1,244 @@
+from __future__ import annotations
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterable
+import logging
+import os
+import time
+import firebase_admin
+from services.hiplogdb import HipLogDB
+
+logger = logging.getLogger(__name__)
+
+# Users listed per round trip
+DEFAULT_PAGE_SIZE = 300
+
+# Writes per second across all workers. 500 is where Firestore's "500/50/5" rule
+# starts: ramp up from there by at most 50% every 5 minutes
+DEFAULT_MAX_OPS_PER_SECOND = 500
+
+# Users handed to the pool ahead of time, per worker, so none sits idle
+USERS_QUEUED_PER_WORKER = 4
+
+# Attempts per write before it's given up on (the user then counts as failed)
+MAX_WRITE_ATTEMPTS = 5
+
+# gRPC status of a conditional write whose document changed: retrying won't help
+FAILED_PRECONDITION = 9
+
+
+class Checkpoint:
+    """The users already recomputed, kept in a file (one user per line) so that an
+    interrupted run resumes where it left off. Without a path, nothing is kept"""
+
+    # Initialization
+    def __init__(self, path: str = None):
+        self.path = path
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.done = {line.strip() for line in f if line.strip()}
+            logger.info(f"Resuming: {len(self.done)} users already recomputed")
+
+    def __contains__(self, user: str) -> bool:
+        return user in self.done
+
+    # Public Methods
+    def add(self, user: str):
+        self.done.add(user)
+        if self.path:
+            # Appended and flushed per user, so an interruption loses nothing
+            with open(self.path, "a") as f:
+                f.write(f"{user}\n")
+
+
+class RecomputeReport:
+    """Progress, outcome and throughput of a recompute run"""
+
+    # Initialization
+    def __init__(self):
+        self.users = 0
+        self.skipped = 0
+        self.failed = []
+        self.logs = 0
+        self.writes = 0
+        self._start = time.perf_counter()
+        self.seconds = 0.0
+
+    def __str__(self):
+        """Sample to demonstrate format:
+        "120 users (3 skipped, 1 failed), 9500 logs, 380 writes in 12.0s: 10.0
+        users/s, 791.7 logs/s"
+        """
+        return (
+            f"{self.users} users ({self.skipped} skipped, {len(self.failed)} failed), "
+            f"{self.logs} logs, {self.writes} writes in {self.seconds:.1f}s: "
+            f"{self.users_per_second:.1f} users/s, {self.logs_per_second:.1f} logs/s"
+        )
+
+    # Properties
+    @property
+    def users_per_second(self) -> float:
+        return self.users / self.seconds if self.seconds else 0.0
+
+    @property
+    def logs_per_second(self) -> float:
+        return self.logs / self.seconds if self.seconds else 0.0
+
+    # Public Methods
+    def record(self, result: dict):
+        """Add a user's result (see `UserRecomputer.recompute()`)"""
+        self.users += 1
+        self.logs += result["logs"]
+        self.writes += result["writes"]
+        if result["error"]:
+            self.failed.append(result["user"])
+        self.seconds = time.perf_counter() - self._start
+
+    def to_dict(self) -> dict:
+        return {
+            "users": self.users,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "logs": self.logs,
+            "writes": self.writes,
+            "seconds": self.seconds,
+            "users_per_second": self.users_per_second,
+            "logs_per_second": self.logs_per_second,
+        }
+
+
+class UserRecomputer:
+    """Recomputes users' derived data one at a time (see
+    `HipLogDB.recompute_derived()`), with one BulkWriter for all of them. There's one
+    per worker process"""
+
+    # Initialization
+    def __init__(self, max_ops_per_second: int = DEFAULT_MAX_OPS_PER_SECOND):
+        self._hiplogdb = HipLogDB()
+        self._writer = self._hiplogdb.bulk_writer(max_ops_per_second)
+        self._writer.on_write_result(self._on_write_result)
+        self._writer.on_write_error(self._on_write_error)
+        self._writes = 0
+        self._failures = []
+
+    # Public Methods
+    def recompute(self, user: str) -> dict:
+        """Recompute a user and wait for their writes
+
+        Returns:
+            dict: the user, number of logs read, number of writes and the error if
+            it failed
+        """
+        self._writes, self._failures = 0, []
+        try:
+            n_logs = self._hiplogdb.recompute_derived(user, self._writer)
+            self._writer.flush()
+        except Exception as e:
+            logger.warning(f"Recomputing '{user}' failed: {e!r}")
+            return {"user": user, "logs": 0, "writes": self._writes, "error": repr(e)}
+
+        error = None
+        if self._failures:
+            error = "; ".join(f.message for f in self._failures)
+            logger.warning(f"Writes for '{user}' failed: {error}")
+
+        return {"user": user, "logs": n_logs, "writes": self._writes, "error": error}
+
+    def close(self):
+        self._writer.close()
+
+    # Private methods
+    def _on_write_result(self, reference, result, writer):
+        self._writes += 1
+
+    def _on_write_error(self, failure, writer) -> bool:
+        """Retry transient errors. A failed precondition means the user logged
+        while being recomputed, so they have to be recomputed again anyway"""
+        if failure.code != FAILED_PRECONDITION and failure.attempts < (
+            MAX_WRITE_ATTEMPTS
+        ):
+            return True
+        self._failures.append(failure)
+        return False
+
+
+def recompute_users(
+    users: Iterable[str],
+    workers: int = 1,
+    checkpoint: Checkpoint = None,
+    max_ops_per_second: int = DEFAULT_MAX_OPS_PER_SECOND,
+) -> RecomputeReport:
+    """Recompute the derived data of many users, fanned out across a process pool
+
+    Each user's logs are streamed once, by one worker. Users are taken from `users`
+    lazily (eg straight from `HipLogDB.list_users()`), so listing overlaps with the
+    recomputing.
+
+    Args:
+        users (Iterable[str]): user ids
+        workers (int, optional): worker processes. 1 recomputes in this process.
+        Defaults to 1.
+        checkpoint (Checkpoint, optional): users in it are skipped, and users are
+        added to it as they succeed. Defaults to none.
+        max_ops_per_second (int, optional): writes per second, shared between the
+        workers
+    """
+    checkpoint = checkpoint or Checkpoint()
+    report = RecomputeReport()
+    pending = _skip_done(users, checkpoint, report)
+
+    def record(result):
+        report.record(result)
+        if not result["error"]:
+            checkpoint.add(result["user"])
+        if report.users % 100 == 0:
+            logger.info(f"Recompute: {report}")
+
+    if workers <= 1:
+        recomputer = UserRecomputer(max_ops_per_second)
+        for user in pending:
+            record(recomputer.recompute(user))
+        recomputer.close()
+    else:
+        with ProcessPoolExecutor(
+            workers,
+            initializer=_init_worker,
+            initargs=(max(1, max_ops_per_second // workers),),
+        ) as pool:
+            running = set()
+            for user in pending:
+                running.add(pool.submit(_recompute_in_worker, user))
+                if len(running) >= workers * USERS_QUEUED_PER_WORKER:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record(future.result())
+            for future in wait(running).done:
+                record(future.result())
+
+    logger.info(f"Recompute finished: {report}")
+    return report
+
+
+# The worker process's recomputer
+_recomputer = None
+
+
+def _init_worker(max_ops_per_second: int):
+    global _recomputer
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_admin.initialize_app()
+    _recomputer = UserRecomputer(max_ops_per_second)
+
+
+def _recompute_in_worker(user: str) -> dict:
+    return _recomputer.recompute(user)
+
+
+def _skip_done(users: Iterable[str], checkpoint: Checkpoint, report):
+    for user in users:
+        if user in checkpoint:
+            report.skipped += 1
+            continue
+        yield user
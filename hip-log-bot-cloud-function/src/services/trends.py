@@ -0,0 +1,364 @@
+from __future__ import annotations
+from typing import Iterable, List, Tuple
+from datetime import date as Date, timedelta
+import logging
+import math
+import numpy as np
+from models.catalog import Catalog
+from models.date_bitmap import DateBitmap
+from models.severity_series import SeveritySeries
+
+logger = logging.getLogger(__name__)
+
+# Window (in days) of a trend when no period is asked for
+DEFAULT_WINDOW_DAYS = 90
+
+# Windows up to this many days are shown day by day, up to WEEKLY_MAX_DAYS week by
+# week, and longer ones month by month
+DAILY_MAX_DAYS = 14
+WEEKLY_MAX_DAYS = 120
+
+DAILY = "daily"
+WEEKLY = "weekly"
+MONTHLY = "monthly"
+
+_HEADERS = {
+    DAILY: "By day:",
+    WEEKLY: "Weekly averages:",
+    MONTHLY: "Monthly averages:",
+}
+
+# Days in the rolling mean
+ROLLING_DAYS = 7
+
+# Weight of each day's severity in the smoothed severity (EWMA). Days without a log
+# still decay the weight of older ones
+EWMA_ALPHA = 0.2
+
+# A change point needs this many logged days on each side of it, and the mean
+# severity to shift by at least MIN_SHIFT. Anything less is noise
+MIN_SEGMENT_DAYS = 7
+MIN_SHIFT = 0.5
+MAX_CHANGE_POINTS = 3
+
+# Smallest decay^k used when filtering in blocks (see `_decay_filter()`), well
+# within float64's range so a block's weights neither overflow nor vanish
+_MIN_BLOCK_WEIGHT = 1e-150
+
+
+class ChangePoint:
+    """A day from which a symptom's mean severity shifted"""
+
+    def __init__(self, day: Date, before: float, after: float):
+        self.day = day
+        self.before = before
+        self.after = after
+
+    def __str__(self):
+        """Print method for a ChangePoint
+
+        Sample to demonstrate format:
+        "Improved from 2.1 to 0.9 around Sep. 12, 2023"
+        """
+        change = "Improved" if self.after < self.before else "Worsened"
+        return (
+            f"{change} from {self.before:.1f} to {self.after:.1f} around "
+            f"{self.day.strftime('%b. %-d, %Y')}"
+        )
+
+
+class SymptomTrend:
+    """A symptom's severity over a window of days, as a daily series with NaN for the
+    days it wasn't logged (a missing log isn't the same as a severity of 0)"""
+
+    # Initialization
+    def __init__(self, name: str, start: Date, severities: np.ndarray):
+        self._name = name
+        self._start = start
+        self._severities = severities
+
+    # Class Methods
+    @classmethod
+    def from_catalog(
+        cls, catalog: Catalog, name: str, start: Date, end: Date
+    ) -> SymptomTrend:
+        """Build the trend from the catalog's severity series, with no reads. Returns
+        None if the symptom's history isn't in the catalog (see
+        `Catalog.get_symptom_severities()`)"""
+        indexed = catalog.get_symptom_severities(name)
+        if indexed is None:
+            return None
+
+        dates, series = indexed
+        return cls(name, start, severity_array(dates, series, start, end))
+
+    @classmethod
+    def from_log_dicts(
+        cls, name: str, logs: Iterable[Tuple[str, dict]], start: Date, end: Date
+    ) -> SymptomTrend:
+        """Build the trend from (date, log dict) pairs in date order, eg from
+        `HipLogDB.stream_logs(since=start)`. Logs after `end` aren't read"""
+        severities = np.full((end - start).days + 1, np.nan)
+        for date_str, log_dict in logs:
+            day = Date.fromisoformat(date_str)
+            if day > end:
+                break
+            symptom = (log_dict.get("symptoms") or {}).get(name)
+            if symptom and day >= start:
+                severities[(day - start).days] = symptom["severity"]
+
+        return cls(name, start, severities)
+
+    # Properties
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def start(self) -> Date:
+        return self._start
+
+    @property
+    def end(self) -> Date:
+        return self._start + timedelta(days=self.num_days - 1)
+
+    @property
+    def num_days(self) -> int:
+        return len(self._severities)
+
+    @property
+    def num_logged(self) -> int:
+        return int(np.count_nonzero(~np.isnan(self._severities)))
+
+    @property
+    def severities(self) -> np.ndarray:
+        return self._severities
+
+    # Public Methods
+    def resolution(self) -> str:
+        """How finely the trend is shown for its window (DAILY, WEEKLY or MONTHLY)"""
+        if self.num_days <= DAILY_MAX_DAYS:
+            return DAILY
+        if self.num_days <= WEEKLY_MAX_DAYS:
+            return WEEKLY
+        return MONTHLY
+
+    def summary(self) -> List[str]:
+        """Describe the trend, one line per entry
+
+        Sample to demonstrate format:
+        ["Logged 40 of 90 days, 1.4 on average (1.1 lately)",
+         "Last 7 days: 1.0 on average",
+         "Improved from 2.1 to 0.9 around Sep. 12, 2023",
+         "Weekly averages:", "* Aug. 1: 2.0", ...]
+        """
+        if not self.num_logged:
+            return [f"No logs of it in these {self.num_days} days"]
+
+        lately = ewma(self._severities)[-1]
+        lines = [
+            f"Logged {self.num_logged} of {self.num_days} days, "
+            f"{np.nanmean(self._severities):.1f} on average ({lately:.1f} lately)"
+        ]
+        last_week = rolling_mean(self._severities)[-1]
+        if not np.isnan(last_week):
+            lines.append(f"Last {ROLLING_DAYS} days: {last_week:.1f} on average")
+        points = change_points(self._severities)
+        if points:
+            lines += [str(_to_change_point(self._start, p)) for p in points]
+        else:
+            lines.append("No clear change over this period")
+
+        resolution = self.resolution()
+        lines.append(_HEADERS[resolution])
+        buckets, means = downsample(self._severities, self._start, resolution)
+        precision = 0 if resolution == DAILY else 1
+        lines += [
+            f"* {bucket.strftime('%b. %-d')}: {mean:.{precision}f}"
+            for bucket, mean in zip(buckets, means)
+            if not np.isnan(mean)
+        ]
+
+        return lines
+
+
+# Public functions
+def severity_array(
+    dates: DateBitmap, series: SeveritySeries, start: Date, end: Date
+) -> np.ndarray:
+    """A symptom's daily severities from `start` to `end` (inclusive) out of its
+    catalog entries, with NaN for the days it wasn't logged. The bitmaps are
+    unpacked whole, with no per-day work in Python"""
+    n_days = (end - start).days + 1
+    logged = _bitmap_array(dates, start, n_days)
+    severities = np.zeros(n_days)
+    for i, plane in enumerate(series.planes):
+        severities += _bitmap_array(plane, start, n_days) * (1 << i)
+
+    return np.where(logged, severities, np.nan)
+
+
+def rolling_mean(x: np.ndarray, window: int = ROLLING_DAYS) -> np.ndarray:
+    """Mean of the logged severities in the trailing `window` days of each day (NaN
+    where none were logged), from cumulative sums in O(n)"""
+    logged = ~np.isnan(x)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(logged, x, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(logged)))
+    hi = np.arange(1, len(x) + 1)
+    lo = np.maximum(hi - window, 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (sums[hi] - sums[lo]) / (counts[hi] - counts[lo])
+
+
+def ewma(x: np.ndarray, alpha: float = EWMA_ALPHA) -> np.ndarray:
+    """Exponentially weighted mean of the logged severities up to each day (NaN
+    before the first log)
+
+    Each day's weight decays by (1 - alpha) a day, logged or not, and the weights of
+    the logged days are normalized, so a gap doesn't drag the mean towards 0.
+    """
+    if not 0 < alpha < 1:
+        raise ValueError(f"alpha must be between 0 and 1, got {alpha}")
+
+    logged = ~np.isnan(x)
+    decay = 1 - alpha
+    weighted = _decay_filter(alpha * np.where(logged, x, 0.0), decay)
+    weights = _decay_filter(alpha * logged, decay)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(weights > 0, weighted / weights, np.nan)
+
+
+def change_points(
+    x: np.ndarray,
+    min_segment: int = MIN_SEGMENT_DAYS,
+    min_shift: float = MIN_SHIFT,
+    max_points: int = MAX_CHANGE_POINTS,
+) -> List[Tuple[int, float, float]]:
+    """Find the days the mean severity shifted, by binary segmentation of the logged
+    days
+
+    The split of a segment that explains the most variance (the largest
+    k(n-k)/n * (mean before - mean after)^2) is found for every k at once from
+    cumulative sums. The segment with the best split is split until there's none
+    left that shifts the mean by `min_shift` with `min_segment` logs each side.
+
+    Returns:
+        List[tuple]: (day index, mean before, mean after), in date order, with the
+        means of the segments either side of each change
+    """
+    days = np.flatnonzero(~np.isnan(x))
+    values = x[days]
+
+    splits = []
+    candidates = [_best_split(values, 0, len(values), min_segment)]
+    while len(splits) < max_points:
+        candidates = [c for c in candidates if c and abs(c[2]) >= min_shift]
+        if not candidates:
+            break
+        k, _, _, lo, hi = best = max(candidates, key=lambda c: c[1])
+        candidates.remove(best)
+        splits.append(k)
+        candidates += [
+            _best_split(values, lo, k, min_segment),
+            _best_split(values, k, hi, min_segment),
+        ]
+    if not splits:
+        return []
+
+    bounds = np.array([0] + sorted(splits) + [len(values)])
+    means = np.add.reduceat(values, bounds[:-1]) / np.diff(bounds)
+    return [
+        (int(days[k]), float(means[i]), float(means[i + 1]))
+        for i, k in enumerate(bounds[1:-1])
+    ]
+
+
+def downsample(
+    x: np.ndarray, start: Date, resolution: str
+) -> Tuple[List[Date], np.ndarray]:
+    """Mean severity of each week (from Monday) or calendar month of a daily series,
+    NaN for those with no logs. DAILY leaves the series as it is
+
+    Returns:
+        tuple: (first day of each bucket within the series, means)
+    """
+    if resolution == DAILY:
+        return [start + timedelta(days=i) for i in range(len(x))], x
+
+    days = np.datetime64(start, "D") + np.arange(len(x))
+    if resolution == WEEKLY:
+        # Day 0 of datetime64 is a Thursday
+        keys = (days.astype(np.int64) + 3) // 7
+    elif resolution == MONTHLY:
+        keys = days.astype("datetime64[M]").astype(np.int64)
+    else:
+        raise ValueError(f"Unknown resolution '{resolution}'")
+
+    _, first, bucket = np.unique(keys, return_index=True, return_inverse=True)
+    logged = ~np.isnan(x)
+    sums = np.bincount(bucket, weights=np.where(logged, x, 0.0))
+    counts = np.bincount(bucket, weights=logged)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / counts
+
+    return [start + timedelta(days=int(i)) for i in first], means
+
+
+# Private functions
+def _bitmap_array(bitmap: DateBitmap, start: Date, n_days: int) -> np.ndarray:
+    """Whether each of `n_days` days from `start` is in a DateBitmap"""
+    res = np.zeros(n_days, dtype=bool)
+    stored = bitmap.to_dict()
+    if not stored["start"]:
+        return res
+
+    bits = np.unpackbits(
+        np.frombuffer(stored["bits"], dtype=np.uint8), bitorder="little"
+    ).astype(bool)
+    days = np.flatnonzero(bits) + (Date.fromisoformat(stored["start"]) - start).days
+    res[days[(days >= 0) & (days < n_days)]] = True
+
+    return res
+
+
+def _decay_filter(u: np.ndarray, decay: float) -> np.ndarray:
+    """y[t] = decay * y[t - 1] + u[t], vectorized
+
+    Within a block, y[t] = decay^t * cumsum(u / decay^t) plus what's carried in. The
+    blocks are short enough that decay^-t stays finite.
+    """
+    block = max(int(math.log(_MIN_BLOCK_WEIGHT) / math.log(decay)), 1)
+    powers = decay ** np.arange(block)
+    parts = []
+    carry = 0.0
+    for chunk in np.split(u, np.arange(block, len(u), block)):
+        p = powers[: len(chunk)]
+        parts.append(p * np.cumsum(chunk / p) + carry * decay * p)
+        carry = parts[-1][-1] if len(chunk) else carry
+
+    return np.concatenate(parts)
+
+
+def _best_split(values: np.ndarray, lo: int, hi: int, min_segment: int):
+    """The split of values[lo:hi] that explains the most variance, as (split index,
+    gain, shift in the mean, lo, hi), or None if the segment is too short"""
+    n = hi - lo
+    if n < 2 * min_segment:
+        return None
+
+    sums = np.cumsum(values[lo:hi])
+    k = np.arange(min_segment, n - min_segment + 1)
+    before = sums[k - 1] / k
+    after = (sums[-1] - sums[k - 1]) / (n - k)
+    gain = k * (n - k) / n * (before - after) ** 2
+    i = int(np.argmax(gain))
+
+    return lo + int(k[i]), float(gain[i]), float(after[i] - before[i]), lo, hi
+
+
+def _to_change_point(start: Date, point: Tuple[int, float, float]) -> ChangePoint:
+    day, before, after = point
+    return ChangePoint(start + timedelta(days=day), before, after)
@@ -0,0 +1,198 @@
+from __future__ import annotations
+from typing import Callable, Dict
+import importlib
+import logging
+import pkgutil
+import threading
+import time
+import firebase_admin
+from models.daily_log import DailyLog
+from models.intent import Intent
+from models.intent_schema import INTENT_SCHEMAS
+from models.renderers import RENDERERS
+from models.supported_intents import SupportedIntents
+from services.hiplogdb import HipLogDB
+
+logger = logging.getLogger(__name__)
+
+# Paths the webhook serves warm-ups and health checks on (see `main.main`)
+WARMUP_PATH = "/warmup"
+HEALTH_PATH = "/health"
+
+# Packages whose modules are all imported by a warm-up, so that the first request
+# doesn't pay for imports it happens to need
+PACKAGES = ("models", "services")
+
+# A health check measures Firestore's latency again once the last measure is older
+HEALTH_MAX_AGE_SECONDS = 60.0
+
+# A warm-up request is a no-op while the last complete warm-up is younger than this
+WARMUP_MIN_INTERVAL_SECONDS = 60.0
+
+# Parameters for a request of each intent, with no user data, parsed to prime the
+# intent parsing path
+SAMPLE_PARAMETERS = {
+    "LogActivity": {
+        "activity": "warmup",
+        "date": "today",
+        "reps": [1],
+        "weight": [{"amount": 1, "unit": "kg"}],
+        "duration": [],
+    },
+    "LogSymptom": {"symptom": "warmup", "severity": 0, "date": "today"},
+    "GetDailyLog": {"date": "today"},
+    "UndoLastSet": {"date": "today"},
+    "EditSet": {"activity": "warmup", "set-number": 1, "reps": [1], "date": "today"},
+    "DeleteActivity": {"activity": "warmup", "date": "today"},
+    "DeleteDailyLog": {"date": "today"},
+    "GetActivitySummary": {"activity": "warmup"},
+    "GetSymptomTrend": {"symptom": "warmup"},
+}
+
+
+class WarmState:
+    """How warm this instance is: what the last warm-up did and how long it took,
+    and Firestore's latency as last measured
+
+    Attributes:
+        warm (bool): the last warm-up completed every step
+        warmed_at (float): when the last warm-up finished (epoch seconds)
+        steps (dict): step name -> seconds, of the last warm-up
+        errors (dict): step name -> error, of the steps that failed
+        firestore_seconds (float): latency of the last Firestore read
+        firestore_checked (float): when it was measured (monotonic seconds)
+    """
+
+    # Initialization
+    def __init__(self):
+        self.started = time.monotonic()
+        self.warm = False
+        self.warmed_at = None
+        self.steps: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.firestore_seconds = None
+        self.firestore_checked = None
+
+    # Public Methods
+    def run_step(self, name: str, step: Callable):
+        """Run and time a warm-up step, recording (rather than raising) a failure"""
+        start = time.perf_counter()
+        try:
+            step()
+            self.errors.pop(name, None)
+        except Exception as e:
+            logger.warning(f"Warm-up step '{name}' failed: {e!r}")
+            self.errors[name] = repr(e)
+        self.steps[name] = time.perf_counter() - start
+
+    def check_firestore(self):
+        """Measure Firestore's latency with a read that touches no user data"""
+        self.firestore_seconds = HipLogDB().ping()
+        self.firestore_checked = time.monotonic()
+
+    # Converters/Serializers
+    def to_dict(self) -> dict:
+        return {
+            "status": "ok" if self.warm and not self.errors else "degraded",
+            "warm": self.warm,
+            "warmed_at": self.warmed_at,
+            "uptime_s": round(time.monotonic() - self.started, 3),
+            "warmup_ms": {k: round(v * 1000, 3) for k, v in self.steps.items()},
+            "firestore_ms": (
+                round(self.firestore_seconds * 1000, 3)
+                if self.firestore_seconds is not None
+                else None
+            ),
+            "errors": dict(self.errors),
+        }
+
+
+# Public functions
+def init_firebase() -> firebase_admin.App:
+    """The process's Firebase app, initializing it the first time. It's kept open for
+    the life of the instance, so its Firestore channel is reused across requests"""
+    try:
+        return firebase_admin.get_app()
+    except ValueError:
+        logger.info("Opened new Firestore app")
+        return firebase_admin.initialize_app()
+
+
+def warm_up(min_interval: float = 0.0) -> WarmState:
+    """Get the instance ready for its first request: import every module, open the
+    Firebase app and Firestore channel (with a read that touches no user data), and
+    build what's cached for the life of the process. Safe to run repeatedly
+
+    Args:
+        min_interval (float): skip the warm-up if the instance is warm and was last
+            warmed up less than this many seconds ago (so repeated requests for one
+            stay cheap)
+
+    Returns:
+        WarmState: the instance's state (see `get_state()`)
+    """
+    state = get_state()
+    with _lock:
+        if state.warm and time.time() - state.warmed_at < min_interval:
+            return state
+
+        state.run_step("imports", _import_all)
+        state.run_step("firebase", init_firebase)
+        state.run_step("firestore", state.check_firestore)
+        state.run_step("intents", _parse_samples)
+        state.run_step("responses", _build_responses)
+        state.warm = not state.errors
+        state.warmed_at = time.time()
+
+    logger.info(f"Warm-up done: {state.to_dict()}")
+    return state
+
+
+def health(max_age: float = HEALTH_MAX_AGE_SECONDS) -> dict:
+    """The instance's warm state and Firestore latency, measured again if the last
+    measure is older than `max_age` seconds (so frequent checks stay cheap)"""
+    state = get_state()
+    stale = (
+        state.firestore_checked is None
+        or time.monotonic() - state.firestore_checked > max_age
+    )
+    if stale:
+        with _lock:
+            state.run_step("firestore", state.check_firestore)
+
+    return state.to_dict()
+
+
+_state = WarmState()
+_lock = threading.Lock()
+
+
+def get_state() -> WarmState:
+    return _state
+
+
+# Private functions
+def _import_all():
+    for package_name in PACKAGES:
+        package = importlib.import_module(package_name)
+        for module in pkgutil.iter_modules(package.__path__):
+            importlib.import_module(f"{package_name}.{module.name}")
+
+
+def _parse_samples():
+    for intent_type in INTENT_SCHEMAS:
+        Intent(
+            {
+                "queryResult": {
+                    "intent": {"displayName": intent_type},
+                    "parameters": dict(SAMPLE_PARAMETERS.get(intent_type, {})),
+                }
+            }
+        )
+
+
+def _build_responses():
+    SupportedIntents.summarize()
+    log = DailyLog("2023-11-03")
+    for renderer in RENDERERS.values():
+        renderer().to_response(renderer().render_logs("Warm-up", [log]))
@@ -1,14 +1,20 @@
+import hmac
 import os
 import logging
-from datetime import datetime
+import time
+from datetime import date
+from models import log_date
+from models.log_date import LogDate
 
 
 def is_valid_date_format(date_string):
-    try:
-        datetime.strptime(date_string, "%Y-%m-%d")
-        return True
-    except ValueError:
-        return False
+    return log_date.is_valid(date_string)
+
+
+def parse_date(date_string) -> date:
+    """Parse a 'YYYY-MM-DD' date string into a date (once per process, see
+    `models.log_date`)"""
+    return LogDate.parse(date_string).date
 
 
 def get_runtime_config():
@@ -24,7 +30,77 @@ def get_runtime_config():
     else:
         log_level = logging.WARNING  # default
 
-    return {"log_level": log_level}
+    # Responses carry debugging headers (eg I/O stats) everywhere but production
+    debug_headers = runtime_env != "production"
+
+    return {"log_level": log_level, "debug_headers": debug_headers}
+
+
+def scoped_collection_name(name: str) -> str:
+    """The name of a top-level collection kept per database instance (eg prod vs
+    test), like the users' collection named by the `FIRESTORE_COLLECTION_NAME` env
+    var (eg "Jobs" becomes "UsersTestJobs" for "UsersTest")"""
+    return f"{os.environ['FIRESTORE_COLLECTION_NAME']}{name}"
+
+
+def is_ops_request(request) -> bool:
+    """Whether an HTTP request may use the operational endpoints (eg `/metrics`):
+    it must carry `Authorization: Bearer <token>` matching the `OPS_TOKEN` env var.
+    With no `OPS_TOKEN` set, no request may"""
+    token = os.environ.get("OPS_TOKEN", "")
+    scheme, _, given = request.headers.get("Authorization", "").partition(" ")
+    if not token or scheme != "Bearer":
+        return False
+    return hmac.compare_digest(given.encode(), token.encode())
+
+
+class LogRateLimiter:
+    """Caps how often a kind of message is logged, so that a flood of bad requests
+    doesn't also flood (and slow down on) the logs
+
+    At most `burst` messages per key are let through every `period` seconds. The
+    number held back is reported with the next one let through.
+    """
+
+    def __init__(self, burst: int = 5, period: float = 60.0, clock=time.monotonic):
+        self.burst = burst
+        self.period = period
+        self._clock = clock
+        self._windows = {}  # key -> [window start, count, suppressed]
+
+    def allow(self, key) -> bool:
+        """Whether a message for `key` can be logged now (counts it either way)"""
+        now = self._clock()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.period:
+            suppressed = window[2] if window else 0
+            window = self._windows[key] = [now, 0, suppressed]
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+    def take_suppressed(self, key) -> int:
+        """How many messages for `key` were held back since last asked"""
+        window = self._windows.get(key)
+        if not window:
+            return 0
+        suppressed, window[2] = window[2], 0
+        return suppressed
+
+    def log(self, logger: logging.Logger, key, msg: str, exc_info=None):
+        """Log an error for `key` unless over the limit"""
+        if not self.allow(key):
+            return
+        suppressed = self.take_suppressed(key)
+        if suppressed:
+            msg = f"{msg} ({suppressed} similar messages suppressed)"
+        logger.error(msg, exc_info=exc_info)
+
+
+# Shared by everything that logs request errors
+error_log_limiter = LogRateLimiter()
 
 
 # Constants
@@ -1,14 +1,15 @@
 import sys
-from dotenv import load_dotenv
 
 sys.path.append(
     "/Users/mkirzon/Documents/2023/230901 - Hip Log Bot/hip-log-bot-cloud-function/src"
 )
 
-import os
-import utils
-import pytest
-from firebase_admin import firestore
+import os  # noqa: E402
+import utils  # noqa: E402
+import pytest  # noqa: E402
+from firebase_admin import firestore  # noqa: E402
+from services.hiplogdb import HipLogDB  # noqa: E402
+from tests.fake_firestore import FakeClient  # noqa: E402
 
 
 @pytest.fixture()
@@ -24,4 +25,57 @@ def reset_testuser():
         print(f"Deleting doc {doc.id} => {doc.to_dict()}")
         doc.reference.delete()
 
+    # Logs in the yearly layout are under a document per year
+    years_ref = (
+        db.collection(os.environ["FIRESTORE_COLLECTION_NAME"])
+        .document(utils.test_username)
+        .collection("Years")
+    )
+    for year_ref in years_ref.list_documents():
+        for doc in year_ref.collection("DailyLogs").stream():
+            doc.reference.delete()
+        year_ref.delete()
+
+    # Packed months of old logs, and derived stats
+    for collection in ["Archives", "Stats"]:
+        for doc in (
+            db.collection(os.environ["FIRESTORE_COLLECTION_NAME"])
+            .document(utils.test_username)
+            .collection(collection)
+            .stream()
+        ):
+            doc.reference.delete()
+
+    # The journal of changes, with the logs its deletes kept in a subcollection per
+    # entry (listed by reference, as deleting an entry leaves its subcollection)
+    journal_ref = (
+        db.collection(os.environ["FIRESTORE_COLLECTION_NAME"])
+        .document(utils.test_username)
+        .collection("Journal")
+    )
+    for entry_ref in journal_ref.list_documents():
+        for doc in entry_ref.collection("Restore").stream():
+            doc.reference.delete()
+        entry_ref.delete()
+
+    # The user document holds the catalog of what's been logged
+    db.collection(os.environ["FIRESTORE_COLLECTION_NAME"]).document(
+        utils.test_username
+    ).delete()
+
     # TODO: reset any other attributes beyond DailyLogs
+
+
+@pytest.fixture()
+def fake_firestore(monkeypatch):
+    """Point anything that calls `firestore.client()` (eg HipLogDB) at an in-process
+    fake, so tests can run offline and count round trips. See fake_firestore.py"""
+    client = FakeClient()
+    monkeypatch.setattr(firestore, "client", lambda: client)
+    # Catalogs remembered from other tests' data would be wrong guesses
+    monkeypatch.setattr(HipLogDB, "_seen_catalogs", {})
+    monkeypatch.setenv(
+        "FIRESTORE_COLLECTION_NAME",
+        os.environ.get("FIRESTORE_COLLECTION_NAME", "UsersTest"),
+    )
+    return client
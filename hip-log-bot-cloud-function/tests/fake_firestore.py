@@ -0,0 +1,938 @@
+"""An in-process fake of the subset of the Firestore client API that HipLogDB uses
+
+Supports collection/document references, get/set/update/delete/create, get_all,
+queries (where, order_by, limit, start_after, stream, count), write batches,
+transactions and bulk writers, including write preconditions, the field transforms
+(Increment, ArrayUnion, ArrayRemove, DELETE_FIELD, SERVER_TIMESTAMP) and the limit on
+writes per commit.
+
+Every call that would be a round trip to Firestore is recorded as an RPC with a
+latency drawn from a configurable (seeded) distribution, and can be made to fail with
+a FaultInjector. Latency is simulated on a virtual clock by default so benchmarks are
+deterministic and fast.
+
+Usage:
+    client = FakeClient(latency=LatencyModel.lognormal(median_ms=20, sigma=0.5))
+    monkeypatch.setattr(firebase_admin.firestore, "client", lambda: client)
+"""
+
+from __future__ import annotations
+import copy
+import datetime
+import math
+import random
+import threading
+import time
+from typing import Callable, Dict, List
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import _helpers, transforms
+from google.cloud.firestore_v1.aggregation import AggregationResult
+from google.cloud.firestore_v1.field_path import FieldPath
+
+# RPC kinds, named after the Firestore API methods they stand for
+GET = "batch_get_documents"
+COMMIT = "commit"
+RUN_QUERY = "run_query"
+AGGREGATE = "run_aggregation_query"
+LIST_DOCUMENTS = "list_documents"
+BEGIN_TRANSACTION = "begin_transaction"
+ROLLBACK = "rollback"
+BATCH_WRITE = "batch_write"
+
+DOCUMENT_ID = FieldPath.document_id()
+
+# Field transforms, whose results a commit returns
+TRANSFORMS = (
+    transforms.Increment,
+    transforms.Maximum,
+    transforms.Minimum,
+    transforms.ArrayUnion,
+    transforms.ArrayRemove,
+)
+
+
+# Latency and faults
+class LatencyModel:
+    """Per-RPC latency distributions
+
+    Args:
+        default (callable): rng -> seconds, used for RPC kinds without their own
+        per_kind (dict): RPC kind -> (rng -> seconds)
+        seed (int): seed for the random number generator
+    """
+
+    def __init__(self, default: Callable = None, per_kind: dict = None, seed=0):
+        self._default = default or (lambda rng: 0.0)
+        self._per_kind = per_kind or {}
+        self._rng = random.Random(seed)
+
+    @classmethod
+    def constant(cls, ms: float, **kwargs) -> LatencyModel:
+        return cls(lambda rng: ms / 1000, **kwargs)
+
+    @classmethod
+    def uniform(cls, low_ms: float, high_ms: float, **kwargs) -> LatencyModel:
+        return cls(lambda rng: rng.uniform(low_ms, high_ms) / 1000, **kwargs)
+
+    @classmethod
+    def lognormal(cls, median_ms: float, sigma: float, **kwargs) -> LatencyModel:
+        """A long tailed distribution, which is what network latency looks like"""
+        mu = math.log(median_ms / 1000)
+        return cls(lambda rng: rng.lognormvariate(mu, sigma), **kwargs)
+
+    def sample(self, kind: str) -> float:
+        return self._per_kind.get(kind, self._default)(self._rng)
+
+
+class FaultInjector:
+    """Makes chosen RPCs fail
+
+    Example:
+        faults = FaultInjector()
+        faults.add(COMMIT, exceptions.ServiceUnavailable("down"), times=1)
+        faults.add(GET, exceptions.DeadlineExceeded("slow"), probability=0.1)
+    """
+
+    def __init__(self, seed=0):
+        self._rules = []
+        self._rng = random.Random(seed)
+
+    def add(
+        self,
+        kind: str,
+        error: Exception,
+        times: int = None,
+        probability: float = 1.0,
+        after: int = 0,
+    ):
+        """Fail RPCs of a kind
+
+        Args:
+            kind (str): RPC kind (or None for any)
+            error (Exception): raised instead of running the RPC
+            times (int, optional): stop after failing this many times
+            probability (float, optional): chance of each matching RPC failing
+            after (int, optional): let this many matching RPCs through first
+        """
+        self._rules.append(
+            {
+                "kind": kind,
+                "error": error,
+                "times": times,
+                "probability": probability,
+                "after": after,
+                "seen": 0,
+            }
+        )
+
+    def clear(self):
+        self._rules = []
+
+    def check(self, kind: str):
+        for rule in self._rules:
+            if rule["kind"] not in (None, kind):
+                continue
+            rule["seen"] += 1
+            if rule["seen"] <= rule["after"] or rule["times"] == 0:
+                continue
+            if self._rng.random() >= rule["probability"]:
+                continue
+            if rule["times"] is not None:
+                rule["times"] -= 1
+            raise rule["error"]
+
+
+class RpcCall:
+    def __init__(self, kind: str, latency: float, documents: int, error=None):
+        self.kind = kind
+        self.latency = latency
+        self.documents = documents
+        self.error = error
+
+    def __repr__(self):
+        return f"RpcCall({self.kind}, {self.latency * 1000:.1f}ms, docs={self.documents})"  # noqa
+
+
+# Client
+class FakeClient:
+    def __init__(
+        self,
+        latency: LatencyModel = None,
+        faults: FaultInjector = None,
+        sleep: bool = False,
+    ):
+        """
+        Args:
+            latency (LatencyModel, optional): defaults to no latency
+            faults (FaultInjector, optional): defaults to no faults
+            sleep (bool, optional): actually sleep for the latency rather than only
+            advancing the virtual clock. Defaults to False.
+        """
+        self.latency = latency or LatencyModel()
+        self.faults = faults or FaultInjector()
+        self.sleep = sleep
+        self.calls: List[RpcCall] = []
+        self.elapsed = 0.0
+        self._docs: Dict[str, dict] = {}
+        # Writes and scans of the documents are serialized, for callers on threads
+        self._lock = threading.RLock()
+        self._clock = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        self._next_transaction_id = 1
+
+    # References
+    def collection(self, *path) -> FakeCollectionReference:
+        return FakeCollectionReference(self, "/".join(path))
+
+    def document(self, *path) -> FakeDocumentReference:
+        return FakeDocumentReference(self, "/".join(path))
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False) -> FakeTransaction:
+        return FakeTransaction(self, max_attempts, read_only)
+
+    def bulk_writer(self, options=None) -> FakeBulkWriter:
+        return FakeBulkWriter(self, options)
+
+    def write_option(self, **kwargs):
+        if len(kwargs) != 1:
+            raise TypeError("Exactly one write option must be provided")
+        name, value = kwargs.popitem()
+        if name not in ("last_update_time", "exists"):
+            raise TypeError(f"Unknown write option: {name}")
+        return (name, value)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        self._rpc(GET, len(references))
+        if transaction is not None:
+            transaction._track_reads(references)
+        return iter([self._snapshot(ref) for ref in references])
+
+    # Stats
+    @property
+    def rpc_counts(self) -> Dict[str, int]:
+        counts = {}
+        for call in self.calls:
+            counts[call.kind] = counts.get(call.kind, 0) + 1
+        return counts
+
+    @property
+    def num_rpcs(self) -> int:
+        return len(self.calls)
+
+    def reset_stats(self):
+        self.calls = []
+        self.elapsed = 0.0
+
+    # Direct (non-RPC) access for test setup and assertions
+    def dump(self, path: str) -> dict:
+        """The stored data at a document path (None if missing)"""
+        doc = self._docs.get(path)
+        return copy.deepcopy(doc["data"]) if doc else None
+
+    def load(self, path: str, data: dict):
+        """Store a document without going through (or counting) an RPC"""
+        self._apply_writes([("set", path, data, False, None)], check=False)
+
+    # Internals
+    def _rpc(self, kind: str, documents: int = 0):
+        latency = self.latency.sample(kind)
+        self.elapsed += latency
+        if self.sleep:
+            time.sleep(latency)
+        try:
+            self.faults.check(kind)
+        except Exception as e:
+            self.calls.append(RpcCall(kind, latency, documents, e))
+            raise
+        self.calls.append(RpcCall(kind, latency, documents))
+
+    def _tick(self) -> datetime.datetime:
+        self._clock += datetime.timedelta(microseconds=1)
+        return self._clock
+
+    def _snapshot(self, ref) -> FakeDocumentSnapshot:
+        doc = self._docs.get(ref.path)
+        if doc is None:
+            return FakeDocumentSnapshot(ref, None, None, None)
+        return FakeDocumentSnapshot(
+            ref, copy.deepcopy(doc["data"]), doc["create_time"], doc["update_time"]
+        )
+
+    def _children(self, collection_path: str) -> List[str]:
+        """Paths of existing documents directly under a collection"""
+        prefix = collection_path + "/"
+        with self._lock:
+            return sorted(
+                path
+                for path in self._docs
+                if path.startswith(prefix) and "/" not in path.removeprefix(prefix)
+            )
+
+    def _apply_writes(self, writes, check=True) -> list:
+        """Validate every write's preconditions, then apply them all (atomically)"""
+        with self._lock:
+            return self._apply_writes_locked(writes, check)
+
+    def _apply_writes_locked(self, writes, check: bool) -> list:
+        if check:
+            for op, path, data, merge, option in writes:
+                self._check_precondition(op, path, option)
+
+        results = []
+        update_time = self._tick()
+        for op, path, data, merge, option in writes:
+            doc = self._docs.get(path)
+            if op == "delete":
+                self._docs.pop(path, None)
+            else:
+                if op == "update":
+                    new_data = _apply_update(copy.deepcopy(doc["data"]), data)
+                elif op == "set" and merge and doc:
+                    new_data = _apply_merge(copy.deepcopy(doc["data"]), data)
+                else:
+                    new_data = _apply_merge({}, data)
+                _resolve_server_timestamps(new_data, update_time)
+                self._docs[path] = {
+                    "data": new_data,
+                    "create_time": doc["create_time"] if doc else update_time,
+                    "update_time": update_time,
+                }
+            results.append(
+                FakeWriteResult(
+                    update_time,
+                    _transform_results(data, new_data, op) if op != "delete" else [],
+                )
+            )
+
+        return results
+
+    def _check_precondition(self, op, path, option):
+        doc = self._docs.get(path)
+        if op == "create" and doc:
+            raise exceptions.AlreadyExists(f"Document already exists: {path}")
+        if op == "update" and not doc:
+            raise exceptions.NotFound(f"No document to update: {path}")
+        if option is None:
+            return
+
+        name, value = option
+        if name == "exists" and bool(doc) != bool(value):
+            if doc:
+                raise exceptions.AlreadyExists(f"Document already exists: {path}")
+            raise exceptions.NotFound(f"No document: {path}")
+        if name == "last_update_time" and (not doc or doc["update_time"] != value):
+            raise exceptions.FailedPrecondition(
+                f"Document {path} was updated since {value}"
+            )
+
+
+class FakeWriteResult:
+    def __init__(self, update_time, transform_results=()):
+        self.update_time = update_time
+        # The transformed fields' values afterwards, as `Value`s by field path
+        self.transform_results = list(transform_results)
+
+
+# References
+class FakeDocumentReference:
+    def __init__(self, client: FakeClient, path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f"FakeDocumentReference({self.path})"
+
+    @property
+    def parent(self) -> FakeCollectionReference:
+        return FakeCollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, collection_id: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def collections(self) -> List[FakeCollectionReference]:
+        self._client._rpc(LIST_DOCUMENTS)
+        prefix = self.path + "/"
+        ids = {
+            path.removeprefix(prefix).split("/")[0]
+            for path in self._client._docs
+            if path.startswith(prefix)
+        }
+        return [self.collection(i) for i in sorted(ids)]
+
+    def get(self, field_paths=None, transaction=None) -> FakeDocumentSnapshot:
+        self._client._rpc(GET, 1)
+        if transaction is not None:
+            transaction._track_reads([self])
+        return self._client._snapshot(self)
+
+    def set(self, document_data: dict, merge=False):
+        return self._write("set", document_data, merge)
+
+    def create(self, document_data: dict):
+        return self._write("create", document_data)
+
+    def update(self, field_updates: dict, option=None):
+        return self._write("update", field_updates, option=option)
+
+    def delete(self, option=None):
+        self._client._rpc(COMMIT, 1)
+        return self._client._apply_writes([("delete", self.path, None, False, option)])[
+            0
+        ].update_time
+
+    def _write(self, op, data, merge=False, option=None):
+        self._client._rpc(COMMIT, 1)
+        return self._client._apply_writes([(op, self.path, data, merge, option)])[0]
+
+
+class FakeQuery:
+    def __init__(
+        self,
+        collection: FakeCollectionReference,
+        filters=(),
+        orders=(),
+        limit=None,
+        start_after=None,
+    ):
+        self._collection = collection
+        self._client = collection._client
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **kwargs) -> FakeQuery:
+        params = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "start_after": self._start_after,
+        }
+        params.update(kwargs)
+        return FakeQuery(self._collection, **params)
+
+    # Query building
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = (
+                filter.field_path,
+                filter.op_string,
+                filter.value,
+            )
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start_after=document_fields_or_snapshot)
+
+    def count(self, alias: str = None) -> FakeAggregationQuery:
+        return FakeAggregationQuery(self, alias)
+
+    # Execution
+    def stream(self, transaction=None):
+        snapshots = self._run()
+        self._client._rpc(RUN_QUERY, len(snapshots))
+        if transaction is not None:
+            transaction._track_reads([s.reference for s in snapshots])
+        return iter(snapshots)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+    def _run(self) -> List[FakeDocumentSnapshot]:
+        snapshots = [
+            self._client._snapshot(FakeDocumentReference(self._client, path))
+            for path in self._client._children(self._collection.path)
+        ]
+        for field_path, op_string, value in self._filters:
+            snapshots = [
+                s
+                for s in snapshots
+                if _matches(_field(s, field_path), op_string, value)
+            ]
+
+        # Documents missing an ordered field are excluded, like in Firestore
+        for field_path, _ in self._orders:
+            snapshots = [s for s in snapshots if _field(s, field_path) is not _MISSING]
+
+        orders = list(self._orders)
+        if not any(f == DOCUMENT_ID for f, _ in orders):
+            direction = orders[-1][1] if orders else "ASCENDING"
+            orders.append((DOCUMENT_ID, direction))
+
+        # Sort by each order key, least significant first (sorts are stable)
+        for field_path, direction in reversed(orders):
+            snapshots.sort(
+                key=lambda s: _sort_key(_field(s, field_path)),
+                reverse=direction == "DESCENDING",
+            )
+
+        if self._start_after is not None:
+            cursor = [
+                _sort_key(_cursor_value(self._start_after, field_path))
+                for field_path, _ in orders
+            ]
+            snapshots = [
+                s
+                for s in snapshots
+                if _after(
+                    [_sort_key(_field(s, f)) for f, _ in orders],
+                    cursor,
+                    [d for _, d in orders],
+                )
+            ]
+
+        if self._limit is not None:
+            snapshots = snapshots[: self._limit]
+
+        return snapshots
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client: FakeClient, path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+        super().__init__(self)
+
+    def __repr__(self):
+        return f"FakeCollectionReference({self.path})"
+
+    @property
+    def parent(self):
+        if "/" not in self.path:
+            return None
+        return FakeDocumentReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def document(self, document_id: str = None) -> FakeDocumentReference:
+        if document_id is None:
+            document_id = "%020x" % random.getrandbits(80)
+        return FakeDocumentReference(self._client, f"{self.path}/{document_id}")
+
+    def add(self, document_data: dict):
+        ref = self.document()
+        return ref.create(document_data).update_time, ref
+
+    def list_documents(self, page_size: int = None):
+        """Documents directly in the collection, including "missing" ones that only
+        exist as the parent of a subcollection"""
+        prefix = self.path + "/"
+        ids = sorted(
+            {
+                path.removeprefix(prefix).split("/")[0]
+                for path in self._client._docs
+                if path.startswith(prefix)
+            }
+        )
+        page_size = page_size or len(ids) or 1
+        while True:
+            page, ids = ids[:page_size], ids[page_size:]
+            self._client._rpc(LIST_DOCUMENTS, len(page))
+            for document_id in page:
+                yield self.document(document_id)
+            if not ids:
+                break
+
+
+class FakeAggregationQuery:
+    def __init__(self, query: FakeQuery, alias: str = None):
+        self._query = query
+        self._alias = alias or "field_1"
+
+    def get(self, transaction=None):
+        snapshots = self._query._run()
+        self._query._client._rpc(AGGREGATE, 0)
+        return [[AggregationResult(alias=self._alias, value=len(snapshots))]]
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data, create_time, update_time):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        value = _field(self, field_path) if field_path else self.to_dict()
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+# Writes
+class FakeWriteBatch:
+    # Firestore rejects a commit of more writes than this
+    MAX_WRITES = 500
+
+    def __init__(self, client: FakeClient):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, document_data: dict, merge=False):
+        self._writes.append(("set", reference.path, document_data, merge, None))
+        return self
+
+    def create(self, reference, document_data: dict):
+        self._writes.append(("create", reference.path, document_data, False, None))
+        return self
+
+    def update(self, reference, field_updates: dict, option=None):
+        self._writes.append(("update", reference.path, field_updates, False, option))
+        return self
+
+    def delete(self, reference, option=None):
+        self._writes.append(("delete", reference.path, None, False, option))
+        return self
+
+    def commit(self):
+        self._client._rpc(COMMIT, len(self._writes))
+        if len(self._writes) > self.MAX_WRITES:
+            raise exceptions.InvalidArgument(
+                f"maximum {self.MAX_WRITES} writes allowed per request"
+            )
+        results = self._client._apply_writes(self._writes)
+        self._writes = []
+        return results
+
+
+class FakeTransaction(FakeWriteBatch):
+    """A transaction with optimistic concurrency: commit aborts if any document read
+    in the transaction changed since it was read. Works with
+    `firestore.transactional`."""
+
+    def __init__(self, client: FakeClient, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._read_versions = {}
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    @property
+    def id(self):
+        return self._id
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, FakeDocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references):
+        return self._client.get_all(references, transaction=self)
+
+    def _track_reads(self, references):
+        for ref in references:
+            doc = self._client._docs.get(ref.path)
+            self._read_versions.setdefault(
+                ref.path, doc["update_time"] if doc else None
+            )
+
+    def _begin(self, retry_id=None):
+        self._client._rpc(BEGIN_TRANSACTION)
+        self._id = self._client._next_transaction_id
+        self._client._next_transaction_id += 1
+
+    def _clean_up(self):
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+
+    def _rollback(self):
+        if self.in_progress:
+            self._client._rpc(ROLLBACK)
+        self._clean_up()
+
+    def _commit(self):
+        self._client._rpc(COMMIT, len(self._writes))
+        for path, update_time in self._read_versions.items():
+            doc = self._client._docs.get(path)
+            if (doc["update_time"] if doc else None) != update_time:
+                self._clean_up()
+                raise exceptions.Aborted(f"Transaction contention on {path}")
+        results = self._client._apply_writes(self._writes)
+        self._clean_up()
+        return results
+
+    def commit(self):
+        return self._commit()
+
+
+class FakeBulkWriteOperation:
+    def __init__(self, write: tuple, reference):
+        self.write = write
+        self.reference = reference
+        self.attempts = 0
+
+
+class FakeBulkWriteFailure:
+    def __init__(self, operation: FakeBulkWriteOperation, error):
+        self.operation = operation
+        self.code = error.grpc_status_code.value[0]
+        self.message = error.message
+
+    @property
+    def attempts(self) -> int:
+        return self.operation.attempts
+
+
+class FakeBulkWriter(FakeWriteBatch):
+    """Like `BulkWriter`: writes are sent in batches of up to 20 when flushed, but
+    each is applied on its own, so one failing doesn't affect the others. A failed
+    write is retried for as long as the error callback returns True. Rate limiting
+    is left out (the options are only kept)."""
+
+    MAX_BATCH_SIZE = 20
+
+    def __init__(self, client: FakeClient, options=None):
+        super().__init__(client)
+        self.options = options
+        self._success_callback = lambda reference, result, writer: None
+        self._error_callback = lambda failure, writer: failure.attempts < 15
+        self._closed = False
+
+    def on_write_result(self, callback):
+        self._success_callback = callback
+
+    def on_write_error(self, callback):
+        self._error_callback = callback
+
+    def flush(self):
+        operations = [
+            FakeBulkWriteOperation(write, self._client.document(write[1]))
+            for write in self._writes
+        ]
+        self._writes = []
+        while operations:
+            n = self.MAX_BATCH_SIZE
+            batch, operations = operations[:n], operations[n:]
+            try:
+                self._client._rpc(BATCH_WRITE, len(batch))
+                batch_error = None
+            except exceptions.GoogleAPICallError as e:
+                batch_error = e
+            for operation in batch:
+                try:
+                    if batch_error:
+                        raise batch_error
+                    [result] = self._client._apply_writes([operation.write])
+                except exceptions.GoogleAPICallError as e:
+                    operation.attempts += 1
+                    if self._error_callback(FakeBulkWriteFailure(operation, e), self):
+                        operations.append(operation)
+                    continue
+                self._success_callback(operation.reference, result, self)
+
+    def close(self):
+        self.flush()
+        self._closed = True
+
+    def commit(self):
+        raise TypeError("BulkWriter has no commit(), use flush()")
+
+
+# Helpers for field paths, values and transforms
+class _Missing:
+    def __repr__(self):
+        return "<missing>"
+
+
+_MISSING = _Missing()
+
+
+def _parts(field_path) -> tuple:
+    if isinstance(field_path, FieldPath):
+        return field_path.parts
+    return FieldPath.from_string(field_path).parts
+
+
+def _field(snapshot: FakeDocumentSnapshot, field_path):
+    if field_path == DOCUMENT_ID:
+        return snapshot.id
+    value = snapshot._data
+    for part in _parts(field_path):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _cursor_value(cursor, field_path):
+    if isinstance(cursor, FakeDocumentSnapshot):
+        return _field(cursor, field_path)
+    if field_path == DOCUMENT_ID:
+        return cursor.get(DOCUMENT_ID, cursor.get("id"))
+    value = cursor
+    for part in _parts(field_path):
+        value = value.get(part, _MISSING) if isinstance(value, dict) else _MISSING
+    return value
+
+
+# Firestore orders values by type first, then by value within a type
+_TYPE_ORDER = [type(None), bool, (int, float), datetime.datetime, str, bytes]
+
+
+def _sort_key(value):
+    if isinstance(value, FakeDocumentReference):
+        value = value.id
+    for rank, types in enumerate(_TYPE_ORDER):
+        if isinstance(value, types):
+            return (rank, value)
+    return (len(_TYPE_ORDER), str(value))
+
+
+def _after(row, cursor, directions) -> bool:
+    for value, cursor_value, direction in zip(row, cursor, directions):
+        if value == cursor_value:
+            continue
+        if direction == "DESCENDING":
+            return value < cursor_value
+        return value > cursor_value
+    return False
+
+
+def _matches(value, op_string, expected) -> bool:
+    # Documents without the field never match, whatever the operator
+    if value is _MISSING:
+        return False
+    if isinstance(expected, FakeDocumentReference):
+        expected = expected.id
+    try:
+        if op_string == "==":
+            return value == expected
+        if op_string == "!=":
+            return value != expected
+        if op_string == "<":
+            return value < expected
+        if op_string == "<=":
+            return value <= expected
+        if op_string == ">":
+            return value > expected
+        if op_string == ">=":
+            return value >= expected
+        if op_string == "in":
+            return value in expected
+        if op_string == "not-in":
+            return value not in expected
+        if op_string == "array-contains":
+            return isinstance(value, list) and expected in value
+        if op_string == "array-contains-any":
+            return isinstance(value, list) and any(x in value for x in expected)
+    except TypeError:
+        # Values of different types never match a range filter
+        return False
+    raise ValueError(f"Unsupported operator: {op_string}")
+
+
+def _transform(current, value):
+    """Resolve a (possibly sentinel) value against the current stored value"""
+    if isinstance(value, transforms.Increment):
+        base = current if isinstance(current, (int, float)) else 0
+        return base + value.value
+    if isinstance(value, transforms.Maximum):
+        return max(current, value.value) if current is not _MISSING else value.value
+    if isinstance(value, transforms.Minimum):
+        return min(current, value.value) if current is not _MISSING else value.value
+    if isinstance(value, transforms.ArrayUnion):
+        res = list(current) if isinstance(current, list) else []
+        for v in value.values:
+            if v not in res:
+                res.append(copy.deepcopy(v))
+        return res
+    if isinstance(value, transforms.ArrayRemove):
+        res = list(current) if isinstance(current, list) else []
+        return [v for v in res if v not in value.values]
+    return copy.deepcopy(value)
+
+
+def _apply_merge(data: dict, updates: dict) -> dict:
+    """Deep merge, as `set(..., merge=True)` does"""
+    for key, value in updates.items():
+        if value is transforms.DELETE_FIELD:
+            data.pop(key, None)
+        elif isinstance(value, dict):
+            existing = data.get(key)
+            data[key] = _apply_merge(
+                existing if isinstance(existing, dict) else {}, value
+            )
+        else:
+            data[key] = _transform(data.get(key, _MISSING), value)
+    return data
+
+
+def _apply_update(data: dict, updates: dict) -> dict:
+    """Field path updates, as `update()` does (values replace whole fields)"""
+    for field_path, value in updates.items():
+        parts = _parts(field_path)
+        parent = data
+        for part in parts[:-1]:
+            if not isinstance(parent.get(part), dict):
+                parent[part] = {}
+            parent = parent[part]
+
+        if value is transforms.DELETE_FIELD:
+            parent.pop(parts[-1], None)
+        elif isinstance(value, dict):
+            parent[parts[-1]] = _apply_merge({}, value)
+        else:
+            parent[parts[-1]] = _transform(parent.get(parts[-1], _MISSING), value)
+    return data
+
+
+def _transform_results(data: dict, new_data: dict, op: str) -> list:
+    """The values a write's field transforms left (eg the total after an
+    Increment), in field path order, as a commit returns them"""
+    paths = []
+
+    def find(values: dict, prefix: tuple, field_paths: bool):
+        for key, value in values.items():
+            parts = prefix + (_parts(key) if field_paths else (key,))
+            if isinstance(value, dict):
+                find(value, parts, False)
+            elif isinstance(value, TRANSFORMS) or value is transforms.SERVER_TIMESTAMP:
+                paths.append(parts)
+
+    find(data, (), op == "update")
+    res = []
+    for parts in sorted(paths):
+        value = new_data
+        for part in parts:
+            value = value[part]
+        res.append(_helpers.encode_value(value))
+    return res
+
+
+def _resolve_server_timestamps(data: dict, timestamp):
+    for key, value in data.items():
+        if value is transforms.SERVER_TIMESTAMP:
+            data[key] = timestamp
+        elif isinstance(value, dict):
+            _resolve_server_timestamps(value, timestamp)
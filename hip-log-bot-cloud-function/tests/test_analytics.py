@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+from datetime import date, timedelta
+from services import analytics
+from services.analytics import (
+    HistoryFrame,
+    Correlation,
+    CorrelationCache,
+    lagged_correlations,
+)
+
+
+def make_history(n_days=60):
+    """Squats every 3rd day, and the left hip is worse the day after squats"""
+    start = date(2023, 1, 1)
+    logs = []
+    for i in range(n_days):
+        log = {"activities": {}, "symptoms": {"left hip": {"severity": 1}}}
+        if i % 3 == 0:
+            log["activities"]["squats"] = {"sets": [{"reps": 10}, {"reps": 8}]}
+        if i % 3 == 1:
+            log["symptoms"]["left hip"]["severity"] = 3
+        if i % 2 == 0:
+            log["activities"]["yoga"] = {"sets": [{"reps": 1}]}
+        logs.append((str(start + timedelta(days=i)), log))
+
+    return logs
+
+
+class StubHipLogDB:
+    def __init__(self, logs):
+        self.logs = logs
+        self.version = 1
+        self.num_streams = 0
+
+    def get_log_version(self, user):
+        return self.version
+
+    def stream_logs(self, user):
+        self.num_streams += 1
+        return iter(self.logs)
+
+
+def test_history_frame_from_log_dicts():
+    frame = HistoryFrame.from_log_dicts(
+        [
+            ("2023-01-01", {"activities": {"yoga": {"sets": [{"reps": 1}]}}}),
+            ("2023-01-03", {"symptoms": {"left hip": {"severity": 2}}}),
+        ]
+    )
+    assert frame.start == date(2023, 1, 1) and frame.end == date(2023, 1, 3)
+    assert frame.activities == ["yoga"] and frame.symptoms == ["left hip"]
+    assert frame.activity_matrix[:, 0].tolist() == [1, 0, 0]
+    assert np.isnan(frame.symptom_matrix[0, 0]) and frame.symptom_matrix[2, 0] == 2
+
+
+def test_history_frame_empty():
+    frame = HistoryFrame.from_log_dicts([])
+    assert frame.num_days == 0
+    assert lagged_correlations(frame) == []
+
+
+def test_lagged_correlations_finds_next_day_effect():
+    frame = HistoryFrame.from_log_dicts(make_history())
+    correlations = lagged_correlations(frame)
+
+    strongest = correlations[0]
+    assert (strongest.activity, strongest.symptom, strongest.lag) == (
+        "squats",
+        "left hip",
+        1,
+    )
+    assert strongest.r == pytest.approx(1.0)
+    assert strongest.delta == pytest.approx(2.0)
+
+
+def test_lagged_correlations_skips_sparse_pairs():
+    # Only 2 days of squats isn't enough to report anything
+    logs = make_history()[:6]
+    assert lagged_correlations(HistoryFrame.from_log_dicts(logs)) == []
+
+
+def test_print_correlation():
+    c = Correlation("squats", "left hip", 1, 0.42, 0.83, 120)
+    assert str(c) == (
+        "Days after squats, left hip severity rises by 0.8 (r=0.42, 120 days)"
+    )
+
+
+def test_correlation_cache_invalidates_on_new_version():
+    CorrelationCache.invalidate()
+    db = StubHipLogDB(make_history())
+
+    CorrelationCache.get(db, "user")
+    CorrelationCache.get(db, "user")
+    assert db.num_streams == 1
+
+    db.version += 1
+    CorrelationCache.get(db, "user")
+    assert db.num_streams == 2
+
+
+def test_correlation_cache_keeps_the_most_recent_users(monkeypatch):
+    CorrelationCache.invalidate()
+    monkeypatch.setattr(analytics, "MAX_CACHED_USERS", 2)
+    db = StubHipLogDB(make_history(10))
+
+    for user in ["a", "b", "a", "c"]:
+        CorrelationCache.get(db, user)
+    assert list(CorrelationCache._entries) == ["a", "c"]
+
+    CorrelationCache.get(db, "a")
+    assert db.num_streams == 3
@@ -0,0 +1,89 @@
+from datetime import date
+import json
+import zlib
+import pytest
+import utils
+from models.archive import MonthArchive
+from models.catalog import Catalog
+from models.daily_log import DailyLog
+from models.record import Activity, Set, Symptom
+from services.archiver import archive_user, months_to_archive
+from services.hiplogdb import HipLogDB
+
+LOGS = {
+    "2023-01-01": DailyLog(
+        "2023-01-01",
+        activities=[Activity("hip adductions", sets=[Set(reps=10), Set(reps=8)])],
+        symptoms=[Symptom("left hip", 2)],
+    ).to_dict(),
+    "2023-01-03": DailyLog("2023-01-03", activities=[Activity("yoga")]).to_dict(),
+}
+
+
+def test_round_trip():
+    packed = MonthArchive("2023-01", LOGS).to_dict()
+    assert packed["dates"] == ["2023-01-01", "2023-01-03"]
+
+    archive = MonthArchive.from_dict(packed)
+    assert archive.dates == ["2023-01-01", "2023-01-03"]
+    assert not archive.is_unpacked
+    assert archive.get("2023-01-02") is None
+    assert not archive.is_unpacked
+
+    assert archive.get("2023-01-01") == LOGS["2023-01-01"]
+    assert dict(archive.items()) == LOGS
+    restored = DailyLog.from_dict("2023-01-01", archive.get("2023-01-01"))
+    assert restored.to_dict() == LOGS["2023-01-01"]
+
+
+def test_set_and_remove():
+    archive = MonthArchive.from_dict(MonthArchive("2023-01", LOGS).to_dict())
+    archive.remove("2023-01-01")
+    moved = dict(LOGS["2023-01-03"], date="2023-01-02")
+    archive.set("2023-01-02", moved)
+
+    restored = MonthArchive.from_dict(archive.to_dict())
+    assert restored.dates == ["2023-01-02", "2023-01-03"]
+    assert restored.get("2023-01-02") == moved
+
+
+def test_unknown_encoding():
+    packed = dict(MonthArchive("2023-01", LOGS).to_dict(), encoding="lz4")
+    with pytest.raises(ValueError):
+        MonthArchive.from_dict(packed)
+
+
+def test_reads_json_archives():
+    packed = {
+        "month": "2023-01",
+        "encoding": "zlib+json",
+        "dates": sorted(LOGS),
+        "data": zlib.compress(json.dumps(LOGS).encode()),
+    }
+    archive = MonthArchive.from_dict(packed)
+    assert dict(archive.items()) == LOGS
+
+    # Rewritten in the current encoding
+    assert archive.to_dict()["encoding"] == MonthArchive.ENCODING
+    assert dict(MonthArchive.from_dict(archive.to_dict()).items()) == LOGS
+
+
+def test_months_to_archive():
+    catalog = Catalog()
+    for day in ["2023-07-31", "2023-08-01", "2023-08-31", "2023-09-01"]:
+        catalog.record_log(DailyLog(day, activities=[Activity("yoga")]))
+    catalog.archived_months.add("2023-07")
+
+    assert months_to_archive(catalog, date(2023, 11, 3), 3) == ["2023-08"]
+    assert months_to_archive(catalog, date(2024, 1, 1), 3) == ["2023-08", "2023-09"]
+
+
+def test_archive_user(fake_firestore):
+    user = utils.test_username
+    db = HipLogDB()
+    for day in ["2023-01-01", "2023-02-01", "2023-11-01"]:
+        db.upload_log(user, DailyLog(day, activities=[Activity("yoga")]))
+
+    assert archive_user(HipLogDB(), user, today=date(2023, 11, 3)) == 2
+    assert HipLogDB().get_catalog(user).archived_months == {"2023-01", "2023-02"}
+    assert archive_user(HipLogDB(), user, today=date(2023, 11, 3)) == 0
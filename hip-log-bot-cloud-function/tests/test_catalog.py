@@ -0,0 +1,142 @@
+from datetime import date
+from models.catalog import Catalog
+from models.daily_log import DailyLog
+from models.record import Activity, Symptom
+
+
+def test_record_log():
+    catalog = Catalog()
+    catalog.record_log(
+        DailyLog(
+            "2023-01-01",
+            activities=[Activity("yoga")],
+            symptoms=[Symptom("left hip", 1)],
+        )
+    )
+    catalog.record_log(DailyLog("2023-01-02", activities=[Activity("pushups")]))
+
+    assert catalog.activities == ["pushups", "yoga"]
+    assert catalog.symptoms == ["left hip"]
+    assert catalog.log_dates.count() == 2
+    assert date(2023, 1, 1) in catalog.get_activity_dates("yoga")
+    assert catalog.get_activity_dates("running").count() == 0
+
+
+def test_remove_log_drops_unused_names():
+    log = DailyLog("2023-01-02", activities=[Activity("pushups")])
+    catalog = Catalog()
+    catalog.record_log(DailyLog("2023-01-01", activities=[Activity("yoga")]))
+    catalog.record_log(log)
+
+    catalog.remove_log(log)
+    assert catalog.activities == ["yoga"]
+    assert catalog.log_dates.count() == 1
+
+
+def test_record_patch_drops_activities_with_no_sets_left():
+    log = DailyLog("2023-01-01", activities=[Activity("yoga"), Activity("run")])
+    catalog = Catalog()
+    catalog.record_log(log)
+
+    patch = DailyLog("2023-01-01", activities=[log.activities["run"].removal()])
+    catalog.record_patch(patch, log.merge(patch))
+    assert catalog.activities == ["yoga"] and catalog.num_logs == 1
+
+
+def test_num_logs_counts_new_dates_only():
+    catalog = Catalog()
+    catalog.record_log(DailyLog("2023-01-01", activities=[Activity("yoga")]))
+    catalog.record_log(DailyLog("2023-01-01", activities=[Activity("run")]))
+    assert catalog.num_logs == 1
+
+    catalog.remove_log(DailyLog("2023-01-02"))
+    assert catalog.num_logs == 1
+    catalog.remove_log(DailyLog("2023-01-01"))
+    assert catalog.num_logs == 0
+
+    # Catalogs written before the counter
+    catalog.record_log(DailyLog("2023-01-03"))
+    legacy = catalog.to_dict()
+    del legacy["num_logs"]
+    assert Catalog.from_dict(legacy).num_logs == 1
+
+
+def test_symptom_severities_follow_the_logs():
+    catalog = Catalog()
+    for day, severity in [("2023-01-01", 3), ("2023-01-02", 0), ("2023-01-03", 2)]:
+        catalog.record_log(DailyLog(day, symptoms=[Symptom("left hip", severity)]))
+    catalog.record_log(DailyLog("2023-01-03", symptoms=[Symptom("left hip", 1)]))
+    catalog.remove_log(DailyLog("2023-01-01", symptoms=[Symptom("left hip", 3)]))
+
+    dates, series = Catalog.from_dict(catalog.to_dict()).get_symptom_severities(
+        "left hip"
+    )
+    assert dates.dates() == [date(2023, 1, 2), date(2023, 1, 3)]
+    assert [series.get(day) for day in dates.dates()] == [0, 1]
+    assert series.get(date(2023, 1, 1)) == 0
+
+    catalog.remove_log(DailyLog("2023-01-02", symptoms=[Symptom("left hip", 0)]))
+    catalog.remove_log(DailyLog("2023-01-03", symptoms=[Symptom("left hip", 1)]))
+    assert catalog.get_symptom_severities("left hip") is None
+    assert catalog.to_dict()["symptom_severities"] == {}
+
+
+def test_symptoms_logged_before_severities_were_kept_have_none():
+    legacy = Catalog()
+    legacy.record_log(DailyLog("2023-01-01", symptoms=[Symptom("left hip", 2)]))
+    legacy_dict = legacy.to_dict()
+    del legacy_dict["symptom_severities"]
+
+    catalog = Catalog.from_dict(legacy_dict)
+    catalog.record_log(DailyLog("2023-01-02", symptoms=[Symptom("left hip", 1)]))
+    catalog.record_log(DailyLog("2023-01-02", symptoms=[Symptom("right hip", 1)]))
+    assert catalog.get_symptom_severities("left hip") is None
+    assert catalog.get_symptom_severities("right hip") is not None
+
+
+def test_from_log_dicts_is_indexed():
+    catalog = Catalog.from_log_dicts(
+        [("2023-01-01", {"activities": {"yoga": {"sets": [{"reps": 1}]}}})]
+    )
+    assert catalog.indexed and catalog.activities == ["yoga"]
+
+
+def test_to_and_from_dict():
+    catalog = Catalog(indexed=True)
+    catalog.log_version = 4
+    catalog.record_log(
+        DailyLog("2023-01-01", symptoms=[Symptom("left hip", 1)]),
+    )
+
+    restored = Catalog.from_dict(catalog.to_dict())
+    assert restored.indexed and restored.log_version == 4
+    assert restored.symptoms == ["left hip"]
+    assert restored.log_dates == catalog.log_dates
+
+
+def test_from_empty_dict():
+    catalog = Catalog.from_dict(None)
+    assert not catalog.indexed and catalog.log_version == 0
+
+
+def test_catalog_year_summary():
+    catalog = Catalog(indexed=True)
+    for day in ["2022-12-31", "2023-01-01", "2023-05-01"]:
+        catalog.record_log(DailyLog(day, activities=[Activity(day[:4])]))
+
+    assert catalog.years == [2022, 2023]
+    assert catalog.year_summary(2023) == {
+        "year": 2023,
+        "num_logs": 2,
+        "activities": {"2023": 2},
+        "symptoms": {},
+    }
+
+
+def test_catalog_layout_round_trip():
+    catalog = Catalog(indexed=True)
+    catalog.layout, catalog.migrating_to = "yearly", "flat"
+
+    restored = Catalog.from_dict(catalog.to_dict())
+    assert (restored.layout, restored.migrating_to) == ("yearly", "flat")
+    assert Catalog.from_dict({}).layout == "flat"
@@ -1,3 +1,4 @@
+import random
 from models.record import Activity, Symptom, Set, Measurement as M
 from models.daily_log import DailyLog
 
@@ -89,6 +90,20 @@ def test_daily_log_print():
     )
 
 
+def test_daily_log_summarize():
+    log = DailyLog(
+        "2023-11-03",
+        activities=[
+            Activity("squats", [Set(reps=10), Set(reps=8)]),
+            Activity("yoga"),
+        ],
+        symptoms=[Symptom("left hip", 1)],
+    )
+
+    assert log.summarize() == "Fri Nov. 3: Squats (2 sets), Yoga (1 set); Left Hip: 1"
+    assert DailyLog("2023-11-04").summarize() == "Sat Nov. 4: nothing logged"
+
+
 def test_log_to_dict():
     """
     Motivation for test:
@@ -120,3 +135,94 @@ def test_add_activity_to_existing_log():
     log.add_activity(Activity("Handstands", [Set(reps=4)]))
 
     print("helo")
+
+
+# Merging versions of a log (eg written concurrently by different devices)
+def make_ops(seed: int, num_ops: int = 12) -> list:
+    """Random single-change patches of a log, each stamped like the executor does:
+    new sets, removed sets, symptom updates and notes"""
+    rng = random.Random(seed)
+    ops, set_ids = [], []
+    for i in range(num_ops):
+        kind = rng.choice(["set", "set", "remove", "symptom", "notes"])
+        if kind == "remove" and set_ids:
+            name, set_id = rng.choice(set_ids)
+            ops.append(
+                DailyLog("2023-11-04", activities=[Activity(name, [], [set_id])])
+            )
+        elif kind == "symptom":
+            symptom = Symptom(rng.choice(["Hip", "Knee"]), rng.randint(0, 3))
+            symptom.stamp(rng.randint(1, 5))
+            ops.append(DailyLog("2023-11-04", symptoms=[symptom]))
+        elif kind == "notes":
+            ops.append(DailyLog("2023-11-04", activity_notes=f"note {i}"))
+        else:
+            activity = Activity(rng.choice(["Yoga", "Squats"]), [Set(reps=i + 1)])
+            activity.stamp(rng.randint(1, 5))
+            set_ids.append((activity.name, activity.sets[0].id))
+            ops.append(DailyLog("2023-11-04", activities=[activity]))
+    return ops
+
+
+def merge_all(logs: list) -> DailyLog:
+    merged = DailyLog("2023-11-04")
+    for log in logs:
+        merged = merged.merge(log)
+    return merged
+
+
+def test_merge_is_commutative_associative_and_idempotent():
+    for seed in range(20):
+        a, b, c = (merge_all(make_ops(seed * 3 + i, 4)) for i in range(3))
+
+        assert a.merge(b).to_dict() == b.merge(a).to_dict()
+        assert a.merge(b).merge(c).to_dict() == a.merge(b.merge(c)).to_dict()
+        assert a.merge(a).to_dict() == a.merge(DailyLog("2023-11-04")).to_dict()
+        assert a.merge(b).merge(b).to_dict() == a.merge(b).to_dict()
+
+
+def test_replicas_converge_whatever_order_they_see_changes_in():
+    for seed in range(20):
+        ops = make_ops(seed)
+        rng = random.Random(seed)
+        # Each replica sees some of the changes, in its own order, and then they
+        # exchange states
+        replicas = []
+        for _ in range(3):
+            seen = rng.sample(ops, rng.randint(0, len(ops)))
+            replicas.append(merge_all(seen))
+        replicas[0] = merge_all([replicas[0]] + ops)
+        expected = merge_all(ops).to_dict()
+
+        for order in [replicas, replicas[::-1], replicas[1:] + replicas[:1]]:
+            assert merge_all(order).to_dict() == expected
+
+
+def test_merge_keeps_concurrent_sets_and_removals():
+    base = DailyLog("2023-11-04", activities=[Activity("Squats", [Set(reps=5)])])
+    mine, theirs = Activity("Squats", [Set(reps=6)]), Activity("Squats", [Set(reps=7)])
+    mine.stamp(2)
+    theirs.stamp(1)
+    removal = DailyLog("2023-11-04", activities=[Activity("Squats", [], ["0000"])])
+
+    merged = base.merge(DailyLog("2023-11-04", activities=[mine])).merge(
+        DailyLog("2023-11-04", activities=[theirs])
+    )
+    assert [s.reps for s in merged.activities["Squats"].sets] == [5, 7, 6]
+    merged = merged.merge(removal)
+    assert [s.reps for s in merged.activities["Squats"].sets] == [7, 6]
+
+    # Removing the last set leaves only the removal behind, which isn't shown
+    gone = base.merge(removal)
+    assert gone.activities == {} and "Squats" in gone.to_dict()["activities"]
+
+
+def test_later_symptom_wins_merge():
+    earlier, later = Symptom("Hip", 3), Symptom("Hip", 1)
+    earlier.stamp(1)
+    later.stamp(2)
+    a = DailyLog("2023-11-04", symptoms=[later])
+    b = DailyLog("2023-11-04", symptoms=[earlier])
+
+    assert a.merge(b).symptoms["Hip"].severity == 1
+    assert b.merge(a).symptoms["Hip"].severity == 1
@@ -0,0 +1,65 @@
+from datetime import date
+from models.date_bitmap import DateBitmap
+
+
+def make_bitmap(*days):
+    bitmap = DateBitmap()
+    for d in days:
+        bitmap.add(date(2023, 1, d))
+    return bitmap
+
+
+def test_add_and_contains():
+    bitmap = make_bitmap(5, 2, 9)
+    assert bitmap.start == date(2023, 1, 2) and bitmap.end == date(2023, 1, 9)
+    assert date(2023, 1, 5) in bitmap
+    assert date(2023, 1, 6) not in bitmap
+    assert date(2022, 12, 31) not in bitmap
+    assert bitmap.count() == 3
+
+
+def test_remove():
+    bitmap = make_bitmap(1, 2, 3)
+    bitmap.remove(date(2023, 1, 2))
+    bitmap.remove(date(2022, 1, 2))  # before the start is a no-op
+    assert bitmap.dates() == [date(2023, 1, 1), date(2023, 1, 3)]
+
+
+def test_streak():
+    bitmap = make_bitmap(1, 3, 4, 5)
+    assert bitmap.streak(date(2023, 1, 5)) == 3
+    # Nothing logged yet "today" still counts yesterday's streak
+    assert bitmap.streak(date(2023, 1, 6)) == 3
+    assert bitmap.streak(date(2023, 1, 7)) == 0
+    assert bitmap.streak(date(2023, 1, 1)) == 1
+    assert DateBitmap().streak(date(2023, 1, 1)) == 0
+
+
+def test_longest_streak():
+    assert make_bitmap(1, 2, 3, 7, 8, 20).longest_streak() == 3
+    assert DateBitmap().longest_streak() == 0
+
+
+def test_gap():
+    bitmap = make_bitmap(1, 3)
+    assert bitmap.gap(date(2023, 1, 10)) == 7
+    assert bitmap.gap(date(2023, 1, 3)) == 0
+    assert make_bitmap(5).gap(date(2023, 1, 1)) is None
+
+
+def test_counts():
+    bitmap = make_bitmap(1, 15, 31)
+    bitmap.add(date(2023, 2, 1))
+    bitmap.add(date(2022, 12, 31))
+    assert bitmap.count_month(2023, 1) == 3
+    assert bitmap.count_month(2022, 12) == 1
+    assert bitmap.count_month(2024, 1) == 0
+    assert bitmap.count_between(date(2023, 1, 15), date(2023, 2, 1)) == 3
+
+
+def test_to_and_from_dict():
+    bitmap = make_bitmap(1, 9, 30)
+    as_dict = bitmap.to_dict()
+    assert as_dict["start"] == "2023-01-01" and isinstance(as_dict["bits"], bytes)
+    assert DateBitmap.from_dict(as_dict) == bitmap
+    assert DateBitmap.from_dict(DateBitmap().to_dict()).count() == 0
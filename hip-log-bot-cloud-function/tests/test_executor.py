@@ -1,14 +1,17 @@
 import logging
+from datetime import date as Date, timedelta
 import pytest
 import os
 import re
 import firebase_admin
 from models.daily_log import DailyLog
 from models.record import Activity, Symptom
-from services.hiplogdb import HipLogDB
+from services.hiplogdb import MAX_DELETE_RANGE_DAYS, HipLogDB
 import utils
 from firebase_admin import firestore
+from services import jobs
 from services.executor import Executor
+from services.jobs import FirestoreJobQueue, MemoryJobQueue
 
 
 @pytest.fixture(scope="module")
@@ -18,13 +21,15 @@ def conn():
         fb_app = firebase_admin.get_app()
     except ValueError:
         fb_app = firebase_admin.initialize_app()
+    # Opened now so that without credentials, only the tests that need the real
+    # Firestore fail (rather than whichever test ends the module, at cleanup)
+    db = firestore.client()
 
     # Keep open until end of tests
     yield fb_app
 
     # Delete all docs in the test collection
     print("Starting Cleanup")
-    db = firestore.client()
     collection_ref = (
         db.collection(os.environ["FIRESTORE_COLLECTION_NAME"])
         .document(utils.test_username)
@@ -304,3 +309,372 @@ def test_catch_mismatch_error_on_run(conn, caplog):
     assert "Mismatched number of reps/weights/durations" in caplog.text
     assert "Setting response" in caplog.text
     assert re.search("It looks like you provided", res)
+
+
+def test_get_streak(fake_firestore):
+    request = {
+        "queryResult": {
+            "parameters": {"activity": "Handstands"},
+            "intent": {
+                "displayName": "GetStreak",
+            },
+        }
+    }
+
+    res = Executor(request).run()
+    assert res == "You haven't logged 'handstands' yet"
+
+    today = Date.today()
+    for days_ago in [0, 1, 3]:
+        HipLogDB().upload_log(
+            utils.test_username,
+            DailyLog(
+                str(today - timedelta(days=days_ago)),
+                activities=[Activity("handstands")],
+            ),
+        )
+    res = Executor(request).run()
+    assert res == (
+        "You've logged 'handstands' 2 day(s) in a row (longest streak: 2 days)"
+    )
+
+
+def test_get_daily_log_for_range(fake_firestore):
+    HipLogDB().upload_log(
+        utils.test_username,
+        DailyLog("2023-11-01", activities=[Activity("squats")]),
+    )
+    request = {
+        "queryResult": {
+            "parameters": {
+                "date-period": {
+                    "startDate": "2023-10-30T00:00:00+01:00",
+                    "endDate": "2023-11-05T23:59:59+01:00",
+                },
+            },
+            "intent": {
+                "displayName": "GetDailyLog",
+            },
+        }
+    }
+
+    res = Executor(request).run()
+    assert res == """Oct. 30 - Nov. 5, 2023: 1 day(s) logged
+
+* Wed Nov. 1: Squats (1 set)"""
+
+    request["queryResult"]["intent"]["displayName"] = "DeleteDailyLog"
+    res = Executor(request).run()
+    assert res == "Your 1 entries for Oct. 30 - Nov. 5, 2023 were deleted"
+
+
+def test_messenger_replies_are_rendered_for_messenger(fake_firestore):
+    HipLogDB().upload_log(
+        "1234", DailyLog("2023-11-01", activities=[Activity("squats")])
+    )
+    request = {
+        "queryResult": {
+            "parameters": {"date": "2023-11-01T12:00:00+01:00"},
+            "intent": {"displayName": "GetDailyLog"},
+        },
+        "originalDetectIntentRequest": {
+            "source": "facebook",
+            "payload": {"data": {"sender": {"id": "1234"}}},
+        },
+    }
+
+    executor = Executor(request)
+    res = executor.run()
+    assert res == "*Wed Nov. 1, 2023*\n• *Squats*: 1x"
+    assert "fulfillmentMessages" in executor.renderer.to_response(res)
+
+
+def test_log_activity_reports_new_prs(fake_firestore, monkeypatch):
+    queue = MemoryJobQueue()
+    monkeypatch.setattr(jobs, "_queue", queue)
+    user = utils.test_username
+
+    def log_bench(reps: int, kg: float):
+        request = {
+            "queryResult": {
+                "parameters": {
+                    "activity": "Bench",
+                    "reps": [reps],
+                    "weight": [{"amount": kg, "unit": "kg"}],
+                    "duration": [],
+                    "date": "2023-11-01T12:00:00+01:00",
+                },
+                "intent": {"displayName": "LogActivity"},
+            }
+        }
+        executor = Executor(request)
+        return executor.run(), executor.io_stats
+
+    # The first log's records are complete, so they're compared against right away
+    log_bench(5, 100)
+    res, io_stats = log_bench(5, 105)
+    assert res.startswith(
+        "New PR! Bench: heaviest weight (105kg), best estimated 1RM (122.5kg)\n\n"
+    )
+    # Compared against the stats fetched with the log, raised with the upload
+    assert (io_stats.rpcs("reads"), io_stats.rpcs("writes")) == (1, 1)
+    res, _ = log_bench(5, 105)
+    assert not res.startswith("New PR!")
+
+    # A delete makes the records stale until they're recomputed
+    HipLogDB().upload_log(user, DailyLog("2023-10-01", activities=[Activity("yoga")]))
+    HipLogDB().delete_log(user, "2023-11-01")
+    res, _ = log_bench(5, 50)
+    assert not res.startswith("New PR!")
+    assert "recompute_stats" in {job.kind for job in iter(queue.claim, None)}
+    assert HipLogDB().recompute_stats(user).records["bench"]["max_weight_kg"] == 50
+
+
+def test_set_edits_only_write_the_changed_sets(fake_firestore, monkeypatch):
+    monkeypatch.setattr(jobs, "_queue", MemoryJobQueue())
+    user = utils.test_username
+
+    def run(intent_type: str, **parameters):
+        request = {
+            "queryResult": {
+                "parameters": dict(parameters, date="2023-11-01T12:00:00+01:00"),
+                "intent": {"displayName": intent_type},
+            }
+        }
+        executor = Executor(request)
+        return executor.run(), executor.io_stats
+
+    run("LogActivity", activity="Squats", reps=[10, 8, 6], weight=[], duration=[])
+    run("LogActivity", activity="Curls", reps=[12], weight=[], duration=[])
+
+    res, io_stats = run("EditSet", activity="squat", **{"set-number": 2}, reps=[9])
+    assert res.startswith("Changed set 2 of squats to 9x\n\n")
+    assert (io_stats.rpcs("reads"), io_stats.rpcs("writes")) == (1, 1)
+    res, _ = run("EditSet", activity="squats", **{"set-number": 4}, reps=[9])
+    assert res == "There are 3 sets of squats on 2023-11-01, so there's no set 4"
+
+    res, _ = run("UndoLastSet")
+    assert res.startswith("Removed your last set of curls: 12x")
+    res, _ = run("UndoLastSet", activity="squats")
+    assert res.startswith("Removed your last set of squats: 6x")
+    log = HipLogDB().get_log(user, "2023-11-01")
+    assert [s.reps for s in log.activities["squats"].sets] == [10, 9]
+    assert "curls" not in log.activities
+
+    res, _ = run("DeleteActivity", activity="squats")
+    assert res.startswith("Deleted squats from 2023-11-01")
+    res, _ = run("DeleteActivity", activity="squats")
+    assert res == "There's no squats on 2023-11-01. Nothing was deleted"
+    # Emptied, so the log is gone
+    assert HipLogDB().get_log(user, "2023-11-01") is None
+    catalog = HipLogDB().get_catalog(user)
+    assert catalog.activities == [] and catalog.num_logs == 0
+
+
+def test_activity_summary_skips_deleted_activities(fake_firestore, monkeypatch):
+    monkeypatch.setattr(jobs, "_queue", MemoryJobQueue())
+
+    def run(intent_type: str, **parameters):
+        request = {
+            "queryResult": {
+                "parameters": parameters,
+                "intent": {"displayName": intent_type},
+            }
+        }
+        executor = Executor(request)
+        return executor.run(), executor.io_stats
+
+    for day in ["2023-11-01", "2023-11-02"]:
+        date = f"{day}T12:00:00+01:00"
+        sets = {"reps": [10], "weight": [], "duration": []}
+        run("LogActivity", activity="Squats", date=date, **sets)
+        run("LogSymptom", symptom="Hip", severity=2, date=date)
+    run("DeleteActivity", activity="squats", date="2023-11-02T12:00:00+01:00")
+
+    res, io_stats = run("GetActivitySummary", activity="squats")
+    assert res == "**Summary Stats for 'squats'**\n\ntotal_count: 1"
+    assert io_stats.num_rpcs == 1
+
+
+def test_undo_reverts_changes_one_at_a_time(fake_firestore, monkeypatch):
+    monkeypatch.setattr(jobs, "_queue", MemoryJobQueue())
+    date = "2023-11-01T12:00:00+01:00"
+
+    def run(intent_type: str, **parameters):
+        request = {
+            "queryResult": {
+                "parameters": parameters,
+                "intent": {"displayName": intent_type},
+            }
+        }
+        executor = Executor(request)
+        return executor.run(), executor.io_stats
+
+    run("LogActivity", activity="Squats", reps=[10], weight=[], duration=[], date=date)
+    run("LogSymptom", symptom="Hip", severity=2, date=date)
+    run("DeleteDailyLog", date=date)
+
+    res, io_stats = run("UndoLastChange")
+    assert res.startswith(
+        "Undid your last change (DeleteDailyLog for 2023-11-01)\n\nNov. 1, 2023 Log:"
+    )
+    assert (io_stats.rpcs("reads"), io_stats.rpcs("writes")) == (3, 1)
+    res, _ = run("UndoLastChange")
+    assert res.startswith("Undid your last change (LogSymptom for 2023-11-01)")
+    log = HipLogDB().get_log(utils.test_username, "2023-11-01")
+    assert list(log.activities) == ["squats"] and log.symptoms == {}
+
+    run("UndoLastChange")
+    res, _ = run("UndoLastChange")
+    assert res == "There's nothing to undo"
+
+
+def test_delete_range_at_the_cap(fake_firestore, monkeypatch):
+    monkeypatch.setattr(jobs, "_queue", FirestoreJobQueue())
+    user = utils.test_username
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{user}"
+    first = Date(2022, 10, 1)
+    days = [first + timedelta(days=i) for i in range(MAX_DELETE_RANGE_DAYS)]
+    for day in [first - timedelta(days=1)] + days:
+        fake_firestore.load(f"{path}/DailyLogs/{day}", {"activity_notes": str(day)})
+    HipLogDB().get_catalog(user)
+    # The most writes: the logs are deleted from both layouts, and every follow-up
+    # job is due (the month left is old enough to archive, and it's the 100th write)
+    catalog = fake_firestore.dump(path)
+    fake_firestore.load(path, dict(catalog, migrating_to="yearly", log_version=99))
+
+    def delete(last: Date) -> str:
+        period = {
+            "startDate": f"{first}T00:00:00+00:00",
+            "endDate": f"{last}T23:59:59+00:00",
+        }
+        request = {
+            "queryResult": {
+                "parameters": {"date-period": period},
+                "intent": {"displayName": "DeleteDailyLog"},
+            }
+        }
+        return Executor(request).run()
+
+    assert delete(days[-1] + timedelta(days=1)) == (
+        "That's too many days to delete at once. Try a range of up to "
+        f"{MAX_DELETE_RANGE_DAYS} days"
+    )
+    delete(days[-1])
+    assert HipLogDB().get_catalog(user).num_logs == 1
+    assert FirestoreJobQueue().counts() == {"pending": 4}
+
+
+def test_symptom_trend_is_answered_from_the_catalog(fake_firestore, monkeypatch):
+    queue = MemoryJobQueue()
+    monkeypatch.setattr(jobs, "_queue", queue)
+    user = utils.test_username
+    hiplogdb = HipLogDB()
+    for day in range(1, 29):
+        symptom = Symptom("left hip", 3 if day <= 14 else 1)
+        hiplogdb.upload_log(user, DailyLog(f"2023-11-{day:02d}", symptoms=[symptom]))
+
+    def get_trend(**parameters):
+        request = {
+            "queryResult": {
+                "parameters": {"symptom": "Left hip", **parameters},
+                "intent": {"displayName": "GetSymptomTrend"},
+            }
+        }
+        executor = Executor(request)
+        return executor.run(), executor.io_stats
+
+    period = {
+        "startDate": "2023-10-30T00:00:00+01:00",
+        "endDate": "2023-12-03T23:59:59+01:00",
+    }
+    res, io_stats = get_trend(**{"date-period": period})
+    assert res.split("\n")[:5] == [
+        "**Left Hip over Oct. 30 - Dec. 3, 2023**",
+        "Logged 28 of 35 days, 2.0 on average (1.1 lately)",
+        "Last 7 days: 1.0 on average",
+        "Improved from 3.0 to 1.0 around Nov. 15, 2023",
+        "Weekly averages:",
+    ]
+    assert (io_stats.rpcs("reads"), io_stats.rpcs("queries")) == (1, 0)
+    lines = res.split("\n")
+    res, _ = get_trend()
+    assert res.startswith("**Left Hip over the last 90 days**")
+
+    # A catalog from before severities were kept is answered from the logs, and
+    # rebuilt
+    catalog = hiplogdb._get_user_ref(user).get().to_dict()
+    del catalog["symptom_severities"]
+    hiplogdb._get_user_ref(user).set(catalog)
+    legacy_res, io_stats = get_trend(**{"date-period": period})
+    assert legacy_res.split("\n") == lines
+    assert io_stats.rpcs("queries") >= 1
+    assert [job.kind for job in iter(queue.claim, None)] == ["rebuild_catalog"]
+
+    res, io_stats = get_trend(symptom="Knee")
+    assert res == "You haven't logged 'knee' yet"
+
+
+@pytest.mark.parametrize(
+    "request_body, expected",
+    [
+        (None, "I couldn't make sense of that"),
+        ({"queryResult": {}}, "I couldn't make sense of that"),
+        (
+            {
+                "queryResult": {
+                    "intent": {"displayName": "LogMood"},
+                    "parameters": {},
+                }
+            },
+            "We don't support this yet (intent = LogMood)",
+        ),
+    ],
+)
+def test_bad_requests_rejected_without_firestore(monkeypatch, request_body, expected):
+    def no_client():
+        raise AssertionError("Firestore client created")
+
+    monkeypatch.setattr("services.executor.HipLogDB", no_client)
+    executor = Executor(request_body)
+
+    assert executor.run().startswith(expected)
+    assert executor.io_stats.rpcs("reads") == 0
+
+
+def test_storage_errors_get_their_own_response(fake_firestore, monkeypatch):
+    from google.api_core.exceptions import ServiceUnavailable
+
+    def unavailable(*args, **kwargs):
+        raise ServiceUnavailable("down")
+
+    monkeypatch.setattr(HipLogDB, "get_catalog", unavailable)
+    request = {
+        "queryResult": {
+            "parameters": {},
+            "intent": {"displayName": "GetNumLogs"},
+        }
+    }
+
+    assert Executor(request).run().startswith("I can't reach your logs right now")
+
+
+def test_failed_deletes_arent_reported_as_done(fake_firestore, monkeypatch):
+    from google.api_core.exceptions import ServiceUnavailable
+
+    HipLogDB().upload_log(
+        utils.test_username, DailyLog("2023-11-01", activities=[Activity("squats")])
+    )
+
+    def unavailable(*args, **kwargs):
+        raise ServiceUnavailable("down")
+
+    monkeypatch.setattr(HipLogDB, "_commit", unavailable)
+    request = {
+        "queryResult": {
+            "parameters": {"date": "2023-11-01T12:00:00+01:00"},
+            "intent": {"displayName": "DeleteDailyLog"},
+        }
+    }
+
+    assert Executor(request).run().startswith("I can't reach your logs right now")
@@ -0,0 +1,183 @@
+import pytest
+from firebase_admin import firestore
+from google.api_core import exceptions
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+from tests.fake_firestore import (
+    FakeClient,
+    FaultInjector,
+    LatencyModel,
+    COMMIT,
+    GET,
+    RUN_QUERY,
+)
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+def test_set_get_and_delete(client):
+    ref = client.collection("Users").document("u").collection("DailyLogs").document("d")
+    ref.set({"a": 1})
+    snapshot = ref.get()
+    assert snapshot.exists and snapshot.to_dict() == {"a": 1} and snapshot.id == "d"
+
+    ref.delete()
+    assert not ref.get().exists
+    assert client.rpc_counts == {COMMIT: 2, GET: 2}
+
+
+def test_update_field_paths_and_transforms(client):
+    ref = client.document("Users/u")
+    ref.set({"n": 1, "tags": ["a"], "activities": {"hip adductions": {"x": 1}}})
+    ref.update(
+        {
+            "n": firestore.Increment(2),
+            "tags": firestore.ArrayUnion(["a", "b"]),
+            FieldPath("activities", "hip adductions", "x").to_api_repr(): 5,
+            "gone": firestore.DELETE_FIELD,
+        }
+    )
+    assert client.dump("Users/u") == {
+        "n": 3,
+        "tags": ["a", "b"],
+        "activities": {"hip adductions": {"x": 5}},
+    }
+
+    ref.update({"tags": firestore.ArrayRemove(["a"])})
+    assert client.dump("Users/u")["tags"] == ["b"]
+
+
+def test_set_merge(client):
+    ref = client.document("Users/u")
+    ref.set({"a": {"b": 1, "c": 2}})
+    ref.set({"a": {"b": 3}, "n": firestore.Increment(1)}, merge=True)
+    assert client.dump("Users/u") == {"a": {"b": 3, "c": 2}, "n": 1}
+
+
+def test_update_missing_document_fails(client):
+    with pytest.raises(exceptions.NotFound):
+        client.document("Users/u").update({"a": 1})
+
+
+def test_preconditions(client):
+    ref = client.document("Users/u")
+    ref.create({"a": 1})
+    with pytest.raises(exceptions.AlreadyExists):
+        ref.create({"a": 2})
+
+    update_time = ref.get().update_time
+    ref.update({"a": 2}, option=client.write_option(last_update_time=update_time))
+    with pytest.raises(exceptions.FailedPrecondition):
+        ref.update({"a": 3}, option=client.write_option(last_update_time=update_time))
+    assert client.dump("Users/u") == {"a": 2}
+
+
+def test_batch_is_atomic(client):
+    client.load("Users/u", {"a": 1})
+    batch = client.batch()
+    batch.set(client.document("Users/u/DailyLogs/d"), {"b": 1})
+    batch.create(client.document("Users/u"), {"a": 2})
+    with pytest.raises(exceptions.AlreadyExists):
+        batch.commit()
+
+    assert client.dump("Users/u/DailyLogs/d") is None
+    assert client.rpc_counts == {COMMIT: 1}
+
+
+def test_get_all(client):
+    client.load("C/a", {"x": 1})
+    snapshots = list(client.get_all([client.document("C/a"), client.document("C/b")]))
+    assert [s.exists for s in snapshots] == [True, False]
+    assert client.num_rpcs == 1
+
+
+def test_query_where_order_limit_and_cursor(client):
+    for i, day in enumerate(["2023-01-03", "2023-01-01", "2023-01-02", "2023-01-04"]):
+        client.load(f"C/{day}", {"date": day, "n": i})
+
+    collection = client.collection("C")
+    assert [s.id for s in collection.stream()] == [
+        "2023-01-01",
+        "2023-01-02",
+        "2023-01-03",
+        "2023-01-04",
+    ]
+
+    query = collection.where(filter=FieldFilter("date", ">=", "2023-01-02")).order_by(
+        "date", direction="DESCENDING"
+    )
+    assert [s.id for s in query.stream()] == ["2023-01-04", "2023-01-03", "2023-01-02"]
+
+    page = collection.order_by(FieldPath.document_id()).limit(2)
+    first = list(page.stream())
+    second = list(page.start_after(first[-1]).stream())
+    assert [s.id for s in second] == ["2023-01-03", "2023-01-04"]
+
+
+def test_order_by_excludes_missing_fields_and_count(client):
+    client.load("C/a", {"activities": {"hip adductions": {}}})
+    client.load("C/b", {"activities": {"yoga": {}}})
+    query = client.collection("C").order_by(
+        FieldPath("activities", "hip adductions").to_api_repr()
+    )
+    assert query.count(alias="all").get()[0][0].value == 1
+
+
+def test_list_documents_includes_missing_parents(client):
+    client.load("Users/a", {"x": 1})
+    client.load("Users/b/DailyLogs/d", {"x": 1})
+    ids = [ref.id for ref in client.collection("Users").list_documents(page_size=1)]
+    assert ids == ["a", "b"]
+
+
+def test_transaction_retries_on_contention(client):
+    client.load("C/a", {"n": 0})
+    ref = client.document("C/a")
+    attempts = []
+
+    @firestore.transactional
+    def increment(transaction):
+        snapshot = ref.get(transaction=transaction)
+        attempts.append(1)
+        if len(attempts) == 1:
+            # Someone else writes in between the read and the commit
+            client.load("C/a", {"n": 10})
+        transaction.update(ref, {"n": snapshot.get("n") + 1})
+
+    increment(client.transaction())
+    assert len(attempts) == 2 and client.dump("C/a") == {"n": 11}
+
+
+def test_latency_is_deterministic():
+    def run():
+        client = FakeClient(latency=LatencyModel.lognormal(median_ms=20, sigma=0.5))
+        for _ in range(10):
+            client.document("C/a").get()
+        return [c.latency for c in client.calls]
+
+    assert run() == run()
+
+
+def test_per_kind_latency():
+    client = FakeClient(
+        latency=LatencyModel(lambda rng: 0.01, per_kind={COMMIT: lambda rng: 0.05})
+    )
+    client.document("C/a").set({})
+    client.document("C/a").get()
+    assert client.elapsed == pytest.approx(0.06)
+
+
+def test_fault_injection():
+    faults = FaultInjector()
+    faults.add(RUN_QUERY, exceptions.ServiceUnavailable("down"), times=1, after=1)
+    client = FakeClient(faults=faults)
+
+    list(client.collection("C").stream())
+    with pytest.raises(exceptions.ServiceUnavailable):
+        list(client.collection("C").stream())
+    list(client.collection("C").stream())
+
+    assert [c.error is not None for c in client.calls] == [False, True, False]
@@ -2,10 +2,15 @@ import os
 import pytest
 import firebase_admin
 import utils
+from datetime import date as Date, timedelta
+from errors import InvalidDeleteRange
 from firebase_admin import firestore
-from services.hiplogdb import HipLogDB
+from services.hiplogdb import MAX_DELETE_RANGE_DAYS, HipLogDB
+from models.catalog import Catalog
 from models.daily_log import DailyLog
-from models.record import Activity, Symptom
+from models.journal import JournalEntry
+from models.record import Activity, Set, Symptom
+from google.api_core.exceptions import ServiceUnavailable
 from google.cloud.firestore_v1.collection import CollectionReference
 
 
@@ -16,13 +21,15 @@ def conn():
         fb_app = firebase_admin.get_app()
     except ValueError:
         fb_app = firebase_admin.initialize_app()
+    # Opened now so that without credentials, only the tests that need the real
+    # Firestore fail (rather than whichever test ends the module, at cleanup)
+    db = firestore.client()
 
     # Keep open until end of tests
     yield fb_app
 
     # Delete all docs in the test collection
     print("Starting Cleanup")
-    db = firestore.client()
     collection_ref = (
         db.collection(os.environ["FIRESTORE_COLLECTION_NAME"])
         .document(utils.test_username)
@@ -203,3 +210,524 @@ def test_get_symptom_list_by_user_missing_symptom(conn, reset_testuser, db):
     # Test that you can still get symptoms
     symptom_list = db.get_symptom_list_by_user(utils.test_username)
     assert isinstance(symptom_list, list)
+
+
+# Offline tests, against the in-process Firestore fake (see fake_firestore.py)
+@pytest.fixture
+def fake_db(fake_firestore):
+    return HipLogDB()
+
+
+def test_fake_upload_and_get_log(fake_db, fake_firestore):
+    user = utils.test_username
+    fake_db.upload_log(user, DailyLog("2023-01-01", activities=[Activity("yoga")]))
+
+    fake_firestore.reset_stats()
+    log = HipLogDB().get_log(user, "2023-01-01")
+    assert log.activities["yoga"] == Activity("yoga")
+
+    # The log and the catalog come back in a single round trip
+    assert fake_firestore.num_rpcs == 1
+
+
+def test_fake_upload_maintains_catalog(fake_db):
+    user = utils.test_username
+    fake_db.upload_log(user, DailyLog("2023-01-01", activities=[Activity("yoga")]))
+    fake_db.upload_log(
+        user, DailyLog("2023-01-02", symptoms=[Symptom("left hip", 2)])
+    )
+
+    catalog = HipLogDB().get_catalog(user)
+    assert catalog.activities == ["yoga"] and catalog.symptoms == ["left hip"]
+    assert catalog.log_dates.count() == 2 and catalog.log_version == 2
+
+
+def test_fake_delete_log_updates_catalog(fake_db):
+    user = utils.test_username
+    fake_db.upload_log(user, DailyLog("2023-01-01", activities=[Activity("yoga")]))
+    fake_db.delete_log(user, "2023-01-01")
+
+    catalog = HipLogDB().get_catalog(user)
+    assert fake_db.get_log(user, "2023-01-01") is None
+    assert catalog.activities == [] and catalog.log_dates.count() == 0
+
+
+def test_fake_num_logs_counts_new_logs_only(fake_db, fake_firestore):
+    user = utils.test_username
+    fake_db.upload_log(user, DailyLog("2023-01-01", activities=[Activity("yoga")]))
+    fake_db.upload_log(user, DailyLog("2023-01-01", activities=[Activity("run")]))
+    fake_db.upload_log(user, DailyLog("2023-01-02", activities=[Activity("yoga")]))
+    fake_db.delete_log(user, "2023-01-01")
+    fake_db.delete_log(user, "2023-01-01")
+
+    fake_firestore.reset_stats()
+    assert HipLogDB().get_num_logs_by_user(user) == 1
+    assert fake_firestore.num_rpcs == 1
+
+
+def test_fake_reconcile_num_logs(fake_db, fake_firestore):
+    user = utils.test_username
+    for day in ["2023-01-01", "2023-01-02", "2023-02-01"]:
+        fake_db.upload_log(user, DailyLog(day, activities=[Activity("yoga")]))
+    fake_db.archive_month(user, "2023-01")
+    assert HipLogDB().reconcile_num_logs(user) == 0
+
+    # A log written around the catalog (eg by hand in the console)
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{user}"
+    fake_firestore.load(f"{path}/DailyLogs/2023-03-01", {"activities": {}})
+    assert HipLogDB().reconcile_num_logs(user) == 1
+    assert fake_firestore.dump(path)["num_logs"] == 4
+    assert HipLogDB().get_num_logs_by_user(user) == 4
+
+
+def test_fake_catalog_rebuilt_for_legacy_logs(fake_db, fake_firestore):
+    # Logs written before catalogs existed
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{utils.test_username}"
+    fake_firestore.load(
+        f"{path}/DailyLogs/2023-01-01",
+        {"activities": {"pullups": {"sets": [{"reps": 2}]}}},
+    )
+
+    catalog = fake_db.get_catalog(utils.test_username)
+    assert catalog.indexed and catalog.activities == ["pullups"]
+    assert fake_firestore.dump(path)["indexed"]
+
+
+def test_fake_upload_retries_on_concurrent_catalog_change(fake_db, fake_firestore):
+    user = utils.test_username
+    fake_db.upload_log(user, DailyLog("2023-01-01", activities=[Activity("yoga")]))
+
+    # Another instance writes a log after this one fetched the catalog
+    log = fake_db.get_log(user, "2023-01-02", initialize_empty=True)
+    HipLogDB().upload_log(user, DailyLog("2023-01-03", activities=[Activity("run")]))
+
+    log.add_activity(Activity("swim"))
+    fake_db.upload_log(user, log)
+
+    assert HipLogDB().get_catalog(user).activities == ["run", "swim", "yoga"]
+
+
+def test_fake_failed_commit_leaves_cached_catalog(fake_db, monkeypatch):
+    user = utils.test_username
+    fake_db.upload_log(user, DailyLog("2023-01-01", activities=[Activity("yoga")]))
+    catalog = fake_db.get_catalog(user)
+
+    def unavailable(*args, **kwargs):
+        raise ServiceUnavailable("down")
+
+    monkeypatch.setattr(HipLogDB, "_commit", unavailable)
+    with pytest.raises(ServiceUnavailable):
+        fake_db.upload_log(user, DailyLog("2023-01-02", activities=[Activity("run")]))
+
+    for cached in [fake_db.get_catalog(user), HipLogDB._seen_catalogs[user]]:
+        assert cached is catalog and cached.log_version == 1
+        assert cached.activities == ["yoga"] and cached.log_dates.count() == 1
+
+
+def upload_sets(db, user, date, name, reps):
+    """Log a set the way the executor does: read the log, then upload a patch"""
+    log = db.get_log(user, date, initialize_empty=True)
+    activity = Activity(name, [Set(reps=reps)])
+    activity.stamp()
+    patch = DailyLog(date, activities=[activity])
+    db.upload_patch(user, patch, log.merge(patch))
+
+
+def test_fake_concurrent_patches_keep_every_set(fake_db, fake_firestore):
+    user = utils.test_username
+    fake_db.upload_log(
+        user, DailyLog("2023-01-01", activities=[Activity("yoga", [Set(reps=1)])])
+    )
+
+    # Both devices read the log before either uploads
+    first, second = HipLogDB(), HipLogDB()
+    first.get_log(user, "2023-01-01")
+    second.get_log(user, "2023-01-01")
+    upload_sets(first, user, "2023-01-01", "yoga", 2)
+    upload_sets(second, user, "2023-01-01", "squats", 3)
+    upload_sets(second, user, "2023-01-01", "yoga", 4)
+
+    log = HipLogDB().get_log(user, "2023-01-01")
+    assert [s.reps for s in log.activities["yoga"].sets] == [1, 2, 4]
+    assert [s.reps for s in log.activities["squats"].sets] == [3]
+    catalog = HipLogDB().get_catalog(user)
+    assert catalog.activities == ["squats", "yoga"] and catalog.num_logs == 1
+
+
+def test_fake_patches_remove_sets_and_replace_symptoms(fake_db, fake_firestore):
+    user = utils.test_username
+    upload_sets(fake_db, user, "2023-01-01", "yoga", 1)
+    upload_sets(fake_db, user, "2023-01-01", "yoga", 2)
+    log = HipLogDB().get_log(user, "2023-01-01")
+    removed = log.activities["yoga"].sets[0].id
+
+    patch = DailyLog("2023-01-01", activities=[Activity("yoga", [], [removed])])
+    symptom = Symptom("hip", 2)
+    symptom.stamp()
+    patch = patch.merge(DailyLog("2023-01-01", symptoms=[symptom]))
+    fake_db.upload_patch(user, patch, log.merge(patch))
+
+    log = HipLogDB().get_log(user, "2023-01-01")
+    assert [s.reps for s in log.activities["yoga"].sets] == [2]
+    assert log.symptoms["hip"].severity == 2
+
+
+def test_fake_patches_of_archived_months_are_merged(fake_db, fake_firestore):
+    user = utils.test_username
+    upload_sets(fake_db, user, "2023-01-01", "yoga", 1)
+    fake_db.archive_month(user, "2023-01")
+
+    upload_sets(HipLogDB(), user, "2023-01-01", "yoga", 2)
+
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{user}"
+    assert fake_firestore.dump(f"{path}/DailyLogs/2023-01-01") is None
+    log = HipLogDB().get_log(user, "2023-01-01")
+    assert [s.reps for s in log.activities["yoga"].sets] == [1, 2]
+
+
+def log_with_journal(db, user, date, patch):
+    """Upload a patch along with its journal entry, the way the executor does"""
+    log = db.get_log(user, date, initialize_empty=True)
+    entry = JournalEntry.for_patch("LogActivity", log, patch)
+    db.upload_patch(user, patch, log.merge(patch), journal=entry)
+    return entry
+
+
+def test_fake_journal_is_written_with_the_change(fake_db, fake_firestore):
+    user = utils.test_username
+    fake_db.get_catalog(user)
+    squats = Activity("squats", [Set(reps=5)])
+    squats.stamp()
+
+    db = HipLogDB()
+    entry = log_with_journal(
+        db, user, "2023-01-01", DailyLog("2023-01-01", activities=[squats])
+    )
+    assert db.io_stats.rpcs("writes") == 1
+
+    assert entry.version == db.get_catalog(user).journal_head
+    journal = list(HipLogDB().stream_journal(user))
+    assert [e.to_dict() for e in journal] == [entry.to_dict()]
+
+
+def test_fake_undo_walks_back_through_changes(fake_db, fake_firestore):
+    user = utils.test_username
+    for reps in [5, 6]:
+        squats = Activity("squats", [Set(reps=reps)])
+        squats.stamp()
+        log_with_journal(
+            fake_db, user, "2023-01-01", DailyLog("2023-01-01", activities=[squats])
+        )
+    HipLogDB().delete_log(user, "2023-01-01", journal=JournalEntry("DeleteDailyLog"))
+    assert HipLogDB().get_log(user, "2023-01-01") is None
+
+    # The delete, then the second set, then the first (which empties the log)
+    db = HipLogDB()
+    entry, logs = db.undo_last_change(user)
+    assert entry.intent == "DeleteDailyLog"
+    assert [s.reps for s in logs[0].activities["squats"].sets] == [5, 6]
+    entry, _ = HipLogDB().undo_last_change(user)
+    assert entry.intent == "LogActivity"
+    log = HipLogDB().get_log(user, "2023-01-01")
+    assert [s.reps for s in log.activities["squats"].sets] == [5]
+    HipLogDB().undo_last_change(user)
+    assert HipLogDB().get_log(user, "2023-01-01") is None
+    assert HipLogDB().get_catalog(user).num_logs == 0
+
+    assert HipLogDB().undo_last_change(user) == (None, [])
+    assert all(e.undone for e in HipLogDB().stream_journal(user))
+
+
+def test_fake_reset_testuser_clears_the_journal(fake_db, fake_firestore, request):
+    user = utils.test_username
+    fake_db.upload_log(user, DailyLog("2023-01-01", activities=[Activity("yoga")]))
+    HipLogDB().delete_log(user, "2023-01-01", journal=JournalEntry("DeleteDailyLog"))
+
+    request.getfixturevalue("reset_testuser")
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{user}/"
+    assert not [p for p in fake_firestore._docs if p.startswith(path)]
+    assert HipLogDB().undo_last_change(user) == (None, [])
+
+
+def test_fake_undo_removes_new_symptoms(fake_db, fake_firestore):
+    user = utils.test_username
+    fake_db.upload_log(user, DailyLog("2023-01-01", symptoms=[Symptom("hip", 1)]))
+    db = HipLogDB()
+    log = db.get_log(user, "2023-01-01")
+    knee, hip = Symptom("knee", 2), Symptom("hip", 3)
+    knee.stamp()
+    hip.stamp()
+    patch = DailyLog("2023-01-01", symptoms=[knee, hip])
+    entry = JournalEntry.for_patch("LogSymptom", log, patch)
+    db.upload_patch(user, patch, log.merge(patch), journal=entry)
+
+    HipLogDB().undo_last_change(user)
+    log = HipLogDB().get_log(user, "2023-01-01")
+    assert list(log.symptoms) == ["hip"] and log.symptoms["hip"].severity == 1
+    assert HipLogDB().get_catalog(user).symptoms == ["hip"]
+
+
+def test_fake_compact_journal_keeps_it_bounded(fake_db, fake_firestore):
+    user = utils.test_username
+    for i in range(5):
+        yoga = Activity("yoga", [Set(reps=i + 1)])
+        yoga.stamp()
+        log_with_journal(
+            fake_db, user, "2023-01-01", DailyLog("2023-01-01", activities=[yoga])
+        )
+
+    db = HipLogDB()
+    versions = [e.version for e in db.stream_journal(user)]
+    assert db.compact_journal(user, keep_versions=2) == 3
+    assert [e.version for e in HipLogDB().stream_journal(user)] == versions[-2:]
+
+    # Changes from before the compaction can't be undone
+    db = HipLogDB()
+    for _ in range(2):
+        assert db.undo_last_change(user)[0] is not None
+    assert db.undo_last_change(user) == (None, [])
+
+
+def test_fake_stream_logs_pages(fake_db, fake_firestore):
+    user = utils.test_username
+    for day in ["2023-01-05", "2023-01-01", "2023-01-03"]:
+        fake_db.upload_log(user, DailyLog(day, activities=[Activity("yoga")]))
+
+    fake_firestore.reset_stats()
+    dates = [date for date, _ in fake_db.stream_logs(user, page_size=2)]
+    assert dates == ["2023-01-01", "2023-01-03", "2023-01-05"]
+    assert fake_firestore.num_rpcs == 2
+
+
+def test_fake_get_activity_summary_with_spaces(fake_db):
+    user = utils.test_username
+    for day in ["2023-01-01", "2023-01-02"]:
+        fake_db.upload_log(user, DailyLog(day, activities=[Activity("hip adductions")]))
+
+    assert fake_db.get_activity_summary(user, "hip adductions")["total_count"] == 2
+
+
+def test_fake_get_logs_for_range(fake_db, fake_firestore):
+    user = utils.test_username
+    for day in ["2023-01-01", "2023-01-03", "2023-01-09"]:
+        fake_db.upload_log(user, DailyLog(day, activities=[Activity("yoga")]))
+
+    fake_firestore.reset_stats()
+    logs = HipLogDB().get_logs(user, "2023-01-01", "2023-01-07")
+    assert [log.date for log in logs] == ["2023-01-01", "2023-01-03"]
+    assert fake_firestore.num_rpcs == 1
+
+
+def test_fake_delete_logs_for_range(fake_db, fake_firestore):
+    user = utils.test_username
+    for day in ["2023-01-01", "2023-01-03", "2023-01-09"]:
+        fake_db.upload_log(user, DailyLog(day, activities=[Activity(day)]))
+
+    fake_firestore.reset_stats()
+    db = HipLogDB()
+    assert db.delete_logs(user, "2023-01-01", "2023-01-07") == [
+        "2023-01-01",
+        "2023-01-03",
+    ]
+
+    # One read for the logs and catalog, one batch for the deletes and catalog
+    assert db.io_stats.rpcs("reads") == 1 and db.io_stats.rpcs("writes") == 1
+    assert HipLogDB().get_catalog(user).activities == ["2023-01-09"]
+    assert db.delete_logs(user, "2023-01-01", "2023-01-07") == []
+
+
+def test_fake_delete_logs_at_the_range_cap(fake_db, fake_firestore):
+    user = utils.test_username
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{user}"
+    first = Date(2022, 10, 1)
+    dates = [str(first + timedelta(days=i)) for i in range(MAX_DELETE_RANGE_DAYS)]
+    for day in dates:
+        fake_firestore.load(f"{path}/DailyLogs/{day}", {"activity_notes": day})
+    fake_db.get_catalog(user)
+    # The most writes per day: the logs are deleted from both layouts
+    catalog = fake_firestore.dump(path)
+    fake_firestore.load(path, dict(catalog, migrating_to="yearly"))
+
+    with pytest.raises(InvalidDeleteRange):
+        day_after = first + timedelta(days=MAX_DELETE_RANGE_DAYS)
+        HipLogDB().delete_logs(user, dates[0], str(day_after))
+    db = HipLogDB()
+    journal = JournalEntry("DeleteDailyLog")
+    assert db.delete_logs(user, dates[0], dates[-1], journal=journal) == dates
+    assert db.io_stats.rpcs("writes") == 1
+
+    # The deleted logs are kept beside the journal entry rather than in it
+    entry_path = f"{path}/Journal/{JournalEntry.doc_id(journal.version)}"
+    assert fake_firestore.dump(entry_path)["deleted"]
+    assert "restore" not in fake_firestore.dump(entry_path)
+    restore = fake_firestore.dump(f"{entry_path}/Restore/{dates[0]}")
+    assert restore["activity_notes"] == dates[0]
+
+    entry, logs = HipLogDB().undo_last_change(user)
+    assert entry.version == journal.version and len(logs) == len(dates)
+    assert len(HipLogDB().get_logs(user, dates[0], dates[-1])) == len(dates)
+
+
+def test_fake_get_logs_range_limit(fake_db):
+    with pytest.raises(ValueError, match="Invalid date range"):
+        fake_db.get_logs(utils.test_username, "2020-01-01", "2023-01-01")
+
+
+@pytest.fixture
+def yearly_db(fake_firestore, monkeypatch):
+    """A HipLogDB where new users get the yearly layout"""
+    monkeypatch.setenv("DAILYLOG_LAYOUT", "yearly")
+    return HipLogDB()
+
+
+def test_fake_yearly_layout_routes_logs(yearly_db, fake_firestore):
+    user = utils.test_username
+    for day in ["2022-12-31", "2023-01-01", "2023-01-02"]:
+        yearly_db.upload_log(user, DailyLog(day, activities=[Activity("yoga")]))
+
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{user}"
+    assert fake_firestore.dump(f"{path}/Years/2023/DailyLogs/2023-01-02")
+    assert fake_firestore.dump(f"{path}/DailyLogs/2023-01-02") is None
+    assert fake_firestore.dump(f"{path}/Years/2023") == {
+        "year": 2023,
+        "num_logs": 2,
+        "activities": {"yoga": 2},
+        "symptoms": {},
+    }
+
+    # Another instance in the same process knows the layout, so it's still a single
+    # round trip
+    fake_firestore.reset_stats()
+    db = HipLogDB()
+    assert db.get_log(user, "2022-12-31").activities["yoga"] == Activity("yoga")
+    assert fake_firestore.num_rpcs == 1
+    assert db.get_num_logs_by_user(user) == 3
+    assert db.get_activity_summary(user, "yoga")["total_count"] == 3
+
+
+def test_fake_yearly_layout_stream_since_skips_old_years(yearly_db, fake_firestore):
+    user = utils.test_username
+    for day in ["2021-06-01", "2022-06-01", "2023-01-01", "2023-06-01"]:
+        yearly_db.upload_log(user, DailyLog(day, activities=[Activity("yoga")]))
+
+    db = HipLogDB()
+    logs = list(db.stream_logs(user, since="2023-03-01"))
+    assert [date for date, _ in logs] == ["2023-06-01"]
+
+    # Only the catalog and the 2023 partition were read
+    assert db.io_stats.rpcs("queries") == 1 and db.io_stats.docs("queries") == 2
+
+
+def test_fake_get_log_follows_changed_layout(yearly_db, fake_firestore):
+    user = utils.test_username
+    yearly_db.upload_log(user, DailyLog("2023-01-01", activities=[Activity("yoga")]))
+
+    # Eg another process remembers an older layout
+    HipLogDB._seen_catalogs[user] = Catalog()
+    assert HipLogDB().get_log(user, "2023-01-01") is not None
+
+
+def test_fake_migrate_layout(fake_db, fake_firestore):
+    user = utils.test_username
+    for day in ["2022-12-31", "2023-01-01"]:
+        fake_db.upload_log(user, DailyLog(day, activities=[Activity("yoga")]))
+
+    assert HipLogDB().migrate_layout(user, "yearly", page_size=1) == 2
+
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{user}"
+    assert fake_firestore.dump(f"{path}/DailyLogs/2023-01-01") is None
+    assert fake_firestore.dump(f"{path}/Years/2022")["num_logs"] == 1
+    db = HipLogDB()
+    assert db.get_catalog(user).layout == "yearly"
+    assert [log.date for log in db.get_logs(user, "2022-12-30", "2023-01-02")] == [
+        "2022-12-31",
+        "2023-01-01",
+    ]
+
+    # And back again, after which nothing is left in the yearly layout
+    assert db.migrate_layout(user, "flat") == 2
+    assert fake_firestore.dump(f"{path}/Years/2022") is None
+    assert HipLogDB().get_log(user, "2023-01-01") is not None
+
+
+def test_fake_writes_go_to_both_layouts_while_migrating(fake_db, fake_firestore):
+    user = utils.test_username
+    fake_db.upload_log(user, DailyLog("2023-01-01", activities=[Activity("yoga")]))
+
+    # A migration that was interrupted after it started
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{user}"
+    catalog = fake_firestore.dump(path)
+    fake_firestore.load(path, dict(catalog, migrating_to="yearly"))
+
+    HipLogDB().upload_log(user, DailyLog("2023-01-02", activities=[Activity("run")]))
+    assert fake_firestore.dump(f"{path}/DailyLogs/2023-01-02")
+    assert fake_firestore.dump(f"{path}/Years/2023/DailyLogs/2023-01-02")
+
+    # Resuming copies only what isn't there yet
+    assert HipLogDB().migrate_layout(user, "yearly") == 1
+
+
+def test_fake_archive_month(fake_db, fake_firestore):
+    user = utils.test_username
+    for day in ["2023-01-01", "2023-01-15", "2023-02-01"]:
+        fake_db.upload_log(user, DailyLog(day, activities=[Activity("yoga")]))
+    before = fake_db.get_logs(user, "2023-01-01", "2023-02-01")
+
+    assert HipLogDB().archive_month(user, "2023-01") == 2
+
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{user}"
+    assert fake_firestore.dump(f"{path}/DailyLogs/2023-01-01") is None
+    assert fake_firestore.dump(f"{path}/Archives/2023-01")["num_logs"] == 2
+    db = HipLogDB()
+    fake_firestore.reset_stats()
+    after = db.get_logs(user, "2023-01-01", "2023-02-01")
+    assert [log.to_dict() for log in after] == [log.to_dict() for log in before]
+    assert fake_firestore.num_rpcs == 1
+    assert db.get_num_logs_by_user(user) == 3
+
+    # Already archived
+    assert db.archive_month(user, "2023-01") == 0
+
+
+def test_fake_write_to_archived_month(fake_db, fake_firestore):
+    user = utils.test_username
+    for day in ["2023-01-01", "2023-01-02"]:
+        fake_db.upload_log(user, DailyLog(day, activities=[Activity("yoga")]))
+    fake_db.archive_month(user, "2023-01")
+
+    db = HipLogDB()
+    log = db.get_log(user, "2023-01-02")
+    log.add_activity(Activity("swim"))
+    db.upload_log(user, log)
+    HipLogDB().delete_log(user, "2023-01-01")
+
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{user}"
+    assert fake_firestore.dump(f"{path}/DailyLogs/2023-01-02") is None
+    assert fake_firestore.dump(f"{path}/Archives/2023-01")["dates"] == ["2023-01-02"]
+    db = HipLogDB()
+    assert db.get_log(user, "2023-01-01") is None
+    assert sorted(db.get_log(user, "2023-01-02").activities) == ["swim", "yoga"]
+    assert db.get_catalog(user).activities == ["swim", "yoga"]
+
+
+def test_fake_stream_and_rebuild_include_archives(fake_db, fake_firestore):
+    user = utils.test_username
+    for day in ["2022-12-31", "2023-01-01", "2023-02-01"]:
+        fake_db.upload_log(user, DailyLog(day, activities=[Activity("yoga")]))
+    fake_db.archive_month(user, "2023-01")
+    fake_db.archive_month(user, "2022-12")
+
+    db = HipLogDB()
+    assert [date for date, _ in db.stream_logs(user)] == [
+        "2022-12-31",
+        "2023-01-01",
+        "2023-02-01",
+    ]
+    assert [date for date, _ in db.stream_logs(user, since="2023-01-01")] == [
+        "2023-01-01",
+        "2023-02-01",
+    ]
+
+    catalog = db.rebuild_catalog(user)
+    assert catalog.archived_months == {"2022-12", "2023-01"}
+    assert catalog.log_dates.count() == 3
@@ -265,6 +265,23 @@ def test_intent_init_for_get_num_logs():
     assert intent.type == "GetNumLogs" and not intent.log_input
 
 
+def test_intent_init_for_get_streak():
+    req = {
+        "queryResult": {
+            "parameters": {"activity": "PT Exercises"},
+            "intent": {
+                "displayName": "GetStreak",
+            },
+        }
+    }
+
+    intent = Intent(req)
+    assert intent.log_input == {"name": "pt exercises"}
+
+    req["queryResult"]["parameters"] = {"activity": ""}
+    assert Intent(req).log_input == {}
+
+
 def test_invalid_intent_type():
     req = {
         "queryResult": {
@@ -317,3 +334,49 @@ def test_missing_attributes_skipped():
 def test_new_attributes_are_tbd():
     # What happens at the intent level if eg an activity has some new parameter we didn't expect (eg location=park) # noqa
     pass
+
+
+def test_intent_init_with_date_period():
+    req = {
+        "queryResult": {
+            "parameters": {
+                "date": "today",
+                "date-period": {
+                    "startDate": "2023-10-30T00:00:00+01:00",
+                    "endDate": "2023-11-05T23:59:59+01:00",
+                },
+            },
+            "intent": {
+                "displayName": "GetDailyLog",
+            },
+        }
+    }
+
+    intent = Intent(req)
+    assert intent.is_date_range
+    assert (intent.start_date, intent.end_date) == ("2023-10-30", "2023-11-05")
+
+    # Without a period it's a single date
+    req["queryResult"]["parameters"]["date-period"] = ""
+    intent = Intent(req)
+    assert not intent.is_date_range
+    assert intent.start_date == intent.end_date == str(date.today())
+
+
+def test_intent_date_period_in_reverse_order():
+    req = {
+        "queryResult": {
+            "parameters": {
+                "date-period": {
+                    "startDate": "2023-11-05T00:00:00+01:00",
+                    "endDate": "2023-10-30T00:00:00+01:00",
+                },
+            },
+            "intent": {
+                "displayName": "DeleteDailyLog",
+            },
+        }
+    }
+
+    intent = Intent(req)
+    assert (intent.start_date, intent.end_date) == ("2023-10-30", "2023-11-05")
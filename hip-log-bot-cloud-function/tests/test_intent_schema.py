@@ -0,0 +1,116 @@
+import pytest
+from errors import (
+    InvalidParameter,
+    MismatchedSets,
+    MissingParameter,
+    UnsupportedIntent,
+    ValidationError,
+)
+from models.intent import Intent
+from models.intent_schema import INTENT_SCHEMAS, parse_sets
+from models.measurement import Measurement
+from models.record import Set
+from models.supported_intents import SupportedIntents
+
+
+def make_request(intent_type, parameters):
+    return {
+        "queryResult": {
+            "intent": {"displayName": intent_type},
+            "parameters": parameters,
+        }
+    }
+
+
+def test_every_supported_intent_has_a_schema():
+    assert set(INTENT_SCHEMAS) == set(i.name for i in SupportedIntents)
+
+
+def test_sets_are_converted_while_parsing():
+    intent = Intent(
+        make_request(
+            "LogActivity",
+            {
+                "activity": "Curls",
+                "date": "2023-07-24T12:00:00+01:00",
+                "reps": [8.0, 6.0],
+                "weight": [
+                    {"amount": "12.5", "unit": "kg"},
+                    {"amount": 15, "unit": "kg"},
+                ],
+                "duration": [],
+            },
+        )
+    )
+
+    assert intent.log_input["name"] == "curls"
+    assert intent.sets == [
+        Set(reps=8, weight=Measurement(12.5, "kg")),
+        Set(reps=6, weight=Measurement(15, "kg")),
+    ]
+    assert intent.log_input["sets"] == [
+        {"reps": 8, "weight": {"amount": "12.5", "unit": "kg"}},
+        {"reps": 6, "weight": {"amount": 15, "unit": "kg"}},
+    ]
+
+
+def test_sets_without_reps():
+    set_dicts, sets = parse_sets(
+        {"reps": "", "duration": [{"amount": 10, "unit": "min"}], "weight": []}
+    )
+
+    assert set_dicts == [{"duration": {"amount": 10, "unit": "min"}}]
+    assert sets == [Set(duration=Measurement(10, "min"))]
+
+
+def test_parse_errors_are_typed():
+    with pytest.raises(UnsupportedIntent):
+        Intent(make_request("LogMood", {}))
+
+    with pytest.raises(MissingParameter) as e:
+        Intent(make_request("LogSymptom", {"symptom": "hip pain", "date": "today"}))
+    assert e.value.parameter == "severity"
+
+    with pytest.raises(MismatchedSets):
+        parse_sets({"reps": [1, 2], "weight": [{"amount": 10, "unit": "kg"}]})
+
+    with pytest.raises(InvalidParameter) as e:
+        parse_sets({"reps": [1], "weight": [{"amount": "heavy", "unit": "kg"}]})
+    assert e.value.parameter == "sets"
+
+    # Still ValueErrors, for callers that don't care which
+    assert issubclass(ValidationError, ValueError)
+
+
+def test_edit_set_takes_a_single_sets_values():
+    intent = Intent(
+        make_request(
+            "EditSet",
+            {"activity": "Squats", "set-number": 2.0, "reps": [12], "date": "today"},
+        )
+    )
+    assert intent.log_input["set_number"] == 2
+    assert intent.log_input["sets"] == [{"reps": 12}]
+
+    for parameters, error in [
+        ({"reps": [], "weight": ""}, MissingParameter),
+        ({"reps": [12, 10]}, InvalidParameter),
+        ({"reps": [12], "set-number": 0}, InvalidParameter),
+        ({"reps": [12], "set-number": 1.5}, InvalidParameter),
+    ]:
+        parameters = dict(
+            {"activity": "Squats", "set-number": 2, "date": "today"}, **parameters
+        )
+        with pytest.raises(error):
+            Intent(make_request("EditSet", parameters))
+
+
+@pytest.mark.parametrize("severity", ["4", -1, "bad"])
+def test_invalid_severity(severity):
+    with pytest.raises(InvalidParameter):
+        Intent(
+            make_request(
+                "LogSymptom",
+                {"symptom": "hip pain", "severity": severity, "date": "today"},
+            )
+        )
@@ -0,0 +1,184 @@
+from typing import List, Tuple
+import pytest
+import utils
+from errors import ERROR_RESPONSES, UNKNOWN_ERROR_RESPONSE
+from models.daily_log import DailyLog
+from models.record import Activity, Symptom
+from models.supported_intents import SupportedIntents
+from services import jobs
+from services.executor import Executor
+from services.hiplogdb import HipLogDB
+from services.io_stats import (
+    ADMISSION_BUDGET,
+    INTENT_BUDGETS,
+    KINDS,
+    NEW_USER_BUDGET,
+    IOBudget,
+    IOStats,
+)
+from services.jobs import FirestoreJobQueue
+from services.rate_limit import AdmissionControl, FirestoreCounterStore, RateLimiter
+from tests.fake_firestore import AGGREGATE, COMMIT, GET, RUN_QUERY
+
+DATE = "2023-11-03T12:00:00+01:00"
+
+PARAMETERS = {
+    "GetCommandList": {},
+    "GetNumLogs": {},
+    "GetStreak": {"activity": "squats"},
+    "GetActivityList": {},
+    "GetSymptomList": {},
+    "GetSymptomTrend": {"symptom": "left hip"},
+    "GetDailyLog": {"date": DATE},
+    "LogActivity": {
+        "activity": "Squats",
+        "reps": [10],
+        "weight": [],
+        "duration": [],
+        "date": DATE,
+    },
+    "LogSymptom": {"symptom": "Left hip", "severity": "2", "date": DATE},
+    "UndoLastSet": {"activity": "squats", "date": DATE},
+    "EditSet": {"activity": "squats", "set-number": 1, "reps": [5], "date": DATE},
+    "DeleteActivity": {"activity": "squats", "date": DATE},
+    "UndoLastChange": {},
+    "DeleteDailyLog": {"date": DATE},
+    "GetActivitySummary": {"activity": "squat"},
+    "GetCorrelations": {},
+}
+
+ERROR_REPLIES = set(ERROR_RESPONSES.values()) | {UNKNOWN_ERROR_RESPONSE}
+
+# The fake's RPCs, by the kind of round trip they're budgeted as
+RPC_KINDS = {
+    GET: "reads",
+    COMMIT: "writes",
+    RUN_QUERY: "queries",
+    AGGREGATE: "aggregations",
+}
+
+
+@pytest.fixture(autouse=True)
+def firestore_queue(monkeypatch):
+    """Jobs are queued in Firestore, as they are by default"""
+    monkeypatch.setattr(jobs, "_queue", FirestoreJobQueue())
+
+
+@pytest.fixture()
+def seeded_user(fake_firestore):
+    """A user with some history and an up to date catalog"""
+    hiplogdb = HipLogDB()
+    for day in ["2023-11-01", "2023-11-02", "2023-11-03"]:
+        hiplogdb.upload_log(
+            utils.test_username,
+            DailyLog(
+                day,
+                activities=[Activity("squats")],
+                symptoms=[Symptom("left hip", 1)],
+            ),
+        )
+
+    return utils.test_username
+
+
+def test_track_counts_and_times():
+    stats = IOStats()
+    with stats.track("reads") as op:
+        op.docs = 2
+    with stats.track("writes"):
+        pass
+
+    assert stats.rpcs("reads") == 1 and stats.docs("reads") == 2
+    assert stats.num_rpcs == 2 and stats.elapsed >= 0
+    assert str(stats).startswith("reads=1 (2 docs), writes=1, queries=0")
+
+
+def test_track_counts_failed_round_trips():
+    stats = IOStats()
+    with pytest.raises(RuntimeError):
+        with stats.track("writes"):
+            raise RuntimeError()
+
+    assert stats.rpcs("writes") == 1
+
+
+def test_over_budget():
+    stats = IOStats()
+    for _ in range(3):
+        with stats.track("reads"):
+            pass
+
+    assert stats.over_budget(IOBudget(reads=1)) == ["reads 3 > 1"]
+    assert stats.over_budget(IOBudget(reads=None)) == []
+    assert stats.over_budget(IOBudget(reads=1) + IOBudget(reads=2)) == []
+
+
+def test_every_intent_has_a_budget():
+    assert set(INTENT_BUDGETS) == set(SupportedIntents.all())
+
+
+def run_intent(fake_firestore, intent: str) -> Tuple[Executor, dict]:
+    """Run a request for an intent as the webhook does: admitted (with its sender's
+    count synced through Firestore), then executed
+
+    Returns:
+        tuple: (the executor, the request's RPCs seen by the fake, by kind)
+    """
+    request = {
+        "queryResult": {
+            "parameters": dict(PARAMETERS[intent]),
+            "intent": {"displayName": intent},
+        }
+    }
+
+    fake_firestore.reset_stats()
+    with AdmissionControl(RateLimiter(FirestoreCounterStore())).admit(request):
+        executor = Executor(request)
+        assert executor.run() not in ERROR_REPLIES
+
+    rpcs = fake_firestore.rpc_counts
+    assert set(rpcs) <= set(RPC_KINDS), rpcs
+    return executor, {RPC_KINDS[kind]: n for kind, n in rpcs.items()}
+
+
+def over_budget(rpcs: dict, budget: IOBudget) -> List[str]:
+    """How a request's RPCs (see `run_intent()`) exceed a budget"""
+    res = []
+    for kind in KINDS:
+        limit = getattr(budget, kind)
+        if limit is not None and rpcs.get(kind, 0) > limit:
+            res.append(f"{kind} {rpcs[kind]} > {limit}")
+
+    return res
+
+
+@pytest.mark.parametrize("intent", sorted(PARAMETERS))
+def test_intent_within_io_budget(fake_firestore, seeded_user, intent):
+    executor, rpcs = run_intent(fake_firestore, intent)
+    assert executor.io_stats.over_budget(INTENT_BUDGETS[intent]) == []
+    assert over_budget(rpcs, INTENT_BUDGETS[intent] + ADMISSION_BUDGET) == []
+
+
+@pytest.mark.parametrize("intent", sorted(PARAMETERS))
+def test_new_user_intent_within_io_budget(fake_firestore, intent):
+    executor, rpcs = run_intent(fake_firestore, intent)
+    budget = INTENT_BUDGETS[intent] + NEW_USER_BUDGET
+    assert executor.io_stats.over_budget(budget) == []
+    assert over_budget(rpcs, budget + ADMISSION_BUDGET) == []
+
+
+def test_activity_list_reads_catalog_not_logs(seeded_user):
+    hiplogdb = HipLogDB()
+    assert hiplogdb.get_activity_list_by_user(seeded_user) == ["squats"]
+    assert hiplogdb.get_symptom_list_by_user(seeded_user) == ["left hip"]
+
+    assert hiplogdb.io_stats.rpcs("reads") == 1
+    assert hiplogdb.io_stats.rpcs("queries") == 0
+
+
+def test_stream_logs_counts_query_pages(seeded_user):
+    hiplogdb = HipLogDB()
+    list(hiplogdb.stream_logs(seeded_user, page_size=2))
+
+    assert hiplogdb.io_stats.rpcs("queries") == 2
+    assert hiplogdb.io_stats.docs("queries") == 3
@@ -0,0 +1,208 @@
+import threading
+import time
+import pytest
+import utils
+from models.daily_log import DailyLog
+from services import executor, jobs
+from services.executor import Executor
+from services.hiplogdb import HipLogDB
+from services.jobs import (
+    DEAD,
+    PENDING,
+    FirestoreJobQueue,
+    Job,
+    JobWorker,
+    MemoryJobQueue,
+    SQLiteJobQueue,
+)
+from tests.fake_firestore import COMMIT
+
+
+@pytest.fixture(params=["memory", "sqlite", "firestore"])
+def queue(request, tmp_path):
+    if request.param == "memory":
+        return MemoryJobQueue()
+    if request.param == "firestore":
+        request.getfixturevalue("fake_firestore")
+        return FirestoreJobQueue()
+    return SQLiteJobQueue(str(tmp_path / "jobs.db"))
+
+
+def test_dedupe_per_user(queue):
+    assert queue.enqueue("rebuild_catalog", "a")
+    assert not queue.enqueue("rebuild_catalog", "a")
+    assert queue.enqueue("rebuild_catalog", "b")
+    assert queue.enqueue("archive_logs", "a")
+    assert queue.counts() == {PENDING: 3}
+
+    # Once it's running, a new change needs a new run
+    job = queue.claim()
+    assert (job.kind, job.user, job.attempts) == ("rebuild_catalog", "a", 1)
+    assert queue.enqueue("rebuild_catalog", "a")
+
+
+def test_retry_with_backoff(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "MAX_ATTEMPTS", 2)
+    queue.enqueue("archive_logs", "a", {"min_age_months": 6})
+
+    job = queue.claim(now=100)
+    assert job.payload == {"min_age_months": 6}
+    assert queue.fail(job, "boom", now=100)
+    assert queue.claim(now=101) is None
+
+    job = queue.claim(now=100 + jobs.RETRY_BACKOFF_SECONDS)
+    assert job.attempts == 2
+    assert not queue.fail(job, "boom again")
+    assert queue.counts() == {DEAD: 1}
+
+
+def test_expired_lease_is_claimed_again(queue):
+    queue.enqueue("rebuild_catalog", "a")
+    queue.claim(now=100)
+
+    assert queue.claim(now=101) is None
+    assert queue.claim(now=100 + jobs.LEASE_SECONDS).attempts == 2
+
+
+def test_firestore_queue_is_shared(fake_firestore, monkeypatch):
+    HipLogDB().upload_log(utils.test_username, DailyLog("2023-11-01"))
+    fake_firestore.reset_stats()
+
+    # Queued by the webhook on one instance, in the delete's batch...
+    monkeypatch.setattr(jobs, "_queue", FirestoreJobQueue())
+    Executor(
+        {
+            "queryResult": {
+                "parameters": {"date": "2023-11-01T12:00:00+01:00"},
+                "intent": {"displayName": "DeleteDailyLog"},
+            }
+        }
+    ).run()
+    assert fake_firestore.rpc_counts[COMMIT] == 1
+
+    # ...and run by a worker on another
+    metrics = JobWorker(FirestoreJobQueue()).run()
+    assert "recompute_stats" in metrics.seconds
+    assert metrics.succeeded == metrics.finished
+    assert FirestoreJobQueue().counts() == {}
+
+
+def test_firestore_queue_is_per_database(fake_firestore, monkeypatch):
+    monkeypatch.setenv("FIRESTORE_COLLECTION_NAME", "UsersTest")
+    FirestoreJobQueue().enqueue("rebuild_catalog", "a")
+
+    monkeypatch.setenv("FIRESTORE_COLLECTION_NAME", "Users")
+    assert FirestoreJobQueue().claim() is None
+    assert [p for p in fake_firestore._docs if p.startswith("UsersTestJobs/")]
+
+
+def test_firestore_retry_covered_by_a_new_job(fake_firestore):
+    queue = FirestoreJobQueue()
+    queue.enqueue("rebuild_catalog", "a")
+    job = queue.claim(now=100)
+    assert queue.enqueue("rebuild_catalog", "a")
+
+    # The retry is dropped, as the new job runs anyway
+    assert not queue.fail(job, "boom", now=100)
+    assert queue.counts() == {PENDING: 1}
+
+
+def test_backoff_is_capped():
+    job = Job("rebuild_catalog", "a", attempts=20)
+    assert job.retry_delay() == jobs.MAX_RETRY_BACKOFF_SECONDS
+
+
+def test_worker_bounded_concurrency(queue):
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+
+    def handler(job):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.01)
+        with lock:
+            running["now"] -= 1
+
+    for user in range(10):
+        queue.enqueue("recompute_stats", str(user))
+
+    metrics = JobWorker(queue, {"recompute_stats": handler}, max_workers=3).run()
+    assert metrics.succeeded == 10 and running["max"] == 3
+    assert queue.counts() in ({}, {"done": 10})
+    assert str(metrics).startswith("10 succeeded, 0 retried, 0 dead")
+
+
+def test_worker_retries_failures(queue):
+    attempts = []
+
+    def handler(job):
+        attempts.append(job.attempts)
+        raise RuntimeError("Firestore unavailable")
+
+    queue.enqueue("rebuild_catalog", "a")
+    metrics = JobWorker(queue, {"rebuild_catalog": handler}).run()
+
+    # The retry isn't due yet, so it's left for a later run
+    assert attempts == [1] and metrics.retried == 1
+    assert queue.counts() == {PENDING: 1}
+
+
+def test_delete_queues_stats_recompute(fake_firestore, monkeypatch):
+    queue = MemoryJobQueue()
+    monkeypatch.setattr(jobs, "_queue", queue)
+    HipLogDB().upload_log(utils.test_username, DailyLog("2023-11-01"))
+    request = {
+        "queryResult": {
+            "parameters": {"date": "2023-11-01T12:00:00+01:00"},
+            "intent": {"displayName": "DeleteDailyLog"},
+        }
+    }
+
+    Executor(request).run()
+    job = queue.claim()
+    assert (job.kind, job.user) == ("recompute_stats", utils.test_username)
+
+
+def test_old_logs_queue_archival(fake_firestore, monkeypatch):
+    queue = MemoryJobQueue()
+    monkeypatch.setattr(jobs, "_queue", queue)
+    request = {
+        "queryResult": {
+            "parameters": {
+                "activity": "Squats",
+                "reps": [],
+                "weight": [],
+                "duration": [],
+                "date": "2020-01-01T12:00:00+01:00",
+            },
+            "intent": {"displayName": "LogActivity"},
+        }
+    }
+
+    Executor(request).run()
+    assert queue.counts() == {PENDING: 1}
+    assert JobWorker(queue).run().succeeded == 1
+    catalog = HipLogDB().get_catalog(utils.test_username)
+    assert catalog.archived_months == {"2020-01"}
+
+
+def test_writes_queue_log_counter_reconciliation(fake_firestore, monkeypatch):
+    queue = MemoryJobQueue()
+    monkeypatch.setattr(jobs, "_queue", queue)
+    monkeypatch.setattr(executor, "RECONCILE_EVERY_WRITES", 2)
+    request = {
+        "queryResult": {
+            "parameters": {"symptom": "Hip", "severity": 2, "date": "today"},
+            "intent": {"displayName": "LogSymptom"},
+        }
+    }
+
+    # The second write is due a reconciliation
+    Executor(request).run()
+    assert queue.claim() is None
+    Executor(request).run()
+    job = queue.claim()
+    assert (job.kind, job.user) == ("reconcile_num_logs", utils.test_username)
+    jobs.reconcile_num_logs(job)
+    assert HipLogDB().get_num_logs_by_user(utils.test_username) == 1
@@ -0,0 +1,56 @@
+from models.daily_log import DailyLog
+from models.journal import JournalEntry
+from models.record import Activity, Set, Symptom
+
+
+def stamped(activity: Activity) -> Activity:
+    activity.stamp()
+    return activity
+
+
+def test_inverse_of_new_sets_removes_them():
+    log = DailyLog("2023-11-01", activities=[stamped(Activity("squats", [Set(5)]))])
+    patch = DailyLog("2023-11-01", activities=[stamped(Activity("squats", [Set(6)]))])
+    entry = JournalEntry.for_patch("LogActivity", log, patch)
+
+    assert entry.dates == ["2023-11-01"] and entry.patch == patch.to_dict()
+    reverted = log.merge(patch).merge(entry.get_undo_patch())
+    assert [s.reps for s in reverted.activities["squats"].sets] == [5]
+
+
+def test_inverse_of_removed_sets_adds_them_back_in_place():
+    log = DailyLog.from_dict(
+        "2023-11-01",
+        {"activities": {"squats": {"sets": [{"reps": 5}, {"reps": 6}, {"reps": 7}]}}},
+    )
+    patch = DailyLog("2023-11-01", activities=[log.activities["squats"].removal()])
+    entry = JournalEntry.for_patch("DeleteActivity", log, patch)
+
+    changed = log.merge(patch)
+    assert changed.activities == {}
+    reverted = changed.merge(entry.get_undo_patch())
+    assert [s.reps for s in reverted.activities["squats"].sets] == [5, 6, 7]
+
+
+def test_inverse_of_symptoms_restores_or_removes_them():
+    log = DailyLog("2023-11-01", symptoms=[Symptom("hip", 1)])
+    log.symptoms["hip"].stamp()
+    hip, knee = Symptom("hip", 3), Symptom("knee", 2)
+    hip.stamp()
+    knee.stamp()
+    patch = DailyLog("2023-11-01", symptoms=[hip, knee])
+    entry = JournalEntry.for_patch("LogSymptom", log, patch)
+
+    assert entry.removed_symptoms == ["knee"]
+    reverted = log.merge(patch).merge(entry.get_undo_patch())
+    assert reverted.symptoms["hip"].severity == 1
+
+
+def test_to_and_from_dict():
+    entry = JournalEntry("DeleteDailyLog", ["2023-11-01"], restore={"2023-11-01": {}})
+    entry.version, entry.previous = 12, 7
+    copy = JournalEntry.from_dict(entry.to_dict())
+
+    assert copy.to_dict() == entry.to_dict()
+    assert copy.is_delete and not copy.undone
+    assert JournalEntry.doc_id(12) < JournalEntry.doc_id(100)
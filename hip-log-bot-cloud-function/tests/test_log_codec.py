@@ -0,0 +1,83 @@
+import io
+import json
+import pytest
+from models import log_codec
+from models.daily_log import DailyLog
+from models.measurement import Measurement
+from models.record import Activity, Set, Symptom
+
+LOGS = [
+    DailyLog(
+        "2023-11-03",
+        activities=[
+            Activity(
+                "squats",
+                sets=[
+                    Set(reps=10, weight=Measurement(60, "kg")),
+                    Set(reps=8, weight=Measurement(62.5, "lb")),
+                ],
+            ),
+            Activity("plank", sets=Set(duration=Measurement(1.5, "min"))),
+        ],
+        symptoms=[Symptom("left hip", 2)],
+        activity_notes="felt strong",
+    ),
+    DailyLog("2023-11-04", symptoms=[Symptom("left hip", 0)]),
+    DailyLog("2023-11-05", activities=[Activity("squats")], symptom_notes="sore"),
+    DailyLog("1969-12-31"),
+]
+
+
+def pairs():
+    return [(log.date, log.to_dict()) for log in LOGS]
+
+
+def test_round_trip():
+    assert list(log_codec.loads(log_codec.dumps(pairs()))) == pairs()
+
+
+def test_round_trip_through_daily_log():
+    for (date, log_dict), (_, original) in zip(
+        log_codec.loads(log_codec.dumps(pairs())), pairs()
+    ):
+        assert DailyLog.from_dict(date, log_dict).to_dict() == original
+
+
+def test_stream_to_file():
+    fp = io.BytesIO()
+    assert log_codec.dump(iter(pairs()), fp) == len(LOGS)
+
+    fp.seek(0)
+    assert list(log_codec.load(fp)) == pairs()
+    assert list(log_codec.load(io.BytesIO())) == []
+
+
+def test_smaller_than_json():
+    encoded = log_codec.dumps(pairs())
+    assert len(encoded) < len(json.dumps(pairs())) / 3
+
+
+def test_names_written_once():
+    logs = [(f"2023-11-0{i}", LOGS[2].to_dict()) for i in range(1, 4)]
+    assert log_codec.dumps(logs).count(b"squats") == 1
+
+
+def test_unknown_unit_kept():
+    log_dict = DailyLog("2023-11-03").to_dict()
+    log_dict["activities"] = {
+        "run": {"sets": [{"duration": {"amount": 1, "unit": "x"}}]}
+    }
+
+    assert list(log_codec.loads(log_codec.dumps([("2023-11-03", log_dict)]))) == [
+        ("2023-11-03", log_dict)
+    ]
+
+
+def test_every_unit_has_a_code():
+    assert set(Measurement.ALLOWED_UNITS) <= set(log_codec.UNITS)
+
+
+def test_unsupported_version():
+    data = bytes([log_codec.VERSION + 1]) + log_codec.dumps(pairs())[1:]
+    with pytest.raises(ValueError):
+        list(log_codec.loads(data))
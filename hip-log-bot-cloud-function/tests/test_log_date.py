@@ -0,0 +1,83 @@
+import pickle
+from datetime import date, datetime, timedelta, timezone
+import pytest
+from errors import InvalidParameter
+from models import log_date
+from models.daily_log import DailyLog
+from models.intent import Intent
+from models.log_date import LogDate
+
+
+def make_request(intent_type, parameters):
+    return {
+        "queryResult": {
+            "intent": {"displayName": intent_type},
+            "parameters": parameters,
+        }
+    }
+
+
+def test_parse_once_and_use_as_str():
+    parsed = LogDate.parse("2023-07-24")
+
+    assert parsed == "2023-07-24"
+    assert parsed.date == date(2023, 7, 24)
+    assert LogDate.parse("2023-07-24") is parsed
+    assert LogDate.parse(parsed) is parsed
+    assert {parsed: 1}["2023-07-24"] == 1
+    assert parsed.format("%b. %-d") is parsed.format("%b. %-d")
+    assert pickle.loads(pickle.dumps(parsed)).date == parsed.date
+    with pytest.raises(ValueError):
+        LogDate.parse("yesterday")
+
+
+def test_today_at_the_users_offset():
+    for hours in (-12, 0, 14):
+        offset = timedelta(hours=hours)
+        assert log_date.today(offset).date == datetime.now(timezone(offset)).date()
+    assert log_date.today() == str(date.today())
+
+
+def test_utc_offset_of_timestamps():
+    assert log_date.utc_offset_of("2023-07-24T12:00:00+01:00") == timedelta(hours=1)
+    assert log_date.utc_offset_of("2023-07-24T12:00:00Z") == timedelta(0)
+    assert log_date.utc_offset_of("2023-07-24T12:00:00") is None
+    assert log_date.utc_offset_of("today") is None
+
+
+def test_intent_dates_are_parsed_once_with_the_users_offset():
+    intent = Intent(
+        make_request(
+            "LogSymptom",
+            {"symptom": "Hip", "severity": 3, "date": "2023-07-24T23:30:00-07:00"},
+        )
+    )
+
+    assert isinstance(intent.date, LogDate)
+    assert intent.date.date == date(2023, 7, 24)
+    assert intent.utc_offset == timedelta(hours=-7)
+    assert intent.today.date == datetime.now(timezone(timedelta(hours=-7))).date()
+    assert DailyLog(intent.date).date is intent.date
+
+    period = Intent(
+        make_request(
+            "GetDailyLog",
+            {
+                "date-period": {
+                    "startDate": "2023-10-30T00:00:00+01:00",
+                    "endDate": "2023-11-05T23:59:59+01:00",
+                }
+            },
+        )
+    )
+    assert (period.start_date.date, period.end_date.date) == (
+        date(2023, 10, 30),
+        date(2023, 11, 5),
+    )
+    assert period.utc_offset == timedelta(hours=1)
+
+
+def test_bad_dates_are_rejected_while_parsing():
+    with pytest.raises(InvalidParameter) as e:
+        Intent(make_request("GetDailyLog", {"date": "next blursday"}))
+    assert e.value.parameter == "date"
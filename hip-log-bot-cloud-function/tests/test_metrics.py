@@ -0,0 +1,77 @@
+import os
+import pytest
+import utils
+from services import metrics
+from services.executor import Executor
+from services.metrics import MetricsRegistry
+
+
+@pytest.fixture()
+def enabled_metrics():
+    metrics.REGISTRY.clear()
+    metrics.REGISTRY.enable()
+    yield metrics.REGISTRY
+    metrics.REGISTRY.enable(False)
+    metrics.REGISTRY.clear()
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry(enabled=True)
+    requests = registry.counter("requests_total", "Requests", ("intent",))
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    requests.inc("GetNumLogs")
+    requests.inc("GetNumLogs")
+    requests.inc('Say "hi"')
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{intent="GetNumLogs"} 2',
+        'requests_total{intent="Say \\"hi\\""} 1',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
+
+
+def test_disabled_registry_records_nothing():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ("intent",))
+    requests.inc("GetNumLogs")
+    with registry.histogram("latency_seconds", "Latency").time():
+        pass
+
+    assert "requests_total{" not in registry.render()
+    assert "latency_seconds_count" not in registry.render()
+
+
+def test_requests_are_instrumented(fake_firestore, enabled_metrics):
+    # A log from before catalogs existed
+    path = f"{os.environ['FIRESTORE_COLLECTION_NAME']}/{utils.test_username}"
+    fake_firestore.load(f"{path}/DailyLogs/2023-01-01", {"activities": {}})
+    request = {
+        "queryResult": {
+            "parameters": {},
+            "intent": {"displayName": "GetNumLogs"},
+        }
+    }
+    executor = Executor(request)
+    executor.run()
+    Executor({"queryResult": {}}).run()
+
+    text = enabled_metrics.render()
+    assert 'hiplog_requests_total{intent="GetNumLogs",outcome="ok"} 1' in text
+    assert 'hiplog_requests_total{intent="unknown",outcome="ValidationError"} 1' in text
+    assert 'hiplog_intent_parse_errors_total{error="ValidationError"} 1' in text
+    # The user's catalog is built from their logs first
+    reads = executor.io_stats.rpcs("reads")
+    assert f'hiplog_firestore_rpcs_total{{kind="reads"}} {reads}' in text
+    assert "hiplog_catalog_rebuilds_total 1" in text
+    assert 'hiplog_request_seconds_count{intent="GetNumLogs"} 1' in text
@@ -0,0 +1,81 @@
+import pytest
+from models.catalog import Catalog
+from models.daily_log import DailyLog
+from models.record import Activity
+from services.name_index import (
+    NameIndex,
+    normalize,
+    stem,
+    canonical_form,
+    edit_distance,
+)
+
+
+@pytest.fixture
+def index():
+    return NameIndex(["pushups", "squats", "hip adductions", "yoga", "bench press"])
+
+
+def test_normalize():
+    assert normalize(" Push-Ups! ") == "push ups"
+
+
+@pytest.mark.parametrize(
+    "word,expected",
+    [
+        ("pushups", "pushup"),
+        ("stretches", "stretch"),
+        ("stories", "story"),
+        ("press", "press"),
+        ("lunging", "lung"),
+        ("yoga", "yoga"),
+    ],
+)
+def test_stem(word, expected):
+    assert stem(word) == expected
+
+
+def test_canonical_form():
+    assert canonical_form("Hip Adductions") == canonical_form("hip adduction")
+
+
+def test_edit_distance():
+    assert edit_distance("kitten", "sitting") == 3
+    assert edit_distance("pushup", "puhsup") == 1  # transposition
+    assert edit_distance("pushup", "yoga", max_distance=1) == 2
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        ("pushups", "pushups"),
+        ("Push-Up", "pushups"),
+        ("puhsups", "pushups"),
+        ("hip aductions", "hip adductions"),
+        ("benchpress", "bench press"),
+        ("tennis", None),
+    ],
+)
+def test_resolve(index, query, expected):
+    assert index.resolve(query) == expected
+
+
+def test_resolve_without_fuzzy(index):
+    assert index.resolve("pushup", fuzzy=False) == "pushups"
+    assert index.resolve("puhsups", fuzzy=False) is None
+
+
+def test_suggest(index):
+    assert index.suggest("squat jumps")[0] == "squats"
+    assert index.suggest("tennis") == []
+
+
+def test_for_catalog_reuses_index_until_new_version():
+    catalog = Catalog()
+    catalog.record_log(DailyLog("2023-01-01", activities=[Activity("yoga")]))
+
+    index = NameIndex.for_catalog("user", catalog)
+    assert NameIndex.for_catalog("user", catalog) is index
+
+    catalog.log_version += 1
+    assert NameIndex.for_catalog("user", catalog) is not index
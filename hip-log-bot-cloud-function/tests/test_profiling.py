@@ -0,0 +1,65 @@
+import utils
+from services import profiling
+from services.executor import Executor
+
+
+def make_request(payload=None):
+    request = {
+        "queryResult": {
+            "parameters": {},
+            "intent": {"displayName": "GetActivityList"},
+        }
+    }
+    if payload is not None:
+        request["originalDetectIntentRequest"] = {
+            "source": "facebook",
+            "payload": dict(payload, data={"sender": {"id": "123"}}),
+        }
+    return request
+
+
+def test_should_profile(monkeypatch):
+    monkeypatch.delenv("PROFILE", raising=False)
+    monkeypatch.delenv("PROFILE_SAMPLE_RATE", raising=False)
+    assert not profiling.should_profile(make_request())
+    assert profiling.should_profile(make_request({"profile": True}))
+
+    monkeypatch.setenv("ENVIRONMENT", "production")
+    assert not profiling.should_profile(make_request({"profile": True}))
+    monkeypatch.setenv("PROFILE_SAMPLE_RATE", "1")
+    assert profiling.should_profile(make_request())
+    monkeypatch.setenv("PROFILE", "on")
+    monkeypatch.setenv("PROFILE_SAMPLE_RATE", "0")
+    assert profiling.should_profile(make_request())
+
+
+def test_profiles_are_tagged_and_aggregated(fake_firestore, monkeypatch, tmp_path):
+    output = tmp_path / "profiles.jsonl"
+    monkeypatch.setenv("PROFILE_OUTPUT", str(output))
+
+    for _ in range(2):
+        res = profiling.run_profiled(Executor(make_request()), top_n=10)
+        assert res.startswith("Here are")
+
+    profiles = list(profiling.read_profiles(output.read_text().splitlines()))
+    assert len(profiles) == 2
+    assert profiles[0].intent == "GetActivityList"
+    assert profiles[0].user_hash == profiling.hash_user(utils.test_username)
+    assert len(profiles[0].functions) == 10
+    assert any("services/executor.py" in f["function"] for f in profiles[0].functions)
+
+    by_intent = profiling.aggregate(profiles)
+    assert by_intent["GetActivityList"]["profiles"] == 2
+    run = next(f for f in by_intent["GetActivityList"]["functions"] if "(run)" in f)
+    assert by_intent["GetActivityList"]["functions"][run]["calls"] == 2
+
+
+def test_read_profiles_from_logs():
+    lines = [
+        "INFO services.executor: something else",
+        'INFO services.profiling: Request profile: {"intent": "GetStreak", '
+        '"seconds": 0.5, "functions": []}',
+    ]
+
+    (profile,) = profiling.read_profiles(lines)
+    assert (profile.intent, profile.seconds) == ("GetStreak", 0.5)
@@ -0,0 +1,134 @@
+import itertools
+import os
+import pytest
+from errors import Overloaded, RateLimited
+from services.rate_limit import (
+    SYNC_EVERY,
+    SYNC_SECONDS,
+    AdmissionControl,
+    FirestoreCounterStore,
+    MemoryCounterStore,
+    RateLimiter,
+    SQLiteCounterStore,
+    TokenBucket,
+    sender_of,
+)
+from tests.fake_firestore import COMMIT
+
+
+class CountingStore(MemoryCounterStore):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def add(self, key, window, n):
+        self.calls += 1
+        return super().add(key, window, n)
+
+
+def make_request(sender):
+    return {
+        "queryResult": {"intent": {"displayName": "GetNumLogs"}, "parameters": {}},
+        "originalDetectIntentRequest": {
+            "source": "facebook",
+            "payload": {"data": {"sender": {"id": sender}}},
+        },
+    }
+
+
+def test_token_bucket():
+    bucket = TokenBucket(capacity=2, refill_per_second=0.5, now=0)
+
+    assert [bucket.take(0) for _ in range(3)] == [True, True, False]
+    assert bucket.take(1) is False
+    assert bucket.take(2) is True
+
+
+def test_rate_limiter_batches_store_writes():
+    store = CountingStore()
+    limiter = RateLimiter(
+        store, burst=100, requests_per_minute=100, clock=lambda: 0, wall_clock=lambda: 0
+    )
+
+    assert all(limiter.allow("a") for _ in range(1 + 2 * SYNC_EVERY))
+    # The window's first request, then one write per SYNC_EVERY requests
+    assert store.calls == 3
+    assert store.add("a", 0, 0) == 1 + 2 * SYNC_EVERY
+
+
+def test_rate_limit_shared_across_instances(tmp_path):
+    path = str(tmp_path / "counts.db")
+    instances = [
+        RateLimiter(
+            SQLiteCounterStore(path),
+            burst=100,
+            requests_per_minute=10,
+            clock=lambda: 0,
+            wall_clock=lambda: 0,
+        )
+        for _ in range(2)
+    ]
+
+    # Between syncs an instance doesn't see the other's requests, so each can go
+    # over by up to a sync's worth
+    allowed = [instances[i % 2].allow("a") for i in range(30)]
+    assert 10 <= sum(allowed) <= 10 + 2 * SYNC_EVERY
+    assert not any(allowed[-5:])
+    assert instances[0].allow("b")
+
+
+def test_firestore_store_shared_by_limiters(fake_firestore):
+    store = FirestoreCounterStore()
+    # Every request is a sync's time after the last, so each one syncs
+    clock = itertools.count(step=SYNC_SECONDS)
+    limiters = [
+        RateLimiter(
+            store,
+            burst=100,
+            requests_per_minute=10,
+            clock=lambda: next(clock),
+            wall_clock=lambda: 0,
+        )
+        for _ in range(2)
+    ]
+
+    # Each alone would allow 10, but they share the count (seeing the other's
+    # requests as of their last sync)
+    allowed = [limiters[i % 2].allow("a") for i in range(30)]
+    assert 10 <= sum(allowed) <= 11
+    # A sync is a single round trip, to the collection of this database instance
+    fake_firestore.reset_stats()
+    assert store.add("a", 0, 0) == sum(allowed)
+    assert fake_firestore.rpc_counts == {COMMIT: 1}
+    collection = f"{os.environ['FIRESTORE_COLLECTION_NAME']}RequestCounts"
+    assert fake_firestore.dump(f"{collection}/a:0")["count"] == sum(allowed)
+    assert limiters[0].allow("b")
+
+
+def test_admission_control():
+    admission = AdmissionControl(
+        RateLimiter(burst=2, refill_per_second=0), max_concurrent=1
+    )
+
+    with admission.admit(make_request("a")):
+        # The instance's only slot is taken
+        with pytest.raises(Overloaded):
+            with admission.admit(make_request("b")):
+                pass
+
+    with admission.admit(make_request("a")):
+        pass
+    with pytest.raises(RateLimited):
+        with admission.admit(make_request("a")):
+            pass
+    # Other senders aren't affected, nor are requests without a sender
+    with admission.admit(make_request("b")):
+        pass
+    with admission.admit(None):
+        pass
+
+
+def test_sender_of():
+    assert sender_of(make_request("123")) == "123"
+    assert sender_of({"originalDetectIntentRequest": {"source": "facebook"}}) is None
+    assert sender_of(None) is None
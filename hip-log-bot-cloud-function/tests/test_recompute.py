@@ -0,0 +1,122 @@
+import os
+import firebase_admin
+from models.daily_log import DailyLog
+from models.record import Activity, Set, Symptom
+from models.stats import SCHEMA_VERSION, UserStats
+from services.hiplogdb import HipLogDB
+from services.recompute import Checkpoint, recompute_users
+
+LOGS = [
+    DailyLog(
+        "2023-01-01",
+        activities=[Activity("squats", sets=[Set(reps=10), Set(reps=8)])],
+        symptoms=[Symptom("left hip", 2)],
+    ),
+    DailyLog("2023-01-03", activities=[Activity("yoga")]),
+    DailyLog(
+        "2023-05-01",
+        activities=[Activity("squats", sets=[Set(reps=5)])],
+        symptoms=[Symptom("left hip", 3)],
+    ),
+]
+
+
+def add_user(user: str, logs=LOGS):
+    db = HipLogDB()
+    for log in logs:
+        db.upload_log(user, DailyLog.from_dict(log.date, log.to_dict()))
+
+
+def test_stats_from_log_dicts():
+    stats = UserStats.from_log_dicts(
+        [(log.date, log.to_dict()) for log in LOGS], log_version=3
+    )
+    assert stats.activities["squats"] == {
+        "num_days": 2,
+        "num_sets": 3,
+        "total_reps": 23,
+        "first_date": "2023-01-01",
+        "last_date": "2023-05-01",
+    }
+    assert stats.symptoms["left hip"]["total_severity"] == 5
+    assert stats.symptoms["left hip"]["max_severity"] == 3
+
+    restored = UserStats.from_dict(stats.to_dict())
+    assert restored.to_dict() == stats.to_dict()
+    assert restored.is_current(3)
+    assert not restored.is_current(4)
+    assert not UserStats.from_dict({"log_version": 3}).is_current(3)
+
+
+def test_recompute_users(fake_firestore, tmp_path):
+    add_user("a")
+    add_user("b", LOGS[:1])
+    HipLogDB().archive_month("a", "2023-01")
+    path = os.environ["FIRESTORE_COLLECTION_NAME"]
+    catalog_before = fake_firestore.dump(f"{path}/a")
+
+    checkpoint = tmp_path / "done"
+    report = recompute_users(
+        HipLogDB().list_users(page_size=1), checkpoint=Checkpoint(str(checkpoint))
+    )
+    assert (report.users, report.logs, report.failed) == (2, 4, [])
+    # Catalog and stats of each user
+    assert report.writes == 4
+    assert checkpoint.read_text().split() == ["a", "b"]
+
+    # Unchanged logs, so same catalog and log version
+    assert fake_firestore.dump(f"{path}/a") == catalog_before
+    stats = HipLogDB().get_stats("a")
+    assert stats.schema_version == SCHEMA_VERSION
+    assert stats.is_current(HipLogDB().get_log_version("a"))
+    assert stats.activities["squats"]["num_days"] == 2
+
+    # Resuming skips the users already done
+    report = recompute_users(["a", "b", "c"], checkpoint=Checkpoint(str(checkpoint)))
+    assert (report.skipped, report.users) == (2, 1)
+
+
+def test_recompute_legacy_user(fake_firestore):
+    # Logs that predate catalogs: no user document
+    path = os.environ["FIRESTORE_COLLECTION_NAME"]
+    for log in LOGS:
+        fake_firestore.load(f"{path}/old/DailyLogs/{log.date}", log.to_dict())
+
+    report = recompute_users(HipLogDB().list_users())
+    assert (report.users, report.logs, report.failed) == (1, 3, [])
+    catalog = HipLogDB().get_catalog("old")
+    assert catalog.indexed
+    assert catalog.log_dates.count() == 3
+
+
+def test_recompute_user_who_logs_meanwhile(fake_firestore, monkeypatch):
+    add_user("a")
+    recompute_derived = HipLogDB.recompute_derived
+
+    def log_meanwhile(self, user, writer):
+        n_logs = recompute_derived(self, user, writer)
+        add_user(user, [DailyLog("2023-06-01", activities=[Activity("yoga")])])
+        return n_logs
+
+    monkeypatch.setattr(HipLogDB, "recompute_derived", log_meanwhile)
+    checkpoint = Checkpoint()
+    report = recompute_users(["a"], checkpoint=checkpoint)
+
+    assert report.failed == ["a"]
+    assert "a" not in checkpoint
+    # The catalog wasn't overwritten, and the stats are known to be stale
+    db = HipLogDB()
+    assert db.get_catalog("a").log_dates.count() == 4
+    assert not db.get_stats("a").is_current(db.get_log_version("a"))
+
+
+def test_recompute_in_worker_processes(fake_firestore, monkeypatch):
+    # Worker processes are forked with the fake, but their writes stay in them
+    monkeypatch.setattr(firebase_admin, "initialize_app", lambda: None)
+    monkeypatch.setattr(firebase_admin, "get_app", lambda: None)
+    for user in ["a", "b", "c"]:
+        add_user(user)
+
+    report = recompute_users(HipLogDB().list_users(), workers=2)
+    assert (report.users, report.logs, report.writes, report.failed) == (3, 9, 6, [])
+    assert report.users_per_second > 0
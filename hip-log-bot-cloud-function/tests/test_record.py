@@ -158,6 +158,36 @@ def test_activity_to_dict():
     }
 
 
+def test_set_edit_patches_address_sets_by_key():
+    # Sets logged before ids are addressed by position
+    stored = {"name": "Curls", "sets": [{"reps": 12}, {"reps": 10}, {"reps": 8}]}
+    activity = Activity.from_dict(stored)
+    assert list(activity.keyed_sets()) == ["0000", "0001", "0002"]
+    assert activity.get_set("0001") == Set(10)
+
+    # An edited set is appended to the stored sets but read back in its place
+    edit = activity.replacement("0001", reps=11, weight=M(8, "kg"))
+    assert edit.removed_set_ids == {"0001"}
+    assert edit.sets == [Set(11, weight=M(8, "kg"))]
+    stored["sets"] += edit.to_dict()["sets"]
+    stored["removed"] = edit.to_dict()["removed"]
+    assert [s.reps for s in Activity.from_dict(stored).sets] == [12, 11, 8]
+    assert [s.reps for s in activity.merge(edit).sets] == [12, 11, 8]
+
+    stamped = Activity("Curls", [Set(5), Set(6)])
+    stamped.stamp(100)
+    key = stamped.sets[0].id
+    assert stamped.replacement(key, reps=7).sets[0].ts == 100
+    assert [s.reps for s in stamped.merge(stamped.replacement(key, reps=7)).sets] == [
+        7,
+        6,
+    ]
+    assert stamped.merge(stamped.removal()).sets == []
+    assert stamped.removal([key]).removed_set_ids == {key}
+    with pytest.raises(KeyError):
+        stamped.replacement("0000", reps=1)
+
+
 def test_print_activity():
     activity = Activity(
         "Shoulder Press",
@@ -0,0 +1,134 @@
+import pytest
+from models.daily_log import DailyLog
+from models.measurement import Measurement as M
+from models.record import Activity, Set, Symptom
+from models.renderers import (
+    CompactRenderer,
+    MessengerRenderer,
+    PlainTextRenderer,
+    Renderer,
+    TRUNCATION_MARKER,
+    renderer_for_source,
+)
+
+
+@pytest.fixture(autouse=True)
+def fragments():
+    Renderer.fragments.clear()
+    return Renderer.fragments
+
+
+def make_log(date="2023-09-24"):
+    return DailyLog(
+        date,
+        activities=[
+            Activity(
+                "curls",
+                [Set(reps=10, weight=M(10, "kg")), Set(reps=8, weight=M(8, "kg"))],
+            ),
+            Activity("Yoga", [Set(duration=M(3, "min"))]),
+        ],
+        symptoms=[Symptom("left hip", 3)],
+    )
+
+
+def test_plain_text():
+    log = make_log()
+    log.set_activity_notes("felt good")
+    assert PlainTextRenderer().render_log(log) == "\n".join(
+        [
+            "Sep. 24, 2023 Log:",
+            "",
+            "2x activities:",
+            "* Curls 2 sets: 10x 10kg, 8x 8kg",
+            "* Yoga 1 sets: 3min",
+            "felt good",
+            "",
+            "1x symptom records:",
+            "* Left Hip: 3",
+        ]
+    )
+
+
+def test_messenger():
+    assert MessengerRenderer().render_log(make_log()) == "\n".join(
+        [
+            "*Sun Sep. 24, 2023*",
+            "• *Curls*: 10x 10kg, 8x 8kg",
+            "• *Yoga*: 3min",
+            "• Left Hip: 3",
+        ]
+    )
+    assert MessengerRenderer().render_log(DailyLog("2023-09-24")).endswith(
+        "Nothing logged yet"
+    )
+
+
+def test_compact():
+    assert (
+        CompactRenderer().render_log(make_log())
+        == "Sun Sep. 24: Curls (2 sets), Yoga (1 set); Left Hip: 3"
+    )
+
+
+def test_fragments_cached_until_record_changes(fragments):
+    log = make_log()
+    first = PlainTextRenderer().render_log(log)
+    misses = fragments.misses
+
+    assert PlainTextRenderer().render_log(log) == first
+    assert fragments.misses == misses
+
+    log.get_activity("curls").add_set(Set(reps=6, weight=M(12, "kg")))
+    assert "* Curls 3 sets: 10x 10kg, 8x 8kg, 6x 12kg" in log.__str__()
+    assert fragments.misses == misses + 1
+
+
+def test_same_records_share_fragments(fragments):
+    renderer = PlainTextRenderer()
+    renderer.render_log(make_log("2023-09-24"))
+    misses = fragments.misses
+    renderer.render_log(make_log("2023-09-25"))
+    assert fragments.misses == misses
+
+
+def test_messenger_truncates_without_rendering_everything(fragments):
+    log = DailyLog(
+        "2023-09-24",
+        activities=[
+            Activity(f"exercise {i}", [Set(reps=10, weight=M(i, "kg"))] * 20)
+            for i in range(100)
+        ],
+    )
+
+    res = MessengerRenderer().render_log(log)
+    assert len(res) <= MessengerRenderer.max_length
+    assert res.endswith(f"\n{TRUNCATION_MARKER}")
+    assert fragments.misses < 20
+
+
+def test_truncates_a_single_long_line():
+    renderer = MessengerRenderer()
+    res = renderer.join(["x" * 3000])
+    assert len(res) == renderer.max_length and res.endswith(TRUNCATION_MARKER)
+
+
+def test_render_logs():
+    logs = [make_log("2023-09-24"), DailyLog("2023-09-25")]
+    assert MessengerRenderer().render_logs("2 days", logs) == "\n".join(
+        [
+            "2 days",
+            "",
+            "• Sun Sep. 24: Curls (2 sets), Yoga (1 set); Left Hip: 3",
+            "• Mon Sep. 25: nothing logged",
+        ]
+    )
+
+
+def test_renderer_for_source():
+    assert isinstance(renderer_for_source("facebook"), MessengerRenderer)
+    assert isinstance(renderer_for_source(None), PlainTextRenderer)
+
+    response = renderer_for_source("facebook").to_response("hi")
+    assert response["fulfillmentText"] == "hi"
+    assert response["fulfillmentMessages"][0]["quickReplies"]["title"] == "hi"
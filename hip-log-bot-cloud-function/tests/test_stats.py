@@ -0,0 +1,49 @@
+from models.stats import UserStats, activity_records, estimated_1rm
+
+
+def weighted(reps: int, amount: float, unit: str = "kg") -> dict:
+    return {"reps": reps, "weight": {"amount": amount, "unit": unit}}
+
+
+def test_activity_records():
+    sets = [
+        weighted(5, 100),
+        weighted(8, 100),
+        weighted(10, 135, "lb"),
+        {"duration": {"amount": 2, "unit": "min"}},
+    ]
+    assert activity_records(sets) == {
+        "max_weight_kg": 100,
+        "max_reps_at_weight": {"100": 8, "61.2": 10},
+        "best_1rm_kg": 126.67,
+        "max_duration_s": 120,
+    }
+    assert activity_records([{"reps": 10}]) == {}
+    assert estimated_1rm(100, 1) == 100
+
+
+def test_find_prs():
+    stats = UserStats()
+    stats.add_records("bench", activity_records([weighted(5, 100)]))
+
+    assert stats.find_prs("bench", [weighted(6, 100)]) == [
+        "most reps at 100kg (6)",
+        "best estimated 1RM (120kg)",
+    ]
+    # A new weight only counts as the heaviest
+    assert stats.find_prs("bench", [weighted(1, 105)]) == ["heaviest weight (105kg)"]
+    # Equalling a record isn't beating it
+    assert stats.find_prs("bench", [weighted(5, 100), weighted(4, 100)]) == []
+    # Nothing to beat the first time
+    assert stats.find_prs("squats", [weighted(5, 100)]) == []
+
+
+def test_add_records_only_raises():
+    stats = UserStats()
+    stats.add_records("bench", activity_records([weighted(5, 100)]))
+    stats.add_records("bench", activity_records([weighted(10, 100), weighted(1, 90)]))
+    assert stats.records["bench"] == {
+        "max_weight_kg": 100,
+        "max_reps_at_weight": {"100": 10, "90": 1},
+        "best_1rm_kg": 133.33,
+    }
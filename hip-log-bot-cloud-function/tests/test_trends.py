@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+from datetime import date, timedelta
+from models.catalog import Catalog
+from models.daily_log import DailyLog
+from models.record import Symptom
+from services.trends import (
+    DAILY,
+    MONTHLY,
+    WEEKLY,
+    SymptomTrend,
+    change_points,
+    downsample,
+    ewma,
+    rolling_mean,
+)
+
+
+def make_logs(n_days=120, seed=0):
+    """The left hip is logged on ~60% of days, at 3 then at 1 from day 60"""
+    rng = np.random.default_rng(seed)
+    start = date(2023, 1, 1)
+    logs = []
+    for i in range(n_days):
+        if rng.random() < 0.6:
+            severity = 3 if i < 60 else 1
+            logs.append(
+                (
+                    str(start + timedelta(days=i)),
+                    {"symptoms": {"left hip": {"severity": severity}}},
+                )
+            )
+
+    return logs
+
+
+def random_severities(n_days, seed):
+    rng = np.random.default_rng(seed)
+    severities = rng.integers(0, 4, n_days).astype(float)
+    severities[rng.random(n_days) < 0.4] = np.nan
+    return severities
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_ewma_matches_a_day_by_day_loop(seed):
+    x = random_severities(700, seed)
+    alpha = 0.2
+
+    expected = []
+    weighted = weights = 0.0
+    for value in x:
+        logged = not np.isnan(value)
+        weighted = (1 - alpha) * weighted + (alpha * value if logged else 0)
+        weights = (1 - alpha) * weights + (alpha if logged else 0)
+        expected.append(weighted / weights if weights else np.nan)
+
+    assert np.allclose(ewma(x, alpha), expected, equal_nan=True)
+
+
+def test_ewma_rejects_bad_alphas():
+    with pytest.raises(ValueError):
+        ewma(np.zeros(3), 1.0)
+
+
+def test_rolling_mean_skips_days_without_logs():
+    x = np.array([np.nan, 1, np.nan, 3, np.nan, np.nan, np.nan])
+    means = rolling_mean(x, window=3)
+    assert np.isnan(means[0]) and np.isnan(means[6])
+    assert list(means[1:6]) == [1, 1, 2, 3, 3]
+
+
+def test_change_points_find_shifts_in_the_mean():
+    x = np.concatenate([np.full(30, 3.0), np.full(30, 1.0), np.full(30, 2.5)])
+    x[::4] = np.nan
+    points = change_points(x)
+    assert [(day, before, after) for day, before, after in points] == [
+        (30, 3.0, 1.0),
+        (61, 1.0, 2.5),
+    ]
+
+
+def test_change_points_ignore_noise_and_short_runs():
+    assert change_points(np.full(60, 2.0)) == []
+    blip = np.concatenate([np.full(30, 1.0), np.full(3, 3.0), np.full(30, 1.0)])
+    assert change_points(blip) == []
+    assert change_points(np.array([np.nan, 1.0])) == []
+
+
+def test_downsample_by_week_and_month():
+    start = date(2023, 1, 30)  # A Monday
+    x = np.full(35, np.nan)
+    x[0], x[6], x[7], x[33] = 1, 3, 2, 0
+
+    weeks, means = downsample(x, start, WEEKLY)
+    assert weeks[:2] == [date(2023, 1, 30), date(2023, 2, 6)]
+    assert list(means[:2]) == [2, 2] and np.isnan(means[2])
+
+    months, means = downsample(x, start, MONTHLY)
+    assert months == [start, date(2023, 2, 1), date(2023, 3, 1)]
+    assert list(means) == [1, 2.5, 0]
+
+    days, means = downsample(x, start, DAILY)
+    assert len(days) == 35 and means is x
+
+
+def test_catalog_and_logs_give_the_same_trend():
+    logs = make_logs()
+    catalog = Catalog.from_dict(Catalog.from_log_dicts(logs).to_dict())
+    start, end = date(2022, 12, 25), date(2023, 5, 10)
+
+    from_catalog = SymptomTrend.from_catalog(catalog, "left hip", start, end)
+    from_logs = SymptomTrend.from_log_dicts("left hip", iter(logs), start, end)
+    assert from_catalog.num_days == from_logs.num_days == 137
+    assert np.array_equal(from_catalog.severities, from_logs.severities, equal_nan=True)
+    assert SymptomTrend.from_catalog(catalog, "right hip", start, end) is None
+
+
+def test_trend_summary():
+    catalog = Catalog.from_log_dicts(make_logs())
+    trend = SymptomTrend.from_catalog(
+        catalog, "left hip", date(2023, 1, 1), date(2023, 4, 30)
+    )
+
+    lines = trend.summary()
+    assert lines[0].startswith(f"Logged {trend.num_logged} of 120 days")
+    assert "Improved from 3.0 to 1.0 around Mar." in lines[2]
+    assert lines[3] == "Weekly averages:"
+    assert lines[4] == "* Jan. 2: 3.0" and lines[-1] == "* Apr. 24: 1.0"
+
+
+def test_short_trends_are_shown_by_day():
+    catalog = Catalog()
+    catalog.record_log(DailyLog("2023-01-02", symptoms=[Symptom("left hip", 2)]))
+    trend = SymptomTrend.from_catalog(
+        catalog, "left hip", date(2023, 1, 1), date(2023, 1, 7)
+    )
+    assert trend.summary() == [
+        "Logged 1 of 7 days, 2.0 on average (2.0 lately)",
+        "Last 7 days: 2.0 on average",
+        "No clear change over this period",
+        "By day:",
+        "* Jan. 2: 2",
+    ]
+
+    trend = SymptomTrend.from_catalog(
+        catalog, "left hip", date(2023, 2, 1), date(2023, 2, 7)
+    )
+    assert trend.summary() == ["No logs of it in these 7 days"]
@@ -1,5 +1,7 @@
+import logging
 import pytest
-from utils import is_valid_date_format
+from types import SimpleNamespace
+from utils import LogRateLimiter, is_ops_request, is_valid_date_format
 
 
 def test_is_valid_date_format_detects_good():
@@ -11,3 +13,34 @@ def test_is_valid_date_format_detects_bad():
     assert is_valid_date_format("223-01-01") is False
     assert is_valid_date_format("2023-01-01T00:00:00") is False
     assert is_valid_date_format("2023-1-1") is False  # not yet supported
+
+
+def test_log_rate_limiter(caplog):
+    now = [0.0]
+    limiter = LogRateLimiter(burst=2, period=60, clock=lambda: now[0])
+    logger = logging.getLogger("test_utils")
+
+    for _ in range(5):
+        limiter.log(logger, "boom", "Boom")
+    limiter.log(logger, "other", "Other")
+    assert [r.message for r in caplog.records] == ["Boom", "Boom", "Other"]
+
+    # A new period lets messages through again, reporting what was held back
+    now[0] = 60
+    limiter.log(logger, "boom", "Boom")
+    assert caplog.records[-1].message == "Boom (3 similar messages suppressed)"
+
+
+def test_is_ops_request(monkeypatch):
+    def request(authorization=None):
+        headers = {"Authorization": authorization} if authorization else {}
+        return SimpleNamespace(headers=headers)
+
+    monkeypatch.delenv("OPS_TOKEN", raising=False)
+    assert not is_ops_request(request("Bearer "))
+
+    monkeypatch.setenv("OPS_TOKEN", "s3cret")
+    assert is_ops_request(request("Bearer s3cret"))
+    assert not is_ops_request(request("Bearer wrong"))
+    assert not is_ops_request(request("s3cret"))
+    assert not is_ops_request(request())
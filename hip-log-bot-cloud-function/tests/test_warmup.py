@@ -0,0 +1,74 @@
+import pytest
+from models.supported_intents import SupportedIntents
+from services import warmup
+from services.hiplogdb import HEALTH_COLLECTION
+from tests.fake_firestore import GET
+
+
+@pytest.fixture()
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(warmup, "_state", warmup.WarmState())
+    monkeypatch.setattr(warmup, "init_firebase", lambda: None)
+    return warmup.get_state()
+
+
+def test_warm_up_touches_no_user_data(fake_firestore, fresh_state):
+    state = warmup.warm_up()
+    status = state.to_dict()
+
+    assert state.warm, status["errors"]
+    assert status["status"] == "ok"
+    assert set(status["warmup_ms"]) == {
+        "imports",
+        "firebase",
+        "firestore",
+        "intents",
+        "responses",
+    }
+    assert status["firestore_ms"] is not None
+    # A single point read, of the health document
+    assert [call.kind for call in fake_firestore.calls] == [GET]
+    assert not [p for p in fake_firestore._docs if not p.startswith(HEALTH_COLLECTION)]
+
+
+def test_health_pings_only_when_stale(fake_firestore, fresh_state):
+    assert warmup.health()["status"] == "degraded"  # never warmed up
+    assert fake_firestore.num_rpcs == 1
+
+    warmup.health()
+    assert fake_firestore.num_rpcs == 1
+    warmup.health(max_age=-1)
+    assert fake_firestore.num_rpcs == 2
+
+
+def test_repeated_warm_ups_are_throttled(fake_firestore, fresh_state):
+    warmup.warm_up(warmup.WARMUP_MIN_INTERVAL_SECONDS)
+    assert fake_firestore.num_rpcs == 1
+
+    warmup.warm_up(warmup.WARMUP_MIN_INTERVAL_SECONDS)
+    assert fake_firestore.num_rpcs == 1
+    warmup.warm_up()
+    assert fake_firestore.num_rpcs == 2
+
+
+def test_failed_step_is_reported(fake_firestore, fresh_state, monkeypatch):
+    attempts = []
+
+    def unreachable():
+        attempts.append(1)
+        raise ConnectionError("unreachable")
+
+    monkeypatch.setattr(fake_firestore, "collection", lambda *_: unreachable())
+    state = warmup.warm_up()
+
+    assert not state.warm
+    assert state.to_dict()["status"] == "degraded"
+    assert "unreachable" in state.to_dict()["errors"]["firestore"]
+
+    # A degraded instance isn't throttled, so the next warm-up retries
+    warmup.warm_up(warmup.WARMUP_MIN_INTERVAL_SECONDS)
+    assert len(attempts) == 2
+
+
+def test_summarize_is_built_once():
+    assert SupportedIntents.summarize() is SupportedIntents.summarize()